@@ -32,7 +32,54 @@ CERTEGO_BUFFALOGS_USER_MAX_DAYS = 60
 CERTEGO_BUFFALOGS_LOGIN_MAX_DAYS = 45
 CERTEGO_BUFFALOGS_ALERT_MAX_DAYS = 45
 CERTEGO_BUFFALOGS_IP_MAX_DAYS = 45
+# months after the current one whose Alert partitions are created in advance by the create_partitions command and the BuffalogsCleanModelsPeriodicallyTask
+CERTEGO_BUFFALOGS_PARTITIONS_AHEAD_MONTHS = 3
+# max number of rows deleted by each statement of the retention, and seconds of pause after each batch, to not block the detection writes
+CERTEGO_BUFFALOGS_RETENTION_BATCH_SIZE = 5000
+CERTEGO_BUFFALOGS_RETENTION_BATCH_PAUSE = 0.2
+# max seconds of each BuffalogsCleanModelsPeriodicallyTask run: then the retention is resumed by a new task, queued after the pending ones
+CERTEGO_BUFFALOGS_RETENTION_MAX_SECONDS = 300
 CERTEGO_BUFFALOGS_MOBILE_DEVICES = ["iOS", "Android", "Windows Phone"]
+# number of Celery subtasks on which the users of each time range are distributed for the detection
+CERTEGO_BUFFALOGS_DETECTION_SHARDS = int(os.environ.get("BUFFALOGS_DETECTION_SHARDS", 4))
+# minutes of logins analyzed by each BuffalogsProcessWindowTask
+CERTEGO_BUFFALOGS_PROCESS_WINDOW_MINUTES = 30
+# max number of time windows scheduled by each BuffalogsProcessLogsTask run (e.g. to catch up after a downtime)
+CERTEGO_BUFFALOGS_PROCESS_MAX_WINDOWS = int(os.environ.get("BUFFALOGS_PROCESS_MAX_WINDOWS", 6))
+# number of time windows processed at the same time. With more than 1, the windows are split in consecutive lanes processed concurrently:
+# the catch-up is faster, but the logins of a user in different lanes are not guaranteed to be analyzed chronologically
+CERTEGO_BUFFALOGS_PROCESS_CONCURRENT_WINDOWS = int(os.environ.get("BUFFALOGS_PROCESS_CONCURRENT_WINDOWS", 1))
+# minutes after which the unfinished shards of a time window are considered abandoned (e.g. worker crash) and resumed
+CERTEGO_BUFFALOGS_CHECKPOINT_RESUME_MINUTES = 60
+# max number of failed attempts (logins extraction or detection) of a shard: then its checkpoint is moved to the dead letters and the time window isn't resumed anymore
+CERTEGO_BUFFALOGS_CHECKPOINT_MAX_ATTEMPTS = int(os.environ.get("BUFFALOGS_CHECKPOINT_MAX_ATTEMPTS", 5))
+# seconds after which each process checks if the cached Config has been changed by another process
+CERTEGO_BUFFALOGS_CONFIG_CACHE_TTL = 60
+# max number of distinct user-agents kept parsed in memory by each process
+CERTEGO_BUFFALOGS_USER_AGENT_CACHE_SIZE = 4096
+# distance used by the impossible travel detection: "exact" (geodesic on the WGS-84 ellipsoid) or "fast" (haversine)
+CERTEGO_BUFFALOGS_TRAVEL_DISTANCE_MODE = "exact"
+# each login is compared by the impossible travel detection with the previous one and with all the logins of the user within these minutes from it,
+# among the last CERTEGO_BUFFALOGS_TRAVEL_HISTORY_SIZE ones kept in memory
+CERTEGO_BUFFALOGS_TRAVEL_WINDOW_MINUTES = 120
+CERTEGO_BUFFALOGS_TRAVEL_HISTORY_SIZE = 32
+# max seconds between consecutive logins with the same ip, user-agent, country and index to be collapsed into a single login, 0 to disable it
+CERTEGO_BUFFALOGS_COLLAPSE_LOGINS_SECONDS = int(os.environ.get("BUFFALOGS_COLLAPSE_LOGINS_SECONDS", 60))
+# stream of login events analyzed by the stream_detection command: "kafka", "redis" or "queue" (in-process stand-in, for tests and benchmarks)
+CERTEGO_BUFFALOGS_STREAM_BACKEND = os.environ.get("BUFFALOGS_STREAM_BACKEND", "kafka")
+CERTEGO_BUFFALOGS_STREAM_URL = os.environ.get("BUFFALOGS_STREAM_URL", "localhost:9092")
+CERTEGO_BUFFALOGS_STREAM_TOPIC = os.environ.get("BUFFALOGS_STREAM_TOPIC", "buffalogs-logins")
+CERTEGO_BUFFALOGS_STREAM_GROUP = os.environ.get("BUFFALOGS_STREAM_GROUP", "buffalogs")
+# max number of events and max seconds waited for each micro-batch of the stream detection
+CERTEGO_BUFFALOGS_STREAM_BATCH_SIZE = 500
+CERTEGO_BUFFALOGS_STREAM_BATCH_TIMEOUT = 1.0
+# max number of logins waiting in the staging table of the ingestion push API: over it, the API answers 429 Too Many Requests
+CERTEGO_BUFFALOGS_PUSH_QUEUE_MAX_SIZE = int(os.environ.get("BUFFALOGS_PUSH_QUEUE_MAX_SIZE", 100000))
+# max number of lines of each request to the ingestion push API
+CERTEGO_BUFFALOGS_PUSH_MAX_BATCH_SIZE = 10000
+# max number of pushed logins analyzed in each transaction, and transactions for each BuffalogsDrainPushedLoginsTask run
+CERTEGO_BUFFALOGS_PUSH_DRAIN_BATCH_SIZE = 1000
+CERTEGO_BUFFALOGS_PUSH_DRAIN_MAX_BATCHES = 50
 
 if CERTEGO_BUFFALOGS_ENVIRONMENT == ENVIRONMENT_DOCKER:
     CERTEGO_BUFFALOGS_DB_HOSTNAME = "postgres"
@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     "rest_framework_simplejwt",
     "authentication",
     "corsheaders",
+    "django_celery_results",
 ]
 
 MIDDLEWARE = [
@@ -218,6 +219,8 @@ DATA_UPLOAD_MAX_NUMBER_FIELDS = None
 
 # Celery config
 CELERY_BROKER_URL = CERTEGO_BUFFALOGS_RABBITMQ_URI
+# result backend required by the chord that collects the detection shards
+CELERY_RESULT_BACKEND = "django-db"
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_BEAT_SCHEDULER = "celery.beat:PersistentScheduler"
 
@@ -226,6 +229,7 @@ CELERY_BEAT_SCHEDULE = {
         "task": "BuffalogsProcessLogsTask",
         "schedule": crontab(minute=30),
     },
+    "drain_pushed_logins": {"task": "BuffalogsDrainPushedLoginsTask", "schedule": crontab()},
     "clean_models_periodically": {"task": "BuffalogsCleanModelsPeriodicallyTask", "schedule": crontab(hour=23, minute=59)},
     "notify_alerts": {"task": "NotifyAlertsTask", "schedule": crontab(minute=5)},
     "daily_alert_summary": {"task": "ScheduledAlertSummaryTask", "schedule": crontab(hour=0, minute=0), "args": ["daily"]},
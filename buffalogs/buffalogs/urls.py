@@ -38,6 +38,7 @@ urlpatterns = [
     # Ingestion APIs
     path("api/ingestion/sources/", ingestion.get_ingestion_sources, name="ingestion_sources_api"),
     path("api/ingestion/active_ingestion_source/", ingestion.get_active_ingestion_source, name="active_ingestion_source_api"),
+    path("api/ingestion/push/", ingestion.PushLoginsView.as_view(), name="ingestion_push_api"),
     path("api/ingestion/<str:source>/", ingestion.ingestion_source_config, name="ingestion_source_config_api"),
     # Alerters APIs
     path("api/alerters/active-alerter/", alerts.get_active_alerter, name="active_alerter_api"),
@@ -5,7 +5,7 @@ from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from impossible_travel.constants import AlertTagValues
 from impossible_travel.forms import AlertAdminForm, ConfigAdminForm, TaskSettingsAdminForm, UserAdminForm
-from impossible_travel.models import Alert, Config, Login, TaskSettings, User, UsersIP
+from impossible_travel.models import Alert, Config, DetectionCheckpoint, Login, PushedLogin, TaskSettings, User, UsersIP
 
 
 @admin.register(Login)
@@ -109,6 +109,19 @@ class TaskSettingsAdmin(admin.ModelAdmin):
     search_fields = ("id", "task_name", "start_date")
 
 
+@admin.register(DetectionCheckpoint)
+class DetectionCheckpointAdmin(admin.ModelAdmin):
+    list_display = ("id", "start_date", "end_date", "shard", "shards_count", "status", "users", "attempts", "updated")
+    list_filter = ("status",)
+
+
+@admin.register(PushedLogin)
+class PushedLoginAdmin(admin.ModelAdmin):
+    list_display = ("id", "username", "timestamp", "failed", "created")
+    list_filter = ("failed",)
+    search_fields = ("username",)
+
+
 @admin.register(Config)
 class ConfigsAdmin(admin.ModelAdmin):
     form = ConfigAdminForm
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ImpossibleTravelConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "impossible_travel"
+
+    def ready(self):
+        # register the signals invalidating the Config cache
+        from impossible_travel.modules import config_cache  # noqa: F401
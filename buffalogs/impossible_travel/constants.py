@@ -1,6 +1,9 @@
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
+# separator between the source name and the index of the logins tagged by the MultiIngestion: it can't be used in the Elasticsearch and Opensearch index names
+INDEX_SOURCE_SEPARATOR = ":"
+
 
 class AlertTagValues(models.TextChoices):
     """Type of Possible alert tags in the format (name=value, label).
@@ -181,3 +184,17 @@ class ExecutionModes(models.TextChoices):
 
     MANUAL = "manual", _("Manual")
     AUTOMATIC = "automatic", _("Automatic")
+
+
+class CheckpointStatus(models.TextChoices):
+    """Status of the detection of a time window for a users shard."""
+
+    PENDING = "pending", _("Pending")
+    COMPLETED = "completed", _("Completed")
+    FAILED = "failed", _("Failed")
+    DEAD = "dead", _("Dead letter")
+
+    @classmethod
+    def terminal(cls) -> list:
+        """The statuses of the shards not analyzed anymore"""
+        return [cls.COMPLETED, cls.DEAD]
@@ -7,6 +7,7 @@ from dateutil.relativedelta import relativedelta
 from django.db.models import Count
 from django.utils import timezone
 from impossible_travel.models import Alert, Login, User
+from impossible_travel.modules.user_agent import group_user_agents
 from impossible_travel.views.utils import read_config
 from pygal_maps_world.maps import World
 
@@ -93,11 +94,7 @@ def alerts_line_chart(start, end):
             date_range.append(start)
             start = start + timedelta(seconds=1)
         for i in range(0, len(date_range) - 2, 2):
-            alerts_in_range.append(
-                Alert.objects.filter(
-                    login_raw_data__timestamp__range=(date_range[i].strftime("%Y-%m-%dT%H:%M:%S.%fZ"), date_range[i + 1].strftime("%Y-%m-%dT%H:%M:%S.%fZ"))
-                ).count()
-            )
+            alerts_in_range.append(Alert.objects.filter(login_timestamp__range=(date_range[i], date_range[i + 1])).count())
     elif delta_timestamp.days >= 1 and delta_timestamp.days <= 31:
         while start <= end:
             date_range.append(start)
@@ -106,11 +103,7 @@ def alerts_line_chart(start, end):
             date_range.append(start)
             start = start + timedelta(seconds=1)
         for i in range(0, len(date_range) - 2, 2):
-            alerts_in_range.append(
-                Alert.objects.filter(
-                    login_raw_data__timestamp__range=(date_range[i].strftime("%Y-%m-%dT%H:%M:%S.%fZ"), date_range[i + 1].strftime("%Y-%m-%dT%H:%M:%S.%fZ"))
-                ).count()
-            )
+            alerts_in_range.append(Alert.objects.filter(login_timestamp__range=(date_range[i], date_range[i + 1])).count())
     else:
         start = timezone.datetime(start.year, start.month, 1)
         end = end.replace(tzinfo=None)
@@ -121,9 +114,7 @@ def alerts_line_chart(start, end):
             date_range.append(start)
         for i in range(0, len(date_range) - 2, 2):
             alerts_in_range.append(
-                Alert.objects.filter(
-                    login_raw_data__timestamp__range=(date_range[i].strftime("%Y-%m-%dT%H:%M:%S.%fZ"), date_range[i + 1].strftime("%Y-%m-%dT%H:%M:%S.%fZ"))
-                ).count()
+                Alert.objects.filter(login_timestamp__range=(timezone.make_aware(date_range[i]), timezone.make_aware(date_range[i + 1]))).count()
             )
     line_chart.x_labels = map(str, date_str)
     line_chart.add("", alerts_in_range)
@@ -138,15 +129,13 @@ def world_map_chart(start, end):
         show_legend=False,
     )
     countries = read_config("countries_list.json")
+    # a single grouped query instead of a count for each country
+    alerts_by_country = dict(
+        Alert.objects.filter(login_timestamp__range=(start, end)).values("login_country").annotate(alerts=Count("id")).values_list("login_country", "alerts")
+    )
     tmp = {}
     for key, value in countries.items():
-        country_alerts = Alert.objects.filter(
-            login_raw_data__timestamp__range=(start.strftime("%Y-%m-%dT%H:%M:%S.%fZ"), end.strftime("%Y-%m-%dT%H:%M:%S.%fZ")), login_raw_data__country=value
-        ).count()
-        if country_alerts == 0:
-            tmp[key] = None
-        else:
-            tmp[key] = country_alerts
+        tmp[key] = alerts_by_country.get(value) or None
     map_chart.add("Alerts", tmp)
     return map_chart.render_data_uri()
 
@@ -162,10 +151,13 @@ def user_login_timeline_chart(user, start, end):
 def user_device_usage_chart(user, start, end):
     devices = Login.objects.filter(user=user, timestamp__range=(start, end)).values("user_agent").annotate(count=Count("id"))
 
+    # group the raw user-agents by browser and OS, so the same device with different versions is counted once
+    devices_count = group_user_agents({d["user_agent"]: d["count"] for d in devices})["label"]
+
     pie_chart = pygal.Pie(style=pie_custom_style, legend=True, show_labels=False, width=1000, height=650)
     pie_chart.title = "Device Usage"
-    for d in devices:
-        pie_chart.add(d["user_agent"], d["count"])
+    for label, count in devices_count.items():
+        pie_chart.add(label, count)
     return pie_chart.render(disable_xml_declaration=True)
 
 
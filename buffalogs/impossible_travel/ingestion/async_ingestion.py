@@ -0,0 +1,150 @@
+import asyncio
+import heapq
+from collections import defaultdict
+from datetime import datetime
+from operator import itemgetter
+from typing import AsyncIterator
+
+
+class AsyncIngestionMixin:
+    """
+    Mixin for the ingestion sources with a native asyncio client (Elasticsearch, Opensearch).
+    The queries are executed concurrently on a point in time, at most ingestion_config["concurrency"] at a time:
+    - the per-user logins are extracted with a query for each user, paginated with search_after
+    - the bulk logins of a time range are extracted with a sliced point in time, a slice per concurrent request, grouped by user while they are streamed
+    The public methods are synchronous wrappers that run the event loop, so they can be called by the Celery tasks.
+
+    The concrete classes must implement: _get_async_client, _aopen_pit, _aclose_pit, _logins_query and _user_logins_query
+    """
+
+    DEFAULT_CONCURRENCY = 8
+
+    @property
+    def concurrency(self) -> int:
+        return max(int(self.ingestion_config.get("concurrency", self.DEFAULT_CONCURRENCY)), 1)
+
+    def process_users_logins(self, start_date: datetime, end_date: datetime, usernames: list) -> dict:
+        """Extract the logins of the given users concurrently, with a paginated query for each user
+        The errors are logged and raised, so the logins of the users aren't returned truncated
+
+        :param start_date: the initial datetime from which the logins are considered
+        :type start_date: datetime (with tzinfo=datetime.timezone.utc)
+        :param end_date: the final datetime within which the logins are considered
+        :type end_date: datetime (with tzinfo=datetime.timezone.utc)
+        :param usernames: the users whose logins must be extracted
+        :type usernames: list
+
+        :return: dict with the lowercase usernames as keys and the list of their logins (sorted by timestamp) as values
+        :rtype: dict
+        """
+        return self._run(self._aprocess_users_logins(start_date, end_date, usernames))
+
+    def process_logins_bulk(self, start_date: datetime, end_date: datetime) -> dict:
+        """Extract all the logins of the time range with a sliced point in time, whose slices are streamed concurrently
+        The errors are logged and raised, so the detection window isn't considered completed
+
+        :param start_date: the initial datetime from which the logins are considered
+        :type start_date: datetime (with tzinfo=datetime.timezone.utc)
+        :param end_date: the final datetime within which the logins are considered
+        :type end_date: datetime (with tzinfo=datetime.timezone.utc)
+
+        :return: dict with the lowercase usernames as keys and the list of their logins (sorted by timestamp) as values
+        :rtype: dict
+        """
+        self.logger.info(f"Starting async bulk logins extraction at: {start_date} Finishing at: {end_date}")
+        logins_by_user = self._run(self._aprocess_logins_bulk(start_date, end_date))
+        self.logger.info(f"Got logins for {len(logins_by_user)} users to be normalized")
+        return logins_by_user
+
+    def _run(self, coroutine) -> dict:
+        """Run the coroutine in a new event loop, logging and raising its errors"""
+        try:
+            return asyncio.run(coroutine)
+        except ConnectionError:
+            self.logger.error(f"Failed to establish a connection with host: {self.ingestion_config['url']}")
+            raise
+        except TimeoutError:
+            self.logger.error(f"Timeout reached for the host: {self.ingestion_config['url']}")
+            raise
+        except Exception as e:
+            self.logger.error(f"Exception while querying {self.ingestion_config['url']}: {e}")
+            raise
+
+    async def _aprocess_users_logins(self, start_date: datetime, end_date: datetime, usernames: list) -> dict:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        client = self._get_async_client()
+        try:
+            pit_id = await self._aopen_pit(client)
+
+            async def user_logins(username: str) -> list:
+                async with semaphore:
+                    query = self._user_logins_query(start_date, end_date, username)
+                    return [self._parse_hit(hit) async for hits in self._aiter_pages(client, query, pit_id) for hit in hits]
+
+            try:
+                results = await asyncio.gather(*(user_logins(username) for username in usernames))
+            finally:
+                await self._aclose_pit(client, pit_id)
+        finally:
+            await client.close()
+        logins_by_user = {}
+        for username, user_logins_list in zip(usernames, results):
+            if user_logins_list:
+                logins_by_user.setdefault(username.lower(), []).extend(user_logins_list)
+        return logins_by_user
+
+    async def _aprocess_logins_bulk(self, start_date: datetime, end_date: datetime) -> dict:
+        query = self._logins_query(start_date, end_date)
+        client = self._get_async_client()
+        try:
+            pit_id = await self._aopen_pit(client)
+            try:
+                slices = self.concurrency
+                # a single slice can't be requested explicitly
+                slices_ids = range(slices) if slices > 1 else [None]
+                slices_logins = await asyncio.gather(*(self._aslice_logins_by_user(client, query, pit_id, slice_id, slices) for slice_id in slices_ids))
+            finally:
+                await self._aclose_pit(client, pit_id)
+        finally:
+            await client.close()
+        # each slice is sorted by timestamp, so the slices of each user are merged keeping their logins in chronological order
+        usernames = dict.fromkeys(username for slice_logins in slices_logins for username in slice_logins)
+        return {
+            username: [
+                login for _, login in heapq.merge(*(slice_logins[username] for slice_logins in slices_logins if username in slice_logins), key=itemgetter(0))
+            ]
+            for username in usernames
+        }
+
+    async def _aslice_logins_by_user(self, client, query: dict, pit_id: str, slice_id: int, slices: int) -> dict:
+        """Group the logins of a slice of the point in time by user, page by page, so the raw hits of the whole slice aren't kept in memory
+
+        :return: dict with the lowercase usernames as keys and the list of (sort values, login) of the user in the slice, sorted, as values
+        :rtype: dict
+        """
+        logins_by_user = defaultdict(list)
+        async for hits in self._aiter_pages(client, query, pit_id, slice_id, slices):
+            for hit in hits:
+                login = self._parse_hit(hit)
+                username = self._get_username(login)
+                if username:  # exclude not well-formatted usernames (e.g. "")
+                    logins_by_user[username.lower()].append((hit["sort"], login))
+        return logins_by_user
+
+    async def _aiter_pages(self, client, query: dict, pit_id: str, slice_id: int = None, slices: int = 1) -> AsyncIterator[list]:
+        """Stream the pages of hits of the query (or of a slice of it) on the point in time, paginated with search_after
+
+        :return: the pages of hits, one by one
+        :rtype: AsyncIterator[list]
+        """
+        page_size = self.ingestion_config["bucket_size"]
+        body = dict(query, size=page_size, pit={"id": pit_id, "keep_alive": self.ingestion_config.get("pit_keep_alive", "1m")})
+        if slice_id is not None:
+            body["slice"] = {"id": slice_id, "max": slices}
+        while True:
+            response = await client.search(body=body)
+            hits = response["hits"]["hits"]
+            yield hits
+            if len(hits) < page_size:
+                break
+            body["search_after"] = hits[-1]["sort"]
@@ -1,7 +1,93 @@
 import logging
 from abc import ABC, abstractmethod
+from collections import defaultdict
 from datetime import datetime
 from enum import Enum
+from typing import Callable, Iterable, Iterator
+
+# fields required by the detection: the logins without them are discarded by the normalization
+REQUIRED_FIELDS = ("timestamp", "ip", "country", "lat", "lon")
+
+
+def compile_mapping(mapping: dict) -> Callable[[dict], dict]:
+    """Compile the mapping into a function that builds the normalized login, with a direct lookup for each (nested) field.
+    The dotted keys are split once here instead of for each login: e.g. {"source.ip": "ip"} generates:
+
+        try:
+            normalized["ip"] = data["source"]["ip"]
+        except (KeyError, TypeError):
+            normalized["ip"] = ""
+
+    :param mapping: the ingestion keys (dotted for the nested ones) mapped to the BuffaLogs fields
+    :type mapping: dict
+
+    :return: the function that returns the normalized dict of a raw login, with "" for the fields not found
+    :rtype: Callable[[dict], dict]
+    """
+    lines = ["def normalize(data):", "    normalized = {}"]
+    for ingestion_key, buffalogs_key in mapping.items():
+        # the keys are embedded with repr(), so they are always valid string literals
+        lookup = "".join(f"[{key!r}]" for key in ingestion_key.split("."))
+        lines.extend(
+            [
+                "    try:",
+                f"        normalized[{buffalogs_key!r}] = data{lookup}",
+                "    except (KeyError, TypeError):",
+                f"        normalized[{buffalogs_key!r}] = ''",
+            ]
+        )
+    lines.append("    return normalized")
+    namespace = {}
+    exec(compile("\n".join(lines), "<buffalogs-mapping>", "exec"), namespace)  # nosec: the source contains only repr() literals
+    return namespace["normalize"]
+
+
+def collapse_logins(logins: Iterable[dict], max_gap_seconds: float) -> list:
+    """Collapse the bursts of identical logins of a user (e.g. token refreshes) into a single login.
+    The consecutive logins with the same (ip, agent, country, index), each one at most max_gap_seconds after the previous one, are merged
+    into the first one, that is analyzed by the detection with the additional fields (set only on the collapsed logins):
+
+        * first_seen: timestamp of the first login of the burst
+        * last_seen: timestamp of the last login of the burst
+        * last_id: id of the last login of the burst
+        * count: number of logins merged
+
+    The logins of a burst after the first one would change only the timestamp and the event_id of the saved Login,
+    so the detection stores the last_seen and last_id values instead of analyzing each of them
+
+    :param logins: the normalized logins of a user, sorted by timestamp
+    :type logins: Iterable[dict]
+    :param max_gap_seconds: max seconds between two consecutive logins of the same burst, 0 to disable the collapsing
+    :type max_gap_seconds: float
+
+    :return: the logins with the bursts collapsed, in the same order
+    :rtype: list
+    """
+    if not max_gap_seconds:
+        return list(logins)
+    collapsed = []
+    burst = None
+    burst_key = None
+    last_date = None
+    for login in logins:
+        key = (login.get("ip"), login.get("agent"), login.get("country"), login.get("index"))
+        try:
+            date = datetime.fromisoformat(login["timestamp"]) if isinstance(login["timestamp"], str) else login["timestamp"]
+        except (KeyError, TypeError, ValueError):
+            date = None
+        if burst is not None and key == burst_key and date is not None and last_date is not None and 0 <= (date - last_date).total_seconds() <= max_gap_seconds:
+            if "count" not in burst:
+                # the login is copied only when it's merged, the ones not in a burst are returned as they are
+                burst = collapsed[-1] = dict(burst, first_seen=burst["timestamp"], count=1)
+            burst["last_seen"] = login["timestamp"]
+            burst["last_id"] = login.get("id", "")
+            burst["count"] += 1
+        else:
+            burst = login
+            burst_key = key
+            collapsed.append(login)
+        last_date = date
+    return collapsed
 
 
 class BaseIngestion(ABC):
@@ -15,16 +101,21 @@ class BaseIngestion(ABC):
         * ELASTICSEARCH: The login data is extracted from Elasticsearch
         * SPLUNK: The login data is extracted from Splunk
         * OPENSEARCH: The login data is extracted from Opensearch
+        * FILE: The login data is read from local NDJSON files, to replay the logins offline
         """
 
         ELASTICSEARCH = "elasticsearch"
         SPLUNK = "splunk"
         OPENSEARCH = "opensearch"
+        FILE = "file"
 
     def __init__(self, ingestion_config, mapping):
         super().__init__()
         self.ingestion_config = ingestion_config
         self.mapping = mapping
+        # ingestion key mapped to the BuffaLogs "username" field, used to group the logins by user
+        self.username_key = next((ingestion_key for ingestion_key, buffalogs_key in self.mapping.items() if buffalogs_key == "username"), "user.name")
+        self._normalize = compile_mapping(self.mapping)
         self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
 
     @abstractmethod
@@ -59,6 +150,123 @@ class BaseIngestion(ABC):
         """
         raise NotImplementedError
 
+    def close(self):
+        """Concrete method that releases the connections of the ingestion source, called by the IngestionRegistry before replacing the ingestion object.
+        This default implementation does nothing: the ingestion sources with a client or a session override it
+        """
+
+    def iter_users(self, start_date: datetime, end_date: datetime) -> Iterator[str]:
+        """Concrete method that streams the users logged in between the time range defined by (start_date, end_date).
+        Differently from process_users, the ingestion sources that support pagination override it in order not to be limited by the bucket_size.
+        This default implementation just yields the users returned by process_users.
+
+        :param start_date: the initial datetime from which the users are considered
+        :type start_date: datetime (with tzinfo=datetime.timezone.utc)
+        :param end_date: the final datetime within which the users are considered
+        :type end_date: datetime (with tzinfo=datetime.timezone.utc)
+
+        :return: the users strings that logged in the system, one by one
+        :rtype: Iterator[str]
+        """
+        yield from self.process_users(start_date, end_date)
+
+    def iter_user_logins(self, start_date: datetime, end_date: datetime, username: str) -> Iterator[dict]:
+        """Concrete method that streams the logins of the given user in the time range defined by (start_date, end_date), from the oldest to the most recent.
+        Differently from process_user_logins, the ingestion sources that support pagination override it in order not to be limited by the bucket_size
+        and to keep the memory bounded, whatever the number of logins is.
+        This default implementation just yields the logins returned by process_user_logins.
+
+        :param username: username of the user that logged in
+        :type username: str
+        :param start_date: the initial datetime from which the logins of the user are considered
+        :type start_date: datetime (with tzinfo=datetime.timezone.utc)
+        :param end_date: the final datetime within which the logins of the user are considered
+        :type end_date: datetime (with tzinfo=datetime.timezone.utc)
+
+        :return: the logins of the user, one by one
+        :rtype: Iterator[dict]
+        """
+        yield from self.process_user_logins(start_date, end_date, username)
+
+    def process_users_logins(self, start_date: datetime, end_date: datetime, usernames: list) -> dict:
+        """Concrete method that extracts the logins of the given users in the time range defined by (start_date, end_date).
+        This default implementation queries the users one after the other, each one with the paginated iter_user_logins,
+        while the asynchronous ingestion sources query them concurrently.
+
+        :param start_date: the initial datetime from which the logins are considered
+        :type start_date: datetime (with tzinfo=datetime.timezone.utc)
+        :param end_date: the final datetime within which the logins are considered
+        :type end_date: datetime (with tzinfo=datetime.timezone.utc)
+        :param usernames: the users whose logins must be extracted
+        :type usernames: list
+
+        :return: dict with the lowercase usernames as keys and the list of their logins (sorted by timestamp) as values
+        :rtype: dict
+        """
+        logins_by_user = {}
+        for username in usernames:
+            user_logins = list(self.iter_user_logins(start_date, end_date, username))
+            if user_logins:
+                logins_by_user.setdefault(username.lower(), []).extend(user_logins)
+        return logins_by_user
+
+    def process_logins_bulk(self, start_date: datetime, end_date: datetime) -> dict:
+        """Concrete method that extracts all the logins in the time range defined by (start_date, end_date), grouped by username.
+        This default implementation falls back to the per-user extraction (iter_users + iter_user_logins),
+        so the ingestion sources that are able to return all the logins of the window in a single streamed query should override it.
+
+        :param start_date: the initial datetime from which the logins are considered
+        :type start_date: datetime (with tzinfo=datetime.timezone.utc)
+        :param end_date: the final datetime within which the logins are considered
+        :type end_date: datetime (with tzinfo=datetime.timezone.utc)
+
+        :return: dict with the lowercase usernames as keys and the list of their logins (sorted by timestamp) as values
+        :rtype: dict
+        """
+        logins_by_user = defaultdict(list)
+        for username in self.iter_users(start_date, end_date):
+            username = username.lower()
+            logins_by_user[username].extend(self.iter_user_logins(start_date, end_date, username))
+        return dict(logins_by_user)
+
+    def group_logins_by_user(self, logins: Iterable[dict]) -> dict:
+        """Group the raw logins by username, keeping their order.
+        The logins must be already sorted by timestamp, so that each user's list of logins is sorted too.
+
+        :param logins: the raw logins returned by the ingestion source
+        :type logins: Iterable[dict]
+
+        :return: dict with the lowercase usernames as keys and the list of their logins as values
+        :rtype: dict
+        """
+        logins_by_user = defaultdict(list)
+        for login in logins:
+            username = self._get_username(login)
+            if username:  # exclude not well-formatted usernames (e.g. "")
+                logins_by_user[username.lower()].append(login)
+        return dict(logins_by_user)
+
+    def _get_username(self, login: dict) -> str:
+        """Extract the username from a raw login, using the ingestion key mapped to the BuffaLogs "username" field
+
+        :param login: the raw login returned by the ingestion source
+        :type login: dict
+
+        :return: the username of the login or an empty string if it's not present
+        :rtype: str
+        """
+        username_key = self.username_key
+        # the key could be flat (ex. Splunk results: {"user.name": ...}) or nested (ex. Elasticsearch documents: {"user": {"name": ...}})
+        if username_key in login:
+            return login[username_key] or ""
+        value = login
+        for k in username_key.split("."):
+            if isinstance(value, dict) and k in value:
+                value = value[k]
+            else:
+                return ""
+        return value if isinstance(value, str) else ""
+
     def normalize_fields(self, logins: list) -> list:
         """Concrete method that manage the mapping into the required BuffaLogs mapping.
         The mapping used is defined into the ingestion.json file "custom_mapping" if defined, otherwise it is used the default one
@@ -69,13 +277,24 @@ class BaseIngestion(ABC):
         :return: the final normalized list of normalized logins
         :rtype: list
         """
-        normalized_logins = []
-        for login in logins:
-            normalized_login = self._normalize_fields(data=login)
-            if normalized_login:
-                normalized_logins.append(normalized_login)
+        return list(self.iter_normalized(logins))
+
+    def iter_normalized(self, logins: Iterable[dict]) -> Iterator[dict]:
+        """Generator version of normalize_fields, that normalizes the logins one by one while they are consumed
 
-        return normalized_logins
+        :param logins: the logins to be normalized into the mapping fields
+        :type logins: Iterable[dict]
+
+        :return: the normalized logins, skipping the ones without the required fields
+        :rtype: Iterator[dict]
+        """
+        normalize = self._normalize
+        for login in logins:
+            normalized_login = normalize(login)
+            # Skip logins without timestamp, ip, country, latitude or longitude (REQUIRED_FIELDS), checked inline because it's the hot loop
+            get = normalized_login.get
+            if get("timestamp") and get("ip") and get("country") and get("lat") and get("lon"):
+                yield normalized_login
 
     def _normalize_fields(self, data: dict) -> dict:
         """Normalize each login based on the mapping
@@ -83,32 +302,9 @@ class BaseIngestion(ABC):
         :param data: the logins to be normalized into the mapping fields
         :type data: dict
 
-        :return: the final normalized login dict
+        :return: the final normalized login dict, None if a required field is missing
         :rtype: dict
         """
-        normalized_data = {}
-        #
-        for ingestion_key, buffalogs_key in self.mapping.items():
-            # Split the key in case it's nested (ex. 'source.geo.location.lat')
-            keys = ingestion_key.split(".")
-            value = data
-
-            # Traverse the nested keys to extract the correct value
-            for k in keys:
-                if isinstance(value, dict) and k in value:
-                    value = value[k]
-                else:
-                    value = ""  # Return empty string if the path doesn't exist
-
-            # Add the value to the normalized data
-            normalized_data[buffalogs_key] = value
-
-        # Skip logins without timestamp, ip, country, latitude or longitude
-        if (
-            normalized_data.get("timestamp")
-            and normalized_data.get("ip")
-            and normalized_data.get("country")
-            and normalized_data.get("lat")
-            and normalized_data.get("lon")
-        ):
+        normalized_data = self._normalize(data)
+        if all(normalized_data.get(field) for field in REQUIRED_FIELDS):
             return normalized_data
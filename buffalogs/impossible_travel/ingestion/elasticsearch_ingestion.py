@@ -1,13 +1,45 @@
 import logging
 from datetime import datetime
+from functools import lru_cache
+from typing import Any, Iterator
 
+from elasticsearch import AsyncElasticsearch, Elasticsearch
 from elasticsearch.dsl import Search, connections
+from elasticsearch.serializer import JsonSerializer
+from impossible_travel.ingestion.async_ingestion import AsyncIngestionMixin
 from impossible_travel.ingestion.base_ingestion import BaseIngestion
 
+try:
+    # optional dependency, used to decode the raw responses faster
+    import orjson
+except ImportError:
+    orjson = None
+
+# fields kept in the raw responses of the logins searches
+RAW_LOGINS_FILTER_PATH = "pit_id,hits.total.value,hits.hits._id,hits.hits._index,hits.hits._source,hits.hits.sort"
+
+
+class RawJsonSerializer(JsonSerializer):
+    """JSON serializer that decodes the responses with orjson if it's installed, otherwise with the standard json module"""
+
+    def loads(self, data: bytes) -> Any:
+        if orjson is not None:
+            return orjson.loads(data)
+        return super().loads(data)
+
+
+@lru_cache(maxsize=1024)
+def get_index_name(index: str) -> str:
+    """Return the BuffaLogs index name of an Elasticsearch index, e.g. "cloud-2025.02.26" -> "cloud", "fw-proxy-2025.02.26" -> "fw-proxy".
+    The indexes are few, so the results are cached instead of splitting the string for each hit"""
+    return "fw-proxy" if index.startswith("fw-") else index.split("-")[0]
+
 
 class ElasticsearchIngestion(BaseIngestion):
     """
-    Concrete implementation of the BaseIngestion class for Elasticsearch ingestion source
+    Concrete implementation of the BaseIngestion class for Elasticsearch ingestion source.
+    With "raw_responses": true in the elasticsearch section of the ingestion.json config file, the logins searches skip the elasticsearch-dsl
+    response layer: the responses are trimmed by filter_path and decoded (with orjson, if installed) directly into plain dicts
     """
 
     def __init__(self, ingestion_config: dict, mapping: dict):
@@ -16,9 +48,39 @@ class ElasticsearchIngestion(BaseIngestion):
         """
         super().__init__(ingestion_config, mapping)
         # create the elasticsearch host connection
-        connections.create_connection(hosts=self.ingestion_config["url"], request_timeout=self.ingestion_config["timeout"], verify_certs=False)
+        connections.create_connection(**self._client_options())
+        self.raw_client = None
+        if self.ingestion_config.get("raw_responses", False):
+            serializer = RawJsonSerializer()
+            self.raw_client = Elasticsearch(
+                **self._client_options(),
+                # the responses are returned with the compatibility mimetype too
+                serializers={"application/json": serializer, "application/vnd.elasticsearch+json": serializer},
+            )
         self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
 
+    def close(self):
+        """Close the connections pools of the elasticsearch-dsl default connection and of the raw client"""
+        try:
+            connections.get_connection().close()
+            connections.remove_connection("default")
+        except KeyError:
+            # the default connection has already been removed
+            pass
+        if self.raw_client is not None:
+            self.raw_client.close()
+
+    def _client_options(self) -> dict:
+        """Return the options of the Elasticsearch clients, with the connections pool tuned by the ingestion.json config file"""
+        return {
+            "hosts": self.ingestion_config["url"],
+            "request_timeout": self.ingestion_config["timeout"],
+            "verify_certs": False,
+            # max keep-alive connections opened to each node
+            "connections_per_node": self.ingestion_config.get("connections_per_node", 10),
+            "max_retries": self.ingestion_config.get("max_retries", 3),
+        }
+
     def process_users(self, start_date: datetime, end_date: datetime) -> list:
         """
         Concrete implementation of the BaseIngestion.process_users abstract method
@@ -55,6 +117,8 @@ class ElasticsearchIngestion(BaseIngestion):
         if response:
             if response.aggregations:
                 self.logger.info(f"Successfully got {len(response.aggregations.login_user.buckets)} users")
+                if len(response.aggregations.login_user.buckets) >= self.ingestion_config["bucket_size"]:
+                    self.logger.warning(f"The users list could be truncated at bucket_size={self.ingestion_config['bucket_size']}, use iter_users instead")
                 for user in response.aggregations.login_user.buckets:
                     if user.key:  # exclude not well-formatted usernames (e.g. "")
                         users_list.append(user.key)
@@ -77,10 +141,152 @@ class ElasticsearchIngestion(BaseIngestion):
         """
         response = None
         user_logins = []
+        s = self._build_logins_search(start_date, end_date).query("match", **{"user.name": username}).extra(size=self.ingestion_config["bucket_size"])
+        if self.raw_client is not None:
+            return self._process_user_logins_raw(s, username)
+        try:
+            response = s.execute()
+        except ConnectionError:
+            self.logger.error(f"Failed to establish a connection with host: {connections.get_connection()}")
+        except TimeoutError:
+            self.logger.error(f"Timeout reached for the host: {connections.get_connection()}")
+        except Exception as e:
+            self.logger.error(f"Exception while quering elasticsearch: {e}")
+
+        # create a single standard dict (with the required fields listed in the ingestion.json config file) for each login
+        if response:
+            self.logger.info(f"Got {len(response)} logins for the user {username} to be normalized")
+            if response.hits.total.value > len(response.hits.hits):
+                self.logger.warning(
+                    f"Got only {len(response.hits.hits)} of {response.hits.total.value} logins for the user {username}, use iter_user_logins instead"
+                )
+
+            for hit in response.hits.hits:
+                user_logins.append(self._parse_hit(hit.to_dict()))
+
+        return user_logins
+
+    def iter_users(self, start_date: datetime, end_date: datetime) -> Iterator[str]:
+        """
+        Concrete implementation of the BaseIngestion.iter_users method.
+        The users are paginated with a composite aggregation, so they are not limited by the bucket_size
+        The errors are logged and raised, so the results of the pages already read aren't taken as complete
+
+        :param start_date: the initial datetime from which the users are considered
+        :type start_date: datetime (with tzinfo=datetime.timezone.utc)
+        :param end_date: the final datetime within which the users are considered
+        :type end_date: datetime (with tzinfo=datetime.timezone.utc)
+
+        :return: the users strings that logged in Elasticsearch, one by one
+        :rtype: Iterator[str]
+        """
+        self.logger.info(f"Starting at: {start_date} Finishing at: {end_date}")
+        page_size = self.ingestion_config["bucket_size"]
+        after_key = None
         s = (
             Search(index=self.ingestion_config["indexes"])
             .filter("range", **{"@timestamp": {"gte": start_date, "lt": end_date}})
-            .query("match", **{"user.name": username})
+            .query("match", **{"event.category": "authentication"})
+            .query("match", **{"event.outcome": "success"})
+            .query("match", **{"event.type": "start"})
+            .query("exists", field="user.name")
+            .extra(size=0)
+        )
+        try:
+            while True:
+                composite = {"size": page_size, "sources": [{"user": {"terms": {"field": "user.name"}}}]}
+                if after_key:
+                    composite["after"] = after_key
+                s.aggs.bucket("login_user", "composite", **composite)
+                response = s.execute()
+                buckets = response.aggregations.login_user.buckets
+                for user in buckets:
+                    if user.key.user:  # exclude not well-formatted usernames (e.g. "")
+                        yield user.key.user
+                after_key = getattr(response.aggregations.login_user, "after_key", None)
+                if len(buckets) < page_size or not after_key:
+                    break
+                after_key = after_key.to_dict()
+        except ConnectionError:
+            self.logger.error(f"Failed to establish a connection with host: {connections.get_connection()}")
+            raise
+        except TimeoutError:
+            self.logger.error(f"Timeout reached for the host: {connections.get_connection()}")
+            raise
+        except Exception as e:
+            self.logger.error(f"Exception while quering elasticsearch: {e}")
+            raise
+
+    def iter_user_logins(self, start_date: datetime, end_date: datetime, username: str) -> Iterator[dict]:
+        """
+        Concrete implementation of the BaseIngestion.iter_user_logins method.
+        The logins are streamed page by page with a point in time and search_after, so they are not limited by the bucket_size
+        The errors are logged and raised, so the results of the pages already read aren't taken as complete
+
+        :param username: username of the user that logged in Elasticsearch
+        :type username: str
+        :param start_date: the initial datetime from which the logins of the user are considered
+        :type start_date: datetime (with tzinfo=datetime.timezone.utc)
+        :param end_date: the final datetime within which the logins of the user are considered
+        :type end_date: datetime (with tzinfo=datetime.timezone.utc)
+
+        :return: the logins (dictionaries) for that username, one by one
+        :rtype: Iterator[dict]
+        """
+        s = self._build_logins_search(start_date, end_date).query("match", **{"user.name": username})
+        try:
+            yield from self._iter_hits(s)
+        except ConnectionError:
+            self.logger.error(f"Failed to establish a connection with host: {connections.get_connection()}")
+            raise
+        except TimeoutError:
+            self.logger.error(f"Timeout reached for the host: {connections.get_connection()}")
+            raise
+        except Exception as e:
+            self.logger.error(f"Exception while quering elasticsearch: {e}")
+            raise
+
+    def process_logins_bulk(self, start_date: datetime, end_date: datetime) -> dict:
+        """
+        Concrete implementation of the BaseIngestion.process_logins_bulk method.
+        All the logins of the time range are extracted in a single query, streamed page by page with a point in time and search_after
+        The errors are logged and raised, so the detection window isn't considered completed
+
+        :param start_date: the initial datetime from which the logins are considered
+        :type start_date: datetime (with tzinfo=datetime.timezone.utc)
+        :param end_date: the final datetime within which the logins are considered
+        :type end_date: datetime (with tzinfo=datetime.timezone.utc)
+
+        :return: dict with the lowercase usernames as keys and the list of their logins (sorted by timestamp) as values
+        :rtype: dict
+        """
+        self.logger.info(f"Starting bulk logins extraction at: {start_date} Finishing at: {end_date}")
+        logins_by_user = {}
+        s = self._build_logins_search(start_date, end_date).query("exists", field="user.name")
+        try:
+            logins_by_user = self.group_logins_by_user(self._iter_hits(s))
+        except ConnectionError:
+            self.logger.error(f"Failed to establish a connection with host: {connections.get_connection()}")
+            raise
+        except TimeoutError:
+            self.logger.error(f"Timeout reached for the host: {connections.get_connection()}")
+            raise
+        except Exception as e:
+            self.logger.error(f"Exception while quering elasticsearch: {e}")
+            raise
+
+        self.logger.info(f"Got logins for {len(logins_by_user)} users to be normalized")
+        return logins_by_user
+
+    def _build_logins_search(self, start_date: datetime, end_date: datetime) -> Search:
+        """Build the search of the successful authentication logins in the time range defined by (start_date, end_date), sorted by timestamp
+
+        :return: the logins search
+        :rtype: elasticsearch.dsl.Search
+        """
+        return (
+            Search(index=self.ingestion_config["indexes"])
+            .filter("range", **{"@timestamp": {"gte": start_date, "lt": end_date}})
             .query("match", **{"event.category": "authentication"})
             .query("match", **{"event.outcome": "success"})
             .query("match", **{"event.type": "start"})
@@ -101,28 +307,133 @@ class ElasticsearchIngestion(BaseIngestion):
                 ]
             )
             .sort("@timestamp")  # from the oldest to the most recent login
-            .extra(size=self.ingestion_config["bucket_size"])
         )
+
+    def _process_user_logins_raw(self, s: Search, username: str) -> list:
+        """Raw mode of process_user_logins: the logins search is executed without the elasticsearch-dsl response layer
+
+        :return: list of the logins (dictionaries) for that username
+        :rtype: list of dicts
+        """
+        user_logins = []
         try:
-            response = s.execute()
+            response = self.raw_client.search(index=self.ingestion_config["indexes"], body=s.to_dict(), filter_path=RAW_LOGINS_FILTER_PATH).body
+            hits = response.get("hits", {}).get("hits", [])
+            self.logger.info(f"Got {len(hits)} logins for the user {username} to be normalized")
+            total = response.get("hits", {}).get("total", {}).get("value", 0)
+            if total > len(hits):
+                self.logger.warning(f"Got only {len(hits)} of {total} logins for the user {username}, use iter_user_logins instead")
+            user_logins = [self._parse_raw_hit(hit) for hit in hits]
         except ConnectionError:
-            self.logger.error(f"Failed to establish a connection with host: {connections.get_connection()}")
+            self.logger.error(f"Failed to establish a connection with host: {self.raw_client}")
         except TimeoutError:
-            self.logger.error(f"Timeout reached for the host: {connections.get_connection()}")
+            self.logger.error(f"Timeout reached for the host: {self.raw_client}")
         except Exception as e:
             self.logger.error(f"Exception while quering elasticsearch: {e}")
+        return user_logins
 
-        # create a single standard dict (with the required fields listed in the ingestion.json config file) for each login
-        if response:
-            self.logger.info(f"Got {len(response)} logins for the user {username} to be normalized")
+    def _iter_hits(self, s: Search) -> Iterator[dict]:
+        """Generator that streams all the hits of the search, one page (of bucket_size hits) at a time,
+        using a point in time in order to have consistent results across the pages and search_after to get the next page
 
-            for hit in response.hits.hits:
-                hit_dict = hit.to_dict()
-                tmp = {
-                    "_index": "fw-proxy" if hit_dict.get("_index", "").startswith("fw-") else hit_dict.get("_index", "").split("-")[0],
-                    "_id": hit_dict["_id"],
-                }
-                tmp.update(hit_dict["_source"])
-                user_logins.append(tmp)
+        :param s: the search to be executed
+        :type s: elasticsearch.dsl.Search
 
-        return user_logins
+        :return: the logins, one by one
+        :rtype: Iterator[dict]
+        """
+        if self.raw_client is not None:
+            yield from self._iter_raw_hits(s)
+            return
+        page_size = self.ingestion_config["bucket_size"]
+        with s.extra(size=page_size).point_in_time(keep_alive=self.ingestion_config.get("pit_keep_alive", "1m")) as page_search:
+            while True:
+                response = page_search.execute()
+                for hit in response.hits.hits:
+                    yield self._parse_hit(hit.to_dict())
+                if len(response.hits.hits) < page_size:
+                    break
+                page_search = page_search.search_after()
+
+    def _iter_raw_hits(self, s: Search) -> Iterator[dict]:
+        """Raw mode of _iter_hits: the pages are requested with the low-level client, trimmed by filter_path and decoded into plain dicts
+
+        :param s: the search to be executed
+        :type s: elasticsearch.dsl.Search
+
+        :return: the logins, one by one
+        :rtype: Iterator[dict]
+        """
+        page_size = self.ingestion_config["bucket_size"]
+        keep_alive = self.ingestion_config.get("pit_keep_alive", "1m")
+        pit_id = self.raw_client.open_point_in_time(index=self.ingestion_config["indexes"], keep_alive=keep_alive)["id"]
+        body = s.extra(size=page_size).to_dict()
+        try:
+            while True:
+                body["pit"] = {"id": pit_id, "keep_alive": keep_alive}
+                response = self.raw_client.search(body=body, filter_path=RAW_LOGINS_FILTER_PATH).body
+                # the hits key is removed by filter_path if there aren't hits
+                hits = response.get("hits", {}).get("hits", [])
+                for hit in hits:
+                    yield self._parse_raw_hit(hit)
+                if len(hits) < page_size:
+                    break
+                # the point in time id can change between the requests
+                pit_id = response.get("pit_id", pit_id)
+                body["search_after"] = hits[-1]["sort"]
+        finally:
+            self.raw_client.close_point_in_time(id=pit_id)
+
+    def _parse_raw_hit(self, hit: dict) -> dict:
+        """Create the login dict from a raw hit, reusing its _source dict instead of copying it
+
+        :param hit: the raw hit, decoded into a plain dict
+        :type hit: dict
+
+        :return: the login dict
+        :rtype: dict
+        """
+        login = hit["_source"]
+        login["_index"] = get_index_name(hit.get("_index", ""))
+        login["_id"] = hit["_id"]
+        return login
+
+    def _parse_hit(self, hit_dict: dict) -> dict:
+        """Create a single standard dict (with the required fields listed in the ingestion.json config file) from an Elasticsearch hit
+
+        :param hit_dict: the raw hit returned by Elasticsearch
+        :type hit_dict: dict
+
+        :return: the login dict
+        :rtype: dict
+        """
+        login = {
+            "_index": get_index_name(hit_dict.get("_index", "")),
+            "_id": hit_dict["_id"],
+        }
+        login.update(hit_dict["_source"])
+        return login
+
+
+class AsyncElasticsearchIngestion(AsyncIngestionMixin, ElasticsearchIngestion):
+    """
+    Elasticsearch ingestion source that runs the logins queries concurrently with the AsyncElasticsearch client.
+    It's enabled by "async": true in the elasticsearch section of the ingestion.json config file
+    """
+
+    def _get_async_client(self) -> AsyncElasticsearch:
+        """Create the async client. It's bound to the event loop, so a new one is created for each run"""
+        return AsyncElasticsearch(**self._client_options())
+
+    async def _aopen_pit(self, client: AsyncElasticsearch) -> str:
+        response = await client.open_point_in_time(index=self.ingestion_config["indexes"], keep_alive=self.ingestion_config.get("pit_keep_alive", "1m"))
+        return response["id"]
+
+    async def _aclose_pit(self, client: AsyncElasticsearch, pit_id: str):
+        await client.close_point_in_time(id=pit_id)
+
+    def _logins_query(self, start_date: datetime, end_date: datetime) -> dict:
+        return self._build_logins_search(start_date, end_date).query("exists", field="user.name").to_dict()
+
+    def _user_logins_query(self, start_date: datetime, end_date: datetime, username: str) -> dict:
+        return self._build_logins_search(start_date, end_date).query("match", **{"user.name": username}).to_dict()
@@ -0,0 +1,267 @@
+import gzip
+import io
+import json
+import mmap
+import os
+from bisect import bisect_left
+from datetime import datetime, timezone
+from typing import Any, Iterator
+
+from impossible_travel.ingestion.base_ingestion import BaseIngestion
+from impossible_travel.ingestion.elasticsearch_ingestion import get_index_name
+
+try:
+    # optional dependency, used to decode the lines faster
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # optional dependency, needed only for the zstd compressed files
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# extensions of the files read when the configured path is a directory
+SUPPORTED_EXTENSIONS = (
+    ".ndjson",
+    ".jsonl",
+    ".json",
+    ".ndjson.gz",
+    ".jsonl.gz",
+    ".json.gz",
+    ".ndjson.zst",
+    ".jsonl.zst",
+    ".json.zst",
+    ".ndjson.zstd",
+    ".jsonl.zstd",
+    ".json.zstd",
+)
+
+
+class FileIngestion(BaseIngestion):
+    """
+    Concrete implementation of the BaseIngestion class for the local NDJSON files, used to replay the logins offline and to benchmark the detection.
+    Each line is an ECS document (with the same mapping as Elasticsearch) or an Elasticsearch hit with the document in its "_source".
+    The files can be compressed with gzip (.gz) or zstd (.zst or .zstd, requires the zstandard package); the plain ones are read through a memory map.
+
+    The files are loaded once, and again only if they are modified: the logins are sorted by timestamp and indexed by user,
+    so each time window is extracted with a binary search instead of a scan.
+    """
+
+    def __init__(self, ingestion_config: dict, mapping: dict):
+        super().__init__(ingestion_config, mapping)
+        self.timestamp_key = next((ingestion_key for ingestion_key, buffalogs_key in self.mapping.items() if buffalogs_key == "timestamp"), "@timestamp")
+        self._timestamps = None
+        self._logins = None
+        self._user_positions = None
+        # (path, modification time) of the files loaded
+        self._files_signature = None
+
+    def process_users(self, start_date: datetime, end_date: datetime) -> list:
+        """
+        Concrete implementation of the BaseIngestion.process_users abstract method
+
+        :param start_date: the initial datetime from which the users are considered
+        :type start_date: datetime (with tzinfo=datetime.timezone.utc)
+        :param end_date: the final datetime within which the users are considered
+        :type end_date: datetime (with tzinfo=datetime.timezone.utc)
+
+        :return: list of users strings that logged in, in order of first login
+        :rtype: list
+        """
+        self.logger.info(f"Starting at: {start_date} Finishing at: {end_date}")
+        users = {}
+        for login in self._iter_window(start_date, end_date):
+            username = self._get_username(login)
+            users.setdefault(username.lower(), username)
+        self.logger.info(f"Successfully got {len(users)} users")
+        return list(users.values())
+
+    def process_user_logins(self, start_date: datetime, end_date: datetime, username: str) -> list:
+        """
+        Concrete implementation of the BaseIngestion.process_user_logins abstract method
+
+        :param username: username of the user that logged in
+        :type username: str
+        :param start_date: the initial datetime from which the logins of the user are considered
+        :type start_date: datetime (with tzinfo=datetime.timezone.utc)
+        :param end_date: the final datetime within which the logins of the user are considered
+        :type end_date: datetime (with tzinfo=datetime.timezone.utc)
+
+        :return: list of the logins (dictionaries) for that username, sorted by timestamp
+        :rtype: list of dicts
+        """
+        self._load()
+        positions = self._user_positions.get(username.lower(), [])
+        timestamp_of = self._timestamps.__getitem__
+        first = bisect_left(positions, start_date.timestamp(), key=timestamp_of)
+        last = bisect_left(positions, end_date.timestamp(), key=timestamp_of)
+        user_logins = [self._logins[position] for position in positions[first:last]]
+        self.logger.info(f"Got {len(user_logins)} logins for the user {username} to be normalized")
+        return user_logins
+
+    def process_logins_bulk(self, start_date: datetime, end_date: datetime) -> dict:
+        """Extract all the logins in the time range defined by (start_date, end_date) with a single slice of the sorted logins
+
+        :param start_date: the initial datetime from which the logins are considered
+        :type start_date: datetime (with tzinfo=datetime.timezone.utc)
+        :param end_date: the final datetime within which the logins are considered
+        :type end_date: datetime (with tzinfo=datetime.timezone.utc)
+
+        :return: dict with the lowercase usernames as keys and the list of their logins (sorted by timestamp) as values
+        :rtype: dict
+        """
+        logins_by_user = self.group_logins_by_user(self._iter_window(start_date, end_date))
+        self.logger.info(f"Got logins for {len(logins_by_user)} users to be normalized")
+        return logins_by_user
+
+    def _iter_window(self, start_date: datetime, end_date: datetime) -> Iterator[dict]:
+        """Yield the logins with start_date <= timestamp < end_date, as the range filter of the Elasticsearch queries"""
+        self._load()
+        first = bisect_left(self._timestamps, start_date.timestamp())
+        last = bisect_left(self._timestamps, end_date.timestamp())
+        for position in range(first, last):
+            yield self._logins[position]
+
+    def _load(self):
+        """Read all the files, keeping the successful logins sorted by timestamp and the positions of the logins of each user"""
+        files = self._get_files()
+        files_signature = tuple((path, os.stat(path).st_mtime_ns if os.path.exists(path) else None) for path in files)
+        if self._logins is not None and files_signature == self._files_signature:
+            return
+        self._files_signature = files_signature
+        entries = []
+        for path in files:
+            skipped = 0
+            try:
+                for line_number, line in enumerate(self._iter_lines(path), start=1):
+                    if not line.strip():
+                        continue
+                    try:
+                        login = self._parse_line(line, f"{os.path.basename(path)}:{line_number}")
+                    except ValueError:
+                        skipped += 1
+                        continue
+                    if login is not None:
+                        entries.append(login)
+            except (OSError, ValueError) as e:
+                self.logger.error(f"Exception while reading the file {path}: {e}")
+            if skipped:
+                self.logger.warning(f"Skipped {skipped} lines not valid in the file {path}")
+        # stable sort, so the logins with the same timestamp keep the order of the files
+        entries.sort(key=lambda entry: entry[0])
+        self._timestamps = [timestamp for timestamp, _ in entries]
+        self._logins = [login for _, login in entries]
+        self._user_positions = {}
+        for position, login in enumerate(self._logins):
+            self._user_positions.setdefault(self._get_username(login).lower(), []).append(position)
+        self.logger.info(f"Loaded {len(self._logins)} logins of {len(self._user_positions)} users")
+
+    def _get_files(self) -> list:
+        """Return the files to be read: the configured path or, if it's a directory, all its NDJSON files in alphabetical order"""
+        path = self.ingestion_config["path"]
+        if os.path.isdir(path):
+            return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(SUPPORTED_EXTENSIONS))
+        return [path]
+
+    def _iter_lines(self, path: str) -> Iterator[bytes]:
+        """Yield the lines of the file, decompressing it if needed
+
+        :param path: the path of the file
+        :type path: str
+
+        :return: the raw lines, one by one
+        :rtype: Iterator[bytes]
+        """
+        if path.endswith(".gz"):
+            with gzip.open(path, "rb") as f:
+                yield from f
+        elif path.endswith((".zst", ".zstd")):
+            if zstandard is None:
+                raise ValueError(f"The zstandard package is required to read the file {path}")
+            with open(path, "rb") as raw_file, zstandard.ZstdDecompressor().stream_reader(raw_file) as reader:
+                yield from io.BufferedReader(reader)
+        else:
+            with open(path, "rb") as f:
+                # an empty file can't be memory-mapped
+                if os.fstat(f.fileno()).st_size == 0:
+                    return
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    yield from iter(mm.readline, b"")
+
+    def _parse_line(self, line: bytes, default_id: str) -> tuple | None:
+        """Decode a line into the login dict, with the same shape of the ones returned by the Elasticsearch ingestion
+
+        :param line: the raw line
+        :type line: bytes
+        :param default_id: the id of the login if the document hasn't an "_id"
+        :type default_id: str
+
+        :return: the (timestamp, login) tuple or None if the document isn't a successful login
+        :rtype: tuple
+        """
+        document = orjson.loads(line) if orjson is not None else json.loads(line)
+        if not isinstance(document, dict):
+            raise ValueError("The line is not a JSON object")
+        if isinstance(document.get("_source"), dict):
+            # Elasticsearch hit, e.g. exported by elasticdump
+            login = document["_source"]
+            login["_index"] = get_index_name(document.get("_index", ""))
+            login["_id"] = document.get("_id", default_id)
+        else:
+            login = document
+            login.setdefault("_id", default_id)
+        if not self._is_successful_login(login) or not self._get_username(login):
+            return None
+        timestamp = self._get_timestamp(login)
+        if timestamp is None:
+            return None
+        container, key = self._get_timestamp_container(login)
+        if not isinstance(container[key], str) or self._is_naive(container[key]):
+            # the detection expects the aware (UTC) ISO timestamps returned by the other sources
+            container[key] = datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+        return timestamp, login
+
+    @staticmethod
+    def _is_naive(value: str) -> bool:
+        """Return True if the (valid) ISO timestamp has no timezone"""
+        return not value.endswith("Z") and datetime.fromisoformat(value).tzinfo is None
+
+    def _is_successful_login(self, login: dict) -> bool:
+        """Apply the same event filters of the Elasticsearch queries, only to the documents that have the event fields"""
+        event = login.get("event")
+        if not isinstance(event, dict):
+            return True
+        for field, expected in (("category", "authentication"), ("outcome", "success"), ("type", "start")):
+            value = event.get(field)
+            if value is not None and expected not in (value if isinstance(value, list) else [value]):
+                return False
+        return True
+
+    def _get_timestamp_container(self, login: dict) -> tuple:
+        """Return the dict that contains the timestamp of the login and its key in it, for a flat or nested (dotted) timestamp key"""
+        if self.timestamp_key in login:
+            return login, self.timestamp_key
+        *parents, key = self.timestamp_key.split(".")
+        container: Any = login
+        for k in parents:
+            container = container.get(k) if isinstance(container, dict) else None
+        return (container if isinstance(container, dict) else {}), key
+
+    def _get_timestamp(self, login: dict) -> float | None:
+        """Return the timestamp of the login as seconds from the epoch, None if it's missing or not valid.
+        The numeric timestamps are epoch milliseconds, as the Elasticsearch date fields, and the ISO timestamps without timezone are in UTC"""
+        container, key = self._get_timestamp_container(login)
+        value: Any = container.get(key)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value / 1000
+        if not isinstance(value, str):
+            return None
+        try:
+            timestamp = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        return timestamp.timestamp()
@@ -1,20 +1,40 @@
 import json
+import logging
 import os
+import threading
 
 from django.conf import settings
 from impossible_travel.ingestion.base_ingestion import BaseIngestion
-from impossible_travel.ingestion.elasticsearch_ingestion import ElasticsearchIngestion
-from impossible_travel.ingestion.opensearch_ingestion import OpensearchIngestion
+from impossible_travel.ingestion.elasticsearch_ingestion import AsyncElasticsearchIngestion, ElasticsearchIngestion
+from impossible_travel.ingestion.file_ingestion import FileIngestion
+from impossible_travel.ingestion.multi_ingestion import MultiIngestion
+from impossible_travel.ingestion.opensearch_ingestion import AsyncOpensearchIngestion, OpensearchIngestion
 from impossible_travel.ingestion.splunk_ingestion import SplunkIngestion
 
+logger = logging.getLogger(__name__)
+
+
+def get_config_path() -> str:
+    """Return the path of the ingestion.json config file"""
+    return os.path.join(settings.CERTEGO_BUFFALOGS_CONFIG_PATH, "buffalogs/ingestion.json")
+
 
 class IngestionFactory:
+    """
+    Build the ingestion object of the "active_ingestion" of the ingestion.json config file.
+    It can be a source name or a list of source names, queried together by a MultiIngestion: the first one is the primary source,
+    whose config and mapping are returned by the ingestion_config and mapping attributes
+    """
+
     def __init__(self):
         config = self._read_config()
-        self.active_ingestion = BaseIngestion.SupportedIngestionSources(config["active_ingestion"])
-        self.ingestion_config = config[config["active_ingestion"]]
+        self.config = config
+        sources = config["active_ingestion"] if isinstance(config["active_ingestion"], list) else [config["active_ingestion"]]
+        self.active_ingestions = [BaseIngestion.SupportedIngestionSources(source) for source in sources]
+        self.active_ingestion = self.active_ingestions[0]
+        self.ingestion_config = config[self.active_ingestion.value]
         # default mapping: Elasticsearch mapping
-        self.mapping = self.ingestion_config.get("custom_mapping", config["elasticsearch"]["custom_mapping"])
+        self.mapping = self._get_mapping(self.active_ingestion)
 
     def _read_config(self) -> dict:
         """
@@ -23,28 +43,110 @@ class IngestionFactory:
         :return : the configuration dict
         :rtype: dict
         """
-        with open(
-            os.path.join(settings.CERTEGO_BUFFALOGS_CONFIG_PATH, "buffalogs/ingestion.json"),
-            mode="r",
-            encoding="utf-8",
-        ) as f:
+        with open(get_config_path(), mode="r", encoding="utf-8") as f:
             config = json.load(f)
-        if config["active_ingestion"] not in [i.value for i in BaseIngestion.SupportedIngestionSources]:
-            raise ValueError(f"The ingestion source: {config['active_ingestion']} is not supported")
-        if not config.get(config["active_ingestion"]):
-            raise ValueError(f"The configuration for the {config['active_ingestion']} must be implemented")
+        sources = config["active_ingestion"] if isinstance(config["active_ingestion"], list) else [config["active_ingestion"]]
+        if not sources:
+            raise ValueError("At least an active ingestion source must be set")
+        for source in sources:
+            if source not in [i.value for i in BaseIngestion.SupportedIngestionSources]:
+                raise ValueError(f"The ingestion source: {source} is not supported")
+            if not config.get(source):
+                raise ValueError(f"The configuration for the {source} must be implemented")
         return config
 
+    def _get_mapping(self, source: BaseIngestion.SupportedIngestionSources) -> dict:
+        return self.config[source.value].get("custom_mapping", self.config["elasticsearch"]["custom_mapping"])
+
     def get_ingestion_class(self):
         """
-        Return the ingestion class
+        Return the ingestion class. With more active sources, it's a MultiIngestion that queries all of them concurrently
         """
-        match self.active_ingestion:
+        if len(self.active_ingestions) == 1:
+            return self._get_source_ingestion(self.active_ingestion)
+        ingestions = {source.value: self._get_source_ingestion(source) for source in self.active_ingestions}
+        return MultiIngestion(
+            {
+                "sources": list(ingestions),
+                "timeout": self.config.get("sources_timeout", MultiIngestion.DEFAULT_TIMEOUT),
+                "partial": self.config.get("sources_partial", False),
+            },
+            ingestions,
+        )
+
+    def _get_source_ingestion(self, source: BaseIngestion.SupportedIngestionSources) -> BaseIngestion:
+        """
+        Return the ingestion class of a source. The Elasticsearch and Opensearch sources run the queries concurrently if "async" is enabled in their config
+        """
+        ingestion_config = self.config[source.value]
+        mapping = self._get_mapping(source)
+        use_async = ingestion_config.get("async", False)
+        match source:
             case BaseIngestion.SupportedIngestionSources.ELASTICSEARCH:
-                return ElasticsearchIngestion(self.ingestion_config, self.mapping)
+                if use_async:
+                    return AsyncElasticsearchIngestion(ingestion_config, mapping)
+                return ElasticsearchIngestion(ingestion_config, mapping)
             case BaseIngestion.SupportedIngestionSources.OPENSEARCH:
-                return OpensearchIngestion(self.ingestion_config, self.mapping)
+                if use_async:
+                    return AsyncOpensearchIngestion(ingestion_config, mapping)
+                return OpensearchIngestion(ingestion_config, mapping)
             case BaseIngestion.SupportedIngestionSources.SPLUNK:
-                return SplunkIngestion(self.ingestion_config, self.mapping)
+                return SplunkIngestion(ingestion_config, mapping)
+            case BaseIngestion.SupportedIngestionSources.FILE:
+                return FileIngestion(ingestion_config, mapping)
             case _:
-                raise ValueError(f"Unsupported ingestion source: {self.active_ingestion}")
+                raise ValueError(f"Unsupported ingestion source: {source}")
+
+
+class IngestionRegistry:
+    """
+    Process-level registry of the active ingestion source (or sources).
+    The ingestion object, with its keep-alive connections pool (or Splunk session), is created once and reused by all the tasks and requests
+    of the process, instead of reading the config file and connecting again each time.
+    It's created again only if the ingestion.json config file is modified or in a forked process (e.g. a Celery prefork worker),
+    because the connections can't be shared with the parent process.
+    When the config file is modified, the previous ingestion object is closed before replacing it, so its connections aren't leaked.
+    The one inherited by a forked process is just dropped instead, because its connections are still used by the parent process
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self._ingestion = None
+
+    def get_ingestion(self) -> BaseIngestion:
+        """Return the ingestion object of the active source
+
+        :return: the ingestion object, shared by the process
+        :rtype: BaseIngestion
+        """
+        key = (os.getpid(), os.stat(get_config_path()).st_mtime_ns)
+        with self._lock:
+            if self._ingestion is None or key != self._key:
+                self._release()
+                self._ingestion = IngestionFactory().get_ingestion_class()
+                self._key = key
+            return self._ingestion
+
+    def clear(self):
+        """Close and forget the ingestion object, so it's created again at the next request"""
+        with self._lock:
+            self._release()
+
+    def _release(self):
+        """Close the current ingestion object, if it was created by this process, and forget it"""
+        if self._ingestion is not None and self._key[0] == os.getpid():
+            try:
+                self._ingestion.close()
+            except Exception as e:
+                logger.warning(f"Failed to close the previous ingestion object: {e}")
+        self._ingestion = None
+        self._key = None
+
+
+ingestion_registry = IngestionRegistry()
+
+
+def get_ingestion() -> BaseIngestion:
+    """Return the ingestion object of the active source, shared by the process and reloaded when the ingestion.json config file changes"""
+    return ingestion_registry.get_ingestion()
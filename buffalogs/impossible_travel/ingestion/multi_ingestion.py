@@ -0,0 +1,205 @@
+import heapq
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import Iterable, Iterator
+
+from impossible_travel.constants import INDEX_SOURCE_SEPARATOR
+from impossible_travel.ingestion.base_ingestion import BaseIngestion
+
+
+def get_login_date(login: dict) -> datetime:
+    """Return the timestamp of a normalized login as an aware datetime, used to merge the logins of different sources.
+    The sources return the timestamps in different formats (e.g. "2025-02-26T13:30:00.000Z" or "2025-02-26T13:30:00.000+00:00")
+
+    :param login: the normalized login
+    :type login: dict
+
+    :return: the timestamp of the login, datetime.min if it's not valid
+    :rtype: datetime
+    """
+    timestamp = login.get("timestamp")
+    try:
+        date = timestamp if isinstance(timestamp, datetime) else datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return datetime.min.replace(tzinfo=timezone.utc)
+    return date if date.tzinfo is not None else date.replace(tzinfo=timezone.utc)
+
+
+class MultiIngestion(BaseIngestion):
+    """
+    Fan-in of more ingestion sources, used when the "active_ingestion" of the ingestion.json config file is a list of sources.
+    Each extraction queries all the sources concurrently, in a thread each, for the same time range.
+    The logins of each source are normalized with its own mapping and their index is tagged with the source name (e.g. "splunk:ad"),
+    then the logins of each user are merged in timestamp order with a k-way merge, so the detection analyzes a single ordered stream.
+
+    A source that fails or doesn't answer within ingestion_config["timeout"] seconds is logged and raised, so the detection window isn't completed
+    and it's analyzed again by the next runs. With ingestion_config["partial"], it's logged and skipped instead, without blocking the logins of the others:
+    in this case its logins of the window are lost.
+    Differently from the other sources, the logins returned are already normalized, so normalize_fields() just returns them
+    """
+
+    DEFAULT_TIMEOUT = 300
+
+    def __init__(self, ingestion_config: dict, ingestions: dict):
+        """
+        :param ingestion_config: the fan-in settings: "sources" (list of the source names), "timeout" (max seconds waited for each extraction)
+            and "partial" (if the sources failed are skipped instead of raised)
+        :type ingestion_config: dict
+        :param ingestions: the ingestion object of each source, in order of priority: the mapping of the first one is the default one
+        :type ingestions: dict
+        """
+        self.ingestions = ingestions
+        super().__init__(ingestion_config, next(iter(ingestions.values())).mapping)
+
+    @property
+    def timeout(self) -> float:
+        return float(self.ingestion_config.get("timeout", self.DEFAULT_TIMEOUT))
+
+    @property
+    def partial(self) -> bool:
+        return bool(self.ingestion_config.get("partial", False))
+
+    def close(self):
+        """Close the ingestion objects of all the sources"""
+        for ingestion in self.ingestions.values():
+            ingestion.close()
+
+    def _fan_out(self, method_name: str, *args) -> dict:
+        """Call the method with the same arguments on all the sources concurrently
+
+        :param method_name: name of the BaseIngestion method called
+        :type method_name: str
+
+        :return: dict with the source names as keys and the results of the method as values, without the sources failed or timed out (only if partial)
+        :rtype: dict
+        """
+        started = time.monotonic()
+
+        def call(source: str, ingestion: BaseIngestion):
+            result = getattr(ingestion, method_name)(*args)
+            # the generators are consumed inside the thread of the source
+            result = list(result) if isinstance(result, Iterator) else result
+            self.logger.info(f"Source {source}: {method_name} completed in {time.monotonic() - started:.2f}s")
+            return result
+
+        results = {}
+        failed_sources = []
+        executor = ThreadPoolExecutor(max_workers=len(self.ingestions), thread_name_prefix="buffalogs-ingestion")
+        try:
+            futures = {executor.submit(call, source, ingestion): source for source, ingestion in self.ingestions.items()}
+            done, not_done = wait(futures, timeout=self.timeout)
+            for future in not_done:
+                self.logger.error(f"Source {futures[future]}: {method_name} not completed within {self.timeout}s")
+                failed_sources.append(futures[future])
+            for future in done:
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    self.logger.error(f"Source {futures[future]}: {method_name} failed: {e}")
+                    failed_sources.append(futures[future])
+        finally:
+            # don't wait for the sources timed out
+            executor.shutdown(wait=False, cancel_futures=True)
+        if failed_sources and not self.partial:
+            raise ConnectionError(f"Sources {failed_sources}: {method_name} not completed")
+        if failed_sources:
+            self.logger.warning(f"Sources {failed_sources}: {method_name} not completed, their logins are skipped")
+        # keep the order of the sources
+        return {source: results[source] for source in self.ingestions if source in results}
+
+    def _tag_logins(self, source: str, logins: Iterable[dict]) -> list:
+        """Normalize the raw logins of a source with its mapping and tag their index with the source name"""
+        normalized_logins = self.ingestions[source].normalize_fields(list(logins))
+        for login in normalized_logins:
+            login["index"] = f"{source}{INDEX_SOURCE_SEPARATOR}{login['index']}"
+        return normalized_logins
+
+    def _merge_logins(self, logins_by_source: dict) -> list:
+        """k-way merge of the normalized logins of the sources, each one already sorted by timestamp
+
+        :param logins_by_source: dict with the source names as keys and their normalized logins as values
+        :type logins_by_source: dict
+
+        :return: all the logins, sorted by timestamp (for the same timestamp, in order of source)
+        :rtype: list
+        """
+        return list(heapq.merge(*logins_by_source.values(), key=get_login_date))
+
+    def _merge_logins_by_user(self, results: dict) -> dict:
+        logins_by_user = {}
+        for source, source_logins_by_user in results.items():
+            for username, user_logins in source_logins_by_user.items():
+                logins_by_user.setdefault(username.lower(), {})[source] = self._tag_logins(source, user_logins)
+        return {username: self._merge_logins(logins_by_source) for username, logins_by_source in logins_by_user.items()}
+
+    def process_users(self, start_date: datetime, end_date: datetime) -> list:
+        """
+        Concrete implementation of the BaseIngestion.process_users abstract method
+
+        :param start_date: the initial datetime from which the users are considered
+        :type start_date: datetime (with tzinfo=datetime.timezone.utc)
+        :param end_date: the final datetime within which the users are considered
+        :type end_date: datetime (with tzinfo=datetime.timezone.utc)
+
+        :return: list of users strings that logged in any source, without case duplicates
+        :rtype: list
+        """
+        users = {}
+        for source_users in self._fan_out("process_users", start_date, end_date).values():
+            for username in source_users:
+                users.setdefault(username.lower(), username)
+        return list(users.values())
+
+    def process_user_logins(self, start_date: datetime, end_date: datetime, username: str) -> list:
+        """
+        Concrete implementation of the BaseIngestion.process_user_logins abstract method
+
+        :param username: username of the user that logged in
+        :type username: str
+        :param start_date: the initial datetime from which the logins of the user are considered
+        :type start_date: datetime (with tzinfo=datetime.timezone.utc)
+        :param end_date: the final datetime within which the logins of the user are considered
+        :type end_date: datetime (with tzinfo=datetime.timezone.utc)
+
+        :return: the normalized logins of the user in all the sources, sorted by timestamp
+        :rtype: list
+        """
+        results = self._fan_out("process_user_logins", start_date, end_date, username)
+        return self._merge_logins({source: self._tag_logins(source, logins) for source, logins in results.items()})
+
+    def iter_users(self, start_date: datetime, end_date: datetime) -> Iterator[str]:
+        users = {}
+        for source_users in self._fan_out("iter_users", start_date, end_date).values():
+            for username in source_users:
+                users.setdefault(username.lower(), username)
+        yield from users.values()
+
+    def iter_user_logins(self, start_date: datetime, end_date: datetime, username: str) -> Iterator[dict]:
+        results = self._fan_out("iter_user_logins", start_date, end_date, username)
+        yield from self._merge_logins({source: self._tag_logins(source, logins) for source, logins in results.items()})
+
+    def process_users_logins(self, start_date: datetime, end_date: datetime, usernames: list) -> dict:
+        return self._merge_logins_by_user(self._fan_out("process_users_logins", start_date, end_date, usernames))
+
+    def process_logins_bulk(self, start_date: datetime, end_date: datetime) -> dict:
+        """Extract all the logins of the time range from all the sources concurrently, each one with its bulk extraction
+
+        :param start_date: the initial datetime from which the logins are considered
+        :type start_date: datetime (with tzinfo=datetime.timezone.utc)
+        :param end_date: the final datetime within which the logins are considered
+        :type end_date: datetime (with tzinfo=datetime.timezone.utc)
+
+        :return: dict with the lowercase usernames as keys and the list of their normalized logins (sorted by timestamp) as values
+        :rtype: dict
+        """
+        self.logger.info(f"Starting bulk logins extraction from the sources {list(self.ingestions)} at: {start_date} Finishing at: {end_date}")
+        results = self._fan_out("process_logins_bulk", start_date, end_date)
+        if not results:
+            # even if partial, the window isn't considered completed if no logins could be extracted
+            raise ConnectionError(f"No source answered from {start_date} to {end_date}")
+        return self._merge_logins_by_user(results)
+
+    def iter_normalized(self, logins: Iterable[dict]) -> Iterator[dict]:
+        """The logins returned by the sources are already normalized, with their own mapping"""
+        yield from logins
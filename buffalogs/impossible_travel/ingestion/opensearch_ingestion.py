@@ -1,12 +1,19 @@
 import logging
 from datetime import datetime
+from typing import Iterator
 
+from impossible_travel.ingestion.async_ingestion import AsyncIngestionMixin
 from impossible_travel.ingestion.base_ingestion import BaseIngestion
 
 try:
     from opensearchpy import OpenSearch
 except ImportError:
     pass
+try:
+    # the async client requires the aiohttp package (opensearch-py[async])
+    from opensearchpy import AsyncOpenSearch
+except ImportError:
+    pass
 
 
 class OpensearchIngestion(BaseIngestion):
@@ -14,6 +21,21 @@ class OpensearchIngestion(BaseIngestion):
     Concrete implementation of the BaseIngestion class for Opensearch ingestion source
     """
 
+    # fields of the login documents returned by the searches
+    LOGIN_FIELDS = [
+        "user.name",
+        "@timestamp",
+        "source.geo.location.lat",
+        "source.geo.location.lon",
+        "source.geo.country_name",
+        "source.as.organization.name",
+        "user_agent.original",
+        "_index",
+        "source.ip",
+        "_id",
+        "source.intelligence_category",
+    ]
+
     def __init__(self, ingestion_config: dict, mapping: dict):
         """
         Constructor for the Opensearch Ingestion object
@@ -24,9 +46,16 @@ class OpensearchIngestion(BaseIngestion):
             hosts=[self.ingestion_config["url"]],
             timeout=self.ingestion_config["timeout"],
             verify_certs=False,
+            # max keep-alive connections opened to each node
+            pool_maxsize=self.ingestion_config.get("pool_maxsize", 10),
+            max_retries=self.ingestion_config.get("max_retries", 3),
         )
         self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
 
+    def close(self):
+        """Close the connections pool of the Opensearch client"""
+        self.client.close()
+
     def process_users(self, start_date: datetime, end_date) -> list:
         """
         Concrete implementation of the BaseIngestion.process_users abstract method
@@ -68,6 +97,8 @@ class OpensearchIngestion(BaseIngestion):
         # Only access response if it exists
         if response and "aggregations" in response and "login_user" in response["aggregations"]:
             self.logger.info(f"Successfully got {len(response['aggregations']['login_user']['buckets'])} users")
+            if len(response["aggregations"]["login_user"]["buckets"]) >= self.ingestion_config["bucket_size"]:
+                self.logger.warning(f"The users list could be truncated at bucket_size={self.ingestion_config['bucket_size']}, use iter_users instead")
             for user in response["aggregations"]["login_user"]["buckets"]:
                 users_list.append(user["key"])
         return users_list
@@ -97,19 +128,7 @@ class OpensearchIngestion(BaseIngestion):
                 }
             },
             "sort": [{"@timestamp": {"order": "asc"}}],
-            "_source": [
-                "user.name",
-                "@timestamp",
-                "source.geo.location.lat",
-                "source.geo.location.lon",
-                "source.geo.country_name",
-                "source.as.organization.name",
-                "user_agent.original",
-                "_index",
-                "source.ip",
-                "_id",
-                "source.intelligence_category",
-            ],
+            "_source": self.LOGIN_FIELDS,
             "size": self.ingestion_config["bucket_size"],
         }
         try:
@@ -124,14 +143,235 @@ class OpensearchIngestion(BaseIngestion):
         if response and "hits" in response and "hits" in response["hits"]:
             # Process hits into standardized format
             self.logger.info(f"Got {len(response['hits']['hits'])} logins or the user {username} to be normalized")
+            total_hits = response["hits"].get("total", {}).get("value", 0)
+            if total_hits > len(response["hits"]["hits"]):
+                self.logger.warning(f"Got only {len(response['hits']['hits'])} of {total_hits} logins for the user {username}, use iter_user_logins instead")
 
             for hit in response["hits"]["hits"]:
-                tmp = {
-                    "_index": "fw-proxy" if hit.get("_index", "").startswith("fw-") else hit.get("_index", "").split("-")[0],
-                    "_id": hit["_id"],
-                }
-                # Add source data to the tmp dict
-                tmp.update(hit["_source"])
-                user_logins.append(tmp)
+                user_logins.append(self._parse_hit(hit))
 
         return user_logins
+
+    def iter_users(self, start_date: datetime, end_date: datetime) -> Iterator[str]:
+        """
+        Concrete implementation of the BaseIngestion.iter_users method.
+        The users are paginated with a composite aggregation, so they are not limited by the bucket_size
+        The errors are logged and raised, so the results of the pages already read aren't taken as complete
+
+        :param start_date: the initial datetime from which the users are considered
+        :type start_date: datetime (with tzinfo=datetime.timezone.utc)
+        :param end_date: the final datetime within which the users are considered
+        :type end_date: datetime (with tzinfo=datetime.timezone.utc)
+
+        :return: the users strings that logged in Opensearch, one by one
+        :rtype: Iterator[str]
+        """
+        self.logger.info(f"Starting at: {start_date} Finishing at: {end_date}")
+        page_size = self.ingestion_config["bucket_size"]
+        composite = {"size": page_size, "sources": [{"user": {"terms": {"field": "user.name"}}}]}
+        query = {
+            "query": {
+                "bool": {
+                    "must": [
+                        {"range": {"@timestamp": {"gte": start_date, "lt": end_date}}},
+                        {"match": {"event.category": "authentication"}},
+                        {"match": {"event.outcome": "success"}},
+                        {"match": {"event.type": "start"}},
+                        {"exists": {"field": "user.name"}},
+                    ]
+                }
+            },
+            "size": 0,
+            "aggs": {"login_user": {"composite": composite}},
+        }
+        try:
+            while True:
+                response = self.client.search(index=self.ingestion_config["indexes"], body=query)
+                buckets = response["aggregations"]["login_user"]["buckets"]
+                for user in buckets:
+                    if user["key"]["user"]:  # exclude not well-formatted usernames (e.g. "")
+                        yield user["key"]["user"]
+                after_key = response["aggregations"]["login_user"].get("after_key")
+                if len(buckets) < page_size or not after_key:
+                    break
+                composite["after"] = after_key
+        except ConnectionError:
+            self.logger.error(f"Failed to establish a connection with host: {self.client}")
+            raise
+        except TimeoutError:
+            self.logger.error(f"Timeout reached for the host: {self.client}")
+            raise
+        except Exception as e:
+            self.logger.error(f"Exception while quering opensearch: {e}")
+            raise
+
+    def iter_user_logins(self, start_date: datetime, end_date: datetime, username: str) -> Iterator[dict]:
+        """
+        Concrete implementation of the BaseIngestion.iter_user_logins method.
+        The logins are streamed page by page with a point in time and search_after, so they are not limited by the bucket_size
+        The errors are logged and raised, so the results of the pages already read aren't taken as complete
+
+        :param username: Username of the user that logged in
+        :param start_date: the initial datetime from which the logins of the user are considered
+        :param end_date: the final datetime within which the logins of the user are considered
+        :return: the logins (dictionaries) for that specified username, one by one
+        :rtype: Iterator[dict]
+        """
+        query = self._user_logins_query(start_date, end_date, username)
+        try:
+            yield from self._iter_hits(query)
+        except ConnectionError:
+            self.logger.error(f"Failed to establish a connection with host:{self.client}")
+            raise
+        except TimeoutError:
+            self.logger.error(f"Timeout reached for the host:{self.client}")
+            raise
+        except Exception as e:
+            self.logger.error(f"Exception while querying opensearch:{e}")
+            raise
+
+    def process_logins_bulk(self, start_date: datetime, end_date: datetime) -> dict:
+        """
+        Concrete implementation of the BaseIngestion.process_logins_bulk method.
+        All the logins of the time range are extracted in a single query, streamed page by page with a point in time and search_after
+        The errors are logged and raised, so the detection window isn't considered completed
+
+        :param start_date: the initial datetime from which the logins are considered
+        :type start_date: datetime (with tzinfo=datetime.timezone.utc)
+        :param end_date: the final datetime within which the logins are considered
+        :type end_date: datetime (with tzinfo=datetime.timezone.utc)
+
+        :return: dict with the lowercase usernames as keys and the list of their logins (sorted by timestamp) as values
+        :rtype: dict
+        """
+        self.logger.info(f"Starting bulk logins extraction at: {start_date} Finishing at: {end_date}")
+        logins_by_user = {}
+        query = self._logins_query(start_date, end_date)
+        try:
+            logins_by_user = self.group_logins_by_user(self._iter_hits(query))
+        except ConnectionError:
+            self.logger.error(f"Failed to establish a connection with host: {self.client}")
+            raise
+        except TimeoutError:
+            self.logger.error(f"Timeout reached for the host: {self.client}")
+            raise
+        except Exception as e:
+            self.logger.error(f"Exception while querying opensearch: {e}")
+            raise
+
+        self.logger.info(f"Got logins for {len(logins_by_user)} users to be normalized")
+        return logins_by_user
+
+    def _logins_query(self, start_date: datetime, end_date: datetime) -> dict:
+        """Build the query of all the successful authentication logins in the time range defined by (start_date, end_date), sorted by timestamp
+
+        :return: the body of the search
+        :rtype: dict
+        """
+        return {
+            "query": {
+                "bool": {
+                    "must": [
+                        {"range": {"@timestamp": {"gte": start_date, "lt": end_date}}},
+                        {"match": {"event.category": "authentication"}},
+                        {"match": {"event.outcome": "success"}},
+                        {"match": {"event.type": "start"}},
+                        {"exists": {"field": "user.name"}},
+                        {"exists": {"field": "source.ip"}},
+                    ]
+                }
+            },
+            # the "_doc" tiebreaker keeps the pagination consistent between logins with the same timestamp
+            "sort": [{"@timestamp": {"order": "asc"}}, {"_doc": {"order": "asc"}}],
+            "_source": self.LOGIN_FIELDS,
+        }
+
+    def _user_logins_query(self, start_date: datetime, end_date: datetime, username: str) -> dict:
+        """Build the query of the successful logins of the user in the time range defined by (start_date, end_date), sorted by timestamp
+
+        :return: the body of the search
+        :rtype: dict
+        """
+        return {
+            "query": {
+                "bool": {
+                    "must": [
+                        {"range": {"@timestamp": {"gte": start_date, "lt": end_date}}},
+                        {"match": {"user.name": username}},
+                        {"match": {"event.outcome": "success"}},
+                        {"match": {"event.type": "start"}},
+                        {"exists": {"field": "source.ip"}},
+                    ]
+                }
+            },
+            # the "_doc" tiebreaker keeps the pagination consistent between logins with the same timestamp
+            "sort": [{"@timestamp": {"order": "asc"}}, {"_doc": {"order": "asc"}}],
+            "_source": self.LOGIN_FIELDS,
+        }
+
+    def _iter_hits(self, query: dict) -> Iterator[dict]:
+        """Generator that streams all the hits of the query, one page (of bucket_size hits) at a time,
+        using a point in time in order to have consistent results across the pages and search_after to get the next page
+
+        :param query: the body of the search, with an explicit sort
+        :type query: dict
+
+        :return: the logins, one by one
+        :rtype: Iterator[dict]
+        """
+        page_size = self.ingestion_config["bucket_size"]
+        keep_alive = self.ingestion_config.get("pit_keep_alive", "1m")
+        pit_id = self.client.create_pit(index=self.ingestion_config["indexes"], keep_alive=keep_alive)["pit_id"]
+        body = dict(query, size=page_size, pit={"id": pit_id, "keep_alive": keep_alive})
+        try:
+            while True:
+                response = self.client.search(body=body)
+                hits = response["hits"]["hits"]
+                for hit in hits:
+                    yield self._parse_hit(hit)
+                if len(hits) < page_size:
+                    break
+                body["search_after"] = hits[-1]["sort"]
+        finally:
+            self.client.delete_pit(body={"pit_id": [pit_id]})
+
+    def _parse_hit(self, hit: dict) -> dict:
+        """Create a single standard dict (with the required fields listed in the ingestion.json config file) from an Opensearch hit
+
+        :param hit: the raw hit returned by Opensearch
+        :type hit: dict
+
+        :return: the login dict
+        :rtype: dict
+        """
+        login = {
+            "_index": "fw-proxy" if hit.get("_index", "").startswith("fw-") else hit.get("_index", "").split("-")[0],
+            "_id": hit["_id"],
+        }
+        # Add source data to the login dict
+        login.update(hit["_source"])
+        return login
+
+
+class AsyncOpensearchIngestion(AsyncIngestionMixin, OpensearchIngestion):
+    """
+    Opensearch ingestion source that runs the logins queries concurrently with the AsyncOpenSearch client.
+    It's enabled by "async": true in the opensearch section of the ingestion.json config file
+    """
+
+    def _get_async_client(self) -> "AsyncOpenSearch":
+        """Create the async client. It's bound to the event loop, so a new one is created for each run"""
+        return AsyncOpenSearch(
+            hosts=[self.ingestion_config["url"]],
+            timeout=self.ingestion_config["timeout"],
+            verify_certs=False,
+            maxsize=self.ingestion_config.get("pool_maxsize", 10),
+            max_retries=self.ingestion_config.get("max_retries", 3),
+        )
+
+    async def _aopen_pit(self, client: "AsyncOpenSearch") -> str:
+        response = await client.create_pit(index=self.ingestion_config["indexes"], keep_alive=self.ingestion_config.get("pit_keep_alive", "1m"))
+        return response["pit_id"]
+
+    async def _aclose_pit(self, client: "AsyncOpenSearch", pit_id: str):
+        await client.delete_pit(body={"pit_id": [pit_id]})
@@ -1,5 +1,8 @@
+import json
 import logging
+import time
 from datetime import datetime
+from typing import Iterator
 
 try:
     from splunklib import client, results
@@ -10,9 +13,17 @@ from impossible_travel.ingestion.base_ingestion import BaseIngestion
 
 class SplunkIngestion(BaseIngestion):
     """
-    Concrete implementation of the BaseIngestion class for Splunk ingestion source
+    Concrete implementation of the BaseIngestion class for Splunk ingestion source.
+    By default the searches are run as jobs, polled until they are done. With "streaming": true in the splunk section
+    of the ingestion.json config file, they are run with the export endpoint, whose JSON results are parsed while they are streamed
     """
 
+    # seconds between the polls of a search job, doubled at each poll up to the max
+    POLL_MIN_INTERVAL = 0.1
+    POLL_MAX_INTERVAL = 5
+    # bytes read at a time from the export stream
+    EXPORT_CHUNK_SIZE = 64 * 1024
+
     def __init__(self, ingestion_config: dict, mapping: dict):
         """
         Constructor for the Splunk Ingestion object
@@ -26,6 +37,8 @@ class SplunkIngestion(BaseIngestion):
                 username=self.ingestion_config.get("username"),
                 password=self.ingestion_config.get("password"),
                 scheme=self.ingestion_config.get("scheme", "http"),
+                # the service is reused by the ingestion registry, so it logs in again if the session expires
+                autologin=True,
             )
         except ConnectionError as e:
             logging.error("Failed to establish a connection: %s", e)
@@ -33,6 +46,11 @@ class SplunkIngestion(BaseIngestion):
 
         self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
 
+    def close(self):
+        """Log out of the Splunk session"""
+        if self.service is not None:
+            self.service.logout()
+
     def process_users(self, start_date: datetime, end_date: datetime) -> list:
         """
         Concrete implementation of the BaseIngestion.process_users abstract method
@@ -57,21 +75,8 @@ class SplunkIngestion(BaseIngestion):
         """
 
         try:
-            search_kwargs = {
-                "earliest_time": start_date_str,
-                "latest_time": end_date_str,
-                "exec_mode": "normal",
-                "count": self.ingestion_config.get("bucket_size", 10000),
-            }
-
-            search_job = self.service.jobs.create(query, **search_kwargs)
-
-            while not search_job.is_done():
-                search_job.refresh()
-
-            results_reader = results.ResultsReader(search_job.results())
-            for result in results_reader:
-                if isinstance(result, dict) and "user.name" in result:
+            for result in self._iter_results(query, start_date_str, end_date_str, count=self.ingestion_config.get("bucket_size", 10000)):
+                if "user.name" in result:
                     users_list.append(result["user.name"])
 
             self.logger.info(f"Successfully got {len(users_list)} users")
@@ -111,30 +116,161 @@ class SplunkIngestion(BaseIngestion):
             | sort 0 @timestamp
         """
         try:
-            search_kwargs = {
-                "earliest_time": start_date_str,
-                "latest_time": end_date_str,
-                "exec_mode": "normal",
-                "count": self.ingestion_config.get("bucket_size", 10000),
-            }
+            response.extend(self._iter_results(query, start_date_str, end_date_str, count=self.ingestion_config.get("bucket_size", 10000)))
+
+            self.logger.info(f"Got {len(response)} logins for user {username} to be normalized")
 
-            search_job = self.service.jobs.create(query, **search_kwargs)
+        except ConnectionError:
+            self.logger.error(f"Failed to establish a connection with host: {self.ingestion_config.get('host')}")
+        except TimeoutError:
+            self.logger.error(f"Timeout reached for the host: {self.ingestion_config.get('host')}")
+        except Exception as e:
+            self.logger.error(f"Exception while querying Splunk: {e}")
+        return response
 
-            # Wait for the job to complete
-            while not search_job.is_done():
-                search_job.refresh()
+    def process_logins_bulk(self, start_date: datetime, end_date: datetime) -> dict:
+        """
+        Concrete implementation of the BaseIngestion.process_logins_bulk method.
+        All the logins of the time range are extracted with a single search (job or export), instead of one per user
+        The errors are logged and raised, so the detection window isn't considered completed
 
-            results_reader = results.ResultsReader(search_job.results())
-            for result in results_reader:
-                if isinstance(result, dict):
-                    response.append(result)
+        :param start_date: Initial datetime from which logins are considered
+        :param end_date: Final datetime within which logins are considered
+        :return: dict with the lowercase usernames as keys and the list of their logins (sorted by timestamp) as values
+        """
+        self.logger.info(f"Starting bulk logins extraction at: {start_date} Finishing at: {end_date}")
+        logins_by_user = {}
 
-            self.logger.info(f"Got {len(response)} logins for user {username} to be normalized")
+        # Format dates for Splunk query
+        start_date_str = start_date.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+        end_date_str = end_date.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+        # Build Splunk query to get the login events of all the users
+        query = f"""
+            search index={self.ingestion_config["indexes"]}
+            earliest="{start_date_str}" latest="{end_date_str}"
+            event.category="authentication" event.outcome="success" event.type="start"
+            | where isnotnull(source.ip) AND isnotnull(user.name) AND user.name!=""
+            | fields user.name, _time AS "@timestamp", source.geo.location.lat, source.geo.location.lon,
+              source.geo.country_name, source.as.organization.name, user_agent.original, index, source.ip, _id,
+              source.intelligence_category
+            | sort 0 @timestamp
+        """
+        try:
+            logins_by_user = self.group_logins_by_user(self._iter_results(query, start_date_str, end_date_str))
+
+            self.logger.info(f"Got logins for {len(logins_by_user)} users to be normalized")
 
         except ConnectionError:
             self.logger.error(f"Failed to establish a connection with host: {self.ingestion_config.get('host')}")
+            raise
         except TimeoutError:
             self.logger.error(f"Timeout reached for the host: {self.ingestion_config.get('host')}")
+            raise
         except Exception as e:
             self.logger.error(f"Exception while querying Splunk: {e}")
-        return response
+            raise
+        return logins_by_user
+
+    def _iter_results(self, query: str, start_date_str: str, end_date_str: str, count: int = 0) -> Iterator[dict]:
+        """Run the search and yield its results: streamed by the export endpoint in streaming mode, otherwise read from a search job
+
+        :param query: the Splunk search
+        :type query: str
+        :param start_date_str: the earliest time of the search
+        :type start_date_str: str
+        :param end_date_str: the latest time of the search
+        :type end_date_str: str
+        :param count: max number of results of the search job, 0 for all the results (not used by the export, which has no limit)
+        :type count: int
+
+        :return: the results, one by one
+        :rtype: Iterator[dict]
+        """
+        if self.ingestion_config.get("streaming", False):
+            stream = self.service.jobs.export(query, earliest_time=start_date_str, latest_time=end_date_str, output_mode="json", preview=False)
+            yield from self._iter_export_results(stream)
+            return
+        search_kwargs = {
+            "earliest_time": start_date_str,
+            "latest_time": end_date_str,
+            "exec_mode": "normal",
+        }
+        if count:
+            search_kwargs["count"] = count
+        search_job = self.service.jobs.create(query, **search_kwargs)
+        self._wait_for_job(search_job)
+        # count=0 returns all the results of the job, not only the first page
+        results_reader = results.ResultsReader(search_job.results() if count else search_job.results(count=0))
+        for result in results_reader:
+            if isinstance(result, dict):
+                yield result
+
+    def _wait_for_job(self, search_job):
+        """Wait for the search job to complete, polling it with a progressive backoff instead of a busy loop against the REST API
+
+        :param search_job: the Splunk search job
+        :type search_job: splunklib.client.Job
+        """
+        interval = self.POLL_MIN_INTERVAL
+        while not search_job.is_done():
+            time.sleep(interval)
+            interval = min(interval * 2, self.POLL_MAX_INTERVAL)
+            search_job.refresh()
+
+    def _iter_export_results(self, stream) -> Iterator[dict]:
+        """Parse the JSON lines of the export endpoint chunk by chunk, so the results are never all loaded in memory.
+        A stream ended before its last row (e.g. a connection dropped by Splunk) is raised, so the results aren't taken as complete
+
+        :param stream: the response body of the export endpoint (output_mode=json)
+        :type stream: splunklib.binding.ResponseReader
+
+        :return: the results, one by one
+        :rtype: Iterator[dict]
+        """
+        buffer = b""
+        state = {"results": 0, "last_row": False}
+        while True:
+            chunk = stream.read(self.EXPORT_CHUNK_SIZE)
+            if not chunk:
+                break
+            # the last line of the chunk could be incomplete, so it's kept in the buffer
+            *lines, buffer = (buffer + chunk).split(b"\n")
+            for line in lines:
+                yield from self._parse_export_line(line, state)
+        try:
+            yield from self._parse_export_line(buffer, state)
+        except json.JSONDecodeError as e:
+            raise RuntimeError(f"Splunk export stream truncated in the middle of a line: {e}") from e
+        if state["results"] and not state["last_row"]:
+            raise RuntimeError(f"Splunk export stream truncated after {state['results']} results, without the last row")
+
+    def _parse_export_line(self, line: bytes, state: dict) -> Iterator[dict]:
+        """Parse a JSON line of the export endpoint, logging the Splunk messages. The ERROR and FATAL messages are raised
+
+        :param line: a line of the export stream
+        :type line: bytes
+        :param state: the number of results of the stream and if its last row has been read, updated by the line
+        :type state: dict
+
+        :return: the final results of the line (the previews are skipped)
+        :rtype: Iterator[dict]
+        """
+        line = line.strip()
+        if not line:
+            return
+        parsed_line = json.loads(line)
+        for message in parsed_line.get("messages", []):
+            if message.get("type") in ("ERROR", "FATAL"):
+                raise RuntimeError(f"Splunk export failed: {message.get('text')}")
+            self.logger.info(f"Splunk export message: {message.get('text')}")
+        if parsed_line.get("preview"):
+            return
+        if parsed_line.get("lastrow"):
+            state["last_row"] = True
+        if "result" in parsed_line:
+            state["results"] += 1
+            yield parsed_line["result"]
+        for result in parsed_line.get("results", []):
+            state["results"] += 1
+            yield result
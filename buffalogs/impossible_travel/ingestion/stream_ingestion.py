@@ -0,0 +1,238 @@
+import json
+import logging
+import queue
+import socket
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any
+
+try:
+    # optional dependency, needed only by the Kafka consumer
+    import confluent_kafka
+except ImportError:
+    confluent_kafka = None
+
+try:
+    # optional dependency, needed only by the Redis stream consumer
+    import redis
+except ImportError:
+    redis = None
+
+try:
+    # optional dependency, used to decode the events faster
+    import orjson
+except ImportError:
+    orjson = None
+
+
+@dataclass(frozen=True)
+class StreamMessage:
+    """A login event read from the stream
+
+    * value: the decoded event, None if it isn't a valid JSON object (it's skipped, but committed anyway)
+    * position: where the event is in the stream, used to commit it (e.g. the Kafka (topic, partition, offset) or the Redis entry id)
+    """
+
+    value: dict | None
+    position: Any
+
+
+def decode_event(data: bytes | str | dict) -> dict | None:
+    """Decode a JSON event, returning None if it's not valid"""
+    if isinstance(data, dict):
+        return data
+    try:
+        value = orjson.loads(data) if orjson is not None else json.loads(data)
+    except (TypeError, ValueError):
+        return None
+    return value if isinstance(value, dict) else None
+
+
+class BaseStreamConsumer(ABC):
+    """
+    Abstract class for the consumers of the login events streams.
+    The messages must be committed explicitly, after that the detection results have been saved,
+    so that the events of a crashed worker are delivered again (at-least-once delivery)
+    """
+
+    class SupportedStreamBackends:
+        """Types of possible login events streams
+
+        * KAFKA: Kafka topic, read by a consumer group
+        * REDIS: Redis stream, read by a consumer group
+        * QUEUE: in-process queue, as a local stand-in of a broker (e.g. for tests and benchmarks)
+        """
+
+        KAFKA = "kafka"
+        REDIS = "redis"
+        QUEUE = "queue"
+
+    def __init__(self, stream_config: dict):
+        self.stream_config = stream_config
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+
+    @abstractmethod
+    def poll(self, max_records: int, timeout: float) -> list:
+        """Read the next events, in the order of the stream
+
+        :param max_records: the max number of events returned
+        :type max_records: int
+        :param timeout: max seconds waited for the events
+        :type timeout: float
+
+        :return: the events read, empty if none arrived before the timeout
+        :rtype: list of StreamMessage
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def commit(self, messages: list):
+        """Mark the events as processed, so they aren't delivered again
+
+        :param messages: the events processed, in the order of the stream
+        :type messages: list of StreamMessage
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release the connection to the stream"""
+
+
+class KafkaStreamConsumer(BaseStreamConsumer):
+    """
+    Consumer of a Kafka topic. The producers must use the username as message key,
+    so that all the events of a user are in the same partition and are read in order
+    """
+
+    def __init__(self, stream_config: dict):
+        super().__init__(stream_config)
+        if confluent_kafka is None:
+            raise ImportError("The confluent-kafka package is required by the Kafka stream consumer")
+        self.consumer = confluent_kafka.Consumer(
+            {
+                "bootstrap.servers": stream_config["url"],
+                "group.id": stream_config["group"],
+                # the offsets are committed only after the detection, by commit()
+                "enable.auto.commit": False,
+                "auto.offset.reset": "earliest",
+            }
+        )
+        self.consumer.subscribe([stream_config["topic"]])
+
+    def poll(self, max_records: int, timeout: float) -> list:
+        messages = []
+        for message in self.consumer.consume(num_messages=max_records, timeout=timeout):
+            if message.error():
+                self.logger.error(f"Error while consuming the topic {self.stream_config['topic']}: {message.error()}")
+                continue
+            messages.append(StreamMessage(decode_event(message.value()), (message.topic(), message.partition(), message.offset())))
+        return messages
+
+    def commit(self, messages: list):
+        # the committed offset of each partition is the next one to be read
+        offsets = {}
+        for topic, partition, offset in (message.position for message in messages):
+            offsets[(topic, partition)] = max(offsets.get((topic, partition), -1), offset + 1)
+        if offsets:
+            self.consumer.commit(
+                offsets=[confluent_kafka.TopicPartition(topic, partition, offset) for (topic, partition), offset in offsets.items()],
+                asynchronous=False,
+            )
+
+    def close(self):
+        self.consumer.close()
+
+
+class RedisStreamConsumer(BaseStreamConsumer):
+    """
+    Consumer of a Redis stream, read by a consumer group. Each entry has the JSON event in its "data" field.
+    At startup, the entries delivered to this consumer but not acknowledged (e.g. before a crash) are read again first
+    """
+
+    def __init__(self, stream_config: dict):
+        super().__init__(stream_config)
+        if redis is None:
+            raise ImportError("The redis package is required by the Redis stream consumer")
+        self.client = redis.Redis.from_url(stream_config["url"])
+        self.stream = stream_config["topic"]
+        self.group = stream_config["group"]
+        # the name must be the same after a restart, in order to read again the entries not acknowledged
+        self.consumer_name = stream_config.get("consumer") or socket.gethostname()
+        try:
+            self.client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._read_pending = True
+
+    def poll(self, max_records: int, timeout: float) -> list:
+        if self._read_pending:
+            entries = self._read("0", max_records, None)
+            if entries:
+                return entries
+            self._read_pending = False
+        return self._read(">", max_records, int(timeout * 1000))
+
+    def _read(self, stream_id: str, max_records: int, block: int | None) -> list:
+        response = self.client.xreadgroup(self.group, self.consumer_name, {self.stream: stream_id}, count=max_records, block=block)
+        messages = []
+        for _, entries in response or []:
+            for entry_id, fields in entries:
+                # the entries deleted from the stream while pending are returned without fields
+                messages.append(StreamMessage(decode_event((fields or {}).get(b"data", b"")), entry_id))
+        return messages
+
+    def commit(self, messages: list):
+        if messages:
+            self.client.xack(self.stream, self.group, *(message.position for message in messages))
+
+    def close(self):
+        self.client.close()
+
+
+class QueueStreamConsumer(BaseStreamConsumer):
+    """Consumer of an in-process queue, a local stand-in of the brokers. The committed positions are kept in the committed list"""
+
+    def __init__(self, stream_config: dict, events: queue.Queue = None):
+        super().__init__(stream_config)
+        self.events = events if events is not None else queue.Queue()
+        self.committed = []
+        self._position = 0
+
+    def poll(self, max_records: int, timeout: float) -> list:
+        messages = []
+        try:
+            # wait only for the first event, then take the ones already queued
+            event = self.events.get(timeout=timeout)
+            while True:
+                messages.append(StreamMessage(decode_event(event), self._position))
+                self._position += 1
+                if len(messages) >= max_records:
+                    break
+                event = self.events.get_nowait()
+        except queue.Empty:
+            pass
+        return messages
+
+    def commit(self, messages: list):
+        self.committed.extend(message.position for message in messages)
+
+
+def get_stream_consumer(stream_config: dict) -> BaseStreamConsumer:
+    """Return the consumer of the stream_config["backend"] stream
+
+    :param stream_config: the stream settings: backend, url, topic and group
+    :type stream_config: dict
+
+    :return: the stream consumer
+    :rtype: BaseStreamConsumer
+    """
+    match stream_config["backend"]:
+        case BaseStreamConsumer.SupportedStreamBackends.KAFKA:
+            return KafkaStreamConsumer(stream_config)
+        case BaseStreamConsumer.SupportedStreamBackends.REDIS:
+            return RedisStreamConsumer(stream_config)
+        case BaseStreamConsumer.SupportedStreamBackends.QUEUE:
+            return QueueStreamConsumer(stream_config)
+        case _:
+            raise ValueError(f"Unsupported stream backend: {stream_config['backend']}")
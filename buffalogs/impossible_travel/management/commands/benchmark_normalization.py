@@ -0,0 +1,72 @@
+import random
+import time
+from collections import deque
+
+from django.core.management.base import BaseCommand
+from impossible_travel.ingestion.base_ingestion import REQUIRED_FIELDS
+from impossible_travel.ingestion.elasticsearch_ingestion import ElasticsearchIngestion
+from impossible_travel.ingestion.ingestion_factory import IngestionFactory
+
+
+def split_normalize(mapping: dict, data: dict) -> dict:
+    """Reference normalization that splits the dotted keys and walks the nested dicts for each login, as done before the compiled mapping"""
+    normalized_data = {}
+    for ingestion_key, buffalogs_key in mapping.items():
+        value = data
+        for k in ingestion_key.split("."):
+            if isinstance(value, dict) and k in value:
+                value = value[k]
+            else:
+                value = ""
+        normalized_data[buffalogs_key] = value
+    if all(normalized_data.get(field) for field in REQUIRED_FIELDS):
+        return normalized_data
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark of the logins normalization on synthetic Elasticsearch hits"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hits", type=int, default=1_000_000, help="Number of synthetic hits to normalize (default: 1M)")
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+
+    def handle(self, *args, **options):
+        config = IngestionFactory()._read_config()["elasticsearch"]
+        ingestion = ElasticsearchIngestion(config, config["custom_mapping"])
+        hits = self.generate_hits(options["hits"], random.Random(options["seed"]))
+
+        # the normalized logins are consumed without keeping them, as done by a streaming consumer
+        start = time.perf_counter()
+        deque((split_normalize(ingestion.mapping, hit) for hit in hits), maxlen=0)
+        reference_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        normalized_count = sum(1 for _ in ingestion.iter_normalized(hits))
+        compiled_time = time.perf_counter() - start
+
+        sample = hits[:10000]
+        if ingestion.normalize_fields(sample) != [login for login in (split_normalize(ingestion.mapping, hit) for hit in sample) if login]:
+            self.stdout.write(self.style.WARNING("The compiled normalization returned different results"))
+        self.stdout.write(f"Normalized {normalized_count} of {len(hits)} hits")
+        self.stdout.write(f"split keys: {reference_time:.3f}s ({len(hits) / reference_time:,.0f} hits/s)")
+        self.stdout.write(f"compiled:   {compiled_time:.3f}s ({len(hits) / compiled_time:,.0f} hits/s)")
+        self.stdout.write(self.style.SUCCESS(f"Speedup: {reference_time / compiled_time:.2f}x"))
+
+    def generate_hits(self, count: int, rand: random.Random) -> list:
+        """Generate hits with the shape returned by ElasticsearchIngestion._parse_hit, 1% of them without the geo data"""
+        hits = []
+        for i in range(count):
+            source = {
+                "@timestamp": f"2025-02-26T13:{i // 60 % 60:02d}:{i % 60:02d}.000Z",
+                "user": {"name": f"user{rand.randrange(10000)}"},
+                "user_agent": {"original": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"},
+                "source": {
+                    "ip": f"10.{rand.randrange(256)}.{rand.randrange(256)}.{rand.randrange(256)}",
+                    "as": {"organization": {"name": "ISP"}},
+                    "geo": {"country_name": "Italy", "location": {"lat": rand.uniform(-90, 90), "lon": rand.uniform(-180, 180)}},
+                },
+            }
+            if i % 100 == 0:
+                del source["source"]["geo"]
+            hits.append(dict(source, _index="cloud", _id=f"log_id_{i}"))
+        return hits
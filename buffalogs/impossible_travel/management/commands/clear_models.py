@@ -1,7 +1,7 @@
 from django.apps import apps
 from django.core.management.base import CommandParser
 from impossible_travel.management.commands.base_command import TaskLoggingCommand
-from impossible_travel.models import Alert, Config, Login, TaskSettings, User
+from impossible_travel.models import Alert, Config, DetectionCheckpoint, Login, PushedLogin, TaskSettings, User
 
 
 class Command(TaskLoggingCommand):
@@ -32,4 +32,6 @@ class Command(TaskLoggingCommand):
             Login.objects.all().delete()
             User.objects.all().delete()
             TaskSettings.objects.all().delete()
+            DetectionCheckpoint.objects.all().delete()
+            PushedLogin.objects.all().delete()
             self.stdout.write(self.style.SUCCESS("All the models have been emptied, except the Config model"))
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import CommandError
+from impossible_travel.management.commands.base_command import TaskLoggingCommand
+from impossible_travel.modules.partitions import get_alert_partitions
+
+
+class Command(TaskLoggingCommand):
+    help = "Create the monthly partitions of the Alert table, from the current month to the next ones"
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--months",
+            type=int,
+            default=settings.CERTEGO_BUFFALOGS_PARTITIONS_AHEAD_MONTHS,
+            help=f"Number of months after the current one whose partitions are created (default: {settings.CERTEGO_BUFFALOGS_PARTITIONS_AHEAD_MONTHS})",
+        )
+
+    def handle(self, *args, **options):
+        months = options.get("months")
+        if months < 0:
+            raise CommandError("The number of months can't be negative.")
+        partitions = get_alert_partitions()
+        if not partitions.is_partitioned():
+            raise CommandError(f"The table {partitions.table} is not partitioned (the partitioning is supported on PostgreSQL only).")
+        created = partitions.create_partitions(months)
+        if created:
+            self.stdout.write(self.style.SUCCESS(f"Created the partitions: {', '.join(created)}."))
+        else:
+            self.stdout.write(self.style.SUCCESS("All the partitions already exist."))
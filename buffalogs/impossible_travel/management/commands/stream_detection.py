@@ -0,0 +1,43 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from impossible_travel.ingestion.ingestion_factory import IngestionFactory
+from impossible_travel.ingestion.stream_ingestion import BaseStreamConsumer, get_stream_consumer
+from impossible_travel.modules.stream_detection import StreamDetectionWorker
+
+
+class Command(BaseCommand):
+    help = "Long-running worker that runs the detection on the login events read from a Kafka topic or a Redis stream"
+
+    def add_arguments(self, parser):
+        backends = [BaseStreamConsumer.SupportedStreamBackends.KAFKA, BaseStreamConsumer.SupportedStreamBackends.REDIS]
+        parser.add_argument("--backend", choices=backends, default=settings.CERTEGO_BUFFALOGS_STREAM_BACKEND, help="Stream backend")
+        parser.add_argument("--url", default=settings.CERTEGO_BUFFALOGS_STREAM_URL, help="Kafka bootstrap servers or Redis URL")
+        parser.add_argument("--topic", default=settings.CERTEGO_BUFFALOGS_STREAM_TOPIC, help="Kafka topic or Redis stream key")
+        parser.add_argument("--group", default=settings.CERTEGO_BUFFALOGS_STREAM_GROUP, help="Consumer group")
+        parser.add_argument("--batch-size", type=int, default=settings.CERTEGO_BUFFALOGS_STREAM_BATCH_SIZE, help="Max events of each micro-batch")
+        parser.add_argument(
+            "--batch-timeout", type=float, default=settings.CERTEGO_BUFFALOGS_STREAM_BATCH_TIMEOUT, help="Max seconds waited for each micro-batch"
+        )
+        parser.add_argument("--max-batches", type=int, default=None, help="Stop after the given number of micro-batches (default: run forever)")
+
+    def handle(self, *args, **options):
+        """Run the stream detection, for example: manage.py stream_detection --backend redis --url redis://localhost:6379/0
+        The events must have the same fields of the active ingestion source, which mapping is used to normalize them
+        """
+        consumer = get_stream_consumer({key: options[key] for key in ("backend", "url", "topic", "group")})
+        worker = StreamDetectionWorker(consumer, IngestionFactory().mapping, batch_size=options["batch_size"], batch_timeout=options["batch_timeout"])
+
+        def stop(signum, frame):
+            self.stdout.write("Stopping the stream detection after the current batch")
+            worker.stop()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        self.stdout.write(f"Consuming the login events from {options['backend']}: {options['topic']}")
+        try:
+            logins_count = worker.run(max_batches=options["max_batches"])
+        finally:
+            consumer.close()
+        self.stdout.write(self.style.SUCCESS(f"Stream detection stopped after {logins_count} logins"))
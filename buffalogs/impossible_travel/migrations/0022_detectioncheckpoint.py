@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("impossible_travel", "0021_tasksettings_execution_mode_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DetectionCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("start_date", models.DateTimeField()),
+                ("end_date", models.DateTimeField()),
+                ("shard", models.PositiveSmallIntegerField()),
+                ("shards_count", models.PositiveSmallIntegerField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[("pending", "Pending"), ("completed", "Completed")],
+                        default="pending",
+                        max_length=20,
+                    ),
+                ),
+                ("users", models.PositiveIntegerField(default=0)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("updated", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="detectioncheckpoint",
+            index=models.Index(
+                fields=["status", "updated"], name="checkpoint_status_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="detectioncheckpoint",
+            constraint=models.UniqueConstraint(
+                fields=("start_date", "end_date", "shard"),
+                name="unique_detection_checkpoint",
+            ),
+        ),
+    ]
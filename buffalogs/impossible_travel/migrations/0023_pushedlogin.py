@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("impossible_travel", "0022_detectioncheckpoint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PushedLogin",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("username", models.TextField()),
+                ("timestamp", models.DateTimeField()),
+                ("login", models.JSONField()),
+                ("created", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
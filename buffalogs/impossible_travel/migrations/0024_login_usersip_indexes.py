@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+
+
+def remove_duplicates(apps, schema_editor):
+    # the detection updated all the logins with the same key together, so the most recent row of each key is kept
+    Login = apps.get_model("impossible_travel", "Login")
+    duplicated_logins = (
+        Login.objects.values("user", "index", "country", "user_agent").annotate(rows=Count("id"), keep_id=Max("id")).filter(rows__gt=1)
+    )
+    for duplicate in duplicated_logins.iterator():
+        Login.objects.filter(user=duplicate["user"], index=duplicate["index"], country=duplicate["country"], user_agent=duplicate["user_agent"]).exclude(
+            id=duplicate["keep_id"]
+        ).delete()
+    # for the IPs, the first row is kept
+    UsersIP = apps.get_model("impossible_travel", "UsersIP")
+    duplicated_ips = UsersIP.objects.values("user", "ip").annotate(rows=Count("id"), keep_id=Min("id")).filter(rows__gt=1)
+    for duplicate in duplicated_ips.iterator():
+        UsersIP.objects.filter(user=duplicate["user"], ip=duplicate["ip"]).exclude(id=duplicate["keep_id"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("impossible_travel", "0023_pushedlogin"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, reverse_code=migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="login",
+            index=models.Index(fields=["user", "-timestamp"], name="login_user_timestamp_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="login",
+            index=models.Index(
+                fields=["user", "country"],
+                include=("timestamp",),
+                name="login_user_country_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="login",
+            index=models.Index(fields=["user", "user_agent"], name="login_user_agent_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="login",
+            constraint=models.UniqueConstraint(
+                fields=("user", "index", "country", "user_agent"),
+                name="unique_login_key",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="usersip",
+            constraint=models.UniqueConstraint(fields=("user", "ip"), name="unique_user_ip"),
+        ),
+        # the single column indexes of the foreign keys are covered by the new ones
+        migrations.AlterField(
+            model_name="login",
+            name="user",
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to="impossible_travel.user"),
+        ),
+        migrations.AlterField(
+            model_name="usersip",
+            name="user",
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to="impossible_travel.user"),
+        ),
+    ]
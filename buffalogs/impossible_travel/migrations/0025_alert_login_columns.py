@@ -0,0 +1,97 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:53
+
+from datetime import datetime
+
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.utils import timezone
+
+BATCH_SIZE = 2000
+
+
+def parse_login_timestamp(timestamp):
+    try:
+        date = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return None
+    return date if not timezone.is_naive(date) else timezone.make_aware(date)
+
+
+def parse_coordinate(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def backfill_login_fields(apps, schema_editor):
+    # the historical model has not the Alert.set_login_fields() method, so the columns are set here
+    Alert = apps.get_model("impossible_travel", "Alert")
+    last_id = 0
+    while True:
+        alerts = list(Alert.objects.filter(id__gt=last_id).order_by("id").only("id", "login_raw_data")[:BATCH_SIZE])
+        if not alerts:
+            break
+        for alert in alerts:
+            login = alert.login_raw_data if isinstance(alert.login_raw_data, dict) else {}
+            alert.login_timestamp = parse_login_timestamp(login.get("timestamp"))
+            alert.login_country = login.get("country") or ""
+            alert.login_ip = login.get("ip") or ""
+            alert.login_lat = parse_coordinate(login.get("lat"))
+            alert.login_lon = parse_coordinate(login.get("lon"))
+        Alert.objects.bulk_update(alerts, fields=["login_timestamp", "login_country", "login_ip", "login_lat", "login_lon"])
+        last_id = alerts[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("impossible_travel", "0024_login_usersip_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="alert",
+            name="login_country",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="alert",
+            name="login_ip",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="alert",
+            name="login_lat",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="alert",
+            name="login_lon",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="alert",
+            name="login_timestamp",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        # the indexes are built after the backfill, instead of being updated for each row
+        migrations.RunPython(backfill_login_fields, reverse_code=migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="alert",
+            index=models.Index(fields=["login_timestamp"], name="alert_login_timestamp_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="alert",
+            index=models.Index(
+                django.db.models.functions.text.Upper("login_country"),
+                models.F("login_lat"),
+                models.F("login_lon"),
+                name="alert_login_location_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="alert",
+            index=models.Index(fields=["login_ip"], name="alert_login_ip_idx"),
+        ),
+    ]
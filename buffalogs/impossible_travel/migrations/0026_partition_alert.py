@@ -0,0 +1,93 @@
+import re
+from datetime import datetime, timezone
+
+from django.db import migrations
+
+TABLE = "impossible_travel_alert"
+# monthly partitions created after the current one, the next ones are created by the create_partitions command
+MONTHS_AHEAD = 3
+
+
+def add_months(month, months):
+    year, month_index = divmod(month.month - 1 + months, 12)
+    return month.replace(year=month.year + year, month=month_index + 1)
+
+
+def partition_alert(apps, schema_editor):
+    """Rebuild the Alert table as a table partitioned by month on the created column.
+
+    Downtime: the table is renamed, copied and its indexes rebuilt in the transaction of the migration, so it stays locked (ACCESS EXCLUSIVE)
+    until the end: the detection and the APIs that read or write the alerts wait for it. Stop the Celery workers before migrating the large tables.
+
+    Primary key: the primary key of a partitioned table must include the partition column, so in the DB it's (id, created),
+    while the Django state keeps id as the only primary key (a composite one isn't supported by the admin and by the REST framework).
+    The id is still unique, because it's always assigned by its sequence (the Alerts are never created with an explicit id),
+    so Alert.objects.get(pk=...) keeps working. A unique constraint on id alone can't be created on the partitioned table,
+    so no foreign key can reference the Alert table
+    """
+    # the native partitioning is available on PostgreSQL only: on the other databases the Alert table is left as it is
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    old_table = f"{TABLE}_old"
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {TABLE} RENAME TO {old_table}")
+        # the defaults, the NOT NULL and CHECK constraints and the identity of the id are copied, the indexes are rebuilt after the copy of the rows
+        cursor.execute(
+            f"CREATE TABLE {TABLE} (LIKE {old_table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING IDENTITY INCLUDING STORAGE) "
+            "PARTITION BY RANGE (created)"
+        )
+        cursor.execute(f"CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT")
+        cursor.execute(f"SELECT MIN(created) FROM {old_table}")
+        oldest = cursor.fetchone()[0]
+        now = datetime.now(timezone.utc)
+        month = (oldest or now).astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        last_month = add_months(now.replace(day=1, hour=0, minute=0, second=0, microsecond=0), MONTHS_AHEAD)
+        while month <= last_month:
+            end = add_months(month, 1)
+            cursor.execute(f"CREATE TABLE {TABLE}_p{month:%Y%m} PARTITION OF {TABLE} FOR VALUES FROM ('{month.isoformat()}') TO ('{end.isoformat()}')")
+            month = end
+        cursor.execute(f"INSERT INTO {TABLE} OVERRIDING SYSTEM VALUE SELECT * FROM {old_table}")
+
+        # the sequence of the id continues from the last id of the old table
+        cursor.execute(
+            "SELECT attidentity FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'id'",
+            [TABLE],
+        )
+        if cursor.fetchone()[0]:
+            cursor.execute(f"SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), COALESCE((SELECT MAX(id) FROM {TABLE}), 1))")
+        else:
+            # serial id: the default still uses the sequence of the old table, that must not be dropped with it
+            cursor.execute(f"SELECT pg_get_serial_sequence('{old_table}', 'id')")
+            sequence = cursor.fetchone()[0]
+            cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {TABLE}.id")
+
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT IN "
+            "(SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p')",
+            [old_table, old_table],
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+            [old_table],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(f"DROP TABLE {old_table}")
+
+        # the primary key of a partitioned table must include the partition column
+        cursor.execute(f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id, created)")
+        for _, index_definition in indexes:
+            cursor.execute(re.sub(rf"\bON (\w+\.)?{old_table}\b", f"ON {TABLE}", index_definition, count=1))
+        for name, definition in foreign_keys:
+            cursor.execute(f"ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("impossible_travel", "0025_alert_login_columns"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_alert, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("impossible_travel", "0027_checkpoint_failed_status"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ShardLogins",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("username", models.TextField()),
+                ("logins", models.JSONField()),
+                (
+                    "checkpoint",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="staged_logins",
+                        to="impossible_travel.detectioncheckpoint",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("impossible_travel", "0028_shardlogins"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="detectioncheckpoint",
+            name="attempts",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name="detectioncheckpoint",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("completed", "Completed"),
+                    ("failed", "Failed"),
+                    ("dead", "Dead letter"),
+                ],
+                default="pending",
+                max_length=20,
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("impossible_travel", "0029_checkpoint_attempts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pushedlogin",
+            name="failed",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="pushedlogin",
+            name="error",
+            field=models.TextField(blank=True, default=""),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:40
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # the unique key and the index on the unbounded user_agent failed to insert the user agents longer than the max btree row size (about 2.7KB),
+    # so they are moved on its md5. The stored generated column rewrites the Login table, under an exclusive lock for the duration of the migration
+
+    dependencies = [
+        ("impossible_travel", "0030_pushedlogin_failed"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="login",
+            name="unique_login_key",
+        ),
+        migrations.RemoveIndex(
+            model_name="login",
+            name="login_user_agent_idx",
+        ),
+        migrations.AddField(
+            model_name="login",
+            name="user_agent_hash",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.db.models.functions.text.MD5("user_agent"),
+                output_field=models.CharField(max_length=32),
+            ),
+        ),
+        # the logins are already unique by user agent (0024_login_usersip_indexes), so they are unique by its md5 too
+        migrations.AddConstraint(
+            model_name="login",
+            constraint=models.UniqueConstraint(
+                fields=("user", "index", "country", "user_agent_hash"),
+                name="unique_login_key",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="login",
+            index=models.Index(fields=["user", "user_agent_hash"], name="login_user_agent_hash_idx"),
+        ),
+    ]
@@ -1,3 +1,4 @@
+import hashlib
 from datetime import datetime
 
 from django.conf import settings
@@ -5,8 +6,9 @@ from django.contrib import admin
 from django.contrib.postgres.fields import ArrayField
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.functions import MD5, Upper
 from django.utils import timezone
-from impossible_travel.constants import AlertDetectionType, AlertFilterType, AlertTagValues, ExecutionModes, UserRiskScoreType
+from impossible_travel.constants import AlertDetectionType, AlertFilterType, AlertTagValues, CheckpointStatus, ExecutionModes, UserRiskScoreType
 from impossible_travel.validators import (
     validate_countries_names,
     validate_country_couples_list,
@@ -41,7 +43,8 @@ class User(models.Model):
 
 
 class Login(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # the lookups by user are served by the composite indexes, that start with the user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     timestamp = models.DateTimeField(default=timezone.now)
@@ -49,10 +52,28 @@ class Login(models.Model):
     longitude = models.FloatField(null=True)
     country = models.TextField(blank=True)
     user_agent = models.TextField(blank=True)
+    # the user agent is unbounded and its btree entries would exceed the max index row size, so it's indexed by its md5, computed by the DB
+    user_agent_hash = models.GeneratedField(expression=MD5("user_agent"), output_field=models.CharField(max_length=32), db_persist=True)
     index = models.TextField()
     event_id = models.TextField()
     ip = models.TextField()
 
+    class Meta:
+        constraints = [
+            # a Login for each (user, index, country, user_agent), upserted by the detection
+            models.UniqueConstraint(fields=["user", "index", "country", "user_agent_hash"], name="unique_login_key"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-timestamp"], name="login_user_timestamp_idx"),
+            models.Index(fields=["user", "country"], include=["timestamp"], name="login_user_country_idx"),
+            models.Index(fields=["user", "user_agent_hash"], name="login_user_agent_hash_idx"),
+        ]
+
+    @staticmethod
+    def hash_user_agent(user_agent: str) -> str:
+        """Return the md5 of the user agent, as the user_agent_hash computed by the DB, to look up the Logins by user agent with the indexes"""
+        return hashlib.md5(user_agent.encode("utf-8"), usedforsecurity=False).hexdigest()
+
     @classmethod
     def apply_filters(
         cls,
@@ -97,10 +118,50 @@ class Login(models.Model):
         return query
 
 
+def parse_login_timestamp(timestamp) -> datetime | None:
+    """Parse the timestamp of a login (e.g. "2023-06-20T10:17:33.358Z"), as an aware datetime (in the current time zone if the offset is missing)
+
+    :param timestamp: the timestamp of the login
+    :type timestamp: str
+
+    :return: the timestamp of the login, None if it's not valid
+    :rtype: datetime
+    """
+    try:
+        date = timestamp if isinstance(timestamp, datetime) else datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return None
+    return date if not timezone.is_naive(date) else timezone.make_aware(date)
+
+
+def parse_coordinate(value) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class AlertQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # the save() is not called by the bulk_create, so the login columns are set here
+        objs = list(objs)
+        for alert in objs:
+            alert.set_login_fields()
+        return super().bulk_create(objs, *args, **kwargs)
+
+
 class Alert(models.Model):
+    # on PostgreSQL the table is partitioned by created and its primary key is (id, created) (see 0026_partition_alert):
+    # the id stays unique only because it's assigned by its sequence, so it must never be set explicitly and no foreign key can reference the Alert
     name = models.CharField(choices=AlertDetectionType.choices, max_length=30, null=False, blank=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     login_raw_data = models.JSONField()
+    # the login_raw_data keys queried by the filters and the dashboard, copied by set_login_fields() in indexed columns
+    login_timestamp = models.DateTimeField(null=True, blank=True)
+    login_country = models.TextField(blank=True, default="")
+    login_ip = models.TextField(blank=True, default="")
+    login_lat = models.FloatField(null=True, blank=True)
+    login_lon = models.FloatField(null=True, blank=True)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     description = models.TextField()
@@ -121,6 +182,21 @@ class Alert(models.Model):
 
     notified_status = models.JSONField(default=dict, blank=True, help_text="Tracks each active_alerter status")
 
+    objects = AlertQuerySet.as_manager()
+
+    def set_login_fields(self):
+        """Copy the timestamp, country, ip, lat and lon of the login_raw_data into their columns"""
+        login = self.login_raw_data if isinstance(self.login_raw_data, dict) else {}
+        self.login_timestamp = parse_login_timestamp(login.get("timestamp"))
+        self.login_country = login.get("country") or ""
+        self.login_ip = login.get("ip") or ""
+        self.login_lat = parse_coordinate(login.get("lat"))
+        self.login_lon = parse_coordinate(login.get("lon"))
+
+    def save(self, *args, **kwargs):
+        self.set_login_fields()
+        super().save(*args, **kwargs)
+
     @property
     def is_filtered(self):
         """Returns if the alert is filtered based on the filter_type field"""
@@ -171,15 +247,15 @@ class Alert(models.Model):
         if notified is True:
             query = query.exclude(notified_status={})
         if ip:
-            query = query.filter(login_raw_data__ip=ip)
+            query = query.filter(login_ip=ip)
         if user_agent:
             query = query.filter(login_raw_data__user_agent__icontains=user_agent)
         if login_start_time:
-            query = query.filter(login_raw_data__timestamp__gte=login_start_time)
+            query = query.filter(login_timestamp__gte=login_start_time)
         if login_end_time:
-            query = query.filter(login_raw_data__timestamp__lte=login_end_time)
+            query = query.filter(login_timestamp__lte=login_end_time)
         if country_code:
-            query = query.filter(login_raw_data__country__iexact=country_code)
+            query = query.filter(login_country__iexact=country_code)
         if risk_score:
             if isinstance(risk_score, int):
                 query = query.filter(user__risk_score=UserRiskScoreType.get_risk_level(risk_score))
@@ -211,14 +287,24 @@ class Alert(models.Model):
                 name="valid_alert_filter_type_choices",
             ),
         ]
+        indexes = [
+            models.Index(fields=["login_timestamp"], name="alert_login_timestamp_idx"),
+            # the country is compared case insensitive (iexact), also together with the coordinates
+            models.Index(Upper("login_country"), models.F("login_lat"), models.F("login_lon"), name="alert_login_location_idx"),
+            models.Index(fields=["login_ip"], name="alert_login_ip_idx"),
+        ]
 
 
 class UsersIP(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # the lookups by user are served by the unique_user_ip index, that starts with the user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     ip = models.GenericIPAddressField()
 
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["user", "ip"], name="unique_user_ip")]
+
 
 class TaskSettings(models.Model):
     task_name = models.TextField()
@@ -232,6 +318,45 @@ class TaskSettings(models.Model):
         constraints = [models.UniqueConstraint(fields=["task_name", "execution_mode"], name="unique_task_execution")]
 
 
+class DetectionCheckpoint(models.Model):
+    """Progress of the BuffalogsProcessLogsTask detection, for each time window and users shard"""
+
+    start_date = models.DateTimeField()
+    end_date = models.DateTimeField()
+    shard = models.PositiveSmallIntegerField()
+    shards_count = models.PositiveSmallIntegerField()
+    status = models.CharField(max_length=20, choices=CheckpointStatus.choices, default=CheckpointStatus.PENDING)
+    users = models.PositiveIntegerField(default=0)
+    # number of failed detections of the shard
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["start_date", "end_date", "shard"], name="unique_detection_checkpoint")]
+        indexes = [models.Index(fields=["status", "updated"], name="checkpoint_status_idx")]
+
+
+class ShardLogins(models.Model):
+    """Logins of a user staged by the BuffalogsProcessWindowTask for the detection of its shard, so they aren't sent through the broker"""
+
+    checkpoint = models.ForeignKey(DetectionCheckpoint, on_delete=models.CASCADE, related_name="staged_logins")
+    username = models.TextField()
+    logins = models.JSONField()
+
+
+class PushedLogin(models.Model):
+    """Staging table of the normalized logins pushed by the ingestion push API, drained by the BuffalogsDrainPushedLoginsTask.
+    The logins whose detection fails are kept as failed, with the error, and aren't drained anymore"""
+
+    username = models.TextField()
+    timestamp = models.DateTimeField()
+    login = models.JSONField()
+    failed = models.BooleanField(default=False)
+    error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(auto_now_add=True)
+
+
 def get_default_ignored_users():
     return list(settings.CERTEGO_BUFFALOGS_IGNORED_USERS)
 
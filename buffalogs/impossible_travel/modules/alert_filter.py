@@ -1,117 +1,170 @@
 import logging
 import re
-from collections import Counter
+from collections import defaultdict
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from ipaddress import ip_address, ip_network
 
-from django.conf import settings
 from impossible_travel.constants import AlertDetectionType, AlertFilterType, ComparisonType, UserRiskScoreType
 from impossible_travel.models import Alert, Config, User
-from ua_parser import parse
+from impossible_travel.modules.config_cache import ConfigSnapshot, as_snapshot
+from impossible_travel.modules.user_agent import parse_user_agent
 
 logger = logging.getLogger(__name__)
 
-
-def match_filters(alert: Alert, app_config: Config) -> Alert:
-    db_user = alert.user
-
-    # Detection filters - users
-    alert = _update_users_filters(db_alert=alert, app_config=app_config, db_user=db_user)
-
-    # Detection filters - location
-    if alert.login_raw_data.get("ip", "") in app_config.ignored_ips:
-        logger.debug(
-            f"Alert: {alert.id} filtered for user: {db_user.username} because the login IP: {alert.login_raw_data['ip']} is in the ignored_ips Config list"
-        )
-        alert.filter_type.append(AlertFilterType.IGNORED_IP_FILTER)  # alert filtered because the ip is in the ignored_ips list
-    if alert.login_raw_data.get("country", "") in app_config.allowed_countries:
-        logger.debug(
-            f"Alert: {alert.id} filtered for user: {db_user.username} because the login IP: {alert.login_raw_data['country']} is in the allower_countries Config list"
-        )
-        alert.filter_type.append(AlertFilterType.ALLOWED_COUNTRY_FILTER)  # alert filtered because the country is in the allowed_countries list
-
-    # Detection filters - devices
-    if alert.login_raw_data.get("organization", "") in app_config.ignored_ISPs:
-        logger.debug(
-            f"Alert: {alert.id} filtered for user: {db_user.username} because the login ISP: {alert.login_raw_data['organization']} is in the ignored_ISPs Config list"
-        )
-        alert.filter_type.append(AlertFilterType.IGNORED_ISP_FILTER)
-    if app_config.ignore_mobile_logins and alert.login_raw_data.get("agent", ""):
-        ua_parsed = parse(alert.login_raw_data["agent"])
-        if ua_parsed.os and ua_parsed.os.family in settings.CERTEGO_BUFFALOGS_MOBILE_DEVICES:
-            logger.debug(
-                f"Alert: {alert.id} filtered for user: {db_user.username} because the login user-agent: {alert.login_raw_data['agent']} is a mobile device and Config.ignore_mobile_logins: {app_config.ignore_mobile_logins}"
-            )
-            alert.filter_type.append(AlertFilterType.IS_MOBILE_FILTER)
-
-    # Detection filters - alerts
-    if alert.name in app_config.filtered_alerts_types:
-        alert.filter_type.append(AlertFilterType.FILTERED_ALERTS)
-
-    if alert.name == AlertDetectionType.IMP_TRAVEL:
-        # check ignored_impossible_travel_countries_couples and ignored_impossible_travel_all_same_country config filters
-        if app_config.ignored_impossible_travel_all_same_country and alert.login_raw_data["country"] == alert.login_raw_data["buffalogs"]["start_country"]:
-            alert.filter_type.append(AlertFilterType.IGNORED_IMP_TRAVEL_ALL_SAME_COUNTRY)
-        couple_country = [alert.login_raw_data["country"], alert.login_raw_data["buffalogs"]["start_country"]]
-        # using Counter to ignore the order: ["Italy", "Germany"] == ["Germany", "Italy"] and check only if the coutry couple is present in the ignored couples
-        for ignored_country_couple in app_config.ignored_impossible_travel_countries_couples:
-            if Counter(ignored_country_couple) == Counter(couple_country):
-                alert.filter_type.append(AlertFilterType.IGNORED_IMP_TRAVEL_COUNTRIES_COUPLE)
-
-    alert.save()
-
-
-def _update_users_filters(db_alert: Alert, app_config: Config, db_user: User) -> Alert:
-    """Check all the filters relative to users (enabled_users, ignored_users, vip_users).
-    Rules of alert filtering, in the check order:
-    1. if Config.alert_is_vip_only == True
-        a. if user not in [Config.vip_users] --> IS_VIP_FILTER
-    else:
-    2. if Config.enabled_users != []
-        b. if user not in [Config.enabled_users] --> IGNORED_USER_FILTER
-      3. else: if user in [Config.ignored_users] --> IGNORED_USER_FILTER
-    4. if user.risk_score < Config.alert_minimum_risk_score --> ALERT_MINIMUM_RISK_SCORE_FILTER
-    5. if now-user.created < Config.user_learning_period --> USER_LEARNING_PERIOD
-    """
-    now = datetime.now(timezone.utc)
-
-    if app_config.alert_is_vip_only:
-        # 1. if the flag Config.is_vip_only is True, check only if the user is in the config.vip_users list
-        if db_user.username not in app_config.vip_users:
-            logger.debug(f"Alert: {db_alert.id} filtered because user: {db_user.username} not in vip_users and enabled_users Config lists")
-            db_alert.filter_type.append(AlertFilterType.IS_VIP_FILTER)  # alert filtered because alert_is_vip_only=True but username not in vip_users list
-    else:
-        if app_config.enabled_users and not _check_username_list_regex(word=db_user.username, values_list=app_config.enabled_users):
-            # 2. alert filtered because the user is not in the enabled_users list
-            logger.debug(f"Alert: {db_alert.id} filtered because user: {db_user.username} not in the enabled_users Config list")
-            db_alert.filter_type.append(AlertFilterType.IGNORED_USER_FILTER)
-        else:
-            if _check_username_list_regex(word=db_user.username, values_list=app_config.ignored_users):
-                # 3. if the user is in the Config.ignored_users list, the user is immediately ignored
-                logger.debug(f"Alert: {db_alert.id} filtered because user: {db_user.username} is in the ignored_users Config list")
-                db_alert.filter_type.append(AlertFilterType.IGNORED_USER_FILTER)
-
-    # 4. check that if the user has a risk_score lower than the alert_minimum_risk_score threshold filter, the alert is filtered
-    if UserRiskScoreType.compare_risk(threshold=app_config.alert_minimum_risk_score, value=db_user.risk_score) == ComparisonType.LOWER:
-        logger.debug(
-            f"Alert: {db_alert.id} filtered because user: {db_user.username} has risk_score: {db_user.risk_score}, but Config.alert_minimum_risk_score is set to {app_config.alert_minimum_risk_score}"
-        )
-        db_alert.filter_type.append(AlertFilterType.ALERT_MINIMUM_RISK_SCORE_FILTER)
-    # 5. check if the User is quite new in the BuffaLogs system, so if the learning period has to be completed yet
-    if (now - db_user.created) < timedelta(days=app_config.user_learning_period):
-        logger.debug(f"Alert: {db_alert.id} filtered because user: {db_user.username} is still into the learning period")
-        db_alert.filter_type.append(AlertFilterType.USER_LEARNING_PERIOD)
-    return db_alert
-
-
-def _check_username_list_regex(word: str, values_list: list) -> bool:
-    """Function to check if a string value is inside a list of string or match a regex in the list"""
-    for item in values_list:
-        if word == item:
-            # check if the word is exacly a value in the list
+# backreferences can't be combined in an alternation, because the groups numbers change
+BACKREFERENCE_REGEX = re.compile(r"\\[1-9]|\(\?P=")
+
+
+def match_filters(alert: Alert, app_config: Config | ConfigSnapshot, save: bool = True) -> Alert:
+    """Set the Alert.filter_type with the Config filters matched by the alert.
+    With save=False the alert is not saved, so it can be written once by the caller (e.g. in bulk)"""
+    filter_engine = get_filter_engine(as_snapshot(app_config))
+    filters = filter_engine.evaluate({"name": alert.name, "login_raw_data": alert.login_raw_data}, alert.user)
+    if filters:
+        logger.debug(f"Alert: {alert.id} for user: {alert.user.username} filtered by: {filters}")
+        alert.filter_type.extend(filters)
+    if save:
+        alert.save()
+    return alert
+
+
+@lru_cache(maxsize=8)
+def get_filter_engine(app_config: ConfigSnapshot) -> "FilterEngine":
+    """Return the FilterEngine of the Config snapshot, built once per Config version"""
+    return FilterEngine(app_config)
+
+
+class UsernameMatcher:
+    """Check if a username is in a list of strings or matches one of its regex, combined into a single alternation"""
+
+    def __init__(self, values: tuple, patterns: tuple = ()):
+        self.values = frozenset(values)
+        self.regex = None
+        self.patterns = patterns
+        if values and not any(BACKREFERENCE_REGEX.search(value) for value in values):
+            try:
+                self.regex = re.compile("|".join(f"(?:{value})" for value in values))
+            except re.error:
+                # e.g. global flags not at the start of the expression: check the patterns one by one
+                self.regex = None
+
+    def __contains__(self, username: str) -> bool:
+        if username in self.values:
             return True
+        if self.regex is not None:
+            return self.regex.search(username) is not None
+        return any(pattern.search(username) for pattern in self.patterns)
+
+
+class IPPrefixTable:
+    """Set of IPs and networks, looked up with a table of the networks for each prefix length"""
+
+    def __init__(self, values: frozenset):
+        self.values = frozenset(values)
+        self.networks = defaultdict(set)
+        for value in values:
+            try:
+                network = ip_network(value, strict=False)
+            except ValueError:
+                continue
+            self.networks[(network.version, network.prefixlen)].add(int(network.network_address))
+        # for each IP version, the masks of the prefix lengths to check, from the most specific one
+        self.masks = defaultdict(list)
+        for version, prefixlen in sorted(self.networks, reverse=True):
+            bits = 32 if version == 4 else 128
+            self.masks[version].append((prefixlen, ((1 << prefixlen) - 1) << (bits - prefixlen)))
+
+    def __contains__(self, ip: str) -> bool:
+        if ip in self.values:
+            return True
+        try:
+            address = ip_address(ip)
+        except ValueError:
+            return False
+        address_value = int(address)
+        return any(address_value & mask in self.networks[(address.version, prefixlen)] for prefixlen, mask in self.masks[address.version])
+
+
+class FilterEngine:
+    """All the Config filters precompiled, to evaluate the alerts without DB queries"""
+
+    def __init__(self, app_config: ConfigSnapshot):
+        self.app_config = app_config
+        self.enabled_users = UsernameMatcher(app_config.enabled_users, app_config.enabled_users_patterns)
+        self.ignored_users = UsernameMatcher(app_config.ignored_users, app_config.ignored_users_patterns)
+        self.ignored_ips = IPPrefixTable(app_config.ignored_ips)
+
+    def evaluate(self, alert: dict, user: User) -> list:
+        """Return the filters matched by the alert
+
+        :param alert: the alert data, with the "name" and "login_raw_data" keys
+        :type alert: dict
+        :param user: the user of the alert
+        :type user: User
+
+        :return: the list of the AlertFilterType matched, empty if the alert must not be filtered
+        :rtype: list
+        """
+        app_config = self.app_config
+        login = alert["login_raw_data"]
+        filters = self._users_filters(user)
+
+        # Detection filters - location
+        if login.get("ip", "") in self.ignored_ips:
+            filters.append(AlertFilterType.IGNORED_IP_FILTER)  # alert filtered because the ip is in the ignored_ips list
+        if login.get("country", "") in app_config.allowed_countries:
+            filters.append(AlertFilterType.ALLOWED_COUNTRY_FILTER)  # alert filtered because the country is in the allowed_countries list
+
+        # Detection filters - devices
+        if login.get("organization", "") in app_config.ignored_ISPs:
+            filters.append(AlertFilterType.IGNORED_ISP_FILTER)
+        if app_config.ignore_mobile_logins and login.get("agent", "") and parse_user_agent(login["agent"]).is_mobile:
+            filters.append(AlertFilterType.IS_MOBILE_FILTER)
+
+        # Detection filters - alerts
+        if alert["name"] in app_config.filtered_alerts_types:
+            filters.append(AlertFilterType.FILTERED_ALERTS)
+
+        if alert["name"] == AlertDetectionType.IMP_TRAVEL:
+            # check ignored_impossible_travel_countries_couples and ignored_impossible_travel_all_same_country config filters
+            start_country = login["buffalogs"]["start_country"]
+            if app_config.ignored_impossible_travel_all_same_country and login["country"] == start_country:
+                filters.append(AlertFilterType.IGNORED_IMP_TRAVEL_ALL_SAME_COUNTRY)
+            # the couples are sorted in order to ignore the order: ["Italy", "Germany"] == ["Germany", "Italy"]
+            if tuple(sorted([login["country"], start_country])) in app_config.ignored_countries_couples:
+                filters.append(AlertFilterType.IGNORED_IMP_TRAVEL_COUNTRIES_COUPLE)
+        return filters
+
+    def _users_filters(self, user: User) -> list:
+        """Check all the filters relative to users (enabled_users, ignored_users, vip_users).
+        Rules of alert filtering, in the check order:
+        1. if Config.alert_is_vip_only == True
+            a. if user not in [Config.vip_users] --> IS_VIP_FILTER
         else:
-            # else, check if the item in the list is a regex that matches the word
-            regexp = re.compile(item)
-            if regexp.search(word):
-                return True
-    return False
+        2. if Config.enabled_users != []
+            b. if user not in [Config.enabled_users] --> IGNORED_USER_FILTER
+          3. else: if user in [Config.ignored_users] --> IGNORED_USER_FILTER
+        4. if user.risk_score < Config.alert_minimum_risk_score --> ALERT_MINIMUM_RISK_SCORE_FILTER
+        5. if now-user.created < Config.user_learning_period --> USER_LEARNING_PERIOD
+        """
+        app_config = self.app_config
+        filters = []
+        if app_config.alert_is_vip_only:
+            # 1. if the flag Config.is_vip_only is True, check only if the user is in the config.vip_users list
+            if user.username not in app_config.vip_users:
+                filters.append(AlertFilterType.IS_VIP_FILTER)  # alert filtered because alert_is_vip_only=True but username not in vip_users list
+        elif app_config.enabled_users and user.username not in self.enabled_users:
+            # 2. alert filtered because the user is not in the enabled_users list
+            filters.append(AlertFilterType.IGNORED_USER_FILTER)
+        elif user.username in self.ignored_users:
+            # 3. if the user is in the Config.ignored_users list, the user is immediately ignored
+            filters.append(AlertFilterType.IGNORED_USER_FILTER)
+
+        # 4. check that if the user has a risk_score lower than the alert_minimum_risk_score threshold filter, the alert is filtered
+        if UserRiskScoreType.compare_risk(threshold=app_config.alert_minimum_risk_score, value=user.risk_score) == ComparisonType.LOWER:
+            filters.append(AlertFilterType.ALERT_MINIMUM_RISK_SCORE_FILTER)
+        # 5. check if the User is quite new in the BuffaLogs system, so if the learning period has to be completed yet
+        if (datetime.now(timezone.utc) - user.created) < timedelta(days=app_config.user_learning_period):
+            filters.append(AlertFilterType.USER_LEARNING_PERIOD)
+        return filters
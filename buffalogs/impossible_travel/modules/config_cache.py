@@ -0,0 +1,152 @@
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass, fields
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from impossible_travel.models import Config
+
+logger = logging.getLogger(__name__)
+
+
+def _compile_patterns(values: tuple) -> tuple:
+    """Compile the regex in the list, skipping the values that are just strings and not valid regex"""
+    patterns = []
+    for value in values:
+        try:
+            patterns.append(re.compile(value))
+        except re.error:
+            logger.warning(f"Invalid regex in the Config: {value}, considered as exact string only")
+    return tuple(patterns)
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """Immutable snapshot of the Config, with the derived structures needed by the detection already computed.
+    It exposes the same fields of the Config model, so it can be used in its place in read only mode
+    """
+
+    id: int
+    updated: datetime
+    ignored_users: tuple
+    enabled_users: tuple
+    vip_users: frozenset
+    alert_is_vip_only: bool
+    alert_minimum_risk_score: str
+    risk_score_increment_alerts: tuple
+    ignored_ips: frozenset
+    allowed_countries: frozenset
+    ignored_ISPs: frozenset
+    ignore_mobile_logins: bool
+    filtered_alerts_types: frozenset
+    threshold_user_risk_alert: str
+    ignored_impossible_travel_countries_couples: tuple
+    ignored_impossible_travel_all_same_country: bool
+    distance_accepted: int
+    vel_accepted: int
+    atypical_country_days: int
+    user_learning_period: int
+    user_max_days: int
+    login_max_days: int
+    alert_max_days: int
+    ip_max_days: int
+    # derived structures
+    ignored_users_patterns: tuple = ()
+    enabled_users_patterns: tuple = ()
+    ignored_countries_couples: frozenset = frozenset()
+
+    @classmethod
+    def from_config(cls, config: Config) -> "ConfigSnapshot":
+        """Build the snapshot of the given Config object
+
+        :param config: the Config object
+        :type config: Config
+
+        :return: the immutable snapshot of the config
+        :rtype: ConfigSnapshot
+        """
+        values = {}
+        for field in fields(cls):
+            if not hasattr(config, field.name):
+                continue
+            value = getattr(config, field.name)
+            if field.type in (tuple, frozenset):
+                value = field.type(value or ())
+            values[field.name] = value
+        values["ignored_impossible_travel_countries_couples"] = tuple(tuple(couple) for couple in values["ignored_impossible_travel_countries_couples"])
+        values["ignored_users_patterns"] = _compile_patterns(values["ignored_users"])
+        values["enabled_users_patterns"] = _compile_patterns(values["enabled_users"])
+        # the couples are sorted in order to ignore the order: ["Italy", "Germany"] == ["Germany", "Italy"]
+        values["ignored_countries_couples"] = frozenset(tuple(sorted(couple)) for couple in values["ignored_impossible_travel_countries_couples"])
+        return cls(**values)
+
+
+def as_snapshot(app_config) -> ConfigSnapshot:
+    """Return the ConfigSnapshot of the app_config, that can be a Config object or already a ConfigSnapshot"""
+    if isinstance(app_config, ConfigSnapshot):
+        return app_config
+    return ConfigSnapshot.from_config(app_config)
+
+
+class _ConfigCache:
+    """Process-local cache of the ConfigSnapshot.
+    It's invalidated by the Config signals in the process that changes the Config,
+    while the other processes (e.g. the Celery workers) check the Config.updated field every CERTEGO_BUFFALOGS_CONFIG_CACHE_TTL seconds
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = 0.0
+
+    def get(self) -> ConfigSnapshot:
+        now = time.monotonic()
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and now - self._checked_at < settings.CERTEGO_BUFFALOGS_CONFIG_CACHE_TTL:
+                return snapshot
+        if snapshot is not None and Config.objects.filter(id=1, updated=snapshot.updated).exists():
+            # the Config has not been changed by the other processes
+            with self._lock:
+                self._checked_at = now
+            return snapshot
+        config, _ = Config.objects.get_or_create(id=1)
+        snapshot = ConfigSnapshot.from_config(config)
+        if not connection.in_atomic_block:
+            # a Config read inside a transaction could be rolled back, so it's not cached
+            with self._lock:
+                self._snapshot = snapshot
+                self._checked_at = now
+        return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+
+_cache = _ConfigCache()
+
+
+def get_config() -> ConfigSnapshot:
+    """Return the cached snapshot of the BuffaLogs Config, creating the Config if it doesn't exist
+
+    :return: the immutable snapshot of the config
+    :rtype: ConfigSnapshot
+    """
+    return _cache.get()
+
+
+def invalidate_config():
+    """Drop the cached Config snapshot, so the next get_config() reads it from the DB"""
+    _cache.invalidate()
+
+
+@receiver(post_save, sender=Config)
+@receiver(post_delete, sender=Config)
+def config_changed(sender, **kwargs):
+    invalidate_config()
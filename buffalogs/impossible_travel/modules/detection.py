@@ -1,17 +1,216 @@
+from collections import defaultdict
 from datetime import datetime
 
+import numpy as np
 from celery.utils.log import get_task_logger
+from django.conf import settings
 from django.db import DatabaseError, IntegrityError, transaction
 from django.utils import timezone
-from geopy.distance import geodesic
-from impossible_travel.constants import AlertDetectionType, ComparisonType, UserRiskScoreType
+from impossible_travel.constants import INDEX_SOURCE_SEPARATOR, AlertDetectionType, ComparisonType, UserRiskScoreType
 from impossible_travel.models import Alert, Config, Login, User, UsersIP
-from impossible_travel.modules import alert_filter
+from impossible_travel.modules import alert_filter, travel
+from impossible_travel.modules.config_cache import get_config
 
 logger = get_task_logger(__name__)
 
 
-def update_risk_level(db_user: User, triggered_alert: Alert, app_config: Config) -> bool:
+class UserDetectionState:
+    """Snapshot of the detection data of a user, loaded with a couple of queries before the analysis of a batch of logins.
+    All the checks of check_fields run in memory against it and its changes are saved on the DB by the DetectionBatchWriter
+    """
+
+    LOGIN_UPDATE_FIELDS = ["timestamp", "latitude", "longitude", "event_id", "ip"]
+
+    def __init__(self, db_user: User):
+        self.db_user = db_user
+        # (index, country, user_agent) -> Login rows of the key, in creation order
+        self.logins_by_key = defaultdict(list)
+        # country -> last Login row created for that country
+        self.last_login_by_country = {}
+        self.indexes = set()
+        self.agents = set()
+        self.latest_login = None
+        for db_login in db_user.login_set.order_by("pk"):
+            self._track_login(db_login)
+        self.known_ips = set(db_user.usersip_set.values_list("ip", flat=True))
+        self._travel_history = None
+        self._new_logins = []
+        self._updated_logins = {}
+        self._new_ips = []
+
+    @staticmethod
+    def _normalize_ip(ip: str) -> str:
+        # same normalization applied by the UsersIP.ip field before the DB lookups
+        return UsersIP._meta.get_field("ip").get_prep_value(ip)
+
+    @staticmethod
+    def _parse_timestamp(timestamp) -> datetime:
+        if not isinstance(timestamp, datetime):
+            timestamp = datetime.fromisoformat(timestamp)
+        if timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp)
+        return timestamp
+
+    def _track_login(self, db_login: Login):
+        self.logins_by_key[(db_login.index, db_login.country, db_login.user_agent)].append(db_login)
+        self.last_login_by_country[db_login.country] = db_login
+        self.indexes.add(db_login.index)
+        self.agents.add(db_login.user_agent)
+        self._track_latest(db_login)
+
+    def _track_latest(self, db_login: Login):
+        if self.latest_login is None or db_login.timestamp >= self.latest_login.timestamp:
+            self.latest_login = db_login
+        elif db_login is self.latest_login:
+            # the latest login has been moved back in time: look for the new latest one
+            self.latest_login = max((row for rows in self.logins_by_key.values() for row in rows), key=lambda row: row.timestamp)
+
+    @property
+    def travel_history(self) -> travel.TravelHistory:
+        """The last geo-points of the user, built the first time from the Login rows already loaded, then updated by each login analyzed"""
+        if self._travel_history is None:
+            self._travel_history = travel.TravelHistory(settings.CERTEGO_BUFFALOGS_TRAVEL_HISTORY_SIZE)
+            for db_login in sorted((row for rows in self.logins_by_key.values() for row in rows), key=lambda row: row.timestamp):
+                if db_login.latitude is not None and db_login.longitude is not None:
+                    self._travel_history.add(float(db_login.latitude), float(db_login.longitude), travel.to_epoch_us(db_login.timestamp), db_login.country)
+        return self._travel_history
+
+    def _track_point(self, db_login: Login):
+        # before the first use, the history is built from the rows, already updated
+        if self._travel_history is not None and db_login.latitude is not None and db_login.longitude is not None:
+            self._travel_history.add(float(db_login.latitude), float(db_login.longitude), travel.to_epoch_us(db_login.timestamp), db_login.country)
+
+    def has_index(self, index: str) -> bool:
+        # the index tagged with the source name (e.g. "elasticsearch:cloud") matches also the untagged one, saved before enabling more sources
+        _, separator, untagged_index = index.partition(INDEX_SOURCE_SEPARATOR)
+        return index in self.indexes or bool(separator) and untagged_index in self.indexes
+
+    def has_agent(self, agent: str) -> bool:
+        return agent in self.agents
+
+    def has_ip(self, ip: str) -> bool:
+        return self._normalize_ip(ip) in self.known_ips
+
+    def has_login(self, login: dict) -> bool:
+        return bool(self.logins_by_key.get((login["index"], login["country"], login["agent"])))
+
+    def add_ip(self, ip: str):
+        ip = self._normalize_ip(ip)
+        if ip not in self.known_ips:
+            self.known_ips.add(ip)
+            self._new_ips.append(ip)
+
+    def add_login(self, login: dict):
+        """In memory version of add_new_login()"""
+        db_login = Login(
+            user=self.db_user,
+            timestamp=self._parse_timestamp(login["timestamp"]),
+            ip=login["ip"],
+            latitude=login["lat"],
+            longitude=login["lon"],
+            country=login["country"],
+            user_agent=login["agent"],
+            index=login["index"],
+            event_id=login["id"],
+        )
+        self._new_logins.append(db_login)
+        self._track_login(db_login)
+        self._track_point(db_login)
+
+    def update_login(self, login: dict):
+        """In memory version of update_model()"""
+        last_db_login = None
+        for db_login in self.logins_by_key[(login["index"], login["country"], login["agent"])]:
+            db_login.timestamp = self._parse_timestamp(login["timestamp"])
+            db_login.latitude = login["lat"]
+            db_login.longitude = login["lon"]
+            db_login.event_id = login["id"]
+            db_login.ip = login["ip"]
+            if db_login.pk is not None:
+                self._updated_logins[db_login.pk] = db_login
+            self._track_latest(db_login)
+            last_db_login = db_login
+        if last_db_login is not None:
+            self._track_point(last_db_login)
+
+    def pop_changes(self) -> tuple:
+        """Return the new logins, the updated logins and the new IPs not saved yet, resetting them"""
+        changes = (self._new_logins, list(self._updated_logins.values()), [UsersIP(user=self.db_user, ip=ip) for ip in self._new_ips])
+        self._new_logins = []
+        self._updated_logins = {}
+        self._new_ips = []
+        return changes
+
+
+class DetectionBatchWriter:
+    """Collect all the rows produced by the detection of a batch of users (logins, IPs, alerts and users risk_score)
+    and save them with bulk queries inside a single transaction by flush()
+    """
+
+    def __init__(self):
+        self.states = {}
+        self.alerts = []
+        self.users = {}
+        self._db_alerts_count = {}
+
+    def get_state(self, db_user: User) -> UserDetectionState:
+        """Return the UserDetectionState of the user, loading it the first time"""
+        if db_user.pk not in self.states:
+            self.states[db_user.pk] = UserDetectionState(db_user)
+        return self.states[db_user.pk]
+
+    def add_alert(self, alert: Alert):
+        self.alerts.append(alert)
+
+    def update_user(self, db_user: User):
+        self.users[db_user.pk] = db_user
+
+    def count_alerts(self, db_user: User, names: list = None) -> int:
+        """Number of alerts of the user (only the ones with the given names, if set), considering the not saved ones too"""
+        key = (db_user.pk, tuple(sorted(names)) if names is not None else None)
+        if key not in self._db_alerts_count:
+            db_alerts = db_user.alert_set.all()
+            if names is not None:
+                db_alerts = db_alerts.filter(name__in=names)
+            self._db_alerts_count[key] = db_alerts.count()
+        return self._db_alerts_count[key] + sum(1 for alert in self.alerts if alert.user_id == db_user.pk and (names is None or alert.name in names))
+
+    def flush(self):
+        """Save all the collected rows on the DB"""
+        new_logins, updated_logins, new_ips = [], [], []
+        for state in self.states.values():
+            state_new_logins, state_updated_logins, state_new_ips = state.pop_changes()
+            new_logins.extend(state_new_logins)
+            updated_logins.extend(state_updated_logins)
+            new_ips.extend(state_new_ips)
+        now = timezone.now()
+        for db_user in self.users.values():
+            db_user.updated = now
+
+        with transaction.atomic():
+            if new_logins:
+                # upsert: a Login with the same key could have been created meanwhile by a concurrent detection (e.g. stream and windows)
+                Login.objects.bulk_create(
+                    new_logins,
+                    update_conflicts=True,
+                    unique_fields=["user", "index", "country", "user_agent_hash"],
+                    update_fields=UserDetectionState.LOGIN_UPDATE_FIELDS,
+                )
+            if updated_logins:
+                Login.objects.bulk_update(updated_logins, fields=UserDetectionState.LOGIN_UPDATE_FIELDS)
+            if new_ips:
+                UsersIP.objects.bulk_create(new_ips, ignore_conflicts=True)
+            if self.alerts:
+                Alert.objects.bulk_create(self.alerts)
+            if self.users:
+                User.objects.bulk_update(self.users.values(), fields=["risk_score", "updated"])
+
+        self.alerts = []
+        self.users = {}
+        self._db_alerts_count = {}
+
+
+def update_risk_level(db_user: User, triggered_alert: Alert, app_config: Config, writer: DetectionBatchWriter = None) -> bool:
     """Update user risk level depending on how many alerts were triggered and the Config.risk_score_increment_alerts
 
     :param db_user: user from DB
@@ -20,6 +219,8 @@ def update_risk_level(db_user: User, triggered_alert: Alert, app_config: Config)
     :type alert: Alert object
     :param app_config: buffalogs config object
     :type app_config: Config object
+    :param writer: batch writer collecting the changes, if not set the user is saved immediately
+    :type writer: DetectionBatchWriter
 
     :return: False if user.risk_score doesn't increased, True otherwise
     :rtype: bool
@@ -27,11 +228,18 @@ def update_risk_level(db_user: User, triggered_alert: Alert, app_config: Config)
     with transaction.atomic():
         current_risk_score = db_user.risk_score
         # for the risk_score consider the number of alerts that are not in the Config.risk_score_increment_alerts list
-        new_risk_level = UserRiskScoreType.get_risk_level(db_user.alert_set.filter(name__in=app_config.risk_score_increment_alerts).count())
+        if writer is not None:
+            increment_alerts_count = writer.count_alerts(db_user, names=app_config.risk_score_increment_alerts)
+        else:
+            increment_alerts_count = db_user.alert_set.filter(name__in=app_config.risk_score_increment_alerts).count()
+        new_risk_level = UserRiskScoreType.get_risk_level(increment_alerts_count)
 
         # update the risk_score anyway in order to keep the users up-to-date each time they are seen by the system
         db_user.risk_score = new_risk_level
-        db_user.save()
+        if writer is not None:
+            writer.update_user(db_user)
+        else:
+            db_user.save()
 
         risk_comparison = UserRiskScoreType.compare_risk(current_risk_score, new_risk_level)
         if risk_comparison in [ComparisonType.LOWER, ComparisonType.EQUAL]:
@@ -51,15 +259,16 @@ def update_risk_level(db_user: User, triggered_alert: Alert, app_config: Config)
                 "alert_desc": f"{AlertDetectionType.USER_RISK_THRESHOLD.label} for User: {db_user.username}, "
                 f"who changed risk_score from {current_risk_score} to {new_risk_level}",
             }
+            alerts_count = writer.count_alerts(db_user) if writer is not None else db_user.alert_set.count()
             logger.info(
-                f"Upgraded risk level for User: {db_user.username} to level: {new_risk_level}, detected {db_user.alert_set.count()} alerts. The Config.risk_score_increment_alerts list contains: {app_config.risk_score_increment_alerts}"
+                f"Upgraded risk level for User: {db_user.username} to level: {new_risk_level}, detected {alerts_count} alerts. The Config.risk_score_increment_alerts list contains: {app_config.risk_score_increment_alerts}"
             )
-            set_alert(db_user=db_user, login_alert=triggered_alert.login_raw_data, alert_info=alert_info, app_config=app_config)
+            set_alert(db_user=db_user, login_alert=triggered_alert.login_raw_data, alert_info=alert_info, app_config=app_config, writer=writer)
 
             return True
 
 
-def set_alert(db_user: User, login_alert: dict, alert_info: dict, app_config: Config) -> Alert:
+def set_alert(db_user: User, login_alert: dict, alert_info: dict, app_config: Config, writer: DetectionBatchWriter = None) -> Alert:
     """Save the alert on db and logs it
 
     :param db_user: user from db
@@ -68,31 +277,42 @@ def set_alert(db_user: User, login_alert: dict, alert_info: dict, app_config: Co
     :type login_alert: dict
     :param alert_info: dictionary with alert info
     :type alert_info: dict
+    :param writer: batch writer collecting the alerts, if not set the alert is saved immediately
+    :type writer: DetectionBatchWriter
 
     :return: new buffalogs alert object
     :rtype: Alert obj
     """
     logger.info(f"ALERT {alert_info['alert_name']} for User: {db_user.username} at: {login_alert['timestamp']}")
-    alert = Alert.objects.create(user=db_user, login_raw_data=login_alert, name=alert_info["alert_name"], description=alert_info["alert_desc"])
-    alert.save()
-    # check filters
-    alert_filter.match_filters(alert=alert, app_config=app_config)
+    # copy the login, so the fields added later to it (e.g. the "buffalogs" ones of the IMP_TRAVEL alert) aren't saved in this alert
+    alert = Alert(user=db_user, login_raw_data=dict(login_alert), name=alert_info["alert_name"], description=alert_info["alert_desc"])
+    # check filters before saving, so the alert is written only once
+    alert_filter.match_filters(alert=alert, app_config=app_config, save=False)
+    if writer is not None:
+        writer.add_alert(alert)
+    else:
+        alert.save()
     # update user.risk_score if necessary (not for filtered alerts)
     if not alert.is_filtered:
-        update_risk_level(db_user=alert.user, triggered_alert=alert, app_config=app_config)
+        update_risk_level(db_user=alert.user, triggered_alert=alert, app_config=app_config, writer=writer)
     return alert
 
 
-def check_fields(db_user: User, fields: list):
+def check_fields(db_user: User, fields: list, writer: DetectionBatchWriter = None):
     """Check different types of alerts based on login fields.
+    The user data needed by the checks are loaded once in a UserDetectionState and all the changes are saved by the DetectionBatchWriter
 
     :param db_user: user from DB
     :type db_user: User object
     :param fields: list of login data of the user
     :type fields: list
+    :param writer: batch writer shared by more users, flushed by the caller. If not set, the changes are saved at the end of the user analysis
+    :type writer: DetectionBatchWriter
     """
 
-    db_config, _ = Config.objects.get_or_create(id=1)
+    db_config = get_config()
+    batch_writer = writer or DetectionBatchWriter()
+    state = batch_writer.get_state(db_user)
 
     for login in fields:
         if login.get("intelligence_category", None) == "anonymizer":
@@ -101,55 +321,60 @@ def check_fields(db_user: User, fields: list):
                 "alert_name": AlertDetectionType.ANONYMOUS_IP_LOGIN.value,
                 "alert_desc": f"{AlertDetectionType.ANONYMOUS_IP_LOGIN.label} from IP: {login['ip']} by User: {db_user.username}",
             }
-            set_alert(db_user, login_alert=login, alert_info=alert_info, app_config=db_config)
+            set_alert(db_user, login_alert=login, alert_info=alert_info, app_config=db_config, writer=batch_writer)
         if login["lat"] and login["lon"]:
-            if Login.objects.filter(user_id=db_user.id, index=login["index"]).exists():
+            if state.has_index(login["index"]):
                 agent_alert = False
                 country_alert = False
                 if login["agent"]:
                     # check the possible alert: NEW_DEVICE
-                    agent_alert = check_new_device(db_user, login)
+                    agent_alert = check_new_device(db_user, login, state=state)
                     if agent_alert:
-                        set_alert(db_user, login_alert=login, alert_info=agent_alert, app_config=db_config)
+                        set_alert(db_user, login_alert=login, alert_info=agent_alert, app_config=db_config, writer=batch_writer)
 
                 if login["country"]:
                     # check the possible alerts: NEW_COUNTRY / ATYPICAL_COUNTRY
-                    country_alert = check_country(db_user, login, db_config)
+                    country_alert = check_country(db_user, login, db_config, state=state)
                     if country_alert:
-                        set_alert(db_user, login_alert=login, alert_info=country_alert, app_config=db_config)
-
-                if not db_user.usersip_set.filter(ip=login["ip"]).exists():
-                    last_user_login = db_user.login_set.latest("timestamp")
-                    logger.info(f"Calculating impossible travel: {login['id']}")
-                    travel_alert, travel_vel = calc_distance_impossible_travel(db_user, prev_login=last_user_login, last_login_user_fields=login)
-                    if travel_alert:
-                        # enrich imp_travel alert with related fields
-                        login["buffalogs"] = {
-                            "start_country": last_user_login.country,
-                            "avg_speed": travel_vel,
-                            "start_lat": last_user_login.latitude,
-                            "start_lon": last_user_login.longitude,
-                        }
-                        set_alert(db_user, login_alert=login, alert_info=travel_alert, app_config=db_config)
-                    #   Add the new ip address from which the login comes to the db
-                    UsersIP.objects.create(user=db_user, ip=login["ip"])
-
-                if Login.objects.filter(user=db_user, index=login["index"], country=login["country"], user_agent=login["agent"]).exists():
+                        set_alert(db_user, login_alert=login, alert_info=country_alert, app_config=db_config, writer=batch_writer)
+
+                # check the possible alert: IMP_TRAVEL, against all the recent logins, also for the known IPs (e.g. a hop of a chain)
+                logger.info(f"Calculating impossible travel: {login['id']}")
+                travel_alert, travel_vel, start_point = check_travel_history(db_user, login, db_config, state=state)
+                if travel_alert:
+                    # enrich imp_travel alert with related fields
+                    login["buffalogs"] = {
+                        "start_country": start_point["country"],
+                        "avg_speed": travel_vel,
+                        "start_lat": start_point["lat"],
+                        "start_lon": start_point["lon"],
+                    }
+                    set_alert(db_user, login_alert=login, alert_info=travel_alert, app_config=db_config, writer=batch_writer)
+                #   Add the new ip address from which the login comes to the db
+                state.add_ip(login["ip"])
+
+                if state.has_login(login):
                     logger.info(f"Updating login {login['id']} for user: {db_user.username}")
-                    update_model(db_user, login)
+                    state.update_login(login)
                 else:
                     logger.info(f"Adding new login {login['id']} for user: {db_user.username}")
-                    add_new_login(db_user, login)
+                    state.add_login(login)
 
             else:
                 logger.info(f"Creating new login {login['id']} for user: {db_user.username}")
-                add_new_login(db_user, login)
-                UsersIP.objects.create(user=db_user, ip=login["ip"])
+                state.add_login(login)
+                state.add_ip(login["ip"])
+            if login.get("count", 1) > 1:
+                # burst of identical logins collapsed by the ingestion: the saved Login keeps the last one
+                state.update_login(dict(login, timestamp=login["last_seen"], id=login["last_id"]))
         else:
             logger.info(f"No latitude or longitude for User {db_user.username}")
 
+    if writer is None:
+        batch_writer.flush()
+
 
-def check_country(db_user: User, login_field: dict, app_config: Config) -> dict:
+def check_country(db_user: User, login_field: dict, app_config: Config, state: UserDetectionState = None) -> dict:
     """
     Check Login from new Country and send alert
 
@@ -159,21 +384,23 @@ def check_country(db_user: User, login_field: dict, app_config: Config) -> dict:
     :type login_field: dict
     :param app_config: buffalogs config object
     :type app_config: Config
+    :param state: detection data of the user, loaded from the DB if not given
+    :type state: UserDetectionState
 
     :return: dictionary with alert info
     :rtype: dict
     """
+    state = state or UserDetectionState(db_user)
     alert_info = {}
+    last_country_login = state.last_login_by_country.get(login_field["country"])
     # check "New Country" alert
-    if db_user.login_set.filter(country=login_field["country"]).count() == 0:
+    if last_country_login is None:
         alert_info["alert_name"] = AlertDetectionType.NEW_COUNTRY.value
         alert_info["alert_desc"] = (
             f"{AlertDetectionType.NEW_COUNTRY.label} for User: {db_user.username}, at: {login_field['timestamp']}, from: {login_field['country']}"
         )
     # check "Atypical Country" alert
-    elif (
-        datetime.fromisoformat(login_field["timestamp"]) - db_user.login_set.filter(country=login_field["country"]).last().timestamp
-    ).days >= app_config.atypical_country_days:
+    elif (state._parse_timestamp(login_field["timestamp"]) - last_country_login.timestamp).days >= app_config.atypical_country_days:
         alert_info["alert_name"] = AlertDetectionType.ATYPICAL_COUNTRY.value
         alert_info["alert_desc"] = (
             f"{AlertDetectionType.ATYPICAL_COUNTRY.label} for User: {db_user.username}, at: {login_field['timestamp']}, from: {login_field['country']}"
@@ -181,7 +408,7 @@ def check_country(db_user: User, login_field: dict, app_config: Config) -> dict:
     return alert_info
 
 
-def check_new_device(db_user: User, login_field: dict) -> dict:
+def check_new_device(db_user: User, login_field: dict, state: UserDetectionState = None) -> dict:
     """
     Check Login from new Device and send alert
 
@@ -189,12 +416,15 @@ def check_new_device(db_user: User, login_field: dict) -> dict:
     :type db_user: object
     :param login_field: last login to check
     :type login_field: dict
+    :param state: detection data of the user, loaded from the DB if not given
+    :type state: UserDetectionState
 
     :return: dictionary with alert info
     :rtype: dict
     """
+    state = state or UserDetectionState(db_user)
     alert_info = {}
-    if db_user.login_set.filter(user_agent=login_field["agent"]).count() == 0:
+    if not state.has_agent(login_field["agent"]):
         timestamp = login_field["timestamp"]
         alert_info["alert_name"] = AlertDetectionType.NEW_DEVICE.value
         alert_info["alert_desc"] = f"{AlertDetectionType.NEW_DEVICE.label} for User: {db_user.username}, at: {timestamp}"
@@ -231,7 +461,7 @@ def update_model(db_user: User, new_login: dict):
     :type new_login: dict
     """
     try:
-        db_user.login_set.filter(user_agent=new_login["agent"], country=new_login["country"], index=new_login["index"]).update(
+        db_user.login_set.filter(user_agent_hash=Login.hash_user_agent(new_login["agent"]), country=new_login["country"], index=new_login["index"]).update(
             timestamp=new_login["timestamp"],
             latitude=new_login["lat"],
             longitude=new_login["lon"],
@@ -252,7 +482,60 @@ def update_model(db_user: User, new_login: dict):
         )
 
 
-def calc_distance_impossible_travel(db_user: User, prev_login: Login, last_login_user_fields: dict):
+def check_travel_history(db_user: User, login_field: dict, app_config: Config, state: UserDetectionState = None) -> tuple:
+    """Compare the login with the last logins of the user within CERTEGO_BUFFALOGS_TRAVEL_WINDOW_MINUTES from it
+    (before or after, for the logins received out of order) and with the previous one, to alert if any travel is impossible.
+    If the previous login is a plausible origin, the older points are skipped, so each travel is alerted once. The fastest travel is reported.
+    All the logins are checked, also the ones from a known IP: a known IP doesn't make a travel possible
+
+    :param db_user: user from db
+    :type db_user: User object
+    :param login_field: login to check
+    :type login_field: dict
+    :param app_config: buffalogs config object
+    :type app_config: Config
+    :param state: detection data of the user, loaded from the DB if not given
+    :type state: UserDetectionState
+
+    :return: dictionary with info about the impossible travel alert, velocity of travel and the starting point (lat, lon and country)
+    :rtype: dict, int, dict
+    """
+    state = state or UserDetectionState(db_user)
+    history = state.travel_history
+    if not len(history):
+        return {}, 0, {}
+    epoch_us = travel.to_epoch_us(state._parse_timestamp(login_field["timestamp"]))
+    positions, distances, velocities = history.velocities(
+        float(login_field["lat"]),
+        float(login_field["lon"]),
+        epoch_us,
+        settings.CERTEGO_BUFFALOGS_TRAVEL_WINDOW_MINUTES * 60 * 10**6,
+        mode=settings.CERTEGO_BUFFALOGS_TRAVEL_DISTANCE_MODE,
+        distance_accepted=app_config.distance_accepted,
+    )
+    impossible = (distances > app_config.distance_accepted) & (velocities > app_config.vel_accepted)
+    predecessor = history.predecessor(epoch_us)
+    replayed = (positions == predecessor) & (history.epoch_us[positions] == epoch_us) & (distances <= app_config.distance_accepted)
+    if replayed.any():
+        # the same login has already been analyzed (e.g. received again by an overlapping window), so its travels too
+        return {}, 0, {}
+    if (positions == predecessor).any() and not impossible[positions == predecessor].any():
+        # the previous login is a plausible origin: the travels from the older points have already been checked with it, so they aren't alerted again
+        impossible &= positions >= predecessor
+    if not impossible.any():
+        return {}, 0, {}
+    fastest = int(np.argmax(np.where(impossible, velocities, -1)))
+    position = positions[fastest]
+    vel = float(velocities[fastest])
+    start_point = {"lat": float(history.lat[position]), "lon": float(history.lon[position]), "country": history.countries[position]}
+    alert_info = {
+        "alert_name": AlertDetectionType.IMP_TRAVEL.value,
+        "alert_desc": f"{AlertDetectionType.IMP_TRAVEL.label} for User: {db_user.username}, at: {login_field['timestamp']}, from: {login_field['country']}, previous country: {start_point['country']}, distance covered at {int(vel)} Km/h",
+    }
+    return alert_info, int(vel), start_point
+
+
+def calc_distance_impossible_travel(db_user: User, prev_login: Login, last_login_user_fields: dict, app_config: Config = None):
     """Compute distance and velocity to alert if impossible travel occurs
 
     :param db_user: user from db
@@ -261,14 +544,20 @@ def calc_distance_impossible_travel(db_user: User, prev_login: Login, last_login
     :type prev_login: object
     :param last_login_user_fields: dictionary login from elastic
     :type last_login_user_fields: dict
+    :param app_config: buffalogs config object, loaded from the DB if not given
+    :type app_config: Config
 
     :return: dictionary with info about the impossible travel alert and velocity of travel
     :rtype: dict, int
     """
-    app_config = Config.objects.get(id=1)
+    app_config = app_config or get_config()
     alert_info = {}
     vel = 0
-    distance_km = geodesic((prev_login.latitude, prev_login.longitude), (last_login_user_fields["lat"], last_login_user_fields["lon"])).km
+    prev_point = (float(prev_login.latitude), float(prev_login.longitude))
+    last_point = (float(last_login_user_fields["lat"]), float(last_login_user_fields["lon"]))
+    distance_km = float(
+        travel.distances_km(*prev_point, *last_point, mode=settings.CERTEGO_BUFFALOGS_TRAVEL_DISTANCE_MODE, distance_accepted=app_config.distance_accepted)
+    )
 
     if distance_km > app_config.distance_accepted:
         last_timestamp_datetimeObj_aware = timezone.make_aware(datetime.strptime(last_login_user_fields["timestamp"], "%Y-%m-%dT%H:%M:%S.%fZ"))
@@ -0,0 +1,138 @@
+import logging
+import re
+from datetime import datetime, timezone
+
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+
+def month_start(date: datetime) -> datetime:
+    """Return the first instant (UTC) of the month of the date"""
+    date = date.astimezone(timezone.utc) if date.tzinfo is not None else date.replace(tzinfo=timezone.utc)
+    return date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    """Return the first instant of the month `months` after the given one"""
+    year, month_index = divmod(month.month - 1 + months, 12)
+    return month.replace(year=month.year + year, month=month_index + 1)
+
+
+class MonthlyPartitions:
+    """
+    Native PostgreSQL range partitions of a table, one for each month of the partition column (e.g. Alert.created).
+    The partitions are named <table>_p<YYYYMM>. A <table>_default partition keeps the rows outside the monthly partitions,
+    that are moved in their monthly partition when it's created.
+    The retention drops the whole partitions older than the retention date, instead of deleting their rows
+    """
+
+    def __init__(self, model, column: str):
+        self.model = model
+        self.table = model._meta.db_table
+        self.column = column
+        self.default_partition = f"{self.table}_default"
+        self._name_regex = re.compile(rf"^{re.escape(self.table)}_p(\d{{4}})(\d{{2}})$")
+
+    def get_partition_name(self, month: datetime) -> str:
+        return f"{self.table}_p{month:%Y%m}"
+
+    def is_partitioned(self) -> bool:
+        """Return if the table is partitioned (the tables are converted by the 0026_partition_alert migration, on PostgreSQL only)"""
+        if connection.vendor != "postgresql":
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass", [self.table])
+            return cursor.fetchone() is not None
+
+    def get_partitions(self) -> dict:
+        """Return the monthly partitions of the table
+
+        :return: dict with the partition names as keys and the first instant of their month as values, sorted by month
+        :rtype: dict
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid WHERE pg_inherits.inhparent = %s::regclass",
+                [self.table],
+            )
+            names = [row[0] for row in cursor.fetchall()]
+        partitions = {}
+        for name in names:
+            match = self._name_regex.match(name)
+            if match:
+                partitions[name] = datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)
+        return dict(sorted(partitions.items(), key=lambda item: item[1]))
+
+    def create_partition(self, month: datetime) -> bool:
+        """Create the partition of the month, moving in it the rows of the month saved meanwhile in the default partition
+
+        :param month: a date of the month
+        :type month: datetime
+
+        :return: True if the partition has been created, False if it already exists
+        :rtype: bool
+        """
+        start = month_start(month)
+        end = add_months(start, 1)
+        name = self.get_partition_name(start)
+        if name in self.get_partitions():
+            return False
+        quote = connection.ops.quote_name
+        columns = ", ".join(quote(field.column) for field in self.model._meta.concrete_fields)
+        bounds = f"{quote(self.column)} >= '{start.isoformat()}' AND {quote(self.column)} < '{end.isoformat()}'"
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE {quote(name)} (LIKE {quote(self.table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+            # a partition can't be attached if the default partition has rows of its range
+            cursor.execute(f"INSERT INTO {quote(name)} ({columns}) SELECT {columns} FROM {quote(self.default_partition)} WHERE {bounds}")
+            cursor.execute(f"DELETE FROM {quote(self.default_partition)} WHERE {bounds}")
+            cursor.execute(f"ALTER TABLE {quote(self.table)} ATTACH PARTITION {quote(name)} FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')")
+        logger.info(f"Created the partition {name} of the table {self.table}")
+        return True
+
+    def create_partitions(self, months_ahead: int, now: datetime = None) -> list:
+        """Create the partitions from the current month to `months_ahead` months later, if they don't exist
+
+        :param months_ahead: number of the future months whose partitions are created
+        :type months_ahead: int
+        :param now: the current date, timezone.now() if not set
+        :type now: datetime
+
+        :return: the names of the partitions created
+        :rtype: list
+        """
+        current_month = month_start(now or datetime.now(timezone.utc))
+        created = []
+        for months in range(months_ahead + 1):
+            month = add_months(current_month, months)
+            if self.create_partition(month):
+                created.append(self.get_partition_name(month))
+        return created
+
+    def drop_partitions_before(self, date: datetime) -> list:
+        """Detach and drop the partitions whose rows are all older than the date
+
+        :param date: the retention date
+        :type date: datetime
+
+        :return: the names of the partitions dropped
+        :rtype: list
+        """
+        quote = connection.ops.quote_name
+        dropped = []
+        for name, month in self.get_partitions().items():
+            if add_months(month, 1) > date:
+                break
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f"ALTER TABLE {quote(self.table)} DETACH PARTITION {quote(name)}")
+                cursor.execute(f"DROP TABLE {quote(name)}")
+            logger.info(f"Dropped the partition {name} of the table {self.table}")
+            dropped.append(name)
+        return dropped
+
+
+def get_alert_partitions() -> MonthlyPartitions:
+    """Return the monthly partitions of the Alert table, by creation date"""
+    from impossible_travel.models import Alert
+
+    return MonthlyPartitions(Alert, "created")
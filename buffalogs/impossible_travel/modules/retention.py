@@ -0,0 +1,129 @@
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Exists, OuterRef, Q, QuerySet
+from impossible_travel.constants import CheckpointStatus
+from impossible_travel.models import Alert, DetectionCheckpoint, Login, PushedLogin, ShardLogins, User, UsersIP
+
+logger = logging.getLogger(__name__)
+
+
+def get_retention_steps(app_config, now: datetime) -> list:
+    """Return the rows deleted by the retention, in order, as (step name, queryset) tuples.
+    The users are deleted last, after their logins, alerts and IPs, and only if nothing references them anymore
+    (e.g. a login saved by the detection meanwhile)
+
+    :param app_config: the Config with the retention days of each model
+    :type app_config: ConfigSnapshot
+    :param now: the current date
+    :type now: datetime
+
+    :return: the retention steps
+    :rtype: list
+    """
+    user_cutoff = now - timedelta(days=app_config.user_max_days)
+    expired_users = User.objects.filter(updated__lte=user_cutoff)
+    # the windows completed more than a day ago aren't needed anymore, the shards moved to the dead letters are kept (with their staged logins)
+    # as long as the logins, while the ones not completed are kept until they are resumed
+    expired_checkpoints = DetectionCheckpoint.objects.filter(
+        Q(status=CheckpointStatus.COMPLETED, updated__lte=now - timedelta(days=1))
+        | Q(status=CheckpointStatus.DEAD, updated__lte=now - timedelta(days=app_config.login_max_days))
+    )
+    steps = [
+        ("Login", Login.objects.filter(updated__lte=now - timedelta(days=app_config.login_max_days))),
+        ("Alert", Alert.objects.filter(updated__lte=now - timedelta(days=app_config.alert_max_days))),
+        ("UsersIP", UsersIP.objects.filter(updated__lte=now - timedelta(days=app_config.ip_max_days))),
+        ("ShardLogins", ShardLogins.objects.filter(checkpoint__in=expired_checkpoints)),
+        # the failed pushed logins are kept for inspection as long as the logins
+        ("PushedLogin", PushedLogin.objects.filter(failed=True, created__lte=now - timedelta(days=app_config.login_max_days))),
+        ("DetectionCheckpoint", expired_checkpoints),
+    ]
+    related_models = [Login, Alert, UsersIP]
+    steps.extend((f"User.{model.__name__}", model.objects.filter(user__in=expired_users)) for model in related_models)
+    unreferenced_users = expired_users
+    for model in related_models:
+        unreferenced_users = unreferenced_users.exclude(Exists(model.objects.filter(user=OuterRef("pk"))))
+    steps.append(("User", unreferenced_users))
+    return steps
+
+
+class RetentionEngine:
+    """
+    Delete the rows of the retention steps with raw DELETE statements of at most CERTEGO_BUFFALOGS_RETENTION_BATCH_SIZE rows,
+    without loading them (and their cascades) in Python. Each batch is a short transaction, followed by a pause,
+    so the detection writes are not blocked for long.
+    The rows of each step are scanned in primary key order: after CERTEGO_BUFFALOGS_RETENTION_MAX_SECONDS the engine stops,
+    and its state (the last primary key of each step and the completed steps) can be used to resume it from there
+    """
+
+    def __init__(self, state: dict = None):
+        state = state or {}
+        self.last_ids = dict(state.get("last_ids", {}))
+        self.completed = list(state.get("completed", []))
+        self.report = defaultdict(int)
+        self.batch_size = settings.CERTEGO_BUFFALOGS_RETENTION_BATCH_SIZE
+        self.pause = settings.CERTEGO_BUFFALOGS_RETENTION_BATCH_PAUSE
+        self.deadline = time.monotonic() + settings.CERTEGO_BUFFALOGS_RETENTION_MAX_SECONDS
+
+    @property
+    def state(self) -> dict:
+        """The JSON serializable state, to resume the engine"""
+        return {"last_ids": self.last_ids, "completed": self.completed}
+
+    def delete_batch(self, queryset: QuerySet, last_id) -> list:
+        """Delete the first rows of the queryset after the last_id, returning their primary keys"""
+        model = queryset.model
+        pk_column = model._meta.pk.column
+        batch = queryset.filter(pk__gt=last_id).order_by("pk").values("pk")[: self.batch_size]
+        sql, params = batch.query.sql_with_params()
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {quote(model._meta.db_table)} WHERE {quote(pk_column)} IN ({sql}) RETURNING {quote(pk_column)}", params)
+            return [row[0] for row in cursor.fetchall()]
+
+    def delete(self, name: str, queryset: QuerySet) -> bool:
+        """Delete all the rows of the queryset in batches, from the last primary key deleted by the step
+
+        :param name: the name of the step
+        :type name: str
+        :param queryset: the rows to be deleted
+        :type queryset: QuerySet
+
+        :return: True if all the rows have been deleted, False if the engine stopped before
+        :rtype: bool
+        """
+        if name in self.completed:
+            return True
+        while time.monotonic() < self.deadline:
+            deleted_ids = self.delete_batch(queryset, self.last_ids.get(name, 0))
+            if not deleted_ids:
+                self.completed.append(name)
+                self.last_ids.pop(name, None)
+                return True
+            self.report[queryset.model.__name__] += len(deleted_ids)
+            self.last_ids[name] = max(deleted_ids)
+            if len(deleted_ids) < self.batch_size:
+                self.completed.append(name)
+                self.last_ids.pop(name, None)
+                return True
+            time.sleep(self.pause)
+        return False
+
+    def run(self, steps: list) -> bool:
+        """Run the retention steps in order
+
+        :param steps: the (step name, queryset) tuples, as returned by get_retention_steps()
+        :type steps: list
+
+        :return: True if all the steps have been completed, False if the engine stopped before and must be resumed
+        :rtype: bool
+        """
+        for name, queryset in steps:
+            if not self.delete(name, queryset):
+                logger.info(f"Retention stopped at the step {name} after {settings.CERTEGO_BUFFALOGS_RETENTION_MAX_SECONDS} seconds")
+                return False
+        return True
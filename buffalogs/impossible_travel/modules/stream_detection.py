@@ -0,0 +1,132 @@
+import logging
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from impossible_travel.ingestion.base_ingestion import REQUIRED_FIELDS, collapse_logins, compile_mapping
+from impossible_travel.ingestion.stream_ingestion import BaseStreamConsumer
+from impossible_travel.tasks import process_detection_shard
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_event(normalize, event: dict) -> dict | None:
+    """Normalize a login event with the compiled mapping
+
+    :param normalize: the normalization function returned by compile_mapping
+    :type normalize: Callable[[dict], dict]
+    :param event: the raw login event
+    :type event: dict
+
+    :return: the normalized login, None if the username or one of the fields required by the detection is missing
+    :rtype: dict
+    """
+    login = normalize(event)
+    username = login.get("username")
+    if username and isinstance(username, str) and all(login.get(field) for field in REQUIRED_FIELDS):
+        return login
+    return None
+
+
+class StreamDetectionWorker:
+    """Run the detection on the login events read from a stream, in micro-batches.
+    Each batch is grouped by user, keeping the order of the stream, and analyzed by the same code of the BuffalogsDetectionShardTask.
+    The batch is committed on the stream only after that its detection results have been saved,
+    so if the worker crashes the events are delivered again instead of being lost.
+    If the detection of a batch fails, its users are analyzed one by one: the logins of the users that still fail are logged and committed anyway,
+    so a bad event doesn't stop the worker, unless the DB isn't reachable (then the error is raised and the batch is delivered again)
+    """
+
+    def __init__(self, consumer: BaseStreamConsumer, mapping: dict, batch_size: int = None, batch_timeout: float = None):
+        self.consumer = consumer
+        self.batch_size = batch_size or settings.CERTEGO_BUFFALOGS_STREAM_BATCH_SIZE
+        self.batch_timeout = batch_timeout if batch_timeout is not None else settings.CERTEGO_BUFFALOGS_STREAM_BATCH_TIMEOUT
+        self._normalize = compile_mapping(mapping)
+        self.running = False
+
+    def run(self, max_batches: int = None) -> int:
+        """Consume the stream until stop() is called or max_batches batches have been processed
+
+        :param max_batches: max number of batches processed, unlimited if None
+        :type max_batches: int
+
+        :return: the number of logins analyzed
+        :rtype: int
+        """
+        self.running = True
+        batches = 0
+        logins_count = 0
+        while self.running and (max_batches is None or batches < max_batches):
+            messages = self.consumer.poll(self.batch_size, self.batch_timeout)
+            if not messages:
+                continue
+            logins_count += self.process_batch(messages)
+            batches += 1
+        return logins_count
+
+    def stop(self):
+        """Stop the worker after the batch in progress"""
+        self.running = False
+
+    def process_batch(self, messages: list) -> int:
+        """Run the detection on a batch of events and commit them
+
+        :param messages: the events read from the stream
+        :type messages: list of StreamMessage
+
+        :return: the number of logins analyzed
+        :rtype: int
+        """
+        logins_by_user = self.group_logins(messages)
+        if logins_by_user:
+            try:
+                process_detection_shard(logins_by_user)
+            except Exception as e:
+                logger.error(f"Detection failed on the batch of {len(messages)} events, analyzing its {len(logins_by_user)} users one by one: {e}")
+                self.process_users(logins_by_user)
+        self.consumer.commit(messages)
+        logins_count = sum(login.get("count", 1) for user_logins in logins_by_user.values() for login in user_logins)
+        logger.info(f"Analyzed {logins_count} logins of {len(logins_by_user)} users from {len(messages)} events")
+        return logins_count
+
+    def process_users(self, logins_by_user: dict):
+        """Run the detection on each user on its own, skipping the users whose detection fails
+
+        :param logins_by_user: the normalized logins of each user of the batch
+        :type logins_by_user: dict
+        """
+        for username, user_logins in logins_by_user.items():
+            try:
+                process_detection_shard({username: user_logins})
+            except Exception as e:
+                if not self.database_available():
+                    # the error isn't caused by the events, so they aren't skipped
+                    raise
+                logger.error(f"Detection failed on the logins of the user {username}, skipped: {[login['id'] for login in user_logins]}: {e}")
+
+    @staticmethod
+    def database_available() -> bool:
+        """Return True if the DB can be queried"""
+        try:
+            connection.ensure_connection()
+            return connection.is_usable()
+        except DatabaseError:
+            return False
+
+    def group_logins(self, messages: list) -> dict:
+        """Normalize the events and group them by lowercase username, in the order of the stream.
+        The events not valid or without the fields required by the detection are skipped and the bursts of identical logins are collapsed
+
+        :param messages: the events read from the stream
+        :type messages: list of StreamMessage
+
+        :return: dict with the lowercase usernames as keys and the list of their normalized logins as values
+        :rtype: dict
+        """
+        normalize = self._normalize
+        logins_by_user = {}
+        for message in messages:
+            login = normalize_event(normalize, message.value) if message.value is not None else None
+            if login is not None:
+                logins_by_user.setdefault(login["username"].lower(), []).append(login)
+        max_gap_seconds = settings.CERTEGO_BUFFALOGS_COLLAPSE_LOGINS_SECONDS
+        return {username: collapse_logins(user_logins, max_gap_seconds) for username, user_logins in logins_by_user.items()}
@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from geopy.distance import geodesic
+
+EARTH_RADIUS_KM = 6371.0088
+# max relative error of the spherical (haversine) distance compared to the WGS-84 ellipsoid (geodesic) is about 0.56%
+HAVERSINE_MAX_ERROR = 0.01
+
+EXACT_MODE = "exact"
+FAST_MODE = "fast"
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Vectorized great-circle distance (in Km) between the points (lat1, lon1) and (lat2, lon2)"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=np.float64)) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def distances_km(lat1, lon1, lat2, lon2, mode: str = EXACT_MODE, distance_accepted: float = None) -> np.ndarray:
+    """Distances (in Km) between the couples of points.
+
+    :param mode: "fast" uses only the haversine formula, "exact" the geodesic one on the WGS-84 ellipsoid (as geopy)
+    :type mode: str
+    :param distance_accepted: in "exact" mode, the distances surely lower than it are not refined with the geodesic, keeping the haversine value
+    :type distance_accepted: float
+
+    :return: the distances in Km
+    :rtype: np.ndarray
+    """
+    # the ufuncs return numpy scalars for scalar inputs, while an array is needed to refine the values in place
+    distances = np.array(haversine_km(lat1, lon1, lat2, lon2), dtype=np.float64)
+    if mode == FAST_MODE:
+        return distances
+    if mode != EXACT_MODE:
+        raise ValueError(f"Travel distance mode not supported: {mode}")
+    lat1, lon1, lat2, lon2 = (np.broadcast_to(np.asarray(value, dtype=np.float64), distances.shape) for value in (lat1, lon1, lat2, lon2))
+    to_refine = np.ones(distances.shape, dtype=bool)
+    if distance_accepted is not None:
+        # the geodesic can't be higher than the distance_accepted if the haversine is below it by more than the max error
+        to_refine = distances >= distance_accepted * (1 - HAVERSINE_MAX_ERROR)
+    for i in np.flatnonzero(to_refine):
+        distances.flat[i] = geodesic((lat1.flat[i], lon1.flat[i]), (lat2.flat[i], lon2.flat[i])).km
+    return distances
+
+
+def velocities_kmh(distances: np.ndarray, elapsed_us: np.ndarray) -> np.ndarray:
+    """Velocities (in Km/h) given the distances and the elapsed times in microseconds.
+    A zero elapsed time is considered as 0.001 hours, as done by the impossible travel detection"""
+    hours = np.asarray(elapsed_us, dtype=np.float64) / 1e6 / 3600
+    hours = np.where(hours == 0, 0.001, hours)
+    return distances / hours
+
+
+def travel_kernel(lat, lon, epoch_us, mode: str = EXACT_MODE, distance_accepted: float = None) -> tuple:
+    """Compute in a single pass the distances and the velocities between each couple of consecutive logins
+
+    :param lat: latitudes of the logins, sorted by time
+    :type lat: array-like
+    :param lon: longitudes of the logins, sorted by time
+    :type lon: array-like
+    :param epoch_us: timestamps of the logins, in microseconds from the epoch
+    :type epoch_us: array-like
+    :param mode: "exact" (geodesic) or "fast" (haversine) distance
+    :type mode: str
+    :param distance_accepted: in "exact" mode, the distances below it are kept with the haversine approximation
+    :type distance_accepted: float
+
+    :return: the distances (Km) and the velocities (Km/h), with one element less than the logins
+    :rtype: tuple(np.ndarray, np.ndarray)
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    epoch_us = np.asarray(epoch_us, dtype=np.int64)
+    distances = distances_km(lat[:-1], lon[:-1], lat[1:], lon[1:], mode=mode, distance_accepted=distance_accepted)
+    return distances, velocities_kmh(distances, np.diff(epoch_us))
+
+
+def to_epoch_us(date: datetime) -> int:
+    """Microseconds from the epoch of an aware datetime"""
+    return (date - EPOCH) // timedelta(microseconds=1)
+
+
+class TravelHistory:
+    """
+    Last `size` geo-points of a user, sorted by time, kept in preallocated numpy arrays (not ORM objects).
+    Each new login is compared in a single vectorized pass with all the points within a time window around it
+    and with its chronological predecessor, so a chain of hops (A->B->C) and the logins received out of order
+    are compared with the right points
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.count = 0
+        self.lat = np.empty(size, dtype=np.float64)
+        self.lon = np.empty(size, dtype=np.float64)
+        self.epoch_us = np.empty(size, dtype=np.int64)
+        self.countries = np.empty(size, dtype=object)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, lat: float, lon: float, epoch_us: int, country: str):
+        """Insert the point in time order. When the buffer is full the oldest point is discarded (or the new one, if it's older than all the others)"""
+        arrays = (self.lat, self.lon, self.epoch_us, self.countries)
+        position = int(np.searchsorted(self.epoch_us[: self.count], epoch_us, side="right"))
+        if self.count == self.size:
+            if position == 0:
+                return
+            position -= 1
+            for array in arrays:
+                array[:position] = array[1 : position + 1].copy()
+        else:
+            for array in arrays:
+                array[position + 1 : self.count + 1] = array[position : self.count].copy()
+            self.count += 1
+        self.lat[position], self.lon[position], self.epoch_us[position], self.countries[position] = lat, lon, epoch_us, country
+
+    def predecessor(self, epoch_us: int) -> int:
+        """Position of the last point not after epoch_us, -1 if there isn't any"""
+        return int(np.searchsorted(self.epoch_us[: self.count], epoch_us, side="right")) - 1
+
+    def neighbours(self, epoch_us: int, window_us: int) -> np.ndarray:
+        """Positions of the points within window_us from epoch_us (before or after it), plus the last point not after it"""
+        selected = np.abs(self.epoch_us[: self.count] - epoch_us) <= window_us
+        predecessor = self.predecessor(epoch_us)
+        if predecessor >= 0:
+            selected[predecessor] = True
+        return np.flatnonzero(selected)
+
+    def velocities(self, lat: float, lon: float, epoch_us: int, window_us: int, mode: str = EXACT_MODE, distance_accepted: float = None) -> tuple:
+        """Compute the distances and the velocities between the new point and its neighbours in the history
+
+        :param lat: latitude of the new login
+        :type lat: float
+        :param lon: longitude of the new login
+        :type lon: float
+        :param epoch_us: timestamp of the new login, in microseconds from the epoch
+        :type epoch_us: int
+        :param window_us: max time distance (microseconds) of the points compared, besides the chronological predecessor
+        :type window_us: int
+        :param mode: "exact" (geodesic) or "fast" (haversine) distance
+        :type mode: str
+        :param distance_accepted: in "exact" mode, the distances below it are kept with the haversine approximation
+        :type distance_accepted: float
+
+        :return: the positions of the points compared, their distances (Km) and velocities (Km/h)
+        :rtype: tuple(np.ndarray, np.ndarray, np.ndarray)
+        """
+        positions = self.neighbours(epoch_us, window_us)
+        distances = distances_km(self.lat[positions], self.lon[positions], lat, lon, mode=mode, distance_accepted=distance_accepted)
+        return positions, distances, velocities_kmh(distances, np.abs(self.epoch_us[positions] - epoch_us))
@@ -0,0 +1,80 @@
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+
+from django.conf import settings
+from ua_parser import parse
+
+UNKNOWN = "Other"
+
+
+@dataclass(frozen=True)
+class UserAgentInfo:
+    """Compact record of a parsed user-agent"""
+
+    os_family: str
+    device_family: str
+    browser: str
+    is_mobile: bool
+
+    @property
+    def label(self) -> str:
+        """Short description of the device, used to group the user-agents in the analytics"""
+        return f"{self.browser} on {self.os_family}"
+
+
+@lru_cache(maxsize=settings.CERTEGO_BUFFALOGS_USER_AGENT_CACHE_SIZE)
+def parse_user_agent(agent: str) -> UserAgentInfo:
+    """Parse the user-agent string, caching the results because the same user-agents are repeated in the most of the logins
+
+    :param agent: the user-agent string
+    :type agent: str
+
+    :return: the parsed user-agent
+    :rtype: UserAgentInfo
+    """
+    ua_parsed = parse(agent or "")
+    os_family = ua_parsed.os.family if ua_parsed.os else UNKNOWN
+    return UserAgentInfo(
+        os_family=os_family,
+        device_family=ua_parsed.device.family if ua_parsed.device else UNKNOWN,
+        browser=ua_parsed.user_agent.family if ua_parsed.user_agent else UNKNOWN,
+        is_mobile=bool(ua_parsed.os) and os_family in settings.CERTEGO_BUFFALOGS_MOBILE_DEVICES,
+    )
+
+
+def group_user_agents(agents_count: dict) -> dict:
+    """Aggregate the counts of raw user-agent strings by their parsed os, browser and device
+
+    :param agents_count: count of the logins for each user-agent string
+    :type agents_count: dict
+
+    :return: the counts grouped by "os", "browser", "device", "label" and the number of "mobile" logins
+    :rtype: dict
+    """
+    grouped = {"os": Counter(), "browser": Counter(), "device": Counter(), "label": Counter()}
+    mobile = 0
+    for agent, count in agents_count.items():
+        ua_info = parse_user_agent(agent)
+        grouped["os"][ua_info.os_family] += count
+        grouped["browser"][ua_info.browser] += count
+        grouped["device"][ua_info.device_family] += count
+        grouped["label"][ua_info.label] += count
+        if ua_info.is_mobile:
+            mobile += count
+    result = {key: dict(counter) for key, counter in grouped.items()}
+    result["mobile"] = mobile
+    return result
+
+
+def cache_stats() -> dict:
+    """Return the hits and misses counters of the user-agents cache, useful to size it"""
+    info = parse_user_agent.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "maxsize": info.maxsize,
+        "currsize": info.currsize,
+        "hit_ratio": round(info.hits / lookups, 4) if lookups else 0.0,
+    }
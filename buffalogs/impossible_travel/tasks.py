@@ -1,27 +1,37 @@
+import zlib
 from collections import defaultdict
 from datetime import timedelta
 
-from celery import shared_task
+from celery import chain, chord, group, shared_task
 from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
 from django.utils import timezone
 from impossible_travel.alerting.alert_factory import AlertFactory
-from impossible_travel.ingestion.ingestion_factory import IngestionFactory
-from impossible_travel.models import Alert, Config, Login, TaskSettings, User
-from impossible_travel.modules import detection
+from impossible_travel.constants import CheckpointStatus
+from impossible_travel.ingestion.base_ingestion import collapse_logins
+from impossible_travel.ingestion.ingestion_factory import get_ingestion
+from impossible_travel.models import Alert, DetectionCheckpoint, PushedLogin, ShardLogins, TaskSettings, User
+from impossible_travel.modules import detection, user_agent
+from impossible_travel.modules.config_cache import get_config
+from impossible_travel.modules.partitions import get_alert_partitions
+from impossible_travel.modules.retention import RetentionEngine, get_retention_steps
 
 logger = get_task_logger(__name__)
 
 
-def delete_old_data(model, days):
-    """Helper function to delete old data,takes model and days as args"""
-    now = timezone.now()
-    delete_time = now - timedelta(days=days)
-    model.objects.filter(updated__lte=delete_time).delete()
+@shared_task(name="BuffalogsCleanModelsPeriodicallyTask")
+def clean_models_periodically(retention_state: dict = None) -> dict:
+    """Delete old data in the models, in batches.
+    If the retention isn't completed within CERTEGO_BUFFALOGS_RETENTION_MAX_SECONDS, it's resumed by a new task queued after the pending ones
 
+    :param retention_state: the state of the RetentionEngine of the previous run, to resume it
+    :type retention_state: dict
 
-@shared_task(name="BuffalogsCleanModelsPeriodicallyTask")
-def clean_models_periodically():
-    """Delete old data in the models"""
+    :return: the number of rows deleted for each model
+    :rtype: dict
+    """
     now = timezone.now()
     task_settings, _ = TaskSettings.objects.get_or_create(
         task_name="BuffalogsCleanModelsPeriodicallyTask",
@@ -30,23 +40,88 @@ def clean_models_periodically():
             "end_date": now,
         },
     )
-    app_config, _ = Config.objects.get_or_create(id=1)
-
-    delete_old_data(User, app_config.user_max_days)
-    delete_old_data(Login, app_config.login_max_days)
-    delete_old_data(Alert, app_config.alert_max_days)
+    app_config = get_config()
+
+    if retention_state is None:
+        alert_partitions = get_alert_partitions()
+        if alert_partitions.is_partitioned():
+            # the months of alerts older than the retention are dropped as a whole, only the rows of the last month are deleted in batches
+            alert_partitions.drop_partitions_before(now - timedelta(days=app_config.alert_max_days))
+            alert_partitions.create_partitions(settings.CERTEGO_BUFFALOGS_PARTITIONS_AHEAD_MONTHS)
+    retention = RetentionEngine(retention_state)
+    completed = retention.run(get_retention_steps(app_config, now))
+    report = dict(retention.report)
+    logger.info(f"Rows deleted by the retention: {report}")
+    if not completed:
+        clean_models_periodically.apply_async(kwargs={"retention_state": retention.state})
 
     task_settings.start_date = task_settings.end_date
     task_settings.end_date = timezone.now()
     task_settings.save()
+    return report
+
+
+def get_detection_shard(username: str, shards: int) -> int:
+    """Return the detection shard of the user.
+    It's based on a stable hash of the username (the builtin hash() is salted per process),
+    so all the logins of a user are always processed by the same shard, in order
+
+    :param username: the username (lowercase)
+    :type username: str
+    :param shards: the number of shards
+    :type shards: int
+
+    :return: the index of the shard, from 0 to shards-1
+    :rtype: int
+    """
+    return zlib.crc32(username.encode("utf-8")) % shards
+
+
+def get_pending_windows() -> list:
+    """Return the time windows to resume: the ones whose logins couldn't be extracted or whose detection failed on a shard,
+    and the ones with shards not completed, abandoned for more than CERTEGO_BUFFALOGS_CHECKPOINT_RESUME_MINUTES (e.g. after a worker crash).
+    The shards moved to the dead letters aren't resumed
+
+    :return: the (start_date, end_date) of the windows to resume, in chronological order
+    :rtype: list
+    """
+    abandoned_date = timezone.now() - timedelta(minutes=settings.CERTEGO_BUFFALOGS_CHECKPOINT_RESUME_MINUTES)
+    pending_checkpoints = DetectionCheckpoint.objects.filter(
+        Q(status=CheckpointStatus.FAILED) | Q(status=CheckpointStatus.PENDING, updated__lte=abandoned_date)
+    )
+    return list(pending_checkpoints.order_by("start_date", "end_date").values_list("start_date", "end_date").distinct())
+
+
+def split_windows(date_ranges: list, lanes: int) -> list:
+    """Split the time windows in at most `lanes` groups of consecutive windows, with the same size (+/- 1)
+
+    :param date_ranges: the (start_date, end_date) of the windows, in chronological order
+    :type date_ranges: list
+    :param lanes: the max number of groups
+    :type lanes: int
+
+    :return: the list of the groups of windows
+    :rtype: list
+    """
+    lanes = max(min(lanes, len(date_ranges)), 1)
+    size, remainder = divmod(len(date_ranges), lanes)
+    result = []
+    start = 0
+    for lane in range(lanes):
+        end = start + size + (1 if lane < remainder else 0)
+        result.append(date_ranges[start:end])
+        start = end
+    return result
 
 
 @shared_task(name="BuffalogsProcessLogsTask")
 def process_logs(start_date=None, end_date=None):
-    """Set the datetime range within which the users must be considered and start the detection"""
-    ingestion_factory = IngestionFactory()
-    ingestion = ingestion_factory.get_ingestion_class()
+    """Set the datetime ranges within which the users must be considered and start the detection.
+    Each time range is processed by a BuffalogsProcessWindowTask: the windows with unfinished shards are resumed first,
+    then at most CERTEGO_BUFFALOGS_PROCESS_MAX_WINDOWS new windows are scheduled, in CERTEGO_BUFFALOGS_PROCESS_CONCURRENT_WINDOWS lanes.
+    A time range passed explicitly (e.g. by the impossible_travel command) is analyzed again on all the shards, even if it has already been completed"""
     date_ranges = []
+    rerun = False
     now = timezone.now()
     process_task, _ = TaskSettings.objects.get_or_create(
         task_name=process_logs.__name__,
@@ -57,49 +132,294 @@ def process_logs(start_date=None, end_date=None):
     )
 
     if start_date and end_date:
-        date_ranges.append((start_date, end_date))
+        date_ranges.append(tuple(date if timezone.is_aware(date) else timezone.make_aware(date) for date in (start_date, end_date)))
+        rerun = True
     else:
-
-        if (now - process_task.end_date).days < 1:
+        date_ranges.extend(get_pending_windows())
+        # the TaskSettings are advanced by the BuffalogsFinalizeWindowTask only up to the first window not completed,
+        # while the windows already started after it have their checkpoints, so they are skipped (they are resumed by get_pending_windows)
+        last_end_date = process_task.end_date
+        started_dates = set(DetectionCheckpoint.objects.filter(start_date__gte=last_end_date).values_list("start_date", flat=True))
+        window = timedelta(minutes=settings.CERTEGO_BUFFALOGS_PROCESS_WINDOW_MINUTES)
+        if (now - last_end_date).days < 1:
             # Recovering old data avoiding task time limit
-            for _ in range(6):
-                start_date = process_task.end_date
-                end_date = start_date + timedelta(minutes=30)
-                if end_date < now:
+            new_windows = 0
+            while new_windows < settings.CERTEGO_BUFFALOGS_PROCESS_MAX_WINDOWS:
+                start_date = last_end_date
+                end_date = start_date + window
+                if end_date >= now:
+                    break
+                if start_date not in started_dates:
                     date_ranges.append((start_date, end_date))
-                    process_task.end_date = end_date
+                    new_windows += 1
+                last_end_date = end_date
         else:
-            logger.info(f"Data lost from {process_task.end_date} to now")
+            logger.info(f"Data lost from {last_end_date} to now")
             end_date = now - timedelta(minutes=1)
-            start_date = end_date - timedelta(minutes=30)
+            start_date = end_date - window
             date_ranges.append((start_date, end_date))
-            process_task.end_date = end_date
 
     if date_ranges:
+        # in each lane, the time ranges are processed in order, so the logins of each user are analyzed chronologically
+        lanes = [
+            chain(process_window.si(start_date, end_date, rerun=rerun) for start_date, end_date in lane)
+            for lane in split_windows(date_ranges, settings.CERTEGO_BUFFALOGS_PROCESS_CONCURRENT_WINDOWS)
+        ]
+        if process_logs.request.called_directly:
+            # manual execution (e.g. impossible_travel command): run the detection synchronously
+            for lane in lanes:
+                try:
+                    lane.apply()
+                except Exception:
+                    # the lane is stopped at the failed window, which has logged the error and is resumed by the next run
+                    continue
+        else:
+            (lanes[0] if len(lanes) == 1 else group(lanes)).apply_async()
 
-        # get the users that logged into the system in those time ranges
-        for start_date, end_date in date_ranges:
-            process_task.start_date = start_date
-            process_task.end_date = end_date
-            process_task.save()
-
-            usernames_list = ingestion.process_users(start_date, end_date)
-
-            # for each user returned, get the related logins
-            for username in usernames_list:
-                username = username.lower()
-                user_logins = ingestion.process_user_logins(start_date, end_date, username)
 
-                parsed_logins = ingestion.normalize_fields(logins=user_logins)
+def get_window_checkpoints(start_date, end_date, rerun: bool = False) -> dict:
+    """Return the checkpoints of the time window, creating the pending ones for all the shards if the window has never been started.
+    A window resumed keeps the number of shards of its first run, because the users are assigned to the shards by that number
 
-                logger.info(f"Got {len(parsed_logins)} actual useful logins for the user {username}")
+    :param start_date: start of the time window
+    :type start_date: datetime
+    :param end_date: end of the time window
+    :type end_date: datetime
+    :param rerun: if True, the shards already completed are set as pending again, to analyze the whole window again
+    :type rerun: bool
 
-                # if valid logins have been found, add the user into the DB and start the detection
-                if parsed_logins:
-                    db_user, created = User.objects.get_or_create(username=username)
-                    # Saving user anyway to update updated_at field in order to take track of the recent users seen
-                    db_user.save()
-                    detection.check_fields(db_user=db_user, fields=parsed_logins)
+    :return: the DetectionCheckpoint of each shard
+    :rtype: dict
+    """
+    checkpoints = DetectionCheckpoint.objects.filter(start_date=start_date, end_date=end_date)
+    if not checkpoints.exists():
+        shards_count = max(settings.CERTEGO_BUFFALOGS_DETECTION_SHARDS, 1)
+        DetectionCheckpoint.objects.bulk_create(
+            [DetectionCheckpoint(start_date=start_date, end_date=end_date, shard=shard, shards_count=shards_count) for shard in range(shards_count)],
+            ignore_conflicts=True,
+        )
+    elif rerun:
+        checkpoints.update(status=CheckpointStatus.PENDING, users=0, attempts=0, updated=timezone.now())
+    else:
+        # mark the window as in progress again, so it isn't resumed by another run at the same time
+        checkpoints.exclude(status__in=CheckpointStatus.terminal()).update(status=CheckpointStatus.PENDING, updated=timezone.now())
+    return {checkpoint.shard: checkpoint for checkpoint in checkpoints.all()}
+
+
+@shared_task(bind=True, name="BuffalogsProcessWindowTask")
+def process_window(self, start_date, end_date, rerun: bool = False):
+    """Get the logins of the time range and fan out the detection on the shards not completed yet, collected by a chord.
+    If the logins can't be extracted or normalized, the checkpoints are set as failed and the error is raised: the next windows of the chain aren't started,
+    the TaskSettings aren't advanced and the window is resumed first by the next run.
+    Like the detection failures, the extraction failures count as attempts of the shards: after CERTEGO_BUFFALOGS_CHECKPOINT_MAX_ATTEMPTS
+    they are moved to the dead letters, so the window is finalized and the TaskSettings can be advanced past it"""
+    checkpoints = get_window_checkpoints(start_date, end_date, rerun=rerun)
+    pending_shards = {shard for shard, checkpoint in checkpoints.items() if checkpoint.status not in CheckpointStatus.terminal()}
+    if not pending_shards:
+        return finalize_window([], start_date, end_date)
+    if len(pending_shards) < len(checkpoints):
+        logger.info(f"Resuming the detection from {start_date} to {end_date} on the shards: {sorted(pending_shards)}")
+
+    ingestion = get_ingestion()
+
+    shards_count = next(iter(checkpoints.values())).shards_count
+    shards = defaultdict(dict)
+    try:
+        # get all the logins of the time range with a single bulk query, grouped by user
+        logins_by_user = ingestion.process_logins_bulk(start_date, end_date)
+        for username, user_logins in logins_by_user.items():
+            username = username.lower()
+            shard = get_detection_shard(username, shards_count)
+            if shard not in pending_shards:
+                # the user has already been analyzed by a completed shard
+                continue
+            # the bursts of identical logins are analyzed once
+            parsed_logins = collapse_logins(ingestion.normalize_fields(logins=user_logins), settings.CERTEGO_BUFFALOGS_COLLAPSE_LOGINS_SECONDS)
+
+            logger.info(f"Got {len(parsed_logins)} actual useful logins for the user {username}")
+
+            # if valid logins have been found, send the user to its detection shard
+            if parsed_logins:
+                shards[shard].setdefault(username, []).extend(parsed_logins)
+    except Exception as e:
+        if not fail_window_shards(start_date, end_date, pending_shards, e, stage="Logins extraction"):
+            raise
+        return finalize_window([], start_date, end_date)
+
+    # the shards without users are already completed
+    DetectionCheckpoint.objects.filter(start_date=start_date, end_date=end_date, shard__in=pending_shards - shards.keys()).update(
+        status=CheckpointStatus.COMPLETED, updated=timezone.now()
+    )
+    if not shards:
+        return finalize_window([], start_date, end_date)
+
+    # the logins are staged in the DB, so the chord messages (and their results) carry just the window and the shard
+    ShardLogins.objects.filter(checkpoint__in=[checkpoints[shard] for shard in shards]).delete()
+    ShardLogins.objects.bulk_create(
+        [
+            ShardLogins(checkpoint=checkpoints[shard], username=username, logins=user_logins)
+            for shard, shard_logins in shards.items()
+            for username, user_logins in shard_logins.items()
+        ],
+        batch_size=1000,
+    )
+    # the TaskSettings are updated only if all the shards succeed
+    detection_chord = chord(
+        (process_detection_shard.si(start_date=start_date, end_date=end_date, shard=shard) for shard in shards),
+        finalize_window.s(start_date, end_date),
+    )
+    return self.replace(detection_chord)
+
+
+@shared_task(name="BuffalogsDetectionShardTask")
+def process_detection_shard(logins_by_user: dict = None, start_date=None, end_date=None, shard: int = None) -> int:
+    """Run the detection for the users of a shard.
+    If the detection of a window shard fails, its checkpoint is set as failed and the error is raised, so the window is resumed by the next run.
+    After CERTEGO_BUFFALOGS_CHECKPOINT_MAX_ATTEMPTS failures the checkpoint is moved to the dead letters instead, and the shard is returned as analyzed,
+    so the TaskSettings can be advanced past the window
+
+    :param logins_by_user: the normalized logins of each user of the shard. If not set, the logins staged for the shard of the window are read from the DB
+    :type logins_by_user: dict
+    :param start_date: start of the time window, to checkpoint the shard
+    :type start_date: datetime
+    :param end_date: end of the time window, to checkpoint the shard
+    :type end_date: datetime
+    :param shard: index of the shard, to checkpoint it
+    :type shard: int
+
+    :return: the number of users processed
+    :rtype: int
+    """
+    staged_logins = None
+    if logins_by_user is None:
+        staged_logins = ShardLogins.objects.filter(checkpoint__start_date=start_date, checkpoint__end_date=end_date, checkpoint__shard=shard)
+        logins_by_user = dict(staged_logins.values_list("username", "logins").iterator())
+    try:
+        # all the rows produced by the detection of the shard are saved in bulk, in a single transaction
+        writer = detection.DetectionBatchWriter()
+        for username, parsed_logins in logins_by_user.items():
+            db_user, created = User.objects.get_or_create(username=username)
+            # Saving user anyway to update updated_at field in order to take track of the recent users seen
+            writer.update_user(db_user)
+            detection.check_fields(db_user=db_user, fields=parsed_logins, writer=writer)
+        with transaction.atomic():
+            writer.flush()
+            if shard is not None:
+                # the checkpoint is saved with the detection results, so a shard is never analyzed twice
+                DetectionCheckpoint.objects.filter(start_date=start_date, end_date=end_date, shard=shard).update(
+                    status=CheckpointStatus.COMPLETED, users=len(logins_by_user), updated=timezone.now()
+                )
+            if staged_logins is not None:
+                staged_logins.delete()
+    except Exception as e:
+        if shard is None or not fail_window_shards(start_date, end_date, [shard], e):
+            raise
+        return 0
+    logger.info(f"User-agents parsing cache: {user_agent.cache_stats()}")
+    return len(logins_by_user)
+
+
+def fail_window_shards(start_date, end_date, shards, error: Exception, stage: str = "Detection") -> bool:
+    """Count a failed attempt of the shards of a time window. The checkpoints are set as failed, to be resumed by the next run,
+    or they are moved to the dead letters after CERTEGO_BUFFALOGS_CHECKPOINT_MAX_ATTEMPTS failures. Their staged logins are kept, to be inspected
+
+    :param start_date: start of the time window
+    :type start_date: datetime
+    :param end_date: end of the time window
+    :type end_date: datetime
+    :param shards: indexes of the shards failed
+    :type shards: Iterable[int]
+    :param error: the error raised by the extraction or by the detection
+    :type error: Exception
+    :param stage: the step of the window that failed, for the logs
+    :type stage: str
+
+    :return: True if all the checkpoints have been moved to the dead letters
+    :rtype: bool
+    """
+    checkpoints = DetectionCheckpoint.objects.filter(start_date=start_date, end_date=end_date, shard__in=list(shards))
+    checkpoints.update(status=CheckpointStatus.FAILED, attempts=F("attempts") + 1, updated=timezone.now())
+    attempts = dict(checkpoints.values_list("shard", "attempts"))
+    dead_shards = sorted(shard for shard, shard_attempts in attempts.items() if shard_attempts >= settings.CERTEGO_BUFFALOGS_CHECKPOINT_MAX_ATTEMPTS)
+    failed_shards = sorted(attempts.keys() - set(dead_shards))
+    if failed_shards:
+        logger.error(
+            f"{stage} failed on the shards {failed_shards} from {start_date} to {end_date} "
+            f"(attempts {[attempts[shard] for shard in failed_shards]}), the window will be resumed: {error}"
+        )
+    if dead_shards:
+        checkpoints.filter(shard__in=dead_shards).update(status=CheckpointStatus.DEAD)
+        logger.critical(
+            f"{stage} failed {settings.CERTEGO_BUFFALOGS_CHECKPOINT_MAX_ATTEMPTS} times on the shards {dead_shards} from {start_date} to {end_date}, "
+            f"the shards are moved to the dead letters and skipped: {error}"
+        )
+    return not failed_shards
+
+
+@shared_task(name="BuffalogsDrainPushedLoginsTask")
+def drain_pushed_logins() -> int:
+    """Run the detection on the logins pushed by the ingestion push API, in micro-batches.
+    Each batch is locked, analyzed and deleted in a single transaction: the concurrent runs wait for it,
+    so the logins are analyzed only once and the logins of each user in order.
+    If the detection of a batch fails, its users are analyzed one by one, each one in a savepoint:
+    the logins of the users that still fail are marked as failed, with the error, and aren't drained anymore
+
+    :return: the number of logins analyzed
+    :rtype: int
+    """
+    drained = 0
+    for _ in range(settings.CERTEGO_BUFFALOGS_PUSH_DRAIN_MAX_BATCHES):
+        with transaction.atomic():
+            pending_logins = PushedLogin.objects.select_for_update().filter(failed=False).order_by("pk")
+            pushed_logins = list(pending_logins[: settings.CERTEGO_BUFFALOGS_PUSH_DRAIN_BATCH_SIZE])
+            if not pushed_logins:
+                break
+            logins_by_user = defaultdict(list)
+            pks_by_user = defaultdict(list)
+            # the logins of a user pushed by different requests could be out of order
+            for pushed_login in sorted(pushed_logins, key=lambda pushed_login: (pushed_login.timestamp, pushed_login.pk)):
+                logins_by_user[pushed_login.username].append(pushed_login.login)
+                pks_by_user[pushed_login.username].append(pushed_login.pk)
+            logins_by_user = {
+                username: collapse_logins(user_logins, settings.CERTEGO_BUFFALOGS_COLLAPSE_LOGINS_SECONDS) for username, user_logins in logins_by_user.items()
+            }
+            try:
+                with transaction.atomic():
+                    process_detection_shard(logins_by_user)
+            except Exception as e:
+                logger.error(f"Detection failed on the batch of {len(pushed_logins)} pushed logins, analyzing its {len(logins_by_user)} users one by one: {e}")
+                for username, user_logins in logins_by_user.items():
+                    try:
+                        with transaction.atomic():
+                            process_detection_shard({username: user_logins})
+                    except Exception as user_error:
+                        logger.error(f"Detection failed on the pushed logins of the user {username}, marked as failed: {user_error}")
+                        PushedLogin.objects.filter(pk__in=pks_by_user.pop(username)).update(failed=True, error=str(user_error))
+            PushedLogin.objects.filter(pk__in=[pk for user_pks in pks_by_user.values() for pk in user_pks]).delete()
+        drained += len(pushed_logins)
+    logger.info(f"Analyzed {drained} pushed logins")
+    return drained
+
+
+@shared_task(name="BuffalogsFinalizeWindowTask")
+def finalize_window(shard_results: list, start_date, end_date):
+    """Advance the BuffalogsProcessLogsTask TaskSettings once the detection of the time range is completed.
+    With concurrent windows they can be completed out of order: the TaskSettings are never moved back nor past a window not completed yet,
+    and they are advanced also over the next windows already completed by the other lanes. The shards moved to the dead letters count as completed"""
+    logger.info(f"Detection completed on {sum(shard_results)} users from {start_date} to {end_date}")
+    if DetectionCheckpoint.objects.filter(start_date__lt=start_date).exclude(status__in=CheckpointStatus.terminal()).exists():
+        # a previous window is failed or still running: the TaskSettings will be advanced when it's completed
+        return
+    next_checkpoints = DetectionCheckpoint.objects.filter(start_date__gte=end_date)
+    incomplete_dates = set(next_checkpoints.exclude(status__in=CheckpointStatus.terminal()).values_list("start_date", flat=True))
+    completed_windows = dict(next_checkpoints.filter(status__in=CheckpointStatus.terminal()).values_list("start_date", "end_date"))
+    while end_date in completed_windows and end_date not in incomplete_dates:
+        start_date, end_date = end_date, completed_windows[end_date]
+    task_settings, created = TaskSettings.objects.get_or_create(task_name=process_logs.__name__, defaults={"start_date": start_date, "end_date": end_date})
+    if not created and task_settings.end_date < end_date:
+        task_settings.start_date = start_date
+        task_settings.end_date = end_date
+        task_settings.save()
 
 
 @shared_task(name="NotifyAlertsTask")
@@ -1,7 +1,11 @@
 import json
+from datetime import datetime
 from unittest import mock
 
+from django.contrib.auth import get_user_model
+from django.test import override_settings
 from django.urls import reverse
+from impossible_travel.models import PushedLogin
 from rest_framework.test import APITestCase
 
 
@@ -16,6 +20,7 @@ class TestIngestionAPIViews(APITestCase):
             {"source": "elasticsearch", "fields": ["url", "username", "password", "timeout", "indexes"]},
             {"source": "opensearch", "fields": ["url", "username", "password", "timeout", "indexes"]},
             {"source": "splunk", "fields": ["host", "port", "scheme", "username", "password", "timeout", "indexes"]},
+            {"source": "file", "fields": ["path"]},
         ]
         response = self.client.get(reverse("ingestion_sources_api"))
         self.assertEqual(response.status_code, 200)
@@ -67,3 +72,62 @@ class TestIngestionAPIViews(APITestCase):
         expected = {"message": "Update successful"}
         self.assertEqual(response.status_code, 200)
         self.assertEqual(expected, json.loads(response.content))
+
+
+class TestIngestionPushAPIView(APITestCase):
+    def setUp(self):
+        self.api_user = get_user_model().objects.create_user(username="idp", email="idp@example.com", password="password")
+        self.client.force_authenticate(user=self.api_user)
+
+    def _event(self, i: int, username: str = "Stitch", **fields) -> dict:
+        event = {
+            "@timestamp": f"2025-02-26T13:{i:02d}:00.000Z",
+            "_id": f"log_id_{i}",
+            "_index": "cloud",
+            "user": {"name": username},
+            "source": {"ip": "192.0.2.1", "geo": {"country_name": "Italy", "location": {"lat": 45.4, "lon": 9.1}}},
+        }
+        event.update(fields)
+        return event
+
+    def _push(self, lines: list):
+        body = "\n".join(line if isinstance(line, str) else json.dumps(line) for line in lines)
+        return self.client.post(reverse("ingestion_push_api"), body, content_type="application/x-ndjson")
+
+    def test_push_logins(self):
+        # the logins are normalized and staged, while the events not valid are discarded
+        response = self._push(
+            [self._event(1), self._event(0, username="Jessica"), "{not json", self._event(2, source={}), self._event(3, **{"@timestamp": "no"})]
+        )
+        self.assertEqual(202, response.status_code)
+        self.assertDictEqual({"accepted": 2, "discarded": 3}, json.loads(response.content))
+        pushed_login = PushedLogin.objects.get(username="stitch")
+        self.assertEqual("log_id_1", pushed_login.login["id"])
+        self.assertEqual(45.4, pushed_login.login["lat"])
+        self.assertEqual(2025, pushed_login.timestamp.year)
+
+    def test_push_logins_naive_timestamp(self):
+        # the naive timestamps are made aware (UTC) both in the staged timestamp and in the login analyzed by the detection
+        self.assertEqual(202, self._push([self._event(0, **{"@timestamp": "2025-02-26T13:00:00"})]).status_code)
+        pushed_login = PushedLogin.objects.get()
+        self.assertEqual("2025-02-26T13:00:00+00:00", pushed_login.login["timestamp"])
+        self.assertEqual(datetime.fromisoformat(pushed_login.login["timestamp"]), pushed_login.timestamp)
+
+    def test_push_logins_not_authenticated(self):
+        self.client.force_authenticate(user=None)
+        self.assertIn(self._push([self._event(0)]).status_code, (401, 403))
+        self.assertFalse(PushedLogin.objects.exists())
+
+    @override_settings(CERTEGO_BUFFALOGS_PUSH_QUEUE_MAX_SIZE=3)
+    def test_push_logins_queue_full(self):
+        # the batches that don't fit in the staging table are refused entirely
+        self.assertEqual(202, self._push([self._event(0), self._event(1)]).status_code)
+        response = self._push([self._event(2), self._event(3)])
+        self.assertEqual(429, response.status_code)
+        self.assertEqual("60", response["Retry-After"])
+        self.assertEqual(2, PushedLogin.objects.count())
+
+    @override_settings(CERTEGO_BUFFALOGS_PUSH_MAX_BATCH_SIZE=2)
+    def test_push_logins_batch_too_large(self):
+        self.assertEqual(413, self._push([self._event(i) for i in range(3)]).status_code)
+        self.assertFalse(PushedLogin.objects.exists())
@@ -1,3 +1,4 @@
+import re
 from datetime import datetime, timezone
 from unittest.mock import patch
 
@@ -6,6 +7,7 @@ from django.test import TestCase
 from impossible_travel.constants import AlertDetectionType, AlertFilterType, UserRiskScoreType
 from impossible_travel.models import Alert, Config, User
 from impossible_travel.modules import alert_filter
+from impossible_travel.modules.config_cache import ConfigSnapshot
 
 
 class TestAlertFilter(TestCase):
@@ -622,3 +624,50 @@ class TestAlertFilter(TestCase):
         self.assertListEqual(["user_learning_period"], db_alert.filter_type)
         # check that if the alert is filtered, the mock_update_risk_level function is not called
         mock_update_risk_level.assert_not_called()
+
+    def test_filter_engine_ignored_ips_networks(self):
+        # the ignored_ips can contain IPs and networks
+        db_config = Config.objects.create(
+            ignored_ips=["1.2.3.4", "10.0.0.0/8", "192.168.1.0/24"], alert_minimum_risk_score=UserRiskScoreType.NO_RISK, filtered_alerts_types=[]
+        )
+        engine = alert_filter.FilterEngine(ConfigSnapshot.from_config(db_config))
+        self.assertIn("1.2.3.4", engine.ignored_ips)
+        self.assertIn("10.20.30.40", engine.ignored_ips)
+        self.assertIn("192.168.1.200", engine.ignored_ips)
+        self.assertNotIn("192.168.2.1", engine.ignored_ips)
+        self.assertNotIn("1.2.3.5", engine.ignored_ips)
+        self.assertNotIn("not-an-ip", engine.ignored_ips)
+        db_user = User.objects.get(username="Lorena Goldoni")
+        filters = engine.evaluate({"name": AlertDetectionType.NEW_DEVICE, "login_raw_data": {"ip": "10.1.1.1", "country": "Italy"}}, db_user)
+        self.assertListEqual([AlertFilterType.IGNORED_IP_FILTER], filters)
+
+    def test_filter_engine_username_matcher(self):
+        # the username patterns are combined in a single regex, with the same results of the single patterns
+        matcher = alert_filter.UsernameMatcher(("admin", "^svc-.*", ".*@test\\.com$"))
+        self.assertIsNotNone(matcher.regex)
+        self.assertIn("admin", matcher)
+        self.assertIn("svc-backup", matcher)
+        self.assertIn("lorena@test.com", matcher)
+        self.assertNotIn("lorena@test.org", matcher)
+        # backreferences are checked one by one
+        values = ("(a)\\1", "b")
+        matcher = alert_filter.UsernameMatcher(values, tuple(re.compile(value) for value in values))
+        self.assertIsNone(matcher.regex)
+        self.assertIn("xaa", matcher)
+        self.assertNotIn("xa", matcher)
+
+    def test_filter_engine_no_queries(self):
+        # the evaluation of the filters doesn't query the DB and the engine is built once per config
+        db_config = Config.objects.create(
+            ignored_impossible_travel_countries_couples=[["Italy", "Germany"]], alert_minimum_risk_score=UserRiskScoreType.NO_RISK, filtered_alerts_types=[]
+        )
+        snapshot = ConfigSnapshot.from_config(db_config)
+        self.assertIs(alert_filter.get_filter_engine(snapshot), alert_filter.get_filter_engine(ConfigSnapshot.from_config(db_config)))
+        db_user = User.objects.get(username="Lorena Goldoni")
+        alert = {
+            "name": AlertDetectionType.IMP_TRAVEL,
+            "login_raw_data": {"ip": "5.6.7.8", "country": "Germany", "buffalogs": {"start_country": "Italy"}},
+        }
+        with self.assertNumQueries(0):
+            filters = alert_filter.get_filter_engine(snapshot).evaluate(alert, db_user)
+        self.assertListEqual([AlertFilterType.IGNORED_IMP_TRAVEL_COUNTRIES_COUPLE], filters)
@@ -0,0 +1,64 @@
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from impossible_travel.models import Config
+from impossible_travel.modules import config_cache
+
+
+class TestConfigCache(TestCase):
+    def setUp(self):
+        Config.objects.all().delete()
+        self.config = Config.objects.create(
+            ignored_users=["admin", "^svc-.*"],
+            ignored_ips=["1.2.3.4"],
+            allowed_countries=["Italy"],
+            ignored_impossible_travel_countries_couples=[["Italy", "Germany"], ["France", "France"]],
+        )
+        # the TestCase runs inside a transaction, so simulate the execution outside it to enable the cache
+        self.atomic_patch = patch.object(config_cache.connection, "in_atomic_block", False)
+        self.atomic_patch.start()
+        config_cache.invalidate_config()
+
+    def tearDown(self):
+        self.atomic_patch.stop()
+        config_cache.invalidate_config()
+
+    def test_snapshot_derived_structures(self):
+        snapshot = config_cache.ConfigSnapshot.from_config(self.config)
+        self.assertEqual(frozenset(["1.2.3.4"]), snapshot.ignored_ips)
+        self.assertIn("Italy", snapshot.allowed_countries)
+        self.assertEqual(("admin", "^svc-.*"), snapshot.ignored_users)
+        self.assertTrue(snapshot.ignored_users_patterns[1].search("svc-backup"))
+        self.assertSetEqual({("Germany", "Italy"), ("France", "France")}, set(snapshot.ignored_countries_couples))
+        with self.assertRaises(AttributeError):
+            snapshot.vel_accepted = 10
+
+    def test_get_config_cached(self):
+        # the Config is read from the DB only the first time
+        with self.assertNumQueries(1):
+            snapshot = config_cache.get_config()
+        with self.assertNumQueries(0):
+            self.assertIs(snapshot, config_cache.get_config())
+        self.assertEqual(frozenset(["Italy"]), snapshot.allowed_countries)
+
+    def test_get_config_invalidated_on_save(self):
+        config_cache.get_config()
+        self.config.allowed_countries = ["Romania"]
+        self.config.save()
+        self.assertEqual(frozenset(["Romania"]), config_cache.get_config().allowed_countries)
+
+    @override_settings(CERTEGO_BUFFALOGS_CONFIG_CACHE_TTL=0)
+    def test_get_config_changed_by_other_process(self):
+        # changes without signals, like the ones done by another process, are seen after the TTL
+        snapshot = config_cache.get_config()
+        with self.assertNumQueries(1):
+            self.assertIs(snapshot, config_cache.get_config())
+        Config.objects.filter(id=1).update(vel_accepted=1000, updated=timezone.now())
+        self.assertEqual(1000, config_cache.get_config().vel_accepted)
+
+    def test_get_config_not_cached_in_transaction(self):
+        with patch.object(config_cache.connection, "in_atomic_block", True):
+            config_cache.get_config()
+        with self.assertNumQueries(1):
+            config_cache.get_config()
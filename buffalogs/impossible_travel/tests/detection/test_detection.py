@@ -2,8 +2,10 @@ import datetime
 from unittest.mock import patch
 
 from django.core.management import call_command
+from django.db import connection
 from django.db.models import Q
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from impossible_travel.constants import AlertDetectionType, AlertFilterType
 from impossible_travel.models import Alert, Config, Login, User, UsersIP
@@ -200,6 +202,20 @@ class DetectionTestCase(TestCase):
         self.assertEqual(AlertDetectionType.ATYPICAL_COUNTRY.value, alert_result["alert_name"])
         self.assertEqual("Login from an atypical country for User: Lorena Goldoni, at: 2025-02-26T17:10:33.358Z, from: Germany", alert_result["alert_desc"])
 
+    def test_check_country_naive_timestamp(self):
+        # testing function check_country with a login timestamp without timezone, compared with the aware timestamps of the saved logins
+        db_config = Config.objects.get(id=1)
+        db_user = User.objects.get(username="Lorena Goldoni")
+        last_login_user_fields = {
+            "timestamp": "2025-02-26T17:10:33.358",
+            "lat": 44.4937,
+            "lon": 24.3456,
+            "country": "Germany",
+            "user_agent": "Mozilla/5.0 (X11; U; Linux i686; es-AR; rv:1.9.1.8) Gecko/20100214 Ubuntu/9.10 (karmic) Firefox/3.5.8",
+        }
+        alert_result = detection.check_country(db_user, last_login_user_fields, db_config)
+        self.assertEqual(AlertDetectionType.ATYPICAL_COUNTRY.value, alert_result["alert_name"])
+
     def test_check_new_device(self):
         # Test to check the the NEW_DEVICE alert has not been triggered
         db_user = User.objects.get(username="Lorena Goldoni")
@@ -439,7 +455,7 @@ class DetectionTestCase(TestCase):
         db_alert = Alert.objects.get(user=db_user, name=AlertDetectionType.IMP_TRAVEL)
         self.assertFalse(db_alert.is_filtered)
         self.assertEqual([], db_alert.filter_type)
-        mock_update_risk_level.assert_called_once_with(db_user=db_user, triggered_alert=db_alert, app_config=db_config)
+        mock_update_risk_level.assert_called_once_with(db_user=db_user, triggered_alert=db_alert, app_config=db_config, writer=None)
 
     def test_check_fields_logins(self):
         fields1 = load_test_data("test_check_fields_part1")
@@ -633,17 +649,18 @@ class DetectionTestCase(TestCase):
         config.save()
 
         # Second part - Expected new alerts in Alert Model:
-        #   12. at 2023-05-03T07:14:22.768Z alert NEW DEVICE
-        #   13. at 2023-05-03T07:14:22.768Z alert IMP TRAVEL
-        #   14. at 2023-05-03T07:18:38.768Z alert NEW DEVICE
-        #   15. at 2023-05-03T07:18:38.768Z alert IMP TRAVEL
-        #   16. at 2023-05-03T07:20:36.154Z alert IMP TRAVEL
+        #   12. at 2023-05-03T06:55:31.768Z alert IMP TRAVEL (known IP, received again after the login from Japan at 06:57:27)
+        #   13. at 2023-05-03T07:14:22.768Z alert NEW DEVICE
+        #   14. at 2023-05-03T07:14:22.768Z alert IMP TRAVEL
+        #   15. at 2023-05-03T07:18:38.768Z alert NEW DEVICE
+        #   16. at 2023-05-03T07:18:38.768Z alert IMP TRAVEL
+        #   17. at 2023-05-03T07:20:36.154Z alert IMP TRAVEL
 
         # get IDs of old alerts to check the new alerts
         new_device_alerts_fields1_ids = list(new_device_alerts_fields1.values_list("id", flat=True))
 
         detection.check_fields(db_user, fields2)
-        self.assertEqual(16, Alert.objects.filter(user=db_user).count())
+        self.assertEqual(17, Alert.objects.filter(user=db_user).count())
         # get new_device alerts relating to fields2 making query all_new_device_alerts - new_device_alerts_fields1
         all_new_device_alerts = Alert.objects.filter(user=db_user, name=AlertDetectionType.NEW_DEVICE).order_by("created")
         self.assertEqual(4, all_new_device_alerts.count())
@@ -658,7 +675,7 @@ class DetectionTestCase(TestCase):
         # same old new_country alert relating to fields1 logins
         self.assertEqual(2, Alert.objects.filter(user=db_user, name=AlertDetectionType.NEW_COUNTRY).count())
 
-        self.assertEqual(6, Alert.objects.filter(user=db_user, name=AlertDetectionType.IMP_TRAVEL).count())
+        self.assertEqual(7, Alert.objects.filter(user=db_user, name=AlertDetectionType.IMP_TRAVEL).count())
 
     def test_check_fields_usersip(self):
         db_user = User.objects.get(username="Aisha Delgado")
@@ -681,6 +698,247 @@ class DetectionTestCase(TestCase):
         # Check No duplicated ips
         self.assertEqual(1, UsersIP.objects.filter(user=db_user, ip="203.0.113.17").count())
         self.assertEqual(1, UsersIP.objects.filter(user=db_user, ip="203.0.113.11").count())
-        # Third part: no new alerts because all the ips have already been used
+        # Third part: all the ips have already been used, but the travels between India and the United States are impossible anyway
+        detection.check_fields(db_user, fields3)
+        travel_alerts = Alert.objects.filter(user=db_user, login_raw_data__timestamp__gt=datetime.datetime(2023, 5, 4, 0, 0, 0).isoformat())
+        self.assertListEqual(
+            ["2023-05-04T16:40:03.768Z", "2023-05-04T17:34:36.154Z", "2023-05-04T17:55:00.154Z"],
+            sorted(alert.login_raw_data["timestamp"] for alert in travel_alerts.filter(name=AlertDetectionType.IMP_TRAVEL)),
+        )
+        self.assertEqual(7, UsersIP.objects.filter(user=db_user).count())
+
+    def test_user_detection_state(self):
+        # check the snapshot of the user data loaded by the UserDetectionState and the saving of its changes
+        db_user = User.objects.get(username="Aisha Delgado")
+        detection.check_fields(db_user, load_test_data("test_check_fields_part1"))
+        state = detection.UserDetectionState(db_user)
+        self.assertTrue(state.has_index("cloud-test_data-2023-5-3"))
+        self.assertFalse(state.has_index("cloud-test_data-2023-5-4"))
+        self.assertTrue(state.has_ip("203.0.113.17"))
+        self.assertFalse(state.has_ip("203.0.113.40"))
+        self.assertEqual(db_user.login_set.latest("timestamp"), state.latest_login)
+        self.assertEqual(Login.objects.filter(user=db_user, country="Japan").last(), state.last_login_by_country["Japan"])
+        new_login = {
+            "id": "test_state",
+            "index": "cloud-test_data-2023-5-4",
+            "ip": "203.0.113.17",
+            "lat": 38.8217,
+            "lon": -77.1814,
+            "country": "United States",
+            "agent": "Mozilla/5.0 (X11; Linux x86_64)",
+            "timestamp": "2023-05-04T12:05:03.000Z",
+        }
+        with CaptureQueriesContext(connection) as queries:
+            state.add_login(new_login)
+            state.add_ip(new_login["ip"])
+            state.update_login(dict(new_login, id="test_state_updated", timestamp="2023-05-04T12:10:03.000Z"))
+        # no query until the flush
+        self.assertEqual(0, len(queries))
+        self.assertTrue(state.has_login(new_login))
+        self.assertTrue(state.has_agent(new_login["agent"]))
+        self.assertEqual("test_state_updated", state.latest_login.event_id)
+        writer = detection.DetectionBatchWriter()
+        writer.states[db_user.pk] = state
+        writer.flush()
+        self.assertEqual(1, Login.objects.filter(user=db_user, index="cloud-test_data-2023-5-4").count())
+        self.assertEqual(10, Login.objects.get(user=db_user, event_id="test_state_updated").timestamp.minute)
+        # known ip: not duplicated
+        self.assertEqual(1, UsersIP.objects.filter(user=db_user, ip="203.0.113.17").count())
+
+    def test_check_fields_collapsed_logins(self):
+        # check that a burst of logins collapsed by the ingestion is analyzed once, saving the last login of the burst
+        db_user = User.objects.get(username="Aisha Delgado")
+        detection.check_fields(db_user, load_test_data("test_check_fields_part1"))
+        login = {
+            "id": "burst_first",
+            "index": "cloud-test_data-2023-5-3",
+            "ip": "203.0.113.17",
+            "lat": 38.8217,
+            "lon": -77.1814,
+            "country": "United States",
+            "agent": "BurstAgent/1.0",
+            "timestamp": "2023-05-04T12:05:03.000Z",
+        }
+        collapsed = dict(login, first_seen=login["timestamp"], last_seen="2023-05-04T12:05:48.000Z", last_id="burst_last", count=12)
+        detection.check_fields(db_user, [collapsed])
+        db_login = Login.objects.get(user=db_user, user_agent="BurstAgent/1.0")
+        self.assertEqual("burst_last", db_login.event_id)
+        self.assertEqual(48, db_login.timestamp.second)
+        # the alerts refer to the first login of the burst
+        self.assertTrue(Alert.objects.filter(user=db_user, login_raw_data__id="burst_first").exists())
+        self.assertFalse(Alert.objects.filter(user=db_user, login_raw_data__id="burst_last").exists())
+
+    def test_check_fields_out_of_order_hop(self):
+        # check that a login received after a later one is compared with the logins around it, not only with the latest one
+        db_user = User.objects.get(username="Aisha Delgado")
+        fields1 = load_test_data("test_check_fields_part1")
+        detection.check_fields(db_user, fields1)
+        # same device and place of the last login of the United States (at 07:10:23) and of the one from India
+        us_login, india_login = fields1[3], fields1[0]
+        logins = [
+            dict(us_login, id="hop_a", timestamp="2023-05-03T09:00:00.000Z", ip="198.51.100.1"),
+            dict(us_login, id="hop_c", timestamp="2023-05-03T09:20:00.000Z", ip="198.51.100.2"),
+            # received last, from India between the two logins from the United States
+            dict(india_login, id="hop_b", timestamp="2023-05-03T09:10:00.000Z", ip="198.51.100.3"),
+        ]
+        state = detection.UserDetectionState(db_user)
+        writer = detection.DetectionBatchWriter()
+        writer.states[db_user.pk] = state
+        # the history is built from the logins already loaded by the state
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(3, len(state.travel_history))
+        self.assertEqual(0, len(queries))
+        detection.check_fields(db_user, logins[:2], writer=writer)
+        self.assertEqual(0, len(writer.alerts))
+        detection.check_fields(db_user, logins[2:], writer=writer)
+        travel_alerts = [alert for alert in writer.alerts if alert.name == AlertDetectionType.IMP_TRAVEL]
+        self.assertEqual(1, len(travel_alerts))
+        self.assertEqual("hop_b", travel_alerts[0].login_raw_data["id"])
+        self.assertEqual("United States", travel_alerts[0].login_raw_data["buffalogs"]["start_country"])
+        self.assertEqual(6, len(state.travel_history))
+
+    def test_check_fields_hop_alerted_once(self):
+        # check that the travel from a point is alerted once, and not again by the following logins of the window that come from a plausible origin
+        db_user = User.objects.get(username="Aisha Delgado")
+        fields1 = load_test_data("test_check_fields_part1")
+        detection.check_fields(db_user, fields1)
+        us_login, india_login = fields1[3], fields1[0]
+        logins = [dict(india_login, id="hop_0", timestamp="2023-05-03T09:00:00.000Z", ip="198.51.100.1")]
+        logins.extend(
+            dict(us_login, id=f"hop_{i}", timestamp=f"2023-05-03T{timestamp}.000Z", ip=f"198.51.100.{i + 1}")
+            for i, timestamp in enumerate(["09:10:00", "09:30:00", "09:50:00", "10:20:00"], start=1)
+        )
+        writer = detection.DetectionBatchWriter()
+        detection.check_fields(db_user, logins, writer=writer)
+        travel_alerts = [alert for alert in writer.alerts if alert.name == AlertDetectionType.IMP_TRAVEL]
+        # hop_0 is alerted for the travel from the last login of part1, in the United States, and hop_1 for the travel back from India
+        self.assertListEqual(["hop_0", "hop_1"], [alert.login_raw_data["id"] for alert in travel_alerts])
+        self.assertEqual("India", travel_alerts[1].login_raw_data["buffalogs"]["start_country"])
+
+    def test_check_fields_alerts_raw_data(self):
+        # check that each alert of a login stores the login data at the time of the alert: only the IMP_TRAVEL alert has the "buffalogs" fields
+        db_user = User.objects.get(username="Aisha Delgado")
+        detection.check_fields(db_user, load_test_data("test_check_fields_part1"))
+        login = {
+            "index": "cloud-test_data-2023-5-3",
+            "id": "all_alerts",
+            "agent": "Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0",
+            "timestamp": "2023-05-03T07:20:00.000Z",
+            "ip": "198.51.100.42",
+            "lat": 45.4642,
+            "lon": 9.19,
+            "country": "Italy",
+            "intelligence_category": "anonymizer",
+        }
+        detection.check_fields(db_user, [login])
+        alerts = {alert.name: alert.login_raw_data for alert in Alert.objects.filter(user=db_user, login_raw_data__id="all_alerts")}
+        self.assertCountEqual(
+            [AlertDetectionType.ANONYMOUS_IP_LOGIN, AlertDetectionType.NEW_DEVICE, AlertDetectionType.NEW_COUNTRY, AlertDetectionType.IMP_TRAVEL],
+            alerts.keys(),
+        )
+        for name, login_raw_data in alerts.items():
+            self.assertEqual(name == AlertDetectionType.IMP_TRAVEL, "buffalogs" in login_raw_data, name)
+        self.assertEqual("United States", alerts[AlertDetectionType.IMP_TRAVEL]["buffalogs"]["start_country"])
+
+    def test_check_fields_source_tagged_index(self):
+        # check that the logins of an index tagged with its source (e.g. after enabling more ingestion sources) are checked against the untagged one
+        db_user = User.objects.get(username="Aisha Delgado")
+        detection.check_fields(db_user, load_test_data("test_check_fields_part1"))
+        login = {
+            "index": "elasticsearch:cloud-test_data-2023-5-3",
+            "id": "tagged_login",
+            "agent": "Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0",
+            "timestamp": "2023-05-04T07:20:00.000Z",
+            "ip": "198.51.100.42",
+            "lat": 45.4642,
+            "lon": 9.19,
+            "country": "Italy",
+        }
+        detection.check_fields(db_user, [login])
+        self.assertCountEqual(
+            [AlertDetectionType.NEW_DEVICE, AlertDetectionType.NEW_COUNTRY, AlertDetectionType.IMP_TRAVEL],
+            Alert.objects.filter(user=db_user, login_raw_data__id="tagged_login").values_list("name", flat=True),
+        )
+        # the login is saved with its tagged index
+        self.assertTrue(Login.objects.filter(user=db_user, index="elasticsearch:cloud-test_data-2023-5-3", event_id="tagged_login").exists())
+
+    def test_check_fields_known_ip_hop(self):
+        # check that an impossible travel is alerted also if the login comes from an IP already used by the user
+        db_user = User.objects.get(username="Aisha Delgado")
+        fields1 = load_test_data("test_check_fields_part1")
+        detection.check_fields(db_user, fields1)
+        us_login, india_login = fields1[3], fields1[0]
+        logins = [
+            dict(us_login, id="hop_a", timestamp="2023-05-03T09:00:00.000Z", ip="198.51.100.1"),
+            # from India with its known IP, 10 minutes later
+            dict(india_login, id="hop_b", timestamp="2023-05-03T09:10:00.000Z"),
+        ]
+        self.assertTrue(UsersIP.objects.filter(user=db_user, ip=india_login["ip"]).exists())
+        writer = detection.DetectionBatchWriter()
+        detection.check_fields(db_user, logins, writer=writer)
+        travel_alerts = [alert for alert in writer.alerts if alert.name == AlertDetectionType.IMP_TRAVEL]
+        self.assertListEqual(["hop_b"], [alert.login_raw_data["id"] for alert in travel_alerts])
+        self.assertEqual("United States", travel_alerts[0].login_raw_data["buffalogs"]["start_country"])
+
+    def test_batch_writer_login_conflict(self):
+        # check that a login created by a concurrent detection after the state was loaded is updated instead of failing on the unique key
+        db_user = User.objects.get(username="Aisha Delgado")
+        state = detection.UserDetectionState(db_user)
+        login = {
+            "id": "concurrent_login",
+            "index": "cloud-test_data-2023-5-4",
+            "ip": "203.0.113.17",
+            "lat": 38.8217,
+            "lon": -77.1814,
+            "country": "United States",
+            "agent": "Mozilla/5.0 (X11; Linux x86_64)",
+            "timestamp": "2023-05-04T12:05:03.000Z",
+        }
+        detection.add_new_login(db_user, dict(login, id="other_worker_login"))
+        UsersIP.objects.create(user=db_user, ip=login["ip"])
+        state.add_login(login)
+        state.add_ip(login["ip"])
+        writer = detection.DetectionBatchWriter()
+        writer.states[db_user.pk] = state
+        writer.flush()
+        self.assertEqual("concurrent_login", Login.objects.get(user=db_user, index="cloud-test_data-2023-5-4").event_id)
+        self.assertEqual(1, UsersIP.objects.filter(user=db_user, ip=login["ip"]).count())
+
+    def test_check_fields_queries(self):
+        # check that the number of queries of check_fields doesn't depend on the number of logins, if no alerts are triggered
+        db_user = User.objects.get(username="Aisha Delgado")
+        detection.check_fields(db_user, load_test_data("test_check_fields_part1"))
+        detection.check_fields(db_user, load_test_data("test_check_fields_part2"))
+        fields3 = load_test_data("test_check_fields_part3")
         detection.check_fields(db_user, fields3)
-        self.assertEqual(0, Alert.objects.filter(user=db_user, login_raw_data__timestamp__gt=datetime.datetime(2023, 5, 4, 0, 0, 0).isoformat()).count())
+        # now all the logins are already saved, so they are just updated
+        with CaptureQueriesContext(connection) as queries_single:
+            detection.check_fields(db_user, fields3[:1])
+        with CaptureQueriesContext(connection) as queries_all:
+            detection.check_fields(db_user, fields3)
+        # the logins received again don't alert again
+        self.assertEqual(3, Alert.objects.filter(user=db_user, login_raw_data__timestamp__gt=datetime.datetime(2023, 5, 4, 0, 0, 0).isoformat()).count())
+        self.assertEqual(len(queries_single), len(queries_all))
+
+    def test_check_fields_batch_writer(self):
+        # check that all the rows of the detection are saved only by the flush, writing each alert exactly once
+        app_config = Config.objects.get(id=1)
+        app_config.risk_score_increment_alerts.append("New Device")
+        app_config.save()
+        db_user = User.objects.get(username="Aisha Delgado")
+        writer = detection.DetectionBatchWriter()
+        with CaptureQueriesContext(connection) as queries:
+            detection.check_fields(db_user, load_test_data("test_check_fields_part1"), writer=writer)
+        self.assertFalse([query["sql"] for query in queries if query["sql"].startswith(("INSERT", "UPDATE"))])
+        self.assertEqual(0, db_user.alert_set.count())
+        self.assertEqual(11, len(writer.alerts))
+        with CaptureQueriesContext(connection) as queries:
+            writer.flush()
+        alert_writes = [query["sql"] for query in queries if "impossible_travel_alert" in query["sql"]]
+        self.assertEqual(1, len(alert_writes))
+        self.assertTrue(alert_writes[0].startswith("INSERT"))
+        self.assertEqual(11, db_user.alert_set.count())
+        self.assertEqual(3, Login.objects.filter(user=db_user, index="cloud-test_data-2023-5-3").count())
+        self.assertEqual(4, UsersIP.objects.filter(user=db_user).count())
+        db_user.refresh_from_db()
+        self.assertEqual("High", db_user.risk_score)
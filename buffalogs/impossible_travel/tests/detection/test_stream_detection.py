@@ -0,0 +1,97 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+from impossible_travel.ingestion.stream_ingestion import QueueStreamConsumer
+from impossible_travel.models import Login, User
+from impossible_travel.modules import detection
+from impossible_travel.modules.stream_detection import StreamDetectionWorker
+from impossible_travel.tests.utils import load_ingestion_config_data
+
+
+class StreamDetectionTestCase(TestCase):
+    def setUp(self):
+        self.mapping = load_ingestion_config_data()["elasticsearch"]["custom_mapping"]
+        self.consumer = QueueStreamConsumer({"backend": "queue"})
+
+    def _event(self, i: int, username: str = "Stitch", **fields) -> dict:
+        event = {
+            "@timestamp": f"2025-02-26T13:{i:02d}:00.000Z",
+            "_id": f"log_id_{i}",
+            "_index": "cloud",
+            "user": {"name": username},
+            "source": {"ip": f"192.0.2.{i}", "geo": {"country_name": "Italy", "location": {"lat": 45.4, "lon": 9.1}}},
+            "user_agent": {"original": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) Firefox/120.0"},
+        }
+        event.update(fields)
+        return event
+
+    def test_group_logins(self):
+        """The events are normalized and grouped by user in the order of the stream, skipping the ones not valid"""
+        for event in [self._event(2), self._event(1, username="STITCH"), self._event(3, username="Jessica"), self._event(4, source={}), b"{not json"]:
+            self.consumer.events.put(event)
+        worker = StreamDetectionWorker(self.consumer, self.mapping)
+        logins_by_user = worker.group_logins(self.consumer.poll(10, 0.01))
+        self.assertListEqual(["stitch", "jessica"], list(logins_by_user.keys()))
+        self.assertListEqual(["log_id_2", "log_id_1"], [login["id"] for login in logins_by_user["stitch"]])
+
+    def test_group_logins_collapsed(self):
+        """The bursts of identical logins of the same user are collapsed"""
+        for i in range(3):
+            self.consumer.events.put(self._event(i, _id=f"log_id_{i}", source=self._event(0)["source"]))
+        worker = StreamDetectionWorker(self.consumer, self.mapping)
+        with self.settings(CERTEGO_BUFFALOGS_COLLAPSE_LOGINS_SECONDS=60):
+            [login] = worker.group_logins(self.consumer.poll(10, 0.01))["stitch"]
+        self.assertEqual(("log_id_0", "log_id_2", 3), (login["id"], login["last_id"], login["count"]))
+
+    def test_run(self):
+        """Each micro-batch is analyzed and then committed"""
+        for i in range(5):
+            self.consumer.events.put(self._event(i, username="Stitch" if i % 2 else "Jessica"))
+        worker = StreamDetectionWorker(self.consumer, self.mapping, batch_size=3, batch_timeout=0.01)
+        self.assertEqual(5, worker.run(max_batches=2))
+        self.assertListEqual([0, 1, 2, 3, 4], self.consumer.committed)
+        self.assertCountEqual(["stitch", "jessica"], User.objects.values_list("username", flat=True))
+        # the logins of the same device and country are merged, keeping the most recent one
+        self.assertEqual("log_id_4", Login.objects.get(user__username="jessica").event_id)
+
+    def test_not_committed_on_failure(self):
+        """The events are not committed if the detection fails because the DB isn't reachable, so they are delivered again"""
+        self.consumer.events.put(self._event(0))
+        worker = StreamDetectionWorker(self.consumer, self.mapping, batch_timeout=0.01)
+        with patch("impossible_travel.modules.stream_detection.process_detection_shard", side_effect=RuntimeError("db down")), patch.object(
+            StreamDetectionWorker, "database_available", return_value=False
+        ):
+            with self.assertRaises(RuntimeError):
+                worker.run(max_batches=1)
+        self.assertListEqual([], self.consumer.committed)
+
+    def test_bad_event(self):
+        """An event whose detection fails is logged and committed, the other users of its batch are analyzed and the worker keeps consuming"""
+        for event in [self._event(0), self._event(1, username="poison"), self._event(2, username="Jessica"), self._event(3)]:
+            self.consumer.events.put(event)
+        check_fields = detection.check_fields
+
+        def check_fields_side_effect(db_user, fields, writer=None):
+            if db_user.username == "poison":
+                raise ValueError("bad login")
+            return check_fields(db_user=db_user, fields=fields, writer=writer)
+
+        worker = StreamDetectionWorker(self.consumer, self.mapping, batch_size=3, batch_timeout=0.01)
+        with patch("impossible_travel.tasks.detection.check_fields", side_effect=check_fields_side_effect), self.assertLogs(
+            "impossible_travel.modules.stream_detection", level="ERROR"
+        ) as logs:
+            worker.run(max_batches=2)
+        self.assertListEqual([0, 1, 2, 3], self.consumer.committed)
+        self.assertTrue(any("poison" in line and "log_id_1" in line for line in logs.output))
+        self.assertCountEqual(["stitch", "jessica"], Login.objects.values_list("user__username", flat=True))
+
+    def test_command(self):
+        consumer = QueueStreamConsumer({"backend": "queue"})
+        consumer.events.put(self._event(0))
+        with patch("impossible_travel.management.commands.stream_detection.get_stream_consumer", return_value=consumer) as mock_get_consumer:
+            call_command("stream_detection", "--backend", "redis", "--max-batches", "1", "--batch-timeout", "0.01", stdout=StringIO())
+        self.assertEqual("redis", mock_get_consumer.call_args.args[0]["backend"])
+        self.assertListEqual([0], consumer.committed)
+        self.assertTrue(Login.objects.filter(user__username="stitch").exists())
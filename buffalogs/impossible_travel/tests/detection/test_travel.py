@@ -0,0 +1,106 @@
+import numpy as np
+from django.test import SimpleTestCase
+from geopy.distance import geodesic
+from impossible_travel.modules import travel
+
+# (lat, lon) couples from the detection fixtures and some extreme cases (poles, antimeridian)
+POINTS = [
+    ((45.4758, 9.2275), (40.364, -79.8605)),
+    ((40.364, -79.8605), (30.0611, 31.2497)),
+    ((41.9028, 12.4964), (41.9027, 12.4965)),
+    ((89.9, 0.0), (-89.9, 180.0)),
+    ((0.0, 179.9), (0.0, -179.9)),
+    ((-33.8688, 151.2093), (51.5074, -0.1278)),
+    ((45.0, 9.0), (45.0, 9.0)),
+]
+
+
+class TestTravel(SimpleTestCase):
+    def setUp(self):
+        start, end = zip(*POINTS)
+        self.lat1, self.lon1 = np.array(start).T
+        self.lat2, self.lon2 = np.array(end).T
+        self.geodesic = np.array([geodesic(p1, p2).km for p1, p2 in POINTS])
+
+    def test_haversine_error(self):
+        distances = travel.haversine_km(self.lat1, self.lon1, self.lat2, self.lon2)
+        self.assertEqual((len(POINTS),), distances.shape)
+        error = np.abs(distances - self.geodesic)
+        self.assertTrue(np.all(error <= self.geodesic * travel.HAVERSINE_MAX_ERROR))
+        self.assertEqual(0, distances[-1])
+
+    def test_distances_exact_mode(self):
+        distances = travel.distances_km(self.lat1, self.lon1, self.lat2, self.lon2)
+        np.testing.assert_allclose(distances, self.geodesic)
+
+    def test_distances_exact_mode_distance_accepted(self):
+        # the decisions at the threshold are the same of the geodesic, the short distances keep the haversine value
+        for distance_accepted in (100, 5000, 7000, 7125, 10000, 17000):
+            distances = travel.distances_km(self.lat1, self.lon1, self.lat2, self.lon2, distance_accepted=distance_accepted)
+            np.testing.assert_array_equal(self.geodesic > distance_accepted, distances > distance_accepted)
+            refined = distances >= distance_accepted * (1 - travel.HAVERSINE_MAX_ERROR)
+            np.testing.assert_allclose(distances[refined], self.geodesic[refined])
+
+    def test_distances_fast_mode(self):
+        distances = travel.distances_km(self.lat1, self.lon1, self.lat2, self.lon2, mode=travel.FAST_MODE, distance_accepted=100)
+        np.testing.assert_array_equal(travel.haversine_km(self.lat1, self.lon1, self.lat2, self.lon2), distances)
+
+    def test_distances_scalar(self):
+        distance = travel.distances_km("45.4758", "9.2275", 40.364, -79.8605)
+        self.assertAlmostEqual(geodesic((45.4758, 9.2275), (40.364, -79.8605)).km, float(distance))
+
+    def test_distances_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            travel.distances_km(0, 0, 1, 1, mode="wrong")
+
+    def test_travel_kernel(self):
+        lat = [45.4758, 40.364, 40.364, 30.0611]
+        lon = [9.2275, -79.8605, -79.8605, 31.2497]
+        hour = 3600 * 10**6
+        epoch_us = [0, 2 * hour, 2 * hour, 5 * hour]
+        distances, velocities = travel.travel_kernel(lat, lon, epoch_us)
+        self.assertEqual((3,), distances.shape)
+        expected_distance = geodesic((45.4758, 9.2275), (40.364, -79.8605)).km
+        self.assertAlmostEqual(expected_distance, distances[0])
+        self.assertAlmostEqual(expected_distance / 2, velocities[0])
+        # same place at the same time: zero elapsed time is considered as 0.001 hours
+        self.assertEqual(0, distances[1])
+        self.assertEqual(0, velocities[1])
+        self.assertAlmostEqual(distances[2] / 3, velocities[2])
+
+    def test_velocities_zero_elapsed(self):
+        velocities = travel.velocities_kmh(np.array([10.0]), np.array([0]))
+        self.assertAlmostEqual(10000, velocities[0])
+
+    def test_travel_history_order(self):
+        # the points are kept sorted by time, also if added out of order
+        history = travel.TravelHistory(3)
+        history.add(45.4758, 9.2275, 20, "Italy")
+        history.add(40.364, -79.8605, 10, "United States")
+        history.add(30.0611, 31.2497, 30, "Egypt")
+        self.assertEqual(3, len(history))
+        np.testing.assert_array_equal([10, 20, 30], history.epoch_us)
+        self.assertListEqual(["United States", "Italy", "Egypt"], list(history.countries))
+        # when full, the oldest point is discarded, and the points older than all the others are ignored
+        history.add(41.9028, 12.4964, 25, "Italy")
+        np.testing.assert_array_equal([20, 25, 30], history.epoch_us)
+        history.add(41.9028, 12.4964, 5, "Italy")
+        np.testing.assert_array_equal([20, 25, 30], history.epoch_us)
+        np.testing.assert_array_equal([45.4758, 41.9028, 30.0611], history.lat)
+
+    def test_travel_history_velocities(self):
+        hour = 3600 * 10**6
+        history = travel.TravelHistory(10)
+        for lat, lon, epoch_us in ((45.4758, 9.2275, 0), (40.364, -79.8605, 10 * hour), (30.0611, 31.2497, 12 * hour), (45.0, 9.0, 13 * hour)):
+            history.add(lat, lon, epoch_us, "")
+        # within 1.5 hours from 12h30: the points at 12h and 13h (also the following one), plus the predecessor at 12h
+        positions, distances, velocities = history.velocities(45.4758, 9.2275, 12 * hour + hour // 2, 3 * hour // 2)
+        np.testing.assert_array_equal([2, 3], positions)
+        self.assertAlmostEqual(geodesic((30.0611, 31.2497), (45.4758, 9.2275)).km, distances[0])
+        self.assertAlmostEqual(distances[0] * 2, velocities[0])
+        self.assertAlmostEqual(distances[1] * 2, velocities[1])
+        # the predecessor is compared also if it's out of the window
+        positions, _, _ = history.velocities(45.4758, 9.2275, 11 * hour, hour // 2)
+        np.testing.assert_array_equal([1], positions)
+        positions, distances, velocities = travel.TravelHistory(10).velocities(45.4758, 9.2275, 0, hour)
+        self.assertEqual(0, len(positions))
@@ -0,0 +1,39 @@
+from django.test import SimpleTestCase
+from impossible_travel.modules import user_agent
+
+ANDROID_AGENT = "Mozilla/5.0 (Linux; Android 12; moto g stylus 5G) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/112.0.0.0 Mobile Safari/537.36"
+WINDOWS_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36"
+WINDOWS_AGENT_OLD = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+
+class TestUserAgent(SimpleTestCase):
+    def setUp(self):
+        user_agent.parse_user_agent.cache_clear()
+
+    def test_parse_user_agent(self):
+        ua_info = user_agent.parse_user_agent(ANDROID_AGENT)
+        self.assertEqual("Android", ua_info.os_family)
+        self.assertEqual("Chrome Mobile", ua_info.browser)
+        self.assertEqual("Motorola g stylus 5G", ua_info.device_family)
+        self.assertTrue(ua_info.is_mobile)
+        self.assertFalse(user_agent.parse_user_agent(WINDOWS_AGENT).is_mobile)
+        # not parsable user-agent
+        ua_info = user_agent.parse_user_agent("Firefox")
+        self.assertEqual(user_agent.UNKNOWN, ua_info.os_family)
+        self.assertFalse(ua_info.is_mobile)
+
+    def test_cache_stats(self):
+        for _ in range(3):
+            user_agent.parse_user_agent(ANDROID_AGENT)
+        user_agent.parse_user_agent(WINDOWS_AGENT)
+        stats = user_agent.cache_stats()
+        self.assertEqual(2, stats["hits"])
+        self.assertEqual(2, stats["misses"])
+        self.assertEqual(2, stats["currsize"])
+        self.assertEqual(0.5, stats["hit_ratio"])
+
+    def test_group_user_agents(self):
+        grouped = user_agent.group_user_agents({ANDROID_AGENT: 2, WINDOWS_AGENT: 3, WINDOWS_AGENT_OLD: 1})
+        self.assertDictEqual({"Android": 2, "Windows": 4}, grouped["os"])
+        self.assertDictEqual({"Chrome Mobile on Android": 2, "Chrome on Windows": 4}, grouped["label"])
+        self.assertEqual(2, grouped["mobile"])
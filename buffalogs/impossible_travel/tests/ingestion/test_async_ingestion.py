@@ -0,0 +1,146 @@
+import asyncio
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, patch
+
+from django.test import SimpleTestCase
+from impossible_travel.ingestion.elasticsearch_ingestion import AsyncElasticsearchIngestion
+from impossible_travel.ingestion.opensearch_ingestion import AsyncOpensearchIngestion
+from impossible_travel.tests.utils import load_ingestion_config_data
+
+
+class AsyncIngestionTestCase(SimpleTestCase):
+    """Test the async Elasticsearch and Opensearch ingestion sources, with mocked clients"""
+
+    def setUp(self):
+        self.ingestion_config = load_ingestion_config_data()
+        self.opensearch_config = dict(self.ingestion_config["opensearch"], concurrency=4)
+        self.elasticsearch_config = dict(self.ingestion_config["elasticsearch"], concurrency=4)
+        self.start_date = datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc)
+        self.end_date = datetime(2025, 2, 26, 14, 0, tzinfo=timezone.utc)
+
+    def _user_hit(self, username: str, i: int) -> dict:
+        return {
+            "_index": "cloud-test_data",
+            "_id": f"log_id_{i}",
+            "_source": {"user": {"name": username}, "@timestamp": f"2025-02-26T13:{i:02d}:00.000Z"},
+            "sort": [i],
+        }
+
+    @patch("impossible_travel.ingestion.opensearch_ingestion.AsyncOpenSearch")
+    def test_process_users_logins_concurrency(self, mock_opensearch):
+        """The per-user queries are executed concurrently, never more than the concurrency limit at a time, and each one is paginated"""
+        config = dict(self.opensearch_config, bucket_size=2)
+        in_flight = 0
+        max_in_flight = 0
+
+        async def search_side_effect(body):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            self.assertEqual("test_pit", body["pit"]["id"])
+            username = body["query"]["bool"]["must"][1]["match"]["user.name"]
+            user_hits = [self._user_hit(username, i) for i in range(3)]
+            start = body["search_after"][0] + 1 if "search_after" in body else 0
+            return {"hits": {"hits": user_hits[start : start + body["size"]]}}
+
+        mock_client = AsyncMock()
+        mock_client.create_pit.return_value = {"pit_id": "test_pit"}
+        mock_client.search.side_effect = search_side_effect
+        mock_opensearch.return_value = mock_client
+        usernames = [f"User{i}" for i in range(20)]
+
+        ingestor = AsyncOpensearchIngestion(config, mapping=config["custom_mapping"])
+        result = ingestor.process_users_logins(self.start_date, self.end_date, usernames)
+
+        # 2 pages for each user, the logins beyond the bucket_size aren't lost
+        self.assertEqual(40, mock_client.search.call_count)
+        self.assertEqual(4, max_in_flight)
+        self.assertListEqual([username.lower() for username in usernames], list(result.keys()))
+        self.assertListEqual(["log_id_0", "log_id_1", "log_id_2"], [login["_id"] for login in result["user3"]])
+        mock_client.delete_pit.assert_awaited_once_with(body={"pit_id": ["test_pit"]})
+        mock_client.close.assert_awaited_once()
+
+    @patch("impossible_travel.ingestion.opensearch_ingestion.AsyncOpenSearch")
+    def test_process_users_logins_exception(self, mock_opensearch):
+        """The failure of the query of a user is logged and raised, so the logins aren't returned incomplete"""
+
+        async def search_side_effect(body):
+            username = body["query"]["bool"]["must"][1]["match"]["user.name"]
+            if username == "broken":
+                raise ConnectionError("connection lost")
+            return {"hits": {"hits": [self._user_hit(username, 0)]}}
+
+        mock_client = AsyncMock()
+        mock_client.create_pit.return_value = {"pit_id": "test_pit"}
+        mock_client.search.side_effect = search_side_effect
+        mock_opensearch.return_value = mock_client
+
+        ingestor = AsyncOpensearchIngestion(self.opensearch_config, mapping={})
+        with self.assertLogs(ingestor.logger, level="ERROR"), self.assertRaises(ConnectionError):
+            ingestor.process_users_logins(self.start_date, self.end_date, ["usera", "broken", "userb"])
+        mock_client.delete_pit.assert_awaited_once()
+        mock_client.close.assert_awaited_once()
+
+    @patch("impossible_travel.ingestion.opensearch_ingestion.AsyncOpenSearch")
+    def test_process_logins_bulk_slices(self, mock_opensearch):
+        """The point in time is split in a slice per concurrent request and the slices are merged in chronological order"""
+        config = dict(self.opensearch_config, concurrency=3, bucket_size=2)
+        hits = [self._user_hit("Stitch" if i % 2 else "jessica", i) for i in range(10)]
+
+        async def search_side_effect(body):
+            self.assertEqual("test_pit", body["pit"]["id"])
+            slice_hits = [hit for hit in hits if hit["sort"][0] % body["slice"]["max"] == body["slice"]["id"]]
+            start = next((i + 1 for i, hit in enumerate(slice_hits) if hit["sort"] == body.get("search_after")), 0)
+            return {"hits": {"hits": slice_hits[start : start + body["size"]]}}
+
+        mock_client = AsyncMock()
+        mock_client.create_pit.return_value = {"pit_id": "test_pit"}
+        mock_client.search.side_effect = search_side_effect
+        mock_opensearch.return_value = mock_client
+
+        ingestor = AsyncOpensearchIngestion(config, mapping=config["custom_mapping"])
+        result = ingestor.process_logins_bulk(self.start_date, self.end_date)
+
+        self.assertCountEqual(["stitch", "jessica"], result.keys())
+        self.assertListEqual([f"log_id_{i}" for i in range(1, 10, 2)], [login["_id"] for login in result["stitch"]])
+        self.assertListEqual([f"log_id_{i}" for i in range(0, 10, 2)], [login["_id"] for login in result["jessica"]])
+        slices = {call.kwargs["body"]["slice"]["id"] for call in mock_client.search.call_args_list}
+        self.assertSetEqual({0, 1, 2}, slices)
+        mock_client.create_pit.assert_awaited_once()
+        mock_client.delete_pit.assert_awaited_once_with(body={"pit_id": ["test_pit"]})
+        mock_client.close.assert_awaited_once()
+
+    @patch("impossible_travel.ingestion.opensearch_ingestion.AsyncOpenSearch")
+    def test_process_logins_bulk_exception(self, mock_opensearch):
+        """An error while streaming a slice is logged and raised, and the point in time is closed"""
+        mock_client = AsyncMock()
+        mock_client.create_pit.return_value = {"pit_id": "test_pit"}
+        mock_client.search.side_effect = Exception("Search failed")
+        mock_opensearch.return_value = mock_client
+
+        ingestor = AsyncOpensearchIngestion(self.opensearch_config, mapping={})
+        with self.assertLogs(ingestor.logger, level="ERROR"), self.assertRaisesRegex(Exception, "Search failed"):
+            ingestor.process_logins_bulk(self.start_date, self.end_date)
+        mock_client.delete_pit.assert_awaited_once()
+        mock_client.close.assert_awaited_once()
+
+    @patch("impossible_travel.ingestion.elasticsearch_ingestion.AsyncElasticsearch")
+    def test_elasticsearch_process_logins_bulk(self, mock_elasticsearch):
+        """With a single concurrent request the point in time isn't sliced"""
+        config = dict(self.elasticsearch_config, concurrency=1)
+        mock_client = AsyncMock()
+        mock_client.open_point_in_time.return_value = {"id": "test_pit"}
+        mock_client.search.return_value = {"hits": {"hits": [self._user_hit("Stitch", 0), self._user_hit("Jessica", 1)]}}
+        mock_elasticsearch.return_value = mock_client
+
+        ingestor = AsyncElasticsearchIngestion(config, mapping=config["custom_mapping"])
+        result = ingestor.process_logins_bulk(self.start_date, self.end_date)
+
+        self.assertListEqual(["stitch", "jessica"], list(result.keys()))
+        body = mock_client.search.call_args.kwargs["body"]
+        self.assertNotIn("slice", body)
+        self.assertListEqual(["@timestamp"], body["sort"])
+        self.assertIn({"exists": {"field": "user.name"}}, body["query"]["bool"]["must"])
+        mock_client.close_point_in_time.assert_awaited_once_with(id="test_pit")
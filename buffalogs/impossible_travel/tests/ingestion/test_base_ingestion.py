@@ -1,4 +1,8 @@
+from datetime import datetime, timezone
+from unittest.mock import patch
+
 from django.test import TestCase
+from impossible_travel.ingestion.base_ingestion import BaseIngestion, collapse_logins, compile_mapping
 from impossible_travel.ingestion.elasticsearch_ingestion import ElasticsearchIngestion
 from impossible_travel.tests.utils import load_ingestion_config_data, load_test_data
 
@@ -177,3 +181,96 @@ class TestBaseIngestion(TestCase):
         ]
         self.assertEqual(len(expected_result), len(actual_result))
         self.assertListEqual(expected_result, actual_result)
+
+    def test_group_logins_by_user(self):
+        # test the grouping of the raw logins by lowercase username, with nested or flat username keys
+        logins = [
+            {"_id": "log_id_0", "user": {"name": "Stitch"}},
+            {"_id": "log_id_1", "user.name": "Scooby"},
+            {"_id": "log_id_2", "user": {"name": "stitch"}},
+            {"_id": "log_id_3", "user": {"name": ""}},
+            {"_id": "log_id_4"},
+        ]
+        ingestor = ElasticsearchIngestion(
+            ingestion_config=self.ingestion_config["elasticsearch"], mapping=self.ingestion_config["elasticsearch"]["custom_mapping"]
+        )
+        actual_result = ingestor.group_logins_by_user(logins)
+        self.assertDictEqual({"stitch": [logins[0], logins[2]], "scooby": [logins[1]]}, actual_result)
+
+    def test_process_logins_bulk_fallback(self):
+        # test the default process_logins_bulk, that falls back to the per-user extraction
+        ingestor = ElasticsearchIngestion(
+            ingestion_config=self.ingestion_config["elasticsearch"], mapping=self.ingestion_config["elasticsearch"]["custom_mapping"]
+        )
+        start_date = datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc)
+        end_date = datetime(2025, 2, 26, 14, 0, tzinfo=timezone.utc)
+        with patch.object(ingestor, "iter_users", return_value=iter(["Stitch", "Scooby"])), patch.object(
+            ingestor, "iter_user_logins", side_effect=lambda start, end, username: iter([{"_id": f"{username}_login"}])
+        ) as mock_iter_user_logins:
+            actual_result = BaseIngestion.process_logins_bulk(ingestor, start_date, end_date)
+        self.assertDictEqual({"stitch": [{"_id": "stitch_login"}], "scooby": [{"_id": "scooby_login"}]}, actual_result)
+        self.assertEqual(2, mock_iter_user_logins.call_count)
+
+    def test_iter_fallback(self):
+        # test the default iter_users and iter_user_logins, that stream the results of process_users and process_user_logins
+        ingestor = ElasticsearchIngestion(
+            ingestion_config=self.ingestion_config["elasticsearch"], mapping=self.ingestion_config["elasticsearch"]["custom_mapping"]
+        )
+        start_date = datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc)
+        end_date = datetime(2025, 2, 26, 14, 0, tzinfo=timezone.utc)
+        with patch.object(ingestor, "process_users", return_value=["Stitch", "Scooby"]), patch.object(
+            ingestor, "process_user_logins", return_value=[{"_id": "log_id_0"}, {"_id": "log_id_1"}]
+        ):
+            self.assertListEqual(["Stitch", "Scooby"], list(BaseIngestion.iter_users(ingestor, start_date, end_date)))
+            self.assertListEqual([{"_id": "log_id_0"}, {"_id": "log_id_1"}], list(BaseIngestion.iter_user_logins(ingestor, start_date, end_date, "Stitch")))
+
+    def test_compile_mapping(self):
+        # test the compiled mapping: nested and flat keys, missing paths and values that are not dicts
+        normalize = compile_mapping({"source.geo.location.lat": "lat", "user.name": "username", "_id": "id", "agent": "agent", "a'b\"c": "quotes"})
+        self.assertDictEqual(
+            {"lat": 45.1, "username": "Stitch", "id": "log_id_0", "agent": "", "quotes": "x"},
+            normalize({"source": {"geo": {"location": {"lat": 45.1}}}, "user": {"name": "Stitch"}, "_id": "log_id_0", "a'b\"c": "x"}),
+        )
+        # a flat dotted key is not a nested path, as in the previous normalization
+        self.assertEqual("", normalize({"source.geo.location": {"lat": 45.1}})["lat"])
+        self.assertEqual("", normalize({"source": {"geo": "Italy"}})["lat"])
+        self.assertEqual("", normalize({"source": {"geo": ["Italy"]}})["lat"])
+        self.assertEqual("", normalize({})["username"])
+
+    def test_iter_normalized(self):
+        # test that the logins are normalized lazily, while they are consumed, skipping the ones without the required fields
+        logins_returned_user1 = load_test_data("test_data_elasticsearch_returned_logins_user1")
+        ingestor = ElasticsearchIngestion(
+            ingestion_config=self.ingestion_config["elasticsearch"], mapping=self.ingestion_config["elasticsearch"]["custom_mapping"]
+        )
+        consumed = []
+
+        def logins_stream():
+            for login in logins_returned_user1 + [{"_id": "log_id_without_geo"}]:
+                consumed.append(login)
+                yield login
+
+        normalized = ingestor.iter_normalized(logins_stream())
+        self.assertListEqual([], consumed)
+        self.assertEqual("log_id_0", next(normalized)["id"])
+        self.assertEqual(1, len(consumed))
+        self.assertListEqual(ingestor.normalize_fields(logins_returned_user1), [ingestor.normalize_fields(logins_returned_user1)[0]] + list(normalized))
+        self.assertEqual(len(logins_returned_user1) + 1, len(consumed))
+
+    def test_collapse_logins(self):
+        # test that the consecutive identical logins within the gap are merged into the first one, while the others are kept as they are
+        def login(i, second, ip="203.0.113.1"):
+            return {"id": f"log_id_{i}", "timestamp": f"2025-02-26T13:30:{second:02d}.000Z", "ip": ip, "agent": "Firefox", "country": "Italy", "index": "cloud"}
+
+        logins = [login(0, 0), login(1, 5), login(2, 20), login(3, 21, ip="203.0.113.2"), login(4, 50), login(5, 51)]
+        collapsed = collapse_logins(logins, max_gap_seconds=15)
+        self.assertListEqual(["log_id_0", "log_id_3", "log_id_4"], [login["id"] for login in collapsed])
+        self.assertDictEqual(
+            dict(logins[0], first_seen="2025-02-26T13:30:00.000Z", last_seen="2025-02-26T13:30:20.000Z", last_id="log_id_2", count=3), collapsed[0]
+        )
+        self.assertIs(logins[3], collapsed[1])
+        self.assertEqual(2, collapsed[2]["count"])
+        # the logins are not modified
+        self.assertNotIn("count", logins[0])
+        self.assertListEqual(logins, collapse_logins(logins, max_gap_seconds=0))
+        self.assertListEqual(logins[:2], collapse_logins(logins[:2], max_gap_seconds=4))
@@ -1,11 +1,13 @@
 from datetime import datetime, timezone
 from typing import List
+from unittest.mock import MagicMock, patch
 
 import elasticsearch
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
 from elasticsearch.dsl import connections
 from elasticsearch.helpers import bulk
-from impossible_travel.ingestion.elasticsearch_ingestion import ElasticsearchIngestion
+from impossible_travel.ingestion import elasticsearch_ingestion
+from impossible_travel.ingestion.elasticsearch_ingestion import RAW_LOGINS_FILTER_PATH, ElasticsearchIngestion, RawJsonSerializer, get_index_name
 from impossible_travel.tests.utils import load_index_template, load_ingestion_config_data, load_test_data
 
 
@@ -198,3 +200,142 @@ class ElasticsearchIngestionTestCase(TestCase):
         user5_logins = elastic_ingestor.process_user_logins(start_date, end_date, username="bugs.bunny2")
         self.assertEqual(1, len(user5_logins))
         self.assertListEqual(expected_return_user5, user5_logins)
+
+    def test_process_logins_bulk(self):
+        # test the function process_logins_bulk: same logins of the per-user extraction, with a single query
+        expected_return_user1 = load_test_data("test_data_elasticsearch_returned_logins_user1")
+        expected_return_user2 = load_test_data("test_data_elasticsearch_returned_logins_user2")
+        expected_return_user3 = load_test_data("test_data_elasticsearch_returned_logins_user3")
+        expected_return_user4 = load_test_data("test_data_elasticsearch_returned_logins_user4")
+        expected_return_user5 = load_test_data("test_data_elasticsearch_returned_logins_user5")
+        start_date = datetime(2025, 2, 26, 10, 40, tzinfo=timezone.utc)
+        end_date = datetime(2025, 2, 26, 18, 10, tzinfo=timezone.utc)
+        elastic_ingestor = ElasticsearchIngestion(ingestion_config=self.elastic_config, mapping=self.elastic_config["custom_mapping"])
+        logins_by_user = elastic_ingestor.process_logins_bulk(start_date, end_date)
+        self.assertCountEqual(["stitch", "scooby.doo@gmail.com", "bugs-bunny@organization.com", "bugs.bunny", "bugs.bunny2"], logins_by_user.keys())
+        self.assertListEqual(expected_return_user1, logins_by_user["stitch"])
+        self.assertListEqual(expected_return_user2, logins_by_user["scooby.doo@gmail.com"])
+        self.assertListEqual(expected_return_user3, logins_by_user["bugs-bunny@organization.com"])
+        self.assertListEqual(expected_return_user4, logins_by_user["bugs.bunny"])
+        self.assertListEqual(expected_return_user5, logins_by_user["bugs.bunny2"])
+
+    def test_process_logins_bulk_ConnectionError(self):
+        # test the function process_logins_bulk with the exception ConnectionError
+        self.elastic_config["url"] = "http://unexisting-url:8888"
+        start_date = datetime(2025, 2, 26, 11, 30, tzinfo=timezone.utc)
+        end_date = datetime(2025, 2, 26, 12, 00, tzinfo=timezone.utc)
+        elastic_ingestor = ElasticsearchIngestion(ingestion_config=self.elastic_config, mapping=self.elastic_config["custom_mapping"])
+        # the error is raised, so the detection window isn't completed
+        with self.assertLogs(elastic_ingestor.logger, level="ERROR"), self.assertRaises(elasticsearch.ConnectionError):
+            elastic_ingestor.process_logins_bulk(start_date, end_date)
+
+    def test_iter_users(self):
+        # test the function iter_users with a bucket_size lower than the number of users, so with more composite aggregation pages
+        self.elastic_config["bucket_size"] = 1
+        start_date = datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc)
+        end_date = datetime(2025, 2, 26, 14, 00, tzinfo=timezone.utc)
+        elastic_ingestor = ElasticsearchIngestion(ingestion_config=self.elastic_config, mapping=self.elastic_config["custom_mapping"])
+        returned_users = list(elastic_ingestor.iter_users(start_date, end_date))
+        self.assertCountEqual(["Stitch", "scooby.doo@gmail.com", "bugs-bunny@organization.com", "bugs.bunny"], returned_users)
+
+    def test_iter_user_logins(self):
+        # test the function iter_user_logins with a bucket_size lower than the number of logins, so with more search_after pages
+        self.elastic_config["bucket_size"] = 1
+        expected_return_user2 = load_test_data("test_data_elasticsearch_returned_logins_user2")
+        start_date = datetime(2025, 2, 26, 10, 40, tzinfo=timezone.utc)
+        end_date = datetime(2025, 2, 26, 18, 10, tzinfo=timezone.utc)
+        elastic_ingestor = ElasticsearchIngestion(ingestion_config=self.elastic_config, mapping=self.elastic_config["custom_mapping"])
+        user2_logins = list(elastic_ingestor.iter_user_logins(start_date, end_date, username="scooby.doo@gmail.com"))
+        self.assertEqual(4, len(user2_logins))
+        self.assertListEqual(expected_return_user2, user2_logins)
+
+
+class ElasticsearchRawResponsesTestCase(SimpleTestCase):
+    """Test the raw responses mode of the Elasticsearch ingestion, with a mocked client"""
+
+    def setUp(self):
+        self.elastic_config = dict(load_ingestion_config_data()["elasticsearch"], raw_responses=True, bucket_size=2)
+        self.start_date = datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc)
+        self.end_date = datetime(2025, 2, 26, 14, 0, tzinfo=timezone.utc)
+
+    def _raw_hit(self, i: int, index: str = "cloud-test_data") -> dict:
+        return {
+            "_index": index,
+            "_id": f"log_id_{i}",
+            "_source": {"user": {"name": "Stitch"}, "@timestamp": f"2025-02-26T13:{30 + i:02d}:00.000Z", "source": {"ip": "1.2.3.4"}},
+            "sort": [i],
+        }
+
+    def _response(self, body: dict) -> MagicMock:
+        response = MagicMock()
+        response.body = body
+        return response
+
+    def test_raw_client_disabled(self):
+        """The raw client is created only if enabled in the config"""
+        config = dict(self.elastic_config, raw_responses=False)
+        self.assertIsNone(ElasticsearchIngestion(config, config["custom_mapping"]).raw_client)
+
+    @patch("impossible_travel.ingestion.elasticsearch_ingestion.Elasticsearch")
+    def test_raw_client_serializers(self, mock_elasticsearch):
+        """Both the JSON mimetypes returned by Elasticsearch are decoded by the raw serializer"""
+        ElasticsearchIngestion(self.elastic_config, self.elastic_config["custom_mapping"])
+        serializers = mock_elasticsearch.call_args.kwargs["serializers"]
+        self.assertIsInstance(serializers["application/json"], RawJsonSerializer)
+        self.assertIsInstance(serializers["application/vnd.elasticsearch+json"], RawJsonSerializer)
+
+    def test_raw_serializer_loads(self):
+        """The raw serializer decodes the same data with and without orjson"""
+        data = b'{"hits": {"hits": [{"_id": "log_id_1", "_source": {"source": {"geo": {"location": {"lat": 45.4, "lon": 9.1}}}}}]}}'
+        decoded = RawJsonSerializer().loads(data)
+        with patch.object(elasticsearch_ingestion, "orjson", None):
+            self.assertDictEqual(decoded, RawJsonSerializer().loads(data))
+        self.assertEqual(45.4, decoded["hits"]["hits"][0]["_source"]["source"]["geo"]["location"]["lat"])
+
+    @patch("impossible_travel.ingestion.elasticsearch_ingestion.Elasticsearch")
+    def test_process_logins_bulk_raw(self, mock_elasticsearch):
+        """The raw pages are trimmed by filter_path and paginated with search_after on the point in time"""
+        mock_client = mock_elasticsearch.return_value
+        mock_client.open_point_in_time.return_value = {"id": "test_pit"}
+        mock_client.search.side_effect = [
+            self._response({"pit_id": "test_pit_2", "hits": {"hits": [self._raw_hit(0), self._raw_hit(1, index="fw-proxy-test_data")]}}),
+            self._response({"pit_id": "test_pit_2", "hits": {"hits": [self._raw_hit(2)]}}),
+        ]
+        ingestor = ElasticsearchIngestion(self.elastic_config, self.elastic_config["custom_mapping"])
+        result = ingestor.process_logins_bulk(self.start_date, self.end_date)
+
+        self.assertListEqual(["stitch"], list(result.keys()))
+        self.assertListEqual(["log_id_0", "log_id_1", "log_id_2"], [login["_id"] for login in result["stitch"]])
+        self.assertListEqual(["cloud", "fw-proxy", "cloud"], [login["_index"] for login in result["stitch"]])
+        self.assertNotIn("_source", result["stitch"][0])
+        first_call, second_call = mock_client.search.call_args_list
+        self.assertEqual(RAW_LOGINS_FILTER_PATH, first_call.kwargs["filter_path"])
+        self.assertEqual("test_pit_2", second_call.kwargs["body"]["pit"]["id"])
+        self.assertListEqual([1], second_call.kwargs["body"]["search_after"])
+        mock_client.close_point_in_time.assert_called_once_with(id="test_pit_2")
+
+    @patch("impossible_travel.ingestion.elasticsearch_ingestion.Elasticsearch")
+    def test_process_logins_bulk_raw_no_hits(self, mock_elasticsearch):
+        """The hits key is removed by filter_path from the empty responses"""
+        mock_client = mock_elasticsearch.return_value
+        mock_client.open_point_in_time.return_value = {"id": "test_pit"}
+        mock_client.search.return_value = self._response({"pit_id": "test_pit"})
+        ingestor = ElasticsearchIngestion(self.elastic_config, self.elastic_config["custom_mapping"])
+        self.assertDictEqual({}, ingestor.process_logins_bulk(self.start_date, self.end_date))
+        mock_client.close_point_in_time.assert_called_once_with(id="test_pit")
+
+    @patch("impossible_travel.ingestion.elasticsearch_ingestion.Elasticsearch")
+    def test_process_user_logins_raw(self, mock_elasticsearch):
+        """The logins of a single user are extracted with a raw search too"""
+        mock_client = mock_elasticsearch.return_value
+        mock_client.search.return_value = self._response({"hits": {"total": {"value": 2}, "hits": [self._raw_hit(0), self._raw_hit(1)]}})
+        ingestor = ElasticsearchIngestion(self.elastic_config, self.elastic_config["custom_mapping"])
+        logins = ingestor.process_user_logins(self.start_date, self.end_date, "Stitch")
+        self.assertListEqual(["log_id_0", "log_id_1"], [login["_id"] for login in logins])
+        self.assertEqual(RAW_LOGINS_FILTER_PATH, mock_client.search.call_args.kwargs["filter_path"])
+
+    def test_get_index_name(self):
+        self.assertEqual("cloud", get_index_name("cloud-2025.02.26"))
+        self.assertEqual("fw-proxy", get_index_name("fw-proxy-2025.02.26"))
+        self.assertEqual("fw-proxy", get_index_name("fw-test"))
+        self.assertEqual("", get_index_name(""))
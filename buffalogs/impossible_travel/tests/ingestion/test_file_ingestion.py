@@ -0,0 +1,163 @@
+import gzip
+import json
+import os
+import tempfile
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+from impossible_travel.ingestion import file_ingestion
+from impossible_travel.ingestion.file_ingestion import FileIngestion
+from impossible_travel.modules.detection import UserDetectionState
+from impossible_travel.tests.utils import load_ingestion_config_data, load_test_data
+
+
+class FileIngestionTestCase(SimpleTestCase):
+    def setUp(self):
+        self.ingestion_config = load_ingestion_config_data()
+        self.mapping = self.ingestion_config["elasticsearch"]["custom_mapping"]
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.start_date = datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc)
+        self.end_date = datetime(2025, 2, 26, 14, 0, tzinfo=timezone.utc)
+
+    def _write_ndjson(self, name: str, documents: list, opener=open) -> str:
+        path = os.path.join(self.tmp_dir.name, name)
+        with opener(path, "wt") as f:
+            for document in documents:
+                f.write(json.dumps(document) + "\n")
+        return path
+
+    def _login(self, i: int, username: str = "Stitch", **fields) -> dict:
+        login = {
+            "@timestamp": f"2025-02-26T13:{30 + i:02d}:00.000Z",
+            "user": {"name": username},
+            "event": {"outcome": "success", "category": "authentication", "type": "start"},
+            "source": {"ip": "192.0.2.1", "geo": {"country_name": "Italy", "location": {"lat": 45.4, "lon": 9.1}}},
+        }
+        login.update(fields)
+        return login
+
+    def _ingestor(self, path: str) -> FileIngestion:
+        return FileIngestion(dict(self.ingestion_config["file"], path=path), self.mapping)
+
+    def test_process_users(self):
+        """Only the users with successful logins in the time range are returned, without case duplicates"""
+        self._write_ndjson("cloud-test_data.ndjson", load_test_data("test_data_elasticsearch_cloud"))
+        ingestor = self._ingestor(self.tmp_dir.name)
+        users = ingestor.process_users(self.start_date, self.end_date)
+        self.assertCountEqual(["Stitch", "bugs-bunny@organization.com", "scooby.doo@gmail.com"], users)
+        self.assertListEqual([], ingestor.process_users(datetime(2025, 2, 26, 11, 30, tzinfo=timezone.utc), self.start_date))
+
+    def test_process_user_logins_window(self):
+        """The logins are sorted by timestamp whatever the order of the lines and filtered by [start_date, end_date)"""
+        path = self._write_ndjson("logins.ndjson", [self._login(i) for i in (5, 0, 30, 10)] + [self._login(1, username="stitch")])
+        ingestor = self._ingestor(path)
+        logins = ingestor.process_user_logins(self.start_date, self.end_date, "STITCH")
+        self.assertListEqual(["logins.ndjson:2", "logins.ndjson:5", "logins.ndjson:1", "logins.ndjson:4"], [login["_id"] for login in logins])
+        end_date = datetime(2025, 2, 26, 13, 35, tzinfo=timezone.utc)
+        self.assertEqual(2, len(ingestor.process_user_logins(self.start_date, end_date, "Stitch")))
+        self.assertListEqual([], ingestor.process_user_logins(self.start_date, self.end_date, "unknown"))
+
+    def test_process_logins_bulk_normalized(self):
+        """The logins are normalized with the Elasticsearch mapping"""
+        path = self._write_ndjson("logins.ndjson", [self._login(1, _id="log_id_1"), self._login(0, username="Jessica", _id="log_id_0")])
+        ingestor = self._ingestor(path)
+        result = ingestor.process_logins_bulk(self.start_date, self.end_date)
+        self.assertListEqual(["jessica", "stitch"], list(result.keys()))
+        normalized = ingestor.normalize_fields(result["stitch"])
+        self.assertEqual("log_id_1", normalized[0]["id"])
+        self.assertEqual("2025-02-26T13:31:00.000Z", normalized[0]["timestamp"])
+        self.assertEqual(45.4, normalized[0]["lat"])
+
+    def test_epoch_millis_timestamp(self):
+        """The numeric timestamps (epoch milliseconds) are converted to the ISO format expected by the detection"""
+        epoch_millis = int(datetime(2025, 2, 26, 13, 31, 0, 250000, tzinfo=timezone.utc).timestamp() * 1000)
+        path = self._write_ndjson("logins.ndjson", [self._login(1, **{"@timestamp": epoch_millis}), self._login(0)])
+        ingestor = self._ingestor(path)
+        normalized = ingestor.normalize_fields(ingestor.process_logins_bulk(self.start_date, self.end_date)["stitch"])
+        self.assertListEqual(["2025-02-26T13:30:00.000Z", "2025-02-26T13:31:00.250Z"], [login["timestamp"] for login in normalized])
+        self.assertEqual(datetime(2025, 2, 26, 13, 31, 0, 250000, tzinfo=timezone.utc), UserDetectionState._parse_timestamp(normalized[1]["timestamp"]))
+
+    def test_naive_iso_timestamp(self):
+        """The ISO timestamps without timezone are considered in UTC and made aware, the aware ones are kept"""
+        path = self._write_ndjson(
+            "logins.ndjson", [self._login(0, **{"@timestamp": "2025-02-26T13:31:00.250"}), self._login(1, **{"@timestamp": "2025-02-26T15:32:00+02:00"})]
+        )
+        ingestor = self._ingestor(path)
+        normalized = ingestor.normalize_fields(ingestor.process_logins_bulk(self.start_date, self.end_date)["stitch"])
+        self.assertListEqual(["2025-02-26T13:31:00.250Z", "2025-02-26T15:32:00+02:00"], [login["timestamp"] for login in normalized])
+        self.assertTrue(all(UserDetectionState._parse_timestamp(login["timestamp"]).tzinfo for login in normalized))
+
+    def test_elasticsearch_hits(self):
+        """The Elasticsearch hits are unwrapped as done by the Elasticsearch ingestion"""
+        hit = {"_index": "fw-proxy-test_data", "_id": "log_id_7", "_source": self._login(0)}
+        ingestor = self._ingestor(self._write_ndjson("hits.ndjson", [hit]))
+        [login] = ingestor.process_user_logins(self.start_date, self.end_date, "Stitch")
+        self.assertEqual("fw-proxy", login["_index"])
+        self.assertEqual("log_id_7", login["_id"])
+        self.assertNotIn("_source", login)
+
+    def test_filtered_lines(self):
+        """The lines that aren't valid, the failed logins and the logins without username or timestamp are skipped"""
+        path = self._write_ndjson(
+            "logins.ndjson",
+            [
+                self._login(0),
+                self._login(1, event={"outcome": "failure", "category": "authentication", "type": "start"}),
+                self._login(2, user={"name": ""}),
+                self._login(3, **{"@timestamp": "not a date"}),
+                self._login(4, **{"@timestamp": 1740576840000}),
+                dict(self._login(5), event={"category": ["authentication", "network"]}),
+            ],
+        )
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("{not json\n\n[1, 2]\n")
+        ingestor = self._ingestor(path)
+        with self.assertLogs(ingestor.logger, level="WARNING"):
+            logins = ingestor.process_user_logins(self.start_date, self.end_date, "Stitch")
+        self.assertListEqual(["logins.ndjson:1", "logins.ndjson:5", "logins.ndjson:6"], [login["_id"] for login in logins])
+
+    def test_gzip_file(self):
+        path = self._write_ndjson("logins.ndjson.gz", [self._login(0), self._login(1)], opener=gzip.open)
+        self.assertEqual(2, len(self._ingestor(path).process_user_logins(self.start_date, self.end_date, "Stitch")))
+
+    def test_zstd_not_installed(self):
+        """Without the zstandard package the zstd files are not read, but the error is logged"""
+        path = self._write_ndjson("logins.ndjson.zst", [self._login(0)])
+        ingestor = self._ingestor(path)
+        with patch.object(file_ingestion, "zstandard", None), self.assertLogs(ingestor.logger, level="ERROR"):
+            self.assertListEqual([], ingestor.process_users(self.start_date, self.end_date))
+
+    def test_supported_extensions(self):
+        """The compressed files in a directory are read with both the zstd extensions"""
+        for name in ("logins.ndjson.zst", "logins.jsonl.zstd", "logins.json.gz", "logins.txt"):
+            open(os.path.join(self.tmp_dir.name, name), "wb").close()
+        self.assertListEqual(
+            ["logins.json.gz", "logins.jsonl.zstd", "logins.ndjson.zst"], [os.path.basename(path) for path in self._ingestor(self.tmp_dir.name)._get_files()]
+        )
+
+    def test_missing_or_empty_files(self):
+        ingestor = self._ingestor(os.path.join(self.tmp_dir.name, "missing.ndjson"))
+        with self.assertLogs(ingestor.logger, level="ERROR"):
+            self.assertListEqual([], ingestor.process_users(self.start_date, self.end_date))
+        self.assertListEqual([], self._ingestor(self._write_ndjson("empty.ndjson", [])).process_users(self.start_date, self.end_date))
+
+    def test_loaded_once(self):
+        """The files are read only at the first extraction"""
+        ingestor = self._ingestor(self._write_ndjson("logins.ndjson", [self._login(0)]))
+        with patch.object(FileIngestion, "_iter_lines", wraps=ingestor._iter_lines) as mock_iter_lines:
+            ingestor.process_users(self.start_date, self.end_date)
+            ingestor.process_user_logins(self.start_date, self.end_date, "Stitch")
+            ingestor.process_logins_bulk(self.start_date, self.end_date)
+        mock_iter_lines.assert_called_once()
+
+    def test_reloaded_if_modified(self):
+        """The files are read again if they are modified, e.g. when the instance is reused by the ingestion registry"""
+        path = self._write_ndjson("logins.ndjson", [self._login(0)])
+        ingestor = self._ingestor(path)
+        self.assertEqual(1, len(ingestor.process_user_logins(self.start_date, self.end_date, "Stitch")))
+        self._write_ndjson("logins.ndjson", [self._login(0), self._login(1)])
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        self.assertEqual(2, len(ingestor.process_user_logins(self.start_date, self.end_date, "Stitch")))
@@ -1,6 +1,15 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
 from django.test import TestCase
-from impossible_travel.ingestion.elasticsearch_ingestion import ElasticsearchIngestion
-from impossible_travel.ingestion.ingestion_factory import IngestionFactory
+from impossible_travel.ingestion.elasticsearch_ingestion import AsyncElasticsearchIngestion, ElasticsearchIngestion
+from impossible_travel.ingestion.file_ingestion import FileIngestion
+from impossible_travel.ingestion.ingestion_factory import IngestionFactory, IngestionRegistry, get_config_path
+from impossible_travel.ingestion.multi_ingestion import MultiIngestion
+from impossible_travel.ingestion.splunk_ingestion import SplunkIngestion
 from impossible_travel.tests.utils import load_ingestion_config_data
 
 
@@ -32,3 +41,90 @@ class IngestionFactoryTestCase(TestCase):
         ingestion_class = factory.get_ingestion_class()
         self.assertIsInstance(ingestion_class, ElasticsearchIngestion)
         self.assertEqual(excpected_config["elasticsearch"], factory.ingestion_config)
+
+    def test_get_ingestion_class_async(self):
+        # test the async Elasticsearch ingestion source, enabled by the "async" flag
+        config = load_ingestion_config_data()
+        config["elasticsearch"]["async"] = True
+        with patch.object(IngestionFactory, "_read_config", return_value=config):
+            ingestion_class = IngestionFactory().get_ingestion_class()
+        self.assertIsInstance(ingestion_class, AsyncElasticsearchIngestion)
+        self.assertEqual(8, ingestion_class.concurrency)
+
+    def test_get_ingestion_class_file(self):
+        # test the file ingestion source, that uses the Elasticsearch mapping
+        config = load_ingestion_config_data()
+        config["active_ingestion"] = "file"
+        with patch.object(IngestionFactory, "_read_config", return_value=config):
+            factory = IngestionFactory()
+        self.assertIsInstance(factory.get_ingestion_class(), FileIngestion)
+        self.assertDictEqual(config["elasticsearch"]["custom_mapping"], factory.mapping)
+
+    @patch("impossible_travel.ingestion.splunk_ingestion.client.connect")
+    def test_get_ingestion_class_multiple_sources(self, mock_connect):
+        # test more active sources, queried together by the MultiIngestion with their own config and mapping
+        config = load_ingestion_config_data()
+        config["active_ingestion"] = ["elasticsearch", "splunk"]
+        with patch.object(IngestionFactory, "_read_config", return_value=config):
+            factory = IngestionFactory()
+        ingestion_class = factory.get_ingestion_class()
+        self.assertIsInstance(ingestion_class, MultiIngestion)
+        self.assertListEqual(["elasticsearch", "splunk"], list(ingestion_class.ingestions))
+        self.assertIsInstance(ingestion_class.ingestions["splunk"], SplunkIngestion)
+        self.assertDictEqual(config["splunk"]["custom_mapping"], ingestion_class.ingestions["splunk"].mapping)
+        self.assertDictEqual(config["elasticsearch"]["custom_mapping"], ingestion_class.mapping)
+        self.assertEqual(config["sources_timeout"], ingestion_class.timeout)
+        self.assertFalse(ingestion_class.partial)
+        self.assertEqual(config["elasticsearch"], factory.ingestion_config)
+
+    def test_read_config_unsupported_source(self):
+        config = load_ingestion_config_data()
+        config["active_ingestion"] = ["elasticsearch", "unknown"]
+        with tempfile.TemporaryDirectory() as config_dir:
+            config_path = os.path.join(config_dir, "ingestion.json")
+            with open(config_path, "w", encoding="utf-8") as f:
+                json.dump(config, f)
+            with patch("impossible_travel.ingestion.ingestion_factory.get_config_path", return_value=config_path):
+                with self.assertRaises(ValueError):
+                    IngestionFactory()
+
+    def test_registry_reuse(self):
+        # the ingestion object is created once per process and config file version
+        registry = IngestionRegistry()
+        ingestion = registry.get_ingestion()
+        self.assertIsInstance(ingestion, ElasticsearchIngestion)
+        with patch.object(IngestionFactory, "get_ingestion_class") as get_ingestion_class_mock, patch.object(ingestion, "close") as close_mock:
+            self.assertIs(ingestion, registry.get_ingestion())
+            get_ingestion_class_mock.assert_not_called()
+            # a forked process creates its own connections, without closing the ones still used by the parent process
+            with patch("impossible_travel.ingestion.ingestion_factory.os.getpid", return_value=os.getpid() + 1):
+                self.assertIs(get_ingestion_class_mock.return_value, registry.get_ingestion())
+            close_mock.assert_not_called()
+        registry.clear()
+        ingestion = registry.get_ingestion()
+        with patch.object(ingestion, "close") as close_mock:
+            registry.clear()
+        close_mock.assert_called_once()
+        self.assertIsNot(ingestion, registry.get_ingestion())
+
+    def test_registry_config_modified(self):
+        # the ingestion object is created again if the config file is modified
+        with tempfile.TemporaryDirectory() as config_dir:
+            config_path = shutil.copy(get_config_path(), config_dir)
+            with patch("impossible_travel.ingestion.ingestion_factory.get_config_path", return_value=config_path):
+                registry = IngestionRegistry()
+                ingestion = registry.get_ingestion()
+                stat = os.stat(config_path)
+                os.utime(config_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+                with patch.object(ingestion, "close") as close_mock:
+                    self.assertIsNot(ingestion, registry.get_ingestion())
+                # the connections of the previous ingestion object are closed
+                close_mock.assert_called_once()
+
+    def test_client_pool_options(self):
+        # the connections pool of the clients is tuned by the config
+        config = dict(self.ingestion_config["elasticsearch"], connections_per_node=4, max_retries=1)
+        with patch("impossible_travel.ingestion.elasticsearch_ingestion.connections.create_connection") as create_connection_mock:
+            ElasticsearchIngestion(config, config["custom_mapping"])
+        self.assertEqual(4, create_connection_mock.call_args.kwargs["connections_per_node"])
+        self.assertEqual(1, create_connection_mock.call_args.kwargs["max_retries"])
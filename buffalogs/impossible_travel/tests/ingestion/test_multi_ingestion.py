@@ -0,0 +1,111 @@
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+
+from django.test import SimpleTestCase
+from impossible_travel.ingestion.file_ingestion import FileIngestion
+from impossible_travel.ingestion.multi_ingestion import MultiIngestion, get_login_date
+from impossible_travel.tests.utils import load_ingestion_config_data
+
+
+class MultiIngestionTestCase(SimpleTestCase):
+    def setUp(self):
+        self.ingestion_config = load_ingestion_config_data()
+        self.mapping = self.ingestion_config["elasticsearch"]["custom_mapping"]
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.start_date = datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc)
+        self.end_date = datetime(2025, 2, 26, 14, 0, tzinfo=timezone.utc)
+
+    def _file_ingestion(self, name: str, logins: list) -> FileIngestion:
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, "w", encoding="utf-8") as f:
+            for minute, username in logins:
+                login = {
+                    "@timestamp": f"2025-02-26T13:{minute:02d}:00.000Z",
+                    "_id": f"{name}_{minute}",
+                    "_index": name,
+                    "user": {"name": username},
+                    "source": {"ip": "192.0.2.1", "geo": {"country_name": "Italy", "location": {"lat": 45.4, "lon": 9.1}}},
+                }
+                f.write(json.dumps(login) + "\n")
+        return FileIngestion(dict(self.ingestion_config["file"], path=path), self.mapping)
+
+    def _multi_ingestion(self, ingestions: dict, timeout: float = 10, partial: bool = False) -> MultiIngestion:
+        return MultiIngestion({"sources": list(ingestions), "timeout": timeout, "partial": partial}, ingestions)
+
+    def test_process_logins_bulk_merged(self):
+        """The logins of each user are normalized by their source, tagged and merged in timestamp order"""
+        ingestor = self._multi_ingestion(
+            {
+                "vpn": self._file_ingestion("vpn", [(31, "Stitch"), (40, "Stitch"), (45, "Jessica")]),
+                "ad": self._file_ingestion("ad", [(35, "stitch"), (50, "Stitch")]),
+            }
+        )
+        logins_by_user = ingestor.process_logins_bulk(self.start_date, self.end_date)
+        self.assertCountEqual(["stitch", "jessica"], logins_by_user.keys())
+        self.assertListEqual(["vpn_31", "ad_35", "vpn_40", "ad_50"], [login["id"] for login in logins_by_user["stitch"]])
+        self.assertListEqual(["vpn:vpn", "ad:ad", "vpn:vpn", "ad:ad"], [login["index"] for login in logins_by_user["stitch"]])
+        # the logins are already normalized
+        self.assertListEqual(logins_by_user["stitch"], ingestor.normalize_fields(logins_by_user["stitch"]))
+        self.assertEqual(self.mapping, ingestor.mapping)
+
+    def test_process_users_and_user_logins(self):
+        ingestor = self._multi_ingestion(
+            {"vpn": self._file_ingestion("vpn", [(31, "Stitch"), (45, "Jessica")]), "ad": self._file_ingestion("ad", [(35, "STITCH")])}
+        )
+        self.assertListEqual(["Stitch", "Jessica"], ingestor.process_users(self.start_date, self.end_date))
+        self.assertListEqual(["vpn_31", "ad_35"], [login["id"] for login in ingestor.process_user_logins(self.start_date, self.end_date, "Stitch")])
+        self.assertListEqual(["vpn_31", "ad_35"], [login["id"] for login in ingestor.iter_user_logins(self.start_date, self.end_date, "Stitch")])
+
+    def test_failed_source(self):
+        """By default a source that fails is raised, so the detection window isn't completed without its logins"""
+        failing = MagicMock()
+        failing.process_logins_bulk.side_effect = ConnectionError("cluster down")
+        ingestor = self._multi_ingestion({"vpn": self._file_ingestion("vpn", [(31, "Stitch")]), "ad": failing})
+        with self.assertLogs(ingestor.logger, level="ERROR") as logs, self.assertRaisesRegex(ConnectionError, "'ad'"):
+            ingestor.process_logins_bulk(self.start_date, self.end_date)
+        self.assertIn("cluster down", logs.output[0])
+
+    def test_failed_source_isolated(self):
+        """With partial enabled, a source that fails doesn't stop the extraction of the others"""
+        failing = MagicMock()
+        failing.process_logins_bulk.side_effect = ConnectionError("cluster down")
+        ingestor = self._multi_ingestion({"vpn": self._file_ingestion("vpn", [(31, "Stitch")]), "ad": failing}, partial=True)
+        with self.assertLogs(ingestor.logger, level="ERROR") as logs:
+            logins_by_user = ingestor.process_logins_bulk(self.start_date, self.end_date)
+        self.assertListEqual(["vpn_31"], [login["id"] for login in logins_by_user["stitch"]])
+        self.assertIn("cluster down", logs.output[0])
+
+    def test_all_sources_failed(self):
+        """Even with partial enabled, if no source answers the bulk extraction fails, so the detection window isn't completed"""
+        failing = MagicMock()
+        failing.process_logins_bulk.side_effect = ConnectionError("cluster down")
+        ingestor = self._multi_ingestion({"vpn": failing, "ad": failing}, partial=True)
+        with self.assertLogs(ingestor.logger, level="ERROR"), self.assertRaises(ConnectionError):
+            ingestor.process_logins_bulk(self.start_date, self.end_date)
+
+    def test_slow_source_isolated(self):
+        """With partial enabled, a source that doesn't answer within the timeout is skipped, without waiting for it"""
+        release = threading.Event()
+        self.addCleanup(release.set)
+        slow = MagicMock()
+        slow.process_users.side_effect = lambda start_date, end_date: release.wait(5) and ["Jessica"]
+        ingestor = self._multi_ingestion({"vpn": self._file_ingestion("vpn", [(31, "Stitch")]), "ad": slow}, timeout=0.2, partial=True)
+        with self.assertLogs(ingestor.logger, level="ERROR"):
+            self.assertListEqual(["Stitch"], ingestor.process_users(self.start_date, self.end_date))
+
+    def test_close(self):
+        """Closing the fan-in closes the ingestion objects of all the sources"""
+        sources = {"vpn": MagicMock(), "ad": MagicMock()}
+        self._multi_ingestion(sources).close()
+        for source in sources.values():
+            source.close.assert_called_once()
+
+    def test_get_login_date(self):
+        self.assertEqual(datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc), get_login_date({"timestamp": "2025-02-26T13:30:00.000Z"}))
+        self.assertEqual(datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc), get_login_date({"timestamp": "2025-02-26T14:30:00.000+01:00"}))
+        self.assertEqual(datetime.min.replace(tzinfo=timezone.utc), get_login_date({"timestamp": ""}))
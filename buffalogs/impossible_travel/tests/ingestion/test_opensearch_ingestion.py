@@ -218,6 +218,193 @@ class OpensearchIngestionTestCase(TestCase):
             self.assertIn("source.ip", login)
             self.assertEqual(login["user.name"], "Stitch")
 
+    @patch("impossible_travel.ingestion.opensearch_ingestion.OpenSearch")
+    def test_iter_users(self, mock_opensearch):
+        """Test iter_users follows the composite aggregation pages, not limited by the bucket_size"""
+        mock_client = MagicMock()
+        mock_opensearch.return_value = mock_client
+        pages = [
+            {"aggregations": {"login_user": {"after_key": {"user": "Jessica"}, "buckets": [{"key": {"user": "Andrew"}}, {"key": {"user": "Jessica"}}]}}},
+            {"aggregations": {"login_user": {"after_key": {"user": "Stitch"}, "buckets": [{"key": {"user": ""}}, {"key": {"user": "Stitch"}}]}}},
+            {"aggregations": {"login_user": {"buckets": []}}},
+        ]
+        after_keys = []
+
+        def search_side_effect(index, body):
+            after_keys.append(body["aggs"]["login_user"]["composite"].get("after"))
+            return pages[len(after_keys) - 1]
+
+        mock_client.search.side_effect = search_side_effect
+        config = dict(self.opensearch_config, bucket_size=2)
+        ingestor = OpensearchIngestion(config, mapping={})
+
+        start_date = datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc)
+        end_date = datetime(2025, 2, 26, 14, 0, tzinfo=timezone.utc)
+        self.assertListEqual(["Andrew", "Jessica", "Stitch"], list(ingestor.iter_users(start_date, end_date)))
+        self.assertListEqual([None, {"user": "Jessica"}, {"user": "Stitch"}], after_keys)
+
+    @patch("impossible_travel.ingestion.opensearch_ingestion.OpenSearch")
+    def test_iter_users_connection_error(self, mock_opensearch):
+        """Test iter_users with connection error: error logged and raised, not returned as an empty list of users"""
+        mock_client = MagicMock()
+        mock_opensearch.return_value = mock_client
+        mock_client.search.side_effect = ConnectionError("Connection failed")
+        ingestor = OpensearchIngestion(self.opensearch_config, mapping={})
+
+        with self.assertLogs(ingestor.logger, level="ERROR"), self.assertRaises(ConnectionError):
+            list(ingestor.iter_users(datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc), datetime(2025, 2, 26, 14, 0, tzinfo=timezone.utc)))
+
+    @patch("impossible_travel.ingestion.opensearch_ingestion.OpenSearch")
+    def test_iter_user_logins(self, mock_opensearch):
+        """Test iter_user_logins streams all the logins of the user, one page at a time"""
+        mock_client = MagicMock()
+        mock_opensearch.return_value = mock_client
+        mock_client.create_pit.return_value = {"pit_id": "test_pit"}
+        hits = [dict(hit, sort=[i]) for i, hit in enumerate(self.user_logins_response["hits"]["hits"])]
+        mock_client.search.side_effect = [{"hits": {"hits": hits[:1]}}, {"hits": {"hits": hits[1:]}}, {"hits": {"hits": []}}]
+        config = dict(self.opensearch_config, bucket_size=1)
+        ingestor = OpensearchIngestion(config, mapping={})
+
+        logins = ingestor.iter_user_logins(datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc), datetime(2025, 2, 26, 14, 0, tzinfo=timezone.utc), "Stitch")
+        # lazy generator: no query until the first login is requested
+        mock_client.create_pit.assert_not_called()
+        result = list(logins)
+        self.assertListEqual(["log_id_0", "log_id_1"], [login["_id"] for login in result])
+        self.assertEqual("cloud", result[0]["_index"])
+        self.assertEqual(3, mock_client.search.call_count)
+        self.assertEqual({"match": {"user.name": "Stitch"}}, mock_client.search.call_args.kwargs["body"]["query"]["bool"]["must"][1])
+        mock_client.delete_pit.assert_called_once_with(body={"pit_id": ["test_pit"]})
+
+    @patch("impossible_travel.ingestion.opensearch_ingestion.OpenSearch")
+    def test_iter_user_logins_exception(self, mock_opensearch):
+        """Test iter_user_logins with an exception on the second page: error raised, so the logins of the first page aren't taken as complete"""
+        mock_client = MagicMock()
+        mock_opensearch.return_value = mock_client
+        mock_client.create_pit.return_value = {"pit_id": "test_pit"}
+        hits = [dict(hit, sort=[i]) for i, hit in enumerate(self.user_logins_response["hits"]["hits"])]
+        mock_client.search.side_effect = [{"hits": {"hits": hits[:1]}}, TimeoutError("Search timed out")]
+        ingestor = OpensearchIngestion(dict(self.opensearch_config, bucket_size=1), mapping={})
+
+        start_date = datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc)
+        end_date = datetime(2025, 2, 26, 14, 0, tzinfo=timezone.utc)
+        logins = []
+        with self.assertLogs(ingestor.logger, level="ERROR"), self.assertRaises(TimeoutError):
+            for login in ingestor.iter_user_logins(start_date, end_date, "Stitch"):
+                logins.append(login)
+        self.assertListEqual(["log_id_0"], [login["_id"] for login in logins])
+        mock_client.delete_pit.assert_called_once()
+
+    @patch("impossible_travel.ingestion.opensearch_ingestion.OpenSearch")
+    def test_process_logins_bulk(self, mock_opensearch):
+        """Test process_logins_bulk groups the streamed logins by lowercase username, keeping them sorted"""
+        mock_client = MagicMock()
+        mock_opensearch.return_value = mock_client
+        mock_client.create_pit.return_value = {"pit_id": "test_pit"}
+        hits = [
+            {"_index": "cloud-test_data", "_id": "log_id_0", "_source": {"user": {"name": "Stitch"}, "@timestamp": "2025-02-26T13:40:15.173Z"}, "sort": [1]},
+            {
+                "_index": "fw-proxy-test_data",
+                "_id": "log_id_1",
+                "_source": {"user": {"name": "Jessica"}, "@timestamp": "2025-02-26T13:41:15.173Z"},
+                "sort": [2],
+            },
+            {"_index": "cloud-test_data", "_id": "log_id_2", "_source": {"user": {"name": "stitch"}, "@timestamp": "2025-02-26T13:42:15.173Z"}, "sort": [3]},
+        ]
+        mock_client.search.return_value = {"hits": {"hits": hits}}
+
+        ingestor = OpensearchIngestion(self.opensearch_config, mapping=self.opensearch_config["custom_mapping"])
+
+        start_date = datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc)
+        end_date = datetime(2025, 2, 26, 14, 0, tzinfo=timezone.utc)
+
+        result = ingestor.process_logins_bulk(start_date, end_date)
+        self.assertListEqual(["stitch", "jessica"], list(result.keys()))
+        self.assertListEqual(["log_id_0", "log_id_2"], [login["_id"] for login in result["stitch"]])
+        self.assertEqual("fw-proxy", result["jessica"][0]["_index"])
+        mock_client.search.assert_called_once()
+        mock_client.delete_pit.assert_called_once_with(body={"pit_id": ["test_pit"]})
+
+    @patch("impossible_travel.ingestion.opensearch_ingestion.OpenSearch")
+    def test_process_logins_bulk_pagination(self, mock_opensearch):
+        """Test process_logins_bulk follows the search_after pages until the last (not full) one"""
+        mock_client = MagicMock()
+        mock_opensearch.return_value = mock_client
+        mock_client.create_pit.return_value = {"pit_id": "test_pit"}
+        config = dict(self.opensearch_config, bucket_size=2)
+        pages = [
+            [{"_id": f"log_id_{i}", "_index": "cloud", "_source": {"user": {"name": f"user{i}"}}, "sort": [i]} for i in range(0, 2)],
+            [{"_id": f"log_id_{i}", "_index": "cloud", "_source": {"user": {"name": f"user{i}"}}, "sort": [i]} for i in range(2, 4)],
+            [{"_id": "log_id_4", "_index": "cloud", "_source": {"user": {"name": "user4"}}, "sort": [4]}],
+        ]
+        search_after_values = []
+
+        def search_side_effect(body):
+            search_after_values.append(body.get("search_after"))
+            return {"hits": {"hits": pages[len(search_after_values) - 1]}}
+
+        mock_client.search.side_effect = search_side_effect
+
+        ingestor = OpensearchIngestion(config, mapping=config["custom_mapping"])
+        result = ingestor.process_logins_bulk(datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc), datetime(2025, 2, 26, 14, 0, tzinfo=timezone.utc))
+        self.assertEqual(5, len(result))
+        self.assertListEqual([None, [1], [3]], search_after_values)
+        mock_client.delete_pit.assert_called_once()
+
+    @patch("impossible_travel.ingestion.opensearch_ingestion.OpenSearch")
+    def test_process_logins_bulk_exception(self, mock_opensearch):
+        """Test process_logins_bulk with an exception while streaming: error logged and raised, point in time closed"""
+        mock_client = MagicMock()
+        mock_opensearch.return_value = mock_client
+        mock_client.create_pit.return_value = {"pit_id": "test_pit"}
+        mock_client.search.side_effect = Exception("Search failed")
+
+        ingestor = OpensearchIngestion(self.opensearch_config, mapping={})
+        with self.assertLogs(ingestor.logger, level="ERROR"), self.assertRaisesRegex(Exception, "Search failed"):
+            ingestor.process_logins_bulk(datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc), datetime(2025, 2, 26, 14, 0, tzinfo=timezone.utc))
+        mock_client.delete_pit.assert_called_once()
+
+    @patch("impossible_travel.ingestion.opensearch_ingestion.OpenSearch")
+    def test_process_logins_bulk_round_trips(self, mock_opensearch):
+        """Benchmark the number of searches needed to get all the logins of a window with many users:
+        the per-user path does 1 + N searches, the bulk path just one search per page of bucket_size logins"""
+        users_count = 500
+        logins_per_user = 4
+        bucket_size = 1000
+        mock_client = MagicMock()
+        mock_opensearch.return_value = mock_client
+        mock_client.create_pit.return_value = {"pit_id": "test_pit"}
+        all_hits = [
+            {"_id": f"log_id_{i}", "_index": "cloud", "_source": {"user": {"name": f"user{i % users_count}"}}, "sort": [i]}
+            for i in range(users_count * logins_per_user)
+        ]
+
+        def search_side_effect(body, index=None):
+            if "aggs" in body:
+                return {"aggregations": {"login_user": {"buckets": [{"key": f"user{i}"} for i in range(users_count)]}}}
+            if "pit" in body:
+                # the sort value of each hit is its position
+                start = body["search_after"][0] + 1 if "search_after" in body else 0
+                return {"hits": {"hits": all_hits[start : start + body["size"]]}}
+            return {"hits": {"hits": [hit for hit in all_hits if hit["_source"]["user"]["name"] == body["query"]["bool"]["must"][1]["match"]["user.name"]]}}
+
+        mock_client.search.side_effect = search_side_effect
+        config = dict(self.opensearch_config, bucket_size=bucket_size)
+        ingestor = OpensearchIngestion(config, mapping=config["custom_mapping"])
+        start_date = datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc)
+        end_date = datetime(2025, 2, 26, 14, 0, tzinfo=timezone.utc)
+
+        # per-user path
+        per_user_logins = {username: ingestor.process_user_logins(start_date, end_date, username) for username in ingestor.process_users(start_date, end_date)}
+        per_user_round_trips = mock_client.search.call_count
+        mock_client.search.reset_mock()
+        # bulk path
+        bulk_logins = ingestor.process_logins_bulk(start_date, end_date)
+        bulk_round_trips = mock_client.search.call_count
+
+        self.assertEqual(per_user_logins, bulk_logins)
+        self.assertEqual(users_count + 1, per_user_round_trips)
+        self.assertEqual(users_count * logins_per_user // bucket_size + 1, bulk_round_trips)
+
     def test_normalize_fields_valid_data(self):
         """Test normalize_fields with valid data (no mocking needed for data transformation)"""
         mapping = {
@@ -1,3 +1,5 @@
+import io
+import json
 from datetime import datetime, timezone
 from unittest.mock import MagicMock, patch
 
@@ -58,6 +60,7 @@ class SplunkIngestionTestCase(TestCase):
             username=self.splunk_config["username"],
             password=self.splunk_config["password"],
             scheme=self.splunk_config["scheme"],
+            autologin=True,
         )
         self.assertEqual(ingestor.service, mock_service)
 
@@ -203,6 +206,97 @@ class SplunkIngestionTestCase(TestCase):
                     self.assertIn(key, actual)
                     self.assertEqual(actual[key], expected[key])
 
+    @patch("splunklib.client.connect")
+    def test_process_logins_bulk(self, mock_connect):
+        """Test process_logins_bulk runs a single search job for the whole window and groups the logins by user"""
+        mock_service = MagicMock()
+        mock_connect.return_value = mock_service
+        mock_job = MagicMock()
+        mock_job.is_done.return_value = True
+        user2_login = dict(self.user1_test_data[0], **{"user.name": "scooby.doo@gmail.com", "_id": "log_id_2"})
+
+        mock_results_reader = MagicMock()
+        mock_results_reader.__iter__.return_value = [self.user1_test_data[0], user2_login, self.user1_test_data[1]]
+
+        with patch("splunklib.results.ResultsReader", return_value=mock_results_reader):
+            mock_service.jobs.create.return_value = mock_job
+            ingestor = SplunkIngestion(self.splunk_config, mapping=self.splunk_config["custom_mapping"])
+
+            start_date = datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc)
+            end_date = datetime(2025, 2, 26, 14, 0, tzinfo=timezone.utc)
+
+            result = ingestor.process_logins_bulk(start_date, end_date)
+            self.assertListEqual(["stitch", "scooby.doo@gmail.com"], list(result.keys()))
+            self.assertListEqual(self.user1_test_data, result["stitch"])
+            self.assertListEqual([user2_login], result["scooby.doo@gmail.com"])
+            mock_service.jobs.create.assert_called_once()
+
+    @patch("splunklib.client.connect")
+    def test_process_logins_bulk_streaming(self, mock_connect):
+        """Test process_logins_bulk in streaming mode: a single export for the whole window, parsed while it is read"""
+        mock_service = MagicMock()
+        mock_connect.return_value = mock_service
+        user2_login = dict(self.user1_test_data[0], **{"user.name": "scooby.doo@gmail.com", "_id": "log_id_2"})
+        lines = [
+            {"preview": True, "result": {"user.name": "preview_user"}},
+            {"messages": [{"type": "INFO", "text": "search started"}]},
+            {"preview": False, "offset": 0, "result": self.user1_test_data[0]},
+            {"preview": False, "offset": 1, "result": user2_login},
+            {"preview": False, "offset": 2, "lastrow": True, "result": self.user1_test_data[1]},
+        ]
+        mock_service.jobs.export.return_value = io.BytesIO("\n".join(json.dumps(line) for line in lines).encode())
+        config = dict(self.splunk_config, streaming=True)
+        ingestor = SplunkIngestion(config, mapping=config["custom_mapping"])
+
+        start_date = datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc)
+        end_date = datetime(2025, 2, 26, 14, 0, tzinfo=timezone.utc)
+        # small chunks, so that the lines are split between them
+        with patch.object(SplunkIngestion, "EXPORT_CHUNK_SIZE", 50):
+            result = ingestor.process_logins_bulk(start_date, end_date)
+        self.assertListEqual(["stitch", "scooby.doo@gmail.com"], list(result.keys()))
+        self.assertListEqual(self.user1_test_data, result["stitch"])
+        self.assertListEqual([user2_login], result["scooby.doo@gmail.com"])
+        mock_service.jobs.create.assert_not_called()
+        mock_service.jobs.export.assert_called_once()
+        self.assertEqual("json", mock_service.jobs.export.call_args.kwargs["output_mode"])
+        self.assertEqual("2025-02-26T13:30:00.000Z", mock_service.jobs.export.call_args.kwargs["earliest_time"])
+
+    @patch("splunklib.client.connect")
+    def test_process_logins_bulk_streaming_failure(self, mock_connect):
+        """Test process_logins_bulk in streaming mode with a failed export: an ERROR message, a stream without the last row
+        or cut in the middle of a line are raised, so the detection window isn't considered completed"""
+        mock_service = MagicMock()
+        mock_connect.return_value = mock_service
+        config = dict(self.splunk_config, streaming=True)
+        ingestor = SplunkIngestion(config, mapping=config["custom_mapping"])
+        first_result = json.dumps({"preview": False, "offset": 0, "result": self.user1_test_data[0]})
+        streams = {
+            "a search peer is down": [first_result, json.dumps({"messages": [{"type": "ERROR", "text": "a search peer is down"}]})],
+            "without the last row": [first_result],
+            "in the middle of a line": [first_result, first_result[:20]],
+        }
+        for error, lines in streams.items():
+            mock_service.jobs.export.return_value = io.BytesIO("\n".join(lines).encode())
+            with self.assertLogs(ingestor.logger, level="ERROR"), self.assertRaisesRegex(RuntimeError, error):
+                ingestor.process_logins_bulk(datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc), datetime(2025, 2, 26, 14, 0, tzinfo=timezone.utc))
+
+    @patch("impossible_travel.ingestion.splunk_ingestion.time.sleep")
+    @patch("splunklib.client.connect")
+    def test_wait_for_job_backoff(self, mock_connect, mock_sleep):
+        """Test that the search job is polled with a progressive backoff"""
+        mock_service = MagicMock()
+        mock_connect.return_value = mock_service
+        mock_job = MagicMock()
+        mock_job.is_done.side_effect = [False] * 8 + [True]
+        mock_service.jobs.create.return_value = mock_job
+
+        with patch("splunklib.results.ResultsReader", return_value=[]):
+            ingestor = SplunkIngestion(self.splunk_config, mapping={})
+            ingestor.process_logins_bulk(datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc), datetime(2025, 2, 26, 14, 0, tzinfo=timezone.utc))
+        self.assertListEqual([0.1, 0.2, 0.4, 0.8, 1.6, 3.2, 5, 5], [round(call.args[0], 4) for call in mock_sleep.call_args_list])
+        self.assertEqual(8, mock_job.refresh.call_count)
+        mock_job.results.assert_called_once_with(count=0)
+
     @patch("splunklib.client.connect")
     def test_normalize_fields_valid_data(self, mock_connect):
         mapping = {
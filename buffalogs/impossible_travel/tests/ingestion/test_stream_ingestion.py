@@ -0,0 +1,106 @@
+from unittest.mock import MagicMock, patch
+
+from django.test import SimpleTestCase
+from impossible_travel.ingestion import stream_ingestion
+from impossible_travel.ingestion.stream_ingestion import (
+    KafkaStreamConsumer,
+    QueueStreamConsumer,
+    RedisStreamConsumer,
+    StreamMessage,
+    decode_event,
+    get_stream_consumer,
+)
+
+
+class StreamIngestionTestCase(SimpleTestCase):
+    """Test the login events stream consumers, with mocked clients"""
+
+    def setUp(self):
+        self.stream_config = {"backend": "queue", "url": "localhost:9092", "topic": "buffalogs-logins", "group": "buffalogs"}
+
+    def _kafka_message(self, partition: int, offset: int, value: bytes, error=None) -> MagicMock:
+        message = MagicMock()
+        message.error.return_value = error
+        message.topic.return_value = "buffalogs-logins"
+        message.partition.return_value = partition
+        message.offset.return_value = offset
+        message.value.return_value = value
+        return message
+
+    def test_decode_event(self):
+        self.assertDictEqual({"user": {"name": "Stitch"}}, decode_event(b'{"user": {"name": "Stitch"}}'))
+        self.assertDictEqual({"a": 1}, decode_event({"a": 1}))
+        self.assertIsNone(decode_event(b"{not json"))
+        self.assertIsNone(decode_event(b"[1, 2]"))
+        with patch.object(stream_ingestion, "orjson", None):
+            self.assertDictEqual({"a": 1}, decode_event('{"a": 1}'))
+
+    def test_queue_consumer(self):
+        """The queue consumer returns the events already queued, up to max_records"""
+        consumer = QueueStreamConsumer(self.stream_config)
+        for i in range(5):
+            consumer.events.put({"i": i})
+        first = consumer.poll(max_records=3, timeout=0.01)
+        self.assertListEqual([0, 1, 2], [message.value["i"] for message in first])
+        second = consumer.poll(max_records=3, timeout=0.01)
+        self.assertListEqual([3, 4], [message.position for message in second])
+        self.assertListEqual([], consumer.poll(max_records=3, timeout=0.01))
+        consumer.commit(first)
+        self.assertListEqual([0, 1, 2], consumer.committed)
+
+    @patch.object(stream_ingestion, "confluent_kafka")
+    def test_kafka_consumer(self, mock_kafka):
+        """The offsets are committed synchronously, with the next offset to be read of each partition"""
+        mock_client = mock_kafka.Consumer.return_value
+        mock_client.consume.return_value = [
+            self._kafka_message(0, 10, b'{"a": 1}'),
+            self._kafka_message(1, 4, b'{"a": 2}'),
+            self._kafka_message(0, 11, b"{not json"),
+            self._kafka_message(1, 5, None, error="broker error"),
+        ]
+        consumer = get_stream_consumer(dict(self.stream_config, backend="kafka"))
+        self.assertIsInstance(consumer, KafkaStreamConsumer)
+        self.assertFalse(mock_kafka.Consumer.call_args.args[0]["enable.auto.commit"])
+        mock_client.subscribe.assert_called_once_with(["buffalogs-logins"])
+
+        with self.assertLogs(consumer.logger, level="ERROR"):
+            messages = consumer.poll(max_records=100, timeout=1.0)
+        mock_client.consume.assert_called_once_with(num_messages=100, timeout=1.0)
+        self.assertListEqual([{"a": 1}, {"a": 2}, None], [message.value for message in messages])
+
+        consumer.commit(messages)
+        mock_kafka.TopicPartition.assert_any_call("buffalogs-logins", 0, 12)
+        mock_kafka.TopicPartition.assert_any_call("buffalogs-logins", 1, 5)
+        self.assertFalse(mock_client.commit.call_args.kwargs["asynchronous"])
+
+    @patch.object(stream_ingestion, "confluent_kafka", None)
+    def test_kafka_not_installed(self):
+        with self.assertRaises(ImportError):
+            KafkaStreamConsumer(self.stream_config)
+
+    @patch.object(stream_ingestion, "redis")
+    def test_redis_consumer(self, mock_redis):
+        """The entries not acknowledged are read again before the new ones"""
+        mock_client = mock_redis.Redis.from_url.return_value
+        mock_client.xreadgroup.side_effect = [
+            [[b"buffalogs-logins", [(b"1-0", {b"data": b'{"a": 1}'}), (b"2-0", None)]]],
+            [[b"buffalogs-logins", []]],
+            [[b"buffalogs-logins", [(b"3-0", {b"data": b'{"a": 3}'})]]],
+        ]
+        consumer = get_stream_consumer(dict(self.stream_config, backend="redis", consumer="worker-1"))
+        self.assertIsInstance(consumer, RedisStreamConsumer)
+        mock_client.xgroup_create.assert_called_once_with("buffalogs-logins", "buffalogs", id="0", mkstream=True)
+
+        pending = consumer.poll(max_records=10, timeout=0.5)
+        self.assertListEqual([StreamMessage({"a": 1}, b"1-0"), StreamMessage(None, b"2-0")], pending)
+        new = consumer.poll(max_records=10, timeout=0.5)
+        self.assertListEqual([StreamMessage({"a": 3}, b"3-0")], new)
+        reads = [(call.args[2], call.kwargs["block"]) for call in mock_client.xreadgroup.call_args_list]
+        self.assertListEqual([({"buffalogs-logins": "0"}, None), ({"buffalogs-logins": "0"}, None), ({"buffalogs-logins": ">"}, 500)], reads)
+
+        consumer.commit(pending + new)
+        mock_client.xack.assert_called_once_with("buffalogs-logins", "buffalogs", b"1-0", b"2-0", b"3-0")
+
+    def test_unsupported_backend(self):
+        with self.assertRaises(ValueError):
+            get_stream_consumer(dict(self.stream_config, backend="unknown"))
@@ -1,3 +1,5 @@
+import hashlib
+
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError
 from django.test import TestCase
@@ -85,12 +87,29 @@ class LoginModelTest(TestCase):
             "longitude",
             "country",
             "user_agent",
+            "user_agent_hash",
             "index",
             "event_id",
             "ip",
         ]
         self.assertCountEqual(model_fields, expected_fields)
 
+    def test_login_oversized_user_agent(self):
+        """The user agents longer than the max btree row size are unique by their md5"""
+        # hex digits, so the user agent can't be compressed under the max row size
+        user_agent = "".join(hashlib.sha256(str(i).encode()).hexdigest() for i in range(300))
+        login = Login.objects.create(user=self.user, index="test_index_abc", country="India", user_agent=user_agent, event_id="event_1", ip="10.0.0.1")
+        login.refresh_from_db()
+        self.assertEqual(Login.hash_user_agent(user_agent), login.user_agent_hash)
+        upserted = Login(user=self.user, index="test_index_abc", country="India", user_agent=user_agent, event_id="event_2", ip="10.0.0.2")
+        Login.objects.bulk_create(
+            [upserted], update_conflicts=True, unique_fields=["user", "index", "country", "user_agent_hash"], update_fields=["event_id", "ip"]
+        )
+        login.refresh_from_db()
+        self.assertEqual(("event_2", "10.0.0.2"), (login.event_id, login.ip))
+        with self.assertRaises(IntegrityError):
+            Login.objects.create(user=self.user, index="test_index_abc", country="India", user_agent=user_agent, event_id="event_3", ip="10.0.0.3")
+
     def test_login_creation(self):
         """Check correct login creation"""
         self.assertIsInstance(self.login, Login)
@@ -260,6 +279,11 @@ class AlertModelTest(TestCase):
             "name",
             "user",
             "login_raw_data",
+            "login_timestamp",
+            "login_country",
+            "login_ip",
+            "login_lat",
+            "login_lon",
             "created",
             "updated",
             "description",
@@ -279,6 +303,17 @@ class AlertModelTest(TestCase):
         self.assertIsNotNone(self.alert.created)
         self.assertIsNotNone(self.alert.updated)
 
+    def test_login_fields(self):
+        """The login columns are copied from the login_raw_data by save() and bulk_create()"""
+        self.assertEqual("1.1.1.1", self.alert.login_ip)
+        self.assertIsNone(self.alert.login_timestamp)
+        login_raw_data = {"timestamp": "2023-06-20T10:17:33.358Z", "country": "Italy", "ip": "2.2.2.2", "lat": 45.4, "lon": "9.1"}
+        [alert] = Alert.objects.bulk_create([Alert(name=AlertDetectionType.NEW_DEVICE, user=self.user, login_raw_data=login_raw_data, description="bulk")])
+        alert.refresh_from_db()
+        self.assertEqual("2023-06-20T10:17:33.358000+00:00", alert.login_timestamp.isoformat())
+        self.assertEqual(("Italy", "2.2.2.2", 45.4, 9.1), (alert.login_country, alert.login_ip, alert.login_lat, alert.login_lon))
+        self.assertListEqual([alert], list(Alert.apply_filters(country_code="italy", login_start_time=alert.login_timestamp)))
+
     def test_tags_field(self):
         """Test tags stores valid alert tag values"""
         self.assertIn("SECURITY_THREAT", self.alert.tags)
@@ -0,0 +1,115 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from impossible_travel.constants import AlertDetectionType
+from impossible_travel.models import Alert, User
+from impossible_travel.modules.partitions import add_months, get_alert_partitions, month_start
+from impossible_travel.tasks import clean_models_periodically
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "The tables are partitioned on PostgreSQL only")
+class AlertPartitionsTestCase(TestCase):
+    def setUp(self):
+        self.partitions = get_alert_partitions()
+        self.db_user = User.objects.create(username="Lorena")
+
+    def _create_alert(self, created: datetime) -> Alert:
+        alert = Alert.objects.create(
+            user=self.db_user, name=AlertDetectionType.NEW_COUNTRY, login_raw_data={"timestamp": "2025-02-26T13:30:00.000Z"}, description="partition"
+        )
+        Alert.objects.filter(id=alert.id).update(created=created)
+        with connection.cursor() as cursor:
+            # the test transaction isn't committed: the deferred foreign key checks would prevent to drop the partition
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        return alert
+
+    def _get_alert_partition(self, alert: Alert) -> str:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT tableoid::regclass::text FROM impossible_travel_alert WHERE id = %s", [alert.id])
+            return cursor.fetchone()[0]
+
+    def test_month_helpers(self):
+        self.assertEqual(datetime(2025, 2, 1, tzinfo=timezone.utc), month_start(datetime(2025, 2, 26, 13, 30, tzinfo=timezone.utc)))
+        self.assertEqual(datetime(2026, 1, 1, tzinfo=timezone.utc), add_months(datetime(2025, 11, 1, tzinfo=timezone.utc), 2))
+        self.assertEqual(datetime(2024, 12, 1, tzinfo=timezone.utc), add_months(datetime(2025, 1, 1, tzinfo=timezone.utc), -1))
+
+    def test_migrated_table(self):
+        """The migration partitions the table up to some months after the current one"""
+        self.assertTrue(self.partitions.is_partitioned())
+        current_month = month_start(datetime.now(timezone.utc))
+        self.assertIn(self.partitions.get_partition_name(current_month), self.partitions.get_partitions())
+        self.assertEqual(self.partitions.get_partition_name(current_month), self._get_alert_partition(self._create_alert(current_month)))
+
+    def test_primary_key(self):
+        """The DB primary key is (id, created), while the id assigned by the sequence keeps identifying an Alert across the partitions"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT array_agg(attname ORDER BY attname) FROM pg_index JOIN pg_attribute ON attrelid = indrelid AND attnum = ANY(indkey) "
+                "WHERE indrelid = 'impossible_travel_alert'::regclass AND indisprimary"
+            )
+            self.assertListEqual(["created", "id"], cursor.fetchone()[0])
+        current_month = month_start(datetime.now(timezone.utc))
+        alerts = [self._create_alert(current_month), self._create_alert(add_months(current_month, -1))]
+        self.assertEqual(2, len({alert.id for alert in alerts}))
+        self.assertNotEqual(self._get_alert_partition(alerts[0]), self._get_alert_partition(alerts[1]))
+        for alert in alerts:
+            self.assertEqual(alert.description, Alert.objects.get(pk=alert.pk).description)
+
+    def test_create_partitions(self):
+        now = datetime(2031, 11, 15, tzinfo=timezone.utc)
+        self.assertListEqual(
+            ["impossible_travel_alert_p203111", "impossible_travel_alert_p203112", "impossible_travel_alert_p203201"],
+            self.partitions.create_partitions(2, now=now),
+        )
+        # the existing partitions are skipped
+        self.assertListEqual(["impossible_travel_alert_p203202"], self.partitions.create_partitions(3, now=now))
+
+    def test_create_partition_moves_default_rows(self):
+        """The rows saved in the default partition before the creation of their monthly partition are moved in it"""
+        alert = self._create_alert(datetime(2031, 3, 10, tzinfo=timezone.utc))
+        other_alert = self._create_alert(datetime(2031, 4, 10, tzinfo=timezone.utc))
+        self.assertEqual("impossible_travel_alert_default", self._get_alert_partition(alert))
+        self.assertTrue(self.partitions.create_partition(datetime(2031, 3, 20, tzinfo=timezone.utc)))
+        self.assertEqual("impossible_travel_alert_p203103", self._get_alert_partition(alert))
+        self.assertEqual("impossible_travel_alert_default", self._get_alert_partition(other_alert))
+        self.assertEqual(2, Alert.objects.filter(user=self.db_user).count())
+        self.assertFalse(self.partitions.create_partition(datetime(2031, 3, 1, tzinfo=timezone.utc)))
+
+    def test_drop_partitions_before(self):
+        self.partitions.create_partition(datetime(2020, 1, 1, tzinfo=timezone.utc))
+        self.partitions.create_partition(datetime(2020, 2, 1, tzinfo=timezone.utc))
+        old_alert = self._create_alert(datetime(2020, 1, 10, tzinfo=timezone.utc))
+        recent_alert = self._create_alert(datetime(2020, 2, 10, tzinfo=timezone.utc))
+        # the partition of February 2020 has rows more recent than the date, so it's kept
+        self.assertIn("impossible_travel_alert_p202001", self.partitions.drop_partitions_before(datetime(2020, 2, 15, tzinfo=timezone.utc)))
+        self.assertNotIn("impossible_travel_alert_p202001", self.partitions.get_partitions())
+        self.assertIn("impossible_travel_alert_p202002", self.partitions.get_partitions())
+        self.assertFalse(Alert.objects.filter(id=old_alert.id).exists())
+        self.assertTrue(Alert.objects.filter(id=recent_alert.id).exists())
+
+    def test_clean_models_periodically(self):
+        """The retention drops the expired partitions and creates the next ones"""
+        self.partitions.create_partition(datetime(2020, 1, 1, tzinfo=timezone.utc))
+        old_alert = self._create_alert(datetime(2020, 1, 10, tzinfo=timezone.utc))
+        Alert.objects.filter(id=old_alert.id).update(updated=datetime.now(timezone.utc))
+        recent_alert = self._create_alert(datetime.now(timezone.utc))
+        with self.settings(CERTEGO_BUFFALOGS_PARTITIONS_AHEAD_MONTHS=6):
+            clean_models_periodically()
+        partitions = self.partitions.get_partitions()
+        self.assertNotIn("impossible_travel_alert_p202001", partitions)
+        self.assertIn(self.partitions.get_partition_name(add_months(month_start(datetime.now(timezone.utc)), 6)), partitions)
+        self.assertFalse(Alert.objects.filter(id=old_alert.id).exists())
+        self.assertTrue(Alert.objects.filter(id=recent_alert.id).exists())
+
+    def test_create_partitions_command(self):
+        out = StringIO()
+        call_command("create_partitions", "--months", "5", stdout=out)
+        self.assertIn(self.partitions.get_partition_name(add_months(month_start(datetime.now(timezone.utc)), 5)), self.partitions.get_partitions())
+        self.assertIn("impossible_travel_alert_p", out.getvalue())
+        out = StringIO()
+        call_command("create_partitions", "--months", "5", stdout=out)
+        self.assertIn("already exist", out.getvalue())
@@ -0,0 +1,103 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase
+from impossible_travel.constants import AlertDetectionType
+from impossible_travel.models import Alert, Login, User, UsersIP
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "The query plans are checked on PostgreSQL")
+class QueryPlansTestCase(TestCase):
+    """Check that the lookups of the detection and of the dashboard use the Login, UsersIP and Alert indexes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create([User(username=f"user_{i}") for i in range(20)])
+        cls.db_user = users[0]
+        base_timestamp = datetime(2025, 2, 26, 13, 0, tzinfo=timezone.utc)
+        Login.objects.bulk_create(
+            Login(
+                user=user,
+                timestamp=base_timestamp + timedelta(minutes=i),
+                latitude=45.4,
+                longitude=9.1,
+                country=f"country_{i % 20}",
+                user_agent=f"agent_{i % 23}",
+                index=f"index_{i % 3}",
+                event_id=f"log_id_{i}",
+                ip=f"192.0.2.{i % 250}",
+            )
+            for user in users
+            for i in range(500)
+        )
+        UsersIP.objects.bulk_create(UsersIP(user=user, ip=f"192.0.2.{i}") for user in users for i in range(50))
+        Alert.objects.bulk_create(
+            Alert(
+                name=AlertDetectionType.NEW_DEVICE,
+                user=users[i % 20],
+                login_raw_data={
+                    "timestamp": (base_timestamp + timedelta(minutes=i)).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                    "country": f"Country {i % 50}",
+                    "ip": f"192.0.2.{i % 250}",
+                    "lat": i % 90,
+                    "lon": i % 180,
+                },
+                description="query plan",
+            )
+            for i in range(5000)
+        )
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE impossible_travel_login")
+            cursor.execute("ANALYZE impossible_travel_usersip")
+            cursor.execute("ANALYZE impossible_travel_alert")
+            # the test tables are tiny: without it, the planner would always prefer a sequential scan
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def assertUsesIndex(self, queryset, index_name: str):
+        plan = queryset.explain()
+        # on the partitioned tables, the plan uses the indexes of the partitions, attached to the index of the table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid WHERE pg_inherits.inhparent = %s::regclass",
+                [index_name],
+            )
+            index_names = [index_name] + [row[0] for row in cursor.fetchall()]
+        self.assertTrue(any(name in plan for name in index_names), plan)
+
+    def test_login_key_lookup(self):
+        logins = Login.objects.filter(user=self.db_user, index="index_0", country="country_0", user_agent_hash=Login.hash_user_agent("agent_0"))
+        self.assertUsesIndex(logins, "unique_login_key")
+
+    def test_login_latest(self):
+        self.assertUsesIndex(Login.objects.filter(user=self.db_user).order_by("-timestamp")[:1], "login_user_timestamp_idx")
+
+    def test_login_country(self):
+        self.assertUsesIndex(Login.objects.filter(user=self.db_user, country="country_1").values("timestamp"), "login_user_country_idx")
+
+    def test_login_user_agent(self):
+        self.assertUsesIndex(Login.objects.filter(user=self.db_user, user_agent_hash=Login.hash_user_agent("agent_1")), "login_user_agent_hash_idx")
+
+    def test_usersip_lookup(self):
+        self.assertUsesIndex(UsersIP.objects.filter(user=self.db_user, ip="192.0.2.1"), "unique_user_ip")
+
+    def test_unique_keys(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            UsersIP.objects.create(user=self.db_user, ip="192.0.2.1")
+        login = Login.objects.filter(user=self.db_user).first()
+        login.pk = None
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            login.save()
+
+    def test_alert_login_timestamp(self):
+        start = datetime(2025, 2, 26, 14, 0, tzinfo=timezone.utc)
+        self.assertUsesIndex(Alert.objects.filter(login_timestamp__range=(start, start + timedelta(minutes=10))), "alert_login_timestamp_idx")
+
+    def test_alert_login_location(self):
+        self.assertUsesIndex(Alert.objects.filter(login_country__iexact="country 1"), "alert_login_location_idx")
+        self.assertUsesIndex(Alert.objects.filter(login_country__iexact="country 1", login_lat=1, login_lon=1), "alert_login_location_idx")
+
+    def test_alert_login_ip(self):
+        self.assertUsesIndex(Alert.apply_filters(ip="192.0.2.1"), "alert_login_ip_idx")
@@ -0,0 +1,89 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from impossible_travel.constants import AlertDetectionType
+from impossible_travel.models import Alert, Login, User, UsersIP
+from impossible_travel.modules.config_cache import get_config
+from impossible_travel.modules.retention import RetentionEngine, get_retention_steps
+from impossible_travel.tasks import clean_models_periodically
+
+
+@override_settings(CERTEGO_BUFFALOGS_RETENTION_BATCH_SIZE=2, CERTEGO_BUFFALOGS_RETENTION_BATCH_PAUSE=0, CERTEGO_BUFFALOGS_RETENTION_MAX_SECONDS=60)
+class RetentionTestCase(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.old_date = self.now - timedelta(days=100)
+        self.db_user = User.objects.create(username="Lorena")
+        self.logins = [Login.objects.create(user=self.db_user, timestamp=self.now, index=f"cloud-{i}", event_id=f"log_id_{i}") for i in range(5)]
+        self.ips = [UsersIP.objects.create(user=self.db_user, ip=f"192.0.2.{i}") for i in range(3)]
+
+    def _expire(self, queryset):
+        queryset.update(updated=self.old_date)
+
+    def test_batches(self):
+        """The rows are deleted in batches of CERTEGO_BUFFALOGS_RETENTION_BATCH_SIZE rows, with a pause between them"""
+        self._expire(Login.objects.exclude(id=self.logins[0].id))
+        engine = RetentionEngine()
+        with patch("impossible_travel.modules.retention.time.sleep") as mock_sleep:
+            self.assertTrue(engine.run(get_retention_steps(get_config(), self.now)))
+        self.assertEqual(2, mock_sleep.call_count)
+        self.assertDictEqual({"Login": 4}, dict(engine.report))
+        self.assertListEqual([self.logins[0].id], list(Login.objects.values_list("id", flat=True)))
+        self.assertTrue(User.objects.filter(id=self.db_user.id).exists())
+
+    def test_usersip_retention(self):
+        """The UsersIP are deleted after Config.ip_max_days"""
+        self._expire(UsersIP.objects.filter(id=self.ips[0].id))
+        report = clean_models_periodically()
+        self.assertDictEqual({"UsersIP": 1}, report)
+        self.assertCountEqual([self.ips[1].id, self.ips[2].id], UsersIP.objects.values_list("id", flat=True))
+
+    def test_expired_user(self):
+        """The logins, alerts and IPs of an expired user are deleted before it, without loading them"""
+        Alert.objects.create(user=self.db_user, name=AlertDetectionType.NEW_DEVICE, login_raw_data={}, description="retention")
+        other_user = User.objects.create(username="Aisha")
+        other_login = Login.objects.create(user=other_user, timestamp=self.now, index="cloud", event_id="other")
+        self._expire(User.objects.filter(id=self.db_user.id))
+        report = clean_models_periodically()
+        self.assertDictEqual({"Login": 5, "Alert": 1, "UsersIP": 3, "User": 1}, report)
+        self.assertListEqual([other_user.id], list(User.objects.values_list("id", flat=True)))
+        self.assertListEqual([other_login.id], list(Login.objects.values_list("id", flat=True)))
+
+    def test_referenced_user_kept(self):
+        """An expired user isn't deleted if a login has been saved after the deletion of its logins"""
+        self._expire(User.objects.filter(id=self.db_user.id))
+        steps = get_retention_steps(get_config(), self.now)
+        user_queryset = dict(steps)["User"]
+        Login.objects.all().delete()
+        UsersIP.objects.all().delete()
+        Login.objects.create(user=self.db_user, timestamp=self.now, index="cloud", event_id="new")
+        engine = RetentionEngine()
+        self.assertTrue(engine.delete("User", user_queryset))
+        self.assertTrue(User.objects.filter(id=self.db_user.id).exists())
+
+    def test_resume(self):
+        """After CERTEGO_BUFFALOGS_RETENTION_MAX_SECONDS the engine stops, and it's resumed from its state"""
+        self._expire(Login.objects.all())
+        engine = RetentionEngine()
+        steps = get_retention_steps(get_config(), self.now)
+        with patch("impossible_travel.modules.retention.time.sleep") as mock_sleep:
+            # the time is over after the first batch
+            mock_sleep.side_effect = lambda seconds: setattr(engine, "deadline", 0)
+            self.assertFalse(engine.run(steps))
+        self.assertDictEqual({"last_ids": {"Login": self.logins[1].id}, "completed": []}, engine.state)
+        self.assertEqual(3, Login.objects.count())
+        resumed_engine = RetentionEngine(engine.state)
+        self.assertTrue(resumed_engine.run(steps))
+        self.assertDictEqual({"Login": 3}, dict(resumed_engine.report))
+        self.assertFalse(Login.objects.exists())
+
+    @override_settings(CERTEGO_BUFFALOGS_RETENTION_MAX_SECONDS=0)
+    def test_clean_models_periodically_resumed(self):
+        """The retention not completed is resumed by a new task"""
+        self._expire(Login.objects.all())
+        with patch.object(clean_models_periodically, "apply_async") as mock_apply_async:
+            self.assertDictEqual({}, clean_models_periodically())
+        mock_apply_async.assert_called_once_with(kwargs={"retention_state": {"last_ids": {}, "completed": []}})
+        self.assertEqual(5, Login.objects.count())
@@ -1,12 +1,23 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
 from unittest.mock import MagicMock, patch
 
 from django.db import connection
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils import timezone
-from impossible_travel.constants import AlertDetectionType
-from impossible_travel.models import Alert, Login, User, UsersIP
-from impossible_travel.tasks import clean_models_periodically, process_logs, scheduled_alert_summary
+from impossible_travel.constants import AlertDetectionType, CheckpointStatus
+from impossible_travel.models import Alert, DetectionCheckpoint, Login, PushedLogin, ShardLogins, TaskSettings, User, UsersIP
+from impossible_travel.tasks import (
+    clean_models_periodically,
+    drain_pushed_logins,
+    finalize_window,
+    get_detection_shard,
+    get_pending_windows,
+    process_detection_shard,
+    process_logs,
+    process_window,
+    scheduled_alert_summary,
+    split_windows,
+)
 from impossible_travel.tests.utils import patched_components
 
 
@@ -200,3 +211,349 @@ class TestTasks(TestCase):
 
         self.assertEqual(User.objects.count(), 1)
         self.assertEqual(User.objects.get().username, "usera")
+
+    def test_process_logs_bulk_logins(self):
+        # check that the logins are extracted with a single bulk query per time range, not per user
+        User.objects.all().delete()
+        end_date = timezone.now()
+        start_date = end_date - timedelta(minutes=30)
+        with patched_components(
+            patch_ingestion=True,
+            patch_detection=True,
+            bulk_return={"usera": [{"_id": "log_id_0"}], "userb": [{"_id": "log_id_1"}]},
+            normalized_return=[{}],
+        ) as (ingestion_mock, detection_mock, _):
+            process_logs(start_date, end_date)
+        ingestion_mock.process_logins_bulk.assert_called_once_with(start_date, end_date)
+        ingestion_mock.process_users.assert_not_called()
+        ingestion_mock.process_user_logins.assert_not_called()
+        self.assertEqual(2, detection_mock.call_count)
+        self.assertCountEqual(["usera", "userb"], User.objects.values_list("username", flat=True))
+
+    def test_get_detection_shard(self):
+        # check that the shard of a user is stable and inside the shards range
+        self.assertEqual(get_detection_shard("usera", 4), get_detection_shard("usera", 4))
+        self.assertEqual(0, get_detection_shard("usera", 1))
+        shards = {get_detection_shard(f"user{i}", 4) for i in range(100)}
+        self.assertSetEqual({0, 1, 2, 3}, shards)
+
+    @override_settings(CERTEGO_BUFFALOGS_DETECTION_SHARDS=3)
+    def test_process_logs_detection_shards(self):
+        # check that the users are distributed on the shards and that all the users are analyzed
+        User.objects.all().delete()
+        end_date = timezone.now()
+        start_date = end_date - timedelta(minutes=30)
+        bulk_return = {f"user{i}": [{"_id": f"log_id_{i}"}] for i in range(10)}
+        with patched_components(
+            patch_ingestion=True,
+            patch_detection=True,
+            bulk_return=bulk_return,
+            normalized_return=[{}],
+        ) as (
+            _,
+            detection_mock,
+            _,
+        ), patch("impossible_travel.tasks.process_detection_shard.run", wraps=process_detection_shard.run) as shard_mock:
+            process_logs(start_date, end_date)
+        expected_shards = {get_detection_shard(username, 3) for username in bulk_return}
+        self.assertEqual(len(expected_shards), shard_mock.call_count)
+        # the shard tasks receive just the window and the shard, their logins are staged in the DB and removed once analyzed
+        self.assertCountEqual(expected_shards, [call.kwargs["shard"] for call in shard_mock.call_args_list])
+        self.assertFalse(any(call.args or call.kwargs.get("logins_by_user") for call in shard_mock.call_args_list))
+        self.assertFalse(ShardLogins.objects.exists())
+        self.assertCountEqual(bulk_return.keys(), [call.kwargs["db_user"].username for call in detection_mock.call_args_list])
+        for checkpoint in DetectionCheckpoint.objects.filter(start_date=start_date):
+            # each shard analyzes only its users
+            self.assertEqual(len([username for username in bulk_return if get_detection_shard(username, 3) == checkpoint.shard]), checkpoint.users)
+        # the TaskSettings are advanced after all the shards have been completed
+        task_settings = TaskSettings.objects.get(task_name=process_logs.__name__)
+        self.assertEqual(start_date, task_settings.start_date)
+        self.assertEqual(end_date, task_settings.end_date)
+
+    def test_process_logs_shard_failure(self):
+        # check that the TaskSettings are not advanced if a detection shard fails
+        User.objects.all().delete()
+        now = timezone.now()
+        TaskSettings.objects.update_or_create(
+            task_name=process_logs.__name__, defaults={"start_date": now - timedelta(minutes=60), "end_date": now - timedelta(minutes=45)}
+        )
+        with patched_components(
+            patch_ingestion=True,
+            patch_detection=True,
+            bulk_return={"usera": [{"_id": "log_id_0"}]},
+            normalized_return=[{}],
+        ) as (_, detection_mock, _):
+            detection_mock.side_effect = ValueError("detection failed")
+            process_logs()
+        task_settings = TaskSettings.objects.get(task_name=process_logs.__name__)
+        self.assertEqual(now - timedelta(minutes=45), task_settings.end_date)
+        # the shard of the user is set as failed, to be resumed by the next runs
+        checkpoint = DetectionCheckpoint.objects.get(start_date=now - timedelta(minutes=45), shard=get_detection_shard("usera", 4))
+        self.assertEqual(CheckpointStatus.FAILED, checkpoint.status)
+        self.assertEqual(1, checkpoint.attempts)
+        self.assertIn((checkpoint.start_date, checkpoint.end_date), get_pending_windows())
+
+    @override_settings(
+        CERTEGO_BUFFALOGS_DETECTION_SHARDS=2,
+        CERTEGO_BUFFALOGS_CHECKPOINT_MAX_ATTEMPTS=3,
+        CERTEGO_BUFFALOGS_PROCESS_MAX_WINDOWS=1,
+        CERTEGO_BUFFALOGS_PROCESS_CONCURRENT_WINDOWS=1,
+    )
+    def test_process_logs_shard_dead_letter(self):
+        # check that a shard failing at each attempt is moved to the dead letters after CERTEGO_BUFFALOGS_CHECKPOINT_MAX_ATTEMPTS,
+        # so it isn't resumed anymore and the TaskSettings are advanced past its window
+        User.objects.all().delete()
+        now = timezone.now()
+        last_end_date = now - timedelta(hours=4)
+        TaskSettings.objects.update_or_create(
+            task_name=process_logs.__name__, defaults={"start_date": last_end_date - timedelta(minutes=30), "end_date": last_end_date}
+        )
+        first_window = (last_end_date, last_end_date + timedelta(minutes=30))
+        good_user = "user0"
+        bad_user = next(f"user{i}" for i in range(1, 10) if get_detection_shard(f"user{i}", 2) != get_detection_shard(good_user, 2))
+        bulk_return = {good_user: [{"_id": "log_id_0"}], bad_user: [{"_id": "log_id_1"}]}
+
+        def check_fields(db_user, fields, writer=None):
+            if db_user.username == bad_user:
+                raise ValueError("poison login")
+
+        for attempt in range(1, 4):
+            with patched_components(patch_ingestion=True, patch_detection=True, bulk_return=bulk_return, normalized_return=[{}]) as (_, detection_mock, _):
+                detection_mock.side_effect = check_fields
+                process_logs()
+            bad_checkpoint = DetectionCheckpoint.objects.get(start_date=first_window[0], shard=get_detection_shard(bad_user, 2))
+            self.assertEqual(attempt, bad_checkpoint.attempts)
+        self.assertEqual(CheckpointStatus.DEAD, bad_checkpoint.status)
+        # the staged logins of the dead shard are kept
+        self.assertTrue(ShardLogins.objects.filter(checkpoint=bad_checkpoint, username=bad_user).exists())
+        good_checkpoint = DetectionCheckpoint.objects.get(start_date=first_window[0], shard=get_detection_shard(good_user, 2))
+        self.assertEqual(CheckpointStatus.COMPLETED, good_checkpoint.status)
+        self.assertEqual(first_window[1], TaskSettings.objects.get(task_name=process_logs.__name__).end_date)
+        self.assertNotIn(first_window, get_pending_windows())
+
+        # the window of the dead shard isn't analyzed again
+        with patched_components(patch_ingestion=True, patch_detection=True, bulk_return=bulk_return, normalized_return=[{}]) as (ingestion_mock, _, _):
+            process_logs()
+        self.assertNotIn(first_window, [call.args for call in ingestion_mock.process_logins_bulk.call_args_list])
+
+    @override_settings(CERTEGO_BUFFALOGS_PROCESS_MAX_WINDOWS=3, CERTEGO_BUFFALOGS_PROCESS_CONCURRENT_WINDOWS=1)
+    def test_process_logs_ingestion_failure(self):
+        # check that a window whose logins can't be extracted stops the next windows and the TaskSettings, and that it's resumed first by the next run
+        User.objects.all().delete()
+        now = timezone.now()
+        last_end_date = now - timedelta(hours=4)
+        TaskSettings.objects.update_or_create(
+            task_name=process_logs.__name__, defaults={"start_date": last_end_date - timedelta(minutes=30), "end_date": last_end_date}
+        )
+        windows = [(last_end_date + timedelta(minutes=30 * i), last_end_date + timedelta(minutes=30 * (i + 1))) for i in range(5)]
+        bulk_return = {"usera": [{"_id": "log_id_0"}]}
+        with patched_components(patch_ingestion=True, patch_detection=True, normalized_return=[{}]) as (ingestion_mock, detection_mock, _):
+            ingestion_mock.process_logins_bulk.side_effect = [bulk_return, ConnectionError("cluster down")]
+            process_logs()
+        # the third window isn't started
+        self.assertListEqual(windows[:2], [call.args for call in ingestion_mock.process_logins_bulk.call_args_list])
+        self.assertEqual(1, detection_mock.call_count)
+        self.assertEqual(windows[0][1], TaskSettings.objects.get(task_name=process_logs.__name__).end_date)
+        failed_checkpoints = DetectionCheckpoint.objects.filter(start_date=windows[1][0])
+        self.assertEqual(4, failed_checkpoints.count())
+        self.assertFalse(failed_checkpoints.exclude(status=CheckpointStatus.FAILED).exists())
+        self.assertFalse(DetectionCheckpoint.objects.filter(start_date=windows[2][0]).exists())
+
+        with patched_components(patch_ingestion=True, patch_detection=True, bulk_return=bulk_return, normalized_return=[{}]) as (ingestion_mock, _, _):
+            process_logs()
+        # the failed window is resumed before the new ones
+        self.assertListEqual(windows[1:], [call.args for call in ingestion_mock.process_logins_bulk.call_args_list])
+        self.assertFalse(DetectionCheckpoint.objects.exclude(status=CheckpointStatus.COMPLETED).exists())
+        self.assertEqual(windows[-1][1], TaskSettings.objects.get(task_name=process_logs.__name__).end_date)
+
+    @override_settings(
+        CERTEGO_BUFFALOGS_CHECKPOINT_MAX_ATTEMPTS=2,
+        CERTEGO_BUFFALOGS_PROCESS_MAX_WINDOWS=1,
+        CERTEGO_BUFFALOGS_PROCESS_CONCURRENT_WINDOWS=1,
+    )
+    def test_process_logs_ingestion_dead_letter(self):
+        # check that a window whose logins extraction fails at each attempt is moved to the dead letters after CERTEGO_BUFFALOGS_CHECKPOINT_MAX_ATTEMPTS,
+        # so the next windows are analyzed and the TaskSettings are advanced past it
+        User.objects.all().delete()
+        now = timezone.now()
+        last_end_date = now - timedelta(hours=4)
+        TaskSettings.objects.update_or_create(
+            task_name=process_logs.__name__, defaults={"start_date": last_end_date - timedelta(minutes=30), "end_date": last_end_date}
+        )
+        windows = [(last_end_date + timedelta(minutes=30 * i), last_end_date + timedelta(minutes=30 * (i + 1))) for i in range(2)]
+        bulk_return = {"usera": [{"_id": "log_id_0"}]}
+
+        def process_logins_bulk(start_date, end_date):
+            if start_date == windows[0][0]:
+                raise ConnectionError("cluster down")
+            return bulk_return
+
+        for attempt in range(1, 3):
+            with patched_components(patch_ingestion=True, patch_detection=True, normalized_return=[{}]) as (ingestion_mock, _, _):
+                ingestion_mock.process_logins_bulk.side_effect = process_logins_bulk
+                process_logs()
+            failed_checkpoints = DetectionCheckpoint.objects.filter(start_date=windows[0][0])
+            self.assertListEqual([attempt] * 4, list(failed_checkpoints.values_list("attempts", flat=True)))
+        self.assertFalse(failed_checkpoints.exclude(status=CheckpointStatus.DEAD).exists())
+        self.assertNotIn(windows[0], get_pending_windows())
+        # the next window has been analyzed after the dead one, in the same lane
+        self.assertListEqual(windows, [call.args for call in ingestion_mock.process_logins_bulk.call_args_list])
+        self.assertEqual(windows[1][1], TaskSettings.objects.get(task_name=process_logs.__name__).end_date)
+
+    def test_process_window_normalization_failure(self):
+        # check that an error raised by the normalization of the logins fails the checkpoints too, so the window is resumed
+        now = timezone.now()
+        window = (now - timedelta(minutes=60), now - timedelta(minutes=30))
+        with patched_components(patch_ingestion=True, bulk_return={"usera": [{"_id": "log_id_0"}]}) as (ingestion_mock, _, _):
+            ingestion_mock.normalize_fields.side_effect = ValueError("bad mapping")
+            with self.assertRaises(ValueError):
+                process_window(*window)
+        checkpoints = DetectionCheckpoint.objects.filter(start_date=window[0])
+        self.assertEqual(4, checkpoints.count())
+        self.assertFalse(checkpoints.exclude(status=CheckpointStatus.FAILED, attempts=1).exists())
+        self.assertIn(window, get_pending_windows())
+
+    def test_finalize_window_after_incomplete_window(self):
+        # check that the TaskSettings aren't advanced past a window not completed, and that they skip the next windows already completed
+        now = timezone.now()
+        windows = [(now - timedelta(minutes=30 * (i + 1)), now - timedelta(minutes=30 * i)) for i in reversed(range(3))]
+        TaskSettings.objects.update_or_create(
+            task_name=process_logs.__name__, defaults={"start_date": windows[0][0] - timedelta(minutes=30), "end_date": windows[0][0]}
+        )
+        for (start_date, end_date), status in zip(windows, [CheckpointStatus.PENDING, CheckpointStatus.COMPLETED, CheckpointStatus.COMPLETED]):
+            DetectionCheckpoint.objects.create(start_date=start_date, end_date=end_date, shard=0, shards_count=1, status=status)
+        finalize_window([], *windows[2])
+        self.assertEqual(windows[0][0], TaskSettings.objects.get(task_name=process_logs.__name__).end_date)
+        DetectionCheckpoint.objects.filter(start_date=windows[0][0]).update(status=CheckpointStatus.COMPLETED)
+        finalize_window([], *windows[0])
+        self.assertEqual(windows[2][1], TaskSettings.objects.get(task_name=process_logs.__name__).end_date)
+
+    @override_settings(CERTEGO_BUFFALOGS_DETECTION_SHARDS=2)
+    def test_process_logs_explicit_range_rerun(self):
+        # check that a time range passed explicitly (e.g. with naive dates by the impossible_travel command) is analyzed again, even if completed
+        User.objects.all().delete()
+        start_date = datetime(2025, 2, 26, 13, 0)
+        end_date = datetime(2025, 2, 26, 13, 30)
+        bulk_return = {f"user{i}": [{"_id": f"log_id_{i}"}] for i in range(10)}
+        for _ in range(2):
+            with patched_components(patch_ingestion=True, patch_detection=True, bulk_return=bulk_return, normalized_return=[{}]) as (_, detection_mock, _):
+                process_logs(start_date, end_date)
+            self.assertEqual(10, detection_mock.call_count)
+        checkpoints = DetectionCheckpoint.objects.all()
+        self.assertEqual(2, checkpoints.count())
+        self.assertFalse(checkpoints.exclude(status=CheckpointStatus.COMPLETED).exists())
+        self.assertEqual(10, sum(checkpoints.values_list("users", flat=True)))
+        self.assertEqual(timezone.make_aware(start_date), checkpoints[0].start_date)
+
+    @override_settings(CERTEGO_BUFFALOGS_DETECTION_SHARDS=3)
+    def test_process_logs_checkpoints(self):
+        # check that a checkpoint is saved for each shard of the time window, with the number of users analyzed
+        User.objects.all().delete()
+        end_date = timezone.now()
+        start_date = end_date - timedelta(minutes=30)
+        bulk_return = {f"user{i}": [{"_id": f"log_id_{i}"}] for i in range(10)}
+        with patched_components(patch_ingestion=True, patch_detection=True, bulk_return=bulk_return, normalized_return=[{}]):
+            process_logs(start_date, end_date)
+        checkpoints = DetectionCheckpoint.objects.filter(start_date=start_date, end_date=end_date)
+        self.assertEqual(3, checkpoints.count())
+        self.assertFalse(checkpoints.exclude(status=CheckpointStatus.COMPLETED).exists())
+        self.assertEqual(10, sum(checkpoints.values_list("users", flat=True)))
+        for checkpoint in checkpoints:
+            self.assertEqual(3, checkpoint.shards_count)
+            self.assertEqual(len([username for username in bulk_return if get_detection_shard(username, 3) == checkpoint.shard]), checkpoint.users)
+
+    @override_settings(CERTEGO_BUFFALOGS_DETECTION_SHARDS=2, CERTEGO_BUFFALOGS_PROCESS_MAX_WINDOWS=0)
+    def test_process_logs_resume_shards(self):
+        # check that a window abandoned in the middle is resumed only on the shards not completed
+        User.objects.all().delete()
+        now = timezone.now()
+        start_date = now - timedelta(hours=5)
+        end_date = start_date + timedelta(minutes=30)
+        TaskSettings.objects.update_or_create(
+            task_name=process_logs.__name__, defaults={"start_date": start_date - timedelta(minutes=30), "end_date": start_date}
+        )
+        bulk_return = {f"user{i}": [{"_id": f"log_id_{i}"}] for i in range(10)}
+        for shard, status in enumerate([CheckpointStatus.COMPLETED, CheckpointStatus.PENDING]):
+            DetectionCheckpoint.objects.create(start_date=start_date, end_date=end_date, shard=shard, shards_count=2, status=status)
+        # a pending checkpoint updated recently is still in progress, so it isn't resumed
+        with patched_components(patch_ingestion=True, patch_detection=True, bulk_return=bulk_return, normalized_return=[{}]) as (_, detection_mock, _):
+            process_logs()
+        detection_mock.assert_not_called()
+
+        DetectionCheckpoint.objects.update(updated=now - timedelta(hours=2))
+        with patched_components(patch_ingestion=True, patch_detection=True, bulk_return=bulk_return, normalized_return=[{}]) as (_, detection_mock, _):
+            process_logs()
+        expected_users = [username for username in bulk_return if get_detection_shard(username, 2) == 1]
+        self.assertCountEqual(expected_users, [call.kwargs["db_user"].username for call in detection_mock.call_args_list])
+        self.assertFalse(DetectionCheckpoint.objects.filter(status=CheckpointStatus.PENDING).exists())
+        task_settings = TaskSettings.objects.get(task_name=process_logs.__name__)
+        self.assertEqual(end_date, task_settings.end_date)
+
+    @override_settings(CERTEGO_BUFFALOGS_PROCESS_MAX_WINDOWS=5, CERTEGO_BUFFALOGS_PROCESS_CONCURRENT_WINDOWS=2)
+    def test_process_logs_concurrent_windows(self):
+        # check that a catch-up run processes all the windows since the last execution
+        User.objects.all().delete()
+        now = timezone.now()
+        last_end_date = now - timedelta(hours=4)
+        TaskSettings.objects.update_or_create(
+            task_name=process_logs.__name__, defaults={"start_date": last_end_date - timedelta(minutes=30), "end_date": last_end_date}
+        )
+        with patched_components(patch_ingestion=True, patch_detection=True, bulk_return={"usera": [{"_id": "log_id_0"}]}, normalized_return=[{}]) as (
+            ingestion_mock,
+            detection_mock,
+            _,
+        ):
+            process_logs()
+        expected_windows = [(last_end_date + timedelta(minutes=30 * i), last_end_date + timedelta(minutes=30 * (i + 1))) for i in range(5)]
+        self.assertCountEqual(expected_windows, [call.args for call in ingestion_mock.process_logins_bulk.call_args_list])
+        self.assertEqual(5, detection_mock.call_count)
+        task_settings = TaskSettings.objects.get(task_name=process_logs.__name__)
+        self.assertEqual(expected_windows[-1][1], task_settings.end_date)
+        # the next run continues from the last window
+        with patched_components(patch_ingestion=True, patch_detection=True, bulk_return={}) as (ingestion_mock, _, _):
+            process_logs()
+        self.assertEqual(expected_windows[-1][1], ingestion_mock.process_logins_bulk.call_args_list[0].args[0])
+
+    def test_split_windows(self):
+        windows = list(range(5))
+        self.assertListEqual([[0, 1, 2], [3, 4]], split_windows(windows, 2))
+        self.assertListEqual([[0, 1, 2, 3, 4]], split_windows(windows, 1))
+        self.assertListEqual([[0], [1], [2], [3], [4]], split_windows(windows, 10))
+        self.assertListEqual([[]], split_windows([], 3))
+
+    @override_settings(CERTEGO_BUFFALOGS_PUSH_DRAIN_BATCH_SIZE=2)
+    def test_drain_pushed_logins(self):
+        # the pushed logins are analyzed in micro-batches, each user in timestamp order, and removed from the staging table
+        now = timezone.now()
+        for i, (username, minutes) in enumerate([("usera", 5), ("usera", 10), ("userb", 1)]):
+            login = dict(self.raw_data_NEW_COUNTRY, id=f"log_id_{i}", ip=f"203.0.113.{i}", username=username)
+            PushedLogin.objects.create(username=username, timestamp=now - timedelta(minutes=minutes), login=login)
+        with patch("impossible_travel.tasks.detection.check_fields") as check_fields_mock:
+            self.assertEqual(3, drain_pushed_logins())
+        self.assertEqual(2, check_fields_mock.call_count)
+        first_call, second_call = check_fields_mock.call_args_list
+        self.assertEqual("usera", first_call.kwargs["db_user"].username)
+        self.assertListEqual(["log_id_1", "log_id_0"], [login["id"] for login in first_call.kwargs["fields"]])
+        self.assertEqual("userb", second_call.kwargs["db_user"].username)
+        self.assertFalse(PushedLogin.objects.exists())
+
+    def test_drain_pushed_logins_failure(self):
+        # the pushed logins of a user whose detection fails are marked as failed, the other users are analyzed and the failed logins aren't drained again
+        now = timezone.now()
+        PushedLogin.objects.create(username="usera", timestamp=now, login=dict(self.raw_data_NEW_COUNTRY, id="log_id_0", username="usera"))
+        PushedLogin.objects.create(username="userb", timestamp=now, login=dict(self.raw_data_NEW_COUNTRY, id="log_id_1", username="userb"))
+
+        def check_fields_side_effect(db_user, fields, writer=None):
+            if db_user.username == "usera":
+                raise RuntimeError("detection failed")
+
+        with patch("impossible_travel.tasks.detection.check_fields", side_effect=check_fields_side_effect) as check_fields_mock:
+            with self.assertLogs("impossible_travel.tasks", level="ERROR"):
+                self.assertEqual(2, drain_pushed_logins())
+            self.assertEqual(0, drain_pushed_logins())
+        # the batch stops at usera, then each user is analyzed on its own
+        self.assertEqual(3, check_fields_mock.call_count)
+        failed_login = PushedLogin.objects.get()
+        self.assertEqual("usera", failed_login.username)
+        self.assertTrue(failed_login.failed)
+        self.assertEqual("detection failed", failed_login.error)
@@ -48,10 +48,12 @@ def patched_components(
     users_return: Optional[list] = None,
     logins_return: Optional[list] = None,
     normalized_return: Optional[list] = None,
+    bulk_return: Optional[dict] = None,
 ):
     """
     Dynamic/Flexible Patch flessibile for components used in the process_logs function.
-        - Ingestion patch: patch_ingestion=True/False with optional return values: users_return, logins_return, normalized_return
+        - Ingestion patch: patch_ingestion=True/False with optional return values: users_return, logins_return, normalized_return, bulk_return
+          (if bulk_return is not set, the process_logins_bulk mock returns the logins_return for each user in users_return)
         - Detection patch: patch_detection=True/False
         - TaskSettings patch: patch_tasksettings=True/False
 
@@ -68,8 +70,11 @@ def patched_components(
         ingestion_mock.process_users.return_value = users_return or []
         ingestion_mock.process_user_logins.return_value = logins_return or []
         ingestion_mock.normalize_fields.return_value = normalized_return or []
+        if bulk_return is None:
+            bulk_return = {username: logins_return or [] for username in users_return or []}
+        ingestion_mock.process_logins_bulk.return_value = bulk_return
 
-        p_ing = patch("impossible_travel.tasks.IngestionFactory")
+        p_ing = patch("impossible_travel.tasks.get_ingestion")
 
         patches.append(p_ing)
 
@@ -85,8 +90,8 @@ def patched_components(
 
     try:
         if patch_ingestion:
-            ingestion_factory_mock = active_patches[0]
-            ingestion_factory_mock.return_value.get_ingestion_class.return_value = ingestion_mock
+            get_ingestion_mock = active_patches[0]
+            get_ingestion_mock.return_value = ingestion_mock
 
         if patch_detection:
             detection_mock = active_patches[-1] if patch_ingestion else active_patches[0]
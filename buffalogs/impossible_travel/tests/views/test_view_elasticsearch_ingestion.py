@@ -8,6 +8,7 @@ from django.test import Client, TestCase
 from django.urls import reverse
 from elasticsearch import Elasticsearch
 from impossible_travel.ingestion.elasticsearch_ingestion import ElasticsearchIngestion
+from impossible_travel.ingestion.ingestion_factory import ingestion_registry
 from impossible_travel.models import User
 from impossible_travel.tests.utils import load_ingestion_config_data
 
@@ -24,6 +25,8 @@ class TestViewsElasticIngestion(TestCase):
         self.config = load_ingestion_config_data(section="elasticsearch")
         self.config["url"] = "http://localhost:9200/"
         self.create_test_data()
+        # the ingestion object could have been created by a previous test
+        ingestion_registry.clear()
 
     @patch("impossible_travel.ingestion.ingestion_factory.IngestionFactory.get_ingestion_class")
     @patch("django.utils.timezone.now")
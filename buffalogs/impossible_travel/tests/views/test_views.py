@@ -49,7 +49,7 @@ class TestViews(APITestCase):
                 Login(
                     user=cls.db_user,
                     event_id="vfraw14gw",
-                    index="cloud",
+                    index="cloud-2023.06.20",
                     ip="1.2.3.4",
                     timestamp="2023-06-20T10:01:33.358Z",
                     latitude=40.364,
@@ -60,7 +60,7 @@ class TestViews(APITestCase):
                 Login(
                     user=cls.db_user,
                     event_id="ht9DEIgBnkLiMp6r-SG-",
-                    index="weblog",
+                    index="weblog-2023.06.20",
                     ip="203.0.113.24",
                     timestamp="2023-06-20T10:08:33.358Z",
                     latitude=36.2462,
@@ -203,7 +203,11 @@ class TestViews(APITestCase):
         end = datetime(2023, 6, 30, 23, 59, 59)
         num_alerts = 0
         list_expected_result = [{"country": "jp", "lat": 36.2462, "lon": 138.8497, "alerts": 3}, {"country": "us", "lat": 40.364, "lon": -79.8605, "alerts": 3}]
-        response = self.client.get(f"{reverse('world_map_chart_api')}?start={start.strftime('%Y-%m-%dT%H:%M:%SZ')}&end={end.strftime('%Y-%m-%dT%H:%M:%SZ')}")
+        # the alerts are counted with a single grouped query
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                f"{reverse('world_map_chart_api')}?start={start.strftime('%Y-%m-%dT%H:%M:%SZ')}&end={end.strftime('%Y-%m-%dT%H:%M:%SZ')}"
+            )
         for elem in list_expected_result:
             num_alerts += elem["alerts"]
         self.assertEqual(response.status_code, 200)
@@ -280,7 +284,7 @@ class TestViews(APITestCase):
                 Login(
                     user=db_user,
                     event_id=f"login_{timestamp.isoformat()}",
-                    index="cloud",
+                    index=f"cloud-{len(logins)}",
                     ip="192.168.1.1",
                     timestamp=timestamp,
                     latitude=37.7749,
@@ -330,7 +334,7 @@ class TestViews(APITestCase):
                     Login(
                         user=db_user,
                         event_id=f"device_test_{device}_{i}",
-                        index="cloud",
+                        index=f"cloud-{len(logins)}",
                         ip="192.168.1.1",
                         timestamp=base_timestamp + timedelta(hours=i),
                         latitude=37.7749,
@@ -356,6 +360,9 @@ class TestViews(APITestCase):
         for device, count in devices.items():
             self.assertIn(device, data["devices"])
             self.assertGreaterEqual(data["devices"][device], count)
+        # user-agents grouped by the parsed fields: the test ones are not real user-agents
+        self.assertEqual(sum(data["devices"].values()), data["devices_summary"]["os"]["Other"])
+        self.assertEqual(0, data["devices_summary"]["mobile"])
 
     def test_user_login_frequency_api(self):
         """Test the user login frequency API endpoint."""
@@ -376,7 +383,7 @@ class TestViews(APITestCase):
                     Login(
                         user=db_user,
                         event_id=f"freq_test_day{day_offset}_{i}",
-                        index="cloud",
+                        index=f"cloud-{len(logins)}",
                         ip="192.168.1.1",
                         timestamp=base_date + timedelta(days=day_offset, hours=i),
                         latitude=37.7749,
@@ -444,7 +451,7 @@ class TestViews(APITestCase):
                         Login(
                             user=db_user,
                             event_id=f"tod_test_h{hour}_d{weekday}_{i}",
-                            index="cloud",
+                            index=f"cloud-{len(logins)}",
                             ip="192.168.1.1",
                             timestamp=timestamp,
                             latitude=37.7749,
@@ -497,7 +504,7 @@ class TestViews(APITestCase):
                     Login(
                         user=db_user,
                         event_id=f"geo_test_{country}_{i}",
-                        index="cloud",
+                        index=f"cloud-{len(logins)}",
                         ip=f"192.168.{offset}.{i + 1}",
                         timestamp=base_timestamp + timedelta(hours=offset + i),
                         latitude=details["lat"],
@@ -2,6 +2,8 @@ import json
 from datetime import timedelta
 
 from dateutil.relativedelta import relativedelta
+from django.db.models import Count, F
+from django.db.models.functions import Lower
 from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotFound, JsonResponse
 from django.shortcuts import render
 from django.utils import timezone
@@ -22,7 +24,7 @@ def aggregate_alerts_interval(start_date, end_date, interval, date_fmt):
 
     while current_date < end_date:
         next_date = current_date + interval
-        count = Alert.objects.filter(login_raw_data__timestamp__range=(current_date.isoformat(), next_date.isoformat())).count()
+        count = Alert.objects.filter(login_timestamp__range=(current_date, next_date)).count()
         aggregated_data[current_date.strftime(date_fmt)] = count
         current_date = next_date
     return aggregated_data
@@ -95,30 +97,20 @@ def world_map_chart_api(request):
     if is_naive(end_date):
         end_date = make_aware(end_date)
 
-    countries = read_config("countries_list.json")
-    result = []
-    tmp = []
-    for key, value in countries.items():
-        country_alerts = Alert.objects.filter(
-            login_raw_data__timestamp__range=(start_date.strftime("%Y-%m-%dT%H:%M:%S.%fZ"), end_date.strftime("%Y-%m-%dT%H:%M:%S.%fZ")),
-            login_raw_data__country__iexact=key,
+    # the countries are matched case-insensitively and listed in the order of the countries_list.json file
+    countries = {name.lower(): (position, code.lower()) for position, (name, code) in enumerate(read_config("countries_list.json").items())}
+    locations = (
+        Alert.objects.filter(login_timestamp__range=(start_date, end_date))
+        .values(country=Lower("login_country"), lat=F("login_lat"), lon=F("login_lon"))
+        .annotate(alerts=Count("id"))
+    )
+    result = [
+        {"country": countries[location["country"]][1], "lat": location["lat"], "lon": location["lon"], "alerts": location["alerts"]}
+        for location in sorted(
+            (location for location in locations if location["country"] in countries),
+            key=lambda location: (countries[location["country"]][0], location["lat"] or 0, location["lon"] or 0),
         )
-        if country_alerts:
-            for alert in country_alerts:
-                if [alert.login_raw_data["country"], alert.login_raw_data["lat"], alert.login_raw_data["lon"]] not in tmp:
-                    tmp.append([alert.login_raw_data["country"], alert.login_raw_data["lat"], alert.login_raw_data["lon"]])
-                    result.append(
-                        {
-                            "country": value.lower(),
-                            "lat": alert.login_raw_data["lat"],
-                            "lon": alert.login_raw_data["lon"],
-                            "alerts": Alert.objects.filter(
-                                login_raw_data__country__iexact=key,
-                                login_raw_data__lat=alert.login_raw_data["lat"],
-                                login_raw_data__lon=alert.login_raw_data["lon"],
-                            ).count(),
-                        }
-                    )
+    ]
     return HttpResponse(json.dumps(result), content_type="application/json")
 
 
@@ -1,11 +1,25 @@
 import json
+from datetime import datetime
 
+from django.conf import settings
+from django.db import connection, transaction
 from django.http import JsonResponse
+from django.utils import timezone
 from django.views.decorators.http import require_http_methods
+from impossible_travel.ingestion.base_ingestion import compile_mapping
+from impossible_travel.ingestion.ingestion_factory import get_ingestion
+from impossible_travel.ingestion.stream_ingestion import decode_event
+from impossible_travel.models import PushedLogin
+from impossible_travel.modules.stream_detection import normalize_event
 from impossible_travel.views import utils
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView
 
 read_config, write_config = utils.get_config_read_write("ingestion.json")
 
+# key of the Postgres advisory lock that serializes the pushes, so the capacity of the PushedLogin staging table is never exceeded
+PUSH_QUEUE_LOCK_ID = 7_274_110_001
+
 
 @require_http_methods(["GET"])
 def get_ingestion_sources(request):
@@ -22,6 +36,9 @@ def get_ingestion_sources(request):
 def get_active_ingestion_source(request):
     config = read_config()
     source = config["active_ingestion"]
+    if isinstance(source, list):
+        # more sources queried together: the first one is the primary source
+        source = source[0]
     context = {"source": source, "fields": dict((field, config[source][field]) for field in config[source]["__custom_fields__"])}
     return JsonResponse(context, json_dumps_params={"default": str})
 
@@ -44,3 +61,49 @@ def ingestion_source_config(request, source):
         ingestion_config.update(config_update)
         write_config(source, ingestion_config)
         return JsonResponse({"message": "Update successful"}, status=200)
+
+
+class PushLoginsView(APIView):
+    """Receive a batch of logins in NDJSON format (one ECS login per line, with the fields of the active ingestion source).
+    The logins are normalized and saved in the PushedLogin staging table, analyzed by the BuffalogsDrainPushedLoginsTask.
+    If the staging table is full, the batch is refused with 429 Too Many Requests and it should be sent again later.
+    The capacity check and the insert are done under a transaction advisory lock, so the concurrent pushes can't exceed the max size together
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        lines = [line for line in request.body.splitlines() if line.strip()]
+        if len(lines) > settings.CERTEGO_BUFFALOGS_PUSH_MAX_BATCH_SIZE:
+            return JsonResponse({"message": f"Too many logins in the batch, the max is {settings.CERTEGO_BUFFALOGS_PUSH_MAX_BATCH_SIZE}"}, status=413)
+
+        normalize = compile_mapping(get_ingestion().mapping)
+        pushed_logins = []
+        for line in lines:
+            event = decode_event(line)
+            login = normalize_event(normalize, event) if event is not None else None
+            if login is None:
+                continue
+            try:
+                timestamp = datetime.fromisoformat(login["timestamp"])
+            except (TypeError, ValueError):
+                continue
+            if timezone.is_naive(timestamp):
+                # the login analyzed by the detection must have the same aware timestamp as the staged one
+                timestamp = timezone.make_aware(timestamp)
+                login["timestamp"] = timestamp.isoformat()
+            pushed_logins.append(PushedLogin(username=login["username"].lower(), timestamp=timestamp, login=login))
+
+        max_size = settings.CERTEGO_BUFFALOGS_PUSH_QUEUE_MAX_SIZE
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                # released at the end of the transaction. The drain only deletes logins, so it doesn't need it
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", [PUSH_QUEUE_LOCK_ID])
+            # the queued logins are counted up to the max size, so the count query is bounded too. The failed ones aren't drained, so they aren't counted
+            queued = PushedLogin.objects.filter(failed=False).order_by()[:max_size].count()
+            if queued + len(pushed_logins) > max_size:
+                response = JsonResponse({"message": "The ingestion queue is full, retry later"}, status=429)
+                response["Retry-After"] = "60"
+                return response
+            PushedLogin.objects.bulk_create(pushed_logins, batch_size=1000)
+        return JsonResponse({"accepted": len(pushed_logins), "discarded": len(lines) - len(pushed_logins)}, status=202)
@@ -4,7 +4,7 @@ from datetime import timedelta
 from django.http import JsonResponse
 from django.utils import timezone
 from django.views.decorators.http import require_http_methods
-from impossible_travel.ingestion.ingestion_factory import IngestionFactory
+from impossible_travel.ingestion.ingestion_factory import get_ingestion
 from impossible_travel.models import Login, User
 from impossible_travel.serializers import LoginSerializer
 from impossible_travel.validators import validate_login_query
@@ -15,8 +15,9 @@ def get_user_logins(request, user_id):
     start_date = end_date + timedelta(days=-365)
     user_obj = User.objects.filter(id=user_id)
     username = user_obj[0].username
-    ingestion = IngestionFactory().get_ingestion_class()
-    user_logins = ingestion.process_user_logins(start_date, end_date, username)
+    ingestion = get_ingestion()
+    # stream the logins in order not to truncate them at the bucket_size for the users with many logins in the year
+    user_logins = list(ingestion.iter_user_logins(start_date, end_date, username))
     normalized_user_logins = ingestion.normalize_fields(user_logins)
     return JsonResponse(json.dumps(normalized_user_logins, default=str), safe=False)
 
@@ -19,6 +19,7 @@ from impossible_travel.dashboard.charts import (
     user_time_of_day_chart,
 )
 from impossible_travel.models import Login, User
+from impossible_travel.modules.user_agent import group_user_agents
 from impossible_travel.serializers import UserSerializer
 from impossible_travel.views.utils import read_config
 
@@ -113,7 +114,7 @@ def user_device_usage_api(request, pk):
         pk: The primary key of the user.
 
     Returns:
-        JsonResponse: A JSON object containing device usage counts.
+        JsonResponse: A JSON object containing device usage counts, for each user-agent and grouped by os, browser and device.
     """
     start_date = parse_datetime(request.GET.get("start", ""))
     end_date = parse_datetime(request.GET.get("end", ""))
@@ -134,7 +135,7 @@ def user_device_usage_api(request, pk):
     devices = Login.objects.filter(user=user, timestamp__range=(start_date, end_date)).values("user_agent").annotate(count=Count("id"))
     device_counts = {d["user_agent"]: d["count"] for d in devices}
 
-    return JsonResponse({"devices": device_counts})
+    return JsonResponse({"devices": device_counts, "devices_summary": group_user_agents(device_counts)})
 
 
 @require_http_methods(["GET"])